@@ -17,6 +17,8 @@ class Configure:
             MARKETS: Market Server config list, default is {}.
             HEARTBEAT: Server heartbeat config, default is {}.
             PROXY: HTTP proxy config, default is None.
+            LATENCY: Stage latency profiling config, default is {} (disabled).
+            TRACE: Order tick-to-trade tracing config, default is {} (disabled).
     """
 
     def __init__(self):
@@ -32,6 +34,8 @@ class Configure:
         self.markets = {}
         self.heartbeat = {}
         self.proxy = None
+        self.latency = {}
+        self.trace = {}
 
     def loads(self, config_file=None) -> None:
         """Load config file.
@@ -71,6 +75,8 @@ class Configure:
         self.markets = update_fields.get("MARKETS", [])
         self.heartbeat = update_fields.get("HEARTBEAT", {})
         self.proxy = update_fields.get("PROXY", None)
+        self.latency = update_fields.get("LATENCY", {})
+        self.trace = update_fields.get("TRACE", {})
 
         for k, v in update_fields.items():
             setattr(self, k, v)
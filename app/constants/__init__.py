@@ -4,4 +4,3 @@
 from app.constants.common import *
 from app.constants.trade import *
 from app.constants.store import *
-from app.constants.stock import *
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from datetime import time as Time
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 10 ** 9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+BAR_FIELDS = ("open", "high", "low", "close", "volume")
+RESAMPLE_INTERVALS = ("5min", "10min", "15min", "30min", "60min", "1day")
+
+
+def time_ns(t: Time) -> int:
+    """Time of day in nanoseconds since midnight"""
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * NS_PER_SECOND + t.microsecond * 1000
+
+
+def in_trading_sessions(tod: np.ndarray, trading_sessions: List[datetime]) -> np.ndarray:
+    """Vectorized `is_trading_time` on times of day (ns since midnight)"""
+    mask = np.zeros(len(tod), dtype=bool)
+    for session in trading_sessions or []:
+        start = time_ns(session[0].time())
+        end = time_ns(session[1].time())
+        if start <= end:
+            mask |= (start <= tod) & (tod <= end)
+        else:
+            # 跨越两个自然日的交易时段
+            mask |= (tod >= start) | (tod <= end)
+    return mask
+
+
+def in_daily_range(tod: np.ndarray, daily_open_time: Time, daily_close_time: Time) -> np.ndarray:
+    """Times of day between the daily open and close (both inclusive)"""
+    if daily_open_time is None or daily_close_time is None:
+        return np.ones(len(tod), dtype=bool)
+    open_ns = time_ns(daily_open_time)
+    close_ns = time_ns(daily_close_time)
+    if open_ns < close_ns:
+        return (tod >= open_ns) & (tod <= close_ns)
+    elif open_ns > close_ns:
+        return ~((tod > close_ns) & (tod < open_ns))
+    return np.ones(len(tod), dtype=bool)
+
+
+def daily_open_close(trading_sessions: List[datetime]) -> Tuple[Time, Time]:
+    """Use trading sessions to determine daily open & close time"""
+    if trading_sessions is None or len(trading_sessions) == 0:
+        return None, None
+    return trading_sessions[0][0].time(), trading_sessions[-1][1].time()
+
+
+def interval_minutes(interval: str) -> int:
+    """'5min' -> 5, '1hour' -> 60; None for daily intervals"""
+    interval = interval.lower()
+    if interval.endswith("min"):
+        return int(interval[:-len("min")])
+    if interval.endswith("hour"):
+        return int(interval[:-len("hour")]) * 60
+    if interval == "1day":
+        return None
+    raise ValueError(f"interval {interval} is NOT valid!")
+
+
+def session_key(trading_sessions: List[datetime]) -> tuple:
+    """Hashable key of the trading sessions (times of day only)"""
+    return tuple((s[0].time(), s[1].time()) for s in trading_sessions or [])
+
+
+def _bucket_labels(
+        times: np.ndarray,
+        minutes: int,
+        trading_sessions: List[datetime]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows within the trading sessions and the end time of their bucket
+
+    Buckets are aligned to the start of each session (to midnight if no
+    session is given) and labelled by their end; a bucket is cut at the end
+    of its session, and a bar at the session start goes to the first bucket.
+    """
+    step = minutes * NS_PER_MINUTE
+    tod = times % NS_PER_DAY
+    day = times - tod
+    sessions = [(time_ns(s[0].time()), time_ns(s[1].time())) for s in trading_sessions or []] \
+        or [(0, NS_PER_DAY - 1)]
+    start = np.full(len(times), -1, dtype=np.int64)
+    length = np.zeros(len(times), dtype=np.int64)
+    for s, e in sessions:
+        free = start < 0
+        if s <= e:
+            member = free & (s <= tod) & (tod <= e)
+            start[member] = day[member] + s
+        else:
+            member = free & ((tod >= s) | (tod <= e))
+            start[member] = np.where(tod[member] >= s, day[member] + s, day[member] - NS_PER_DAY + s)
+        length[member] = (e - s) % NS_PER_DAY
+    rows = np.flatnonzero(start >= 0)
+    start, length = start[rows], length[rows]
+    index = np.maximum(-(-(times[rows] - start) // step), 1)
+    return rows, np.minimum(start + index * step, start + length)
+
+
+def _trading_days(times: np.ndarray, trading_sessions: List[datetime]) -> np.ndarray:
+    """Trading day (ns of its midnight) of every bar, as `get_trading_day`"""
+    tod = times % NS_PER_DAY
+    day = times - tod
+    daily_open_time, daily_close_time = daily_open_close(trading_sessions)
+    if daily_open_time is None or daily_open_time <= daily_close_time:
+        return day
+    # 夜盘：收盘时间之后的 bar 属于下一个交易日
+    return np.where(tod > time_ns(daily_close_time), day + NS_PER_DAY, day)
+
+
+def aggregate_ohlcv(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """OHLCV of the contiguous groups of rows beginning at `starts`"""
+    if len(starts) == 0:
+        return np.empty((0, len(BAR_FIELDS)), dtype=np.float64)
+    ends = np.append(starts[1:], len(values))
+    return np.column_stack((
+        values[starts, 0],
+        np.maximum.reduceat(values[:, 1], starts),
+        np.minimum.reduceat(values[:, 2], starts),
+        values[ends - 1, 3],
+        np.add.reduceat(values[:, 4], starts),
+    ))
+
+
+class ResampledBars:
+    """Bars of a longer interval built from the bars of a base series
+
+    `first_row`/`last_row` are the first and last base rows of every bar, so
+    that a window at any time only takes the bars whose base rows are all
+    known, and the bar in progress can be built from the rows seen so far.
+    """
+
+    def __init__(
+            self,
+            base_times: np.ndarray,
+            base_values: np.ndarray,
+            interval: str,
+            trading_sessions: List[datetime] = None
+    ):
+        self.interval = interval.lower()
+        minutes = interval_minutes(self.interval)
+        # 日线以最后一根 bar 的时间为准，分钟线以区间结束时间为准
+        self.label_last = minutes is None
+        if self.label_last:
+            rows = np.flatnonzero(in_trading_sessions(base_times % NS_PER_DAY, trading_sessions)) \
+                if trading_sessions else np.arange(len(base_times))
+            labels = _trading_days(base_times[rows], trading_sessions)
+        else:
+            rows, labels = _bucket_labels(base_times, minutes, trading_sessions)
+        starts = np.flatnonzero(np.diff(labels, prepend=labels[:1] - 1)) if len(labels) else \
+            np.array([], dtype=np.int64)
+        self.rows = rows
+        self.base_times = base_times
+        self.base_values = base_values
+        self.first_row = rows[starts]
+        self.last_row = rows[np.append(starts[1:], len(rows)) - 1] if len(starts) else starts
+        self.times = base_times[self.last_row] if self.label_last else labels[starts]
+        self.values = aggregate_ohlcv(base_values[rows], starts)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def window(
+            self,
+            periods: int,
+            end_row: int,
+            cur_datetime: datetime = None,
+            include_partial: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The last `periods` bars built from the base rows before `end_row`
+
+        Without `include_partial`, only the bars that have ended by
+        `cur_datetime` are returned; otherwise the bar in progress is built
+        from the base rows available. Raises ValueError if there are not
+        enough bars.
+        """
+        n = int(np.searchsorted(self.last_row, end_row, side="left"))
+        if not self.label_last and cur_datetime is not None:
+            n = min(n, int(np.searchsorted(self.times, pd.Timestamp(cur_datetime).value, side="right")))
+        times, values = self.times[:n], self.values[:n]
+        if include_partial and n < len(self.times):
+            lo = int(np.searchsorted(self.rows, self.first_row[n]))
+            hi = int(np.searchsorted(self.rows, end_row))
+            if hi > lo:
+                rows = self.rows[lo:hi]
+                label = self.base_times[rows[-1]] if self.label_last else self.times[n]
+                times = np.append(times, label)
+                values = np.vstack((values, aggregate_ohlcv(self.base_values[rows], np.array([0]))))
+        if len(times) < periods:
+            raise ValueError(f"We want {periods} data points, but only got {len(times)}.")
+        return times[len(times) - periods:].view("datetime64[ns]"), values[len(values) - periods:]
+
+
+def resample_bar_df(
+        data: pd.DataFrame,
+        interval: str,
+        trading_sessions: List[datetime] = None,
+        time_col: str = "time_key"
+) -> pd.DataFrame:
+    """Resample a frame of (1min) bars to `interval` (see `ResampledBars`)"""
+    times = pd.to_datetime(data[time_col]).values.astype("datetime64[ns]").view(np.int64)
+    order = np.argsort(times, kind="stable")
+    values = np.column_stack([data[field].to_numpy(dtype=np.float64)[order] for field in BAR_FIELDS])
+    resampled = ResampledBars(times[order], values, interval, trading_sessions)
+    df = pd.DataFrame(resampled.values, columns=list(BAR_FIELDS))
+    df.insert(0, time_col, resampled.times.view("datetime64[ns]"))
+    return df
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.domain.bar_aggregation import NS_PER_DAY, session_key, time_ns
+
+
+def _to_ns(t) -> int:
+    """Timestamp in ns; timezone-aware times are converted to UTC, naive
+    times are taken as they are"""
+    ts = pd.Timestamp(t)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.value
+
+
+def _to_datetime(t) -> datetime:
+    """Naive datetime of t (timezone-aware times in UTC)"""
+    if type(t) is datetime and t.tzinfo is None:
+        return t
+    return pd.Timestamp(_to_ns(t)).to_pydatetime()
+
+
+def _day_ns(d: date) -> int:
+    return pd.Timestamp(d).value
+
+
+class SessionTimeline:
+    """Open/close times of consecutive trading sessions, as sorted int64 arrays
+    (ns since epoch)
+
+    "Is open at t" and "next session start after t" are binary searches.
+    Answers are exact within [start, end) (`covers`); outside of it a
+    timeline built for that time range is needed.
+    """
+
+    def __init__(
+            self,
+            opens: np.ndarray,
+            closes: np.ndarray,
+            start: int,
+            end: int,
+            close_inclusive: bool = True
+    ):
+        order = np.argsort(opens, kind="stable")
+        self.opens = np.asarray(opens, dtype=np.int64)[order]
+        self.closes = np.asarray(closes, dtype=np.int64)[order]
+        # 单个时间的查询直接用 datetime 列表二分查找（不用转换时间类型）
+        self._opens: List[datetime] = list(pd.DatetimeIndex(self.opens).to_pydatetime())
+        self._closes: List[datetime] = list(pd.DatetimeIndex(self.closes).to_pydatetime())
+        self.start = pd.Timestamp(start).to_pydatetime()
+        self.end = pd.Timestamp(end).to_pydatetime()
+        # 配置的交易时段包含收盘时刻；交易所日历的收盘时刻不再交易
+        self.close_inclusive = close_inclusive
+
+    @classmethod
+    def from_sessions(
+            cls,
+            trading_sessions: List[List[datetime]],
+            start: date,
+            end: date
+    ) -> "SessionTimeline":
+        """Daily sessions (only the time of day is used) of every calendar day
+        in [start, end]"""
+        days = np.arange(_day_ns(start), _day_ns(end) + 1, NS_PER_DAY, dtype=np.int64)
+        opens, closes = [], []
+        for session in trading_sessions:
+            open_ns = time_ns(session[0].time())
+            close_ns = time_ns(session[1].time())
+            opens.append(days + open_ns)
+            # 跨越两个自然日的交易时段在第二天收盘
+            closes.append(days + close_ns + (NS_PER_DAY if close_ns < open_ns else 0))
+        if not opens:
+            return cls(np.array([], dtype=np.int64), np.array([], dtype=np.int64), 0, 0)
+        # 前一天的夜盘会延续到 start 当天，最后一天之后的时段未知
+        return cls(np.concatenate(opens), np.concatenate(closes), days[0] + NS_PER_DAY, days[-1])
+
+    @classmethod
+    def from_schedule(cls, schedule: pd.DataFrame) -> "SessionTimeline":
+        """Sessions of an exchange calendar schedule (open/close, and the
+        optional lunch break, in UTC)"""
+
+        def column(name):
+            values = pd.DatetimeIndex(schedule[name])
+            if values.tz is not None:
+                values = values.tz_convert("UTC").tz_localize(None)
+            return values.values.astype("datetime64[ns]").view(np.int64)
+
+        opens, closes = column("open"), column("close")
+        if "break_start" in schedule.columns and schedule["break_start"].notna().any():
+            has_break = schedule["break_start"].notna().to_numpy()
+            break_start, break_end = column("break_start"), column("break_end")
+            closes = np.where(has_break, break_start, closes)
+            opens = np.concatenate((opens, break_end[has_break]))
+            closes = np.concatenate((closes, column("close")[has_break]))
+        if len(opens) == 0:
+            return cls(opens, closes, 0, 0, close_inclusive=False)
+        return cls(opens, closes, int(opens.min()), int(closes.max()), close_inclusive=False)
+
+    def __len__(self) -> int:
+        return len(self.opens)
+
+    def covers(self, t) -> bool:
+        return self.start <= _to_datetime(t) < self.end
+
+    def _session_index(self, t: datetime) -> int:
+        """Index of the last session opened at or before t (-1 if none)"""
+        return bisect_right(self._opens, t) - 1
+
+    def is_open(self, t) -> bool:
+        t = _to_datetime(t)
+        i = self._session_index(t)
+        if i < 0:
+            return False
+        close = self._closes[i]
+        return t <= close if self.close_inclusive else t < close
+
+    def session_at(self, t) -> Tuple[datetime, datetime]:
+        """(open, close) of the session at t; None if not in session"""
+        if not self.is_open(t):
+            return None
+        i = self._session_index(_to_datetime(t))
+        return self._opens[i], self._closes[i]
+
+    def next_open(self, t) -> datetime:
+        """Start of the first session strictly after t; None if not known"""
+        i = bisect_right(self._opens, _to_datetime(t))
+        if i >= len(self._opens):
+            return None
+        return self._opens[i]
+
+
+class CalendarService:
+    """Exchange calendars and session timelines, loaded once and shared by
+    strategies, gateways and the quotes service
+
+    Exchange calendars ("XNYS", "XHKG", ...) come from `exchange_calendars`,
+    which is only imported when one is needed; times are in UTC (naive times
+    are taken as UTC, as `exchange_calendars` does).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendars = {}
+        self._exchange_timelines: Dict[str, SessionTimeline] = {}
+        self._session_days: Dict[str, np.ndarray] = {}
+        self._session_timelines: Dict[tuple, SessionTimeline] = {}
+
+    def get_calendar(self, name: str):
+        """The `exchange_calendars` calendar of the exchange"""
+        calendar = self._calendars.get(name)
+        if calendar is None:
+            import exchange_calendars as xcals
+            with self._lock:
+                calendar = self._calendars.get(name)
+                if calendar is None:
+                    calendar = self._calendars[name] = xcals.get_calendar(name)
+        return calendar
+
+    def exchange_timeline(self, name: str) -> SessionTimeline:
+        timeline = self._exchange_timelines.get(name)
+        if timeline is None:
+            schedule = self.get_calendar(name).schedule
+            timeline = SessionTimeline.from_schedule(schedule)
+            sessions = pd.DatetimeIndex(schedule.index)
+            if sessions.tz is not None:
+                sessions = sessions.tz_localize(None)
+            self._session_days[name] = sessions.values.astype("datetime64[D]")
+            self._exchange_timelines[name] = timeline
+        return timeline
+
+    def _sessions(self, name: str) -> np.ndarray:
+        self.exchange_timeline(name)
+        return self._session_days[name]
+
+    def is_open(self, name: str, t) -> bool:
+        """Whether the exchange is trading at t"""
+        return self.exchange_timeline(name).is_open(t)
+
+    def is_open_on_minute(self, name: str, minute) -> bool:
+        """Whether the exchange is trading on the minute of t (seconds are ignored)"""
+        return self.exchange_timeline(name).is_open(
+            _to_datetime(minute).replace(second=0, microsecond=0))
+
+    def next_open(self, name: str, t) -> datetime:
+        """Next session open (UTC) of the exchange strictly after t"""
+        return self.exchange_timeline(name).next_open(t)
+
+    def is_session(self, name: str, day) -> bool:
+        """Whether the date is a trading day of the exchange"""
+        sessions = self._sessions(name)
+        d = np.datetime64(pd.Timestamp(day).date(), "D")
+        i = int(np.searchsorted(sessions, d))
+        return i < len(sessions) and sessions[i] == d
+
+    def previous_session(self, name: str, day) -> pd.Timestamp:
+        """The trading day of the exchange before the date"""
+        sessions = self._sessions(name)
+        i = int(np.searchsorted(sessions, np.datetime64(pd.Timestamp(day).date(), "D"))) - 1
+        if i < 0:
+            raise ValueError(f"There is no session of {name} before {day}.")
+        return pd.Timestamp(sessions[i])
+
+    def session_timeline(
+            self,
+            trading_sessions: List[List[datetime]],
+            start: date,
+            end: date
+    ) -> SessionTimeline:
+        """Timeline of the configured daily sessions for [start, end] (cached)"""
+        key = (session_key(trading_sessions), start, end)
+        timeline = self._session_timelines.get(key)
+        if timeline is None:
+            timeline = SessionTimeline.from_sessions(trading_sessions, start, end)
+            self._session_timelines[key] = timeline
+        return timeline
+
+    def clear(self):
+        with self._lock:
+            self._calendars.clear()
+            self._exchange_timelines.clear()
+            self._session_days.clear()
+            self._session_timelines.clear()
+
+
+calendar_service = CalendarService()
@@ -1,22 +1,23 @@
 import os
-import importlib
 import warnings
 from datetime import datetime
 from datetime import time as Time
 from datetime import date as Date
 from datetime import timedelta
-from typing import List, Any
+from typing import List, Any, Iterator
 from dataclasses import dataclass
 
+import numpy as np
 import pandas as pd
 
 from app.constants import Exchange
 from app.domain.security import Stock, Security
+from app.domain.stores.bar_store import bar_store
 from app.utils.utility import get_kline_dfield_from_seconds
 from trader_config import DATA_PATH, TIME_STEP
 
 
-@dataclass
+@dataclass(slots=True)
 class Bar:
     """OHLCV"""
     datetime: datetime
@@ -28,7 +29,7 @@ class Bar:
     volume: float
 
 
-@dataclass
+@dataclass(slots=True)
 class Quote:
     """Quote"""
     security: Stock
@@ -51,7 +52,7 @@ class Quote:
     sec_status: str = "NORMAL"
 
 
-@dataclass
+@dataclass(slots=True)
 class CapitalDistribution:
     """Capital Distributions"""
     datetime: datetime
@@ -64,6 +65,101 @@ class CapitalDistribution:
     capital_out_small: float
 
 
+class BarSeries:
+    """Bars of one security kept as struct-of-arrays in a fixed size ring.
+
+    It is a drop-in replacement of the `List[Bar]` buffers in strategies:
+    `append` overwrites the oldest bar once the buffer is full, and the column
+    attributes (`open`, `high`, `low`, `close`, `volume`, `datetime`) return
+    numpy arrays in chronological order.
+    """
+
+    FIELDS = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, security: Stock = None, maxlen: int = 120):
+        assert maxlen > 0, f"maxlen should be positive, but {maxlen} was given."
+        self.security = security
+        self.maxlen = maxlen
+        self._datetime = np.empty(maxlen, dtype="datetime64[us]")
+        self._values = np.empty((len(self.FIELDS), maxlen), dtype=np.float64)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, bar: Bar):
+        if self.security is None:
+            self.security = bar.security
+        if self._size < self.maxlen:
+            pos = (self._start + self._size) % self.maxlen
+            self._size += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.maxlen
+        self._datetime[pos] = np.datetime64(bar.datetime, "us")
+        values = self._values
+        values[0, pos] = bar.open
+        values[1, pos] = bar.high
+        values[2, pos] = bar.low
+        values[3, pos] = bar.close
+        values[4, pos] = bar.volume
+
+    def _order(self) -> np.ndarray:
+        return (self._start + np.arange(self._size)) % self.maxlen
+
+    def __getitem__(self, idx: int) -> Bar:
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError(f"BarSeries index {idx} out of range")
+        pos = (self._start + idx) % self.maxlen
+        o, h, l, c, v = self._values[:, pos].tolist()
+        return Bar(
+            datetime=self._datetime[pos].astype(datetime),
+            security=self.security,
+            open=o,
+            high=h,
+            low=l,
+            close=c,
+            volume=v)
+
+    def __iter__(self) -> Iterator[Bar]:
+        for i in range(self._size):
+            yield self[i]
+
+    @property
+    def datetime(self) -> np.ndarray:
+        return self._datetime[self._order()]
+
+    @property
+    def open(self) -> np.ndarray:
+        return self._values[0, self._order()]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self._values[1, self._order()]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self._values[2, self._order()]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._values[3, self._order()]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self._values[4, self._order()]
+
+    def to_frame(self) -> pd.DataFrame:
+        order = self._order()
+        data = {"datetime": self._datetime[order]}
+        for i, field in enumerate(self.FIELDS):
+            data[field] = self._values[i, order]
+        return pd.DataFrame(data)
+
+
 def _get_data_path(security: Security, dfield: str, **kwargs) -> str:
     """Get the path to corresponding csv files."""
     if dfield == "kline":
@@ -104,6 +200,10 @@ def _get_data(
         **kwargs
 ) -> pd.DataFrame:
     """Get historical data"""
+    # Read from the columnar store if the security has been migrated
+    data_path = _get_data_path(security, dfield, **kwargs)
+    if bar_store.exists(data_path):
+        return _get_stored_data(security, start, end, dfield, dtype, data_path)
     # Get all csv files of the security given
     data_files = _get_data_files(security, dfield, **kwargs)
     # Filter out the data that is within the time range given
@@ -167,31 +267,74 @@ def _get_data(
     return full_data
 
 
+def _get_stored_data(
+        security: Stock,
+        start: datetime,
+        end: datetime,
+        dfield: str,
+        dtype: List[str],
+        data_path: str
+) -> pd.DataFrame:
+    """Get historical data from the columnar store"""
+    columns = bar_store.get_columns(data_path)
+    if dtype is None:
+        # Identify the time_key/timestamp column
+        inspect_time_cols = [c for c in columns if "time" in c or "Time" in c]
+        assert len(inspect_time_cols) > 0, (
+            "Data must contains at least one `*time*` column. Invalid "
+            f"data: {bar_store.get_file(data_path)}"
+        )
+        if "update_time" in inspect_time_cols:
+            time_col = "update_time"
+        else:
+            time_col = inspect_time_cols[0]
+    else:
+        assert sum([1 for d in dtype if "time" in d or "Time" in d]) > 0, (
+            "Input params `dtype` must contains at least one `*time*` "
+            f"column. Invalid data: {bar_store.get_file(data_path)}"
+        )
+        assert set(dtype).issubset(set(columns)), (
+            f"Input params `dtype` must be a subset of the data columns in "
+            f"{bar_store.get_file(data_path)}"
+        )
+        time_col = dtype[0]  # The first element must be time
+    full_data = bar_store.read(
+        data_path, start=start, end=end, columns=dtype, time_col=time_col)
+    if full_data.empty:
+        raise ValueError(
+            f"There is no historical data for {security.code} within time range"
+            f": [{start} - {end}]!")
+    full_data["time_key"] = pd.to_datetime(full_data["time_key"])
+    return full_data
+
+
 def _get_data_iterator(
         security: Stock,
         full_data: pd.DataFrame,
         class_name: str
 ) -> Any:
-    """Data generator"""
+    """Data generator
+
+    The frame is converted to typed columns once, and each data point is built
+    from the column values directly (no per-row pandas overhead).
+    """
     # `class_name` could be Bar, CapitalDistribution, Quote, Orderbook, etc
-    data_cls = getattr(importlib.import_module(
-        "app.domain.data"), class_name)
+    data_cls = globals()[class_name]
     time_col = full_data.columns[0]
     assert "time" in time_col or "Time" in time_col, (
         "The first column in `full_data` must be a `*time*` column, but "
         f"{time_col} was given."
     )
-    for _, row in full_data.iterrows():
-        cur_time = row[time_col]
-        if not isinstance(row[time_col], str):
-            cur_time = cur_time.to_pydatetime()
-        kwargs = {"datetime": cur_time, "security": security}
-        for col in full_data.columns:
-            if col == time_col:
-                continue
-            kwargs[col] = row[col]
-        data = data_cls(**kwargs)
-        yield data
+    data_cols = [col for col in full_data.columns if col != time_col]
+    times = full_data[time_col]
+    if pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.DatetimeIndex(times).to_pydatetime()
+    else:
+        times = times.to_numpy()
+    columns = [full_data[col].to_numpy().tolist() for col in data_cols]
+    for cur_time, *values in zip(times, *columns):
+        yield data_cls(
+            datetime=cur_time, security=security, **dict(zip(data_cols, values)))
 
 
 def _load_historical_bars_in_reverse(
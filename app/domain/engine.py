@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 import importlib
 from datetime import datetime
-from time import sleep
+from functools import partial
 from typing import List, Union, Any, Dict
-from threading import Thread
 
 from app.domain.balance import AccountBalance
 from app.constants import Direction, Offset, OrderType, TradeMode, OrderStatus, TradeMarket, OrderTimeInForce
@@ -11,17 +10,18 @@ from app.domain.data import Bar, Quote, CapitalDistribution
 from app.domain.deal import Deal
 from app.domain.order import Order
 from app.domain.portfolio import Portfolio
+from app.domain.persist import PersistQueue
 from app.domain.position import PositionData, Position
 from app.domain.security import Stock
 from app.domain.order import OrderBook
 from app.domain.data import _get_data
 from app.utils import logger
+from app.utils.latency import latency
+from app.utils.tracing import tracer
 from trader_config import DATA_MODEL, DATA_PATH
 from trader_config import ACTIVATED_PLUGINS
 from app.gateways import BaseGateway
 
-PERSIST_TIME_INTERVAL = 5  # 秒
-
 
 class Engine:
     """Execution engine"""
@@ -46,9 +46,12 @@ class Engine:
         if self.gateways_persist:
             DB = getattr(self.plugins["mariadb"], "DB")
             self.db = DB()
-            # 新建线程，定期将数据持久化到数据库
-            self.persist_active: bool = False
-            self._persist_t: Thread = Thread(target=persist_data, args=(self,), name="persist_thread")
+            # 订单、成交、头寸、资金有变化时入队，由写线程批量写入数据库
+            self._persist = PersistQueue(self)
+            for gateway_name in self.gateways_persist:
+                gateway = self.gateways[gateway_name]
+                gateway.orders.add_listener(partial(self._persist.mark_order, gateway_name))
+                gateway.deals.add_listener(partial(self._persist.mark_deal, gateway_name))
 
         self.portfolios = {}
         self.init_portfolio({
@@ -59,16 +62,13 @@ class Engine:
     def start(self):
         """启动engine，在事件循环开始之前启动"""
         if self.has_db():
-            self.persist_active = True
-            self._persist_t.start()
+            self._persist.start()
         logger.info("Engine starts")
 
     def stop(self):
         """停止engine，在事件循环结束之后/或者手动停止循环之后"""
         if self.has_db():
-            self.persist_active = False
-            # sleep(PERSIST_TIME_INTERVAL + 2)  # wait for the persist thread stop
-            self._persist_t.join((PERSIST_TIME_INTERVAL + 2) * 1000)  # wait for the persist thread stop
+            self._persist.stop()  # flush the pending changes
             self.db.close()
         logger.info("Engine stops")
 
@@ -88,6 +88,8 @@ class Engine:
                 position=Position(),  # 仓位管理
                 market=gateway  # 交易通道gateway
             )
+            if self.has_db() and gateway_name in self.gateways_persist:
+                portfolio.add_listener(partial(self._persist.on_portfolio_update, gateway_name))
             self.portfolios[gateway_name] = portfolio
 
     def get_plugins(self) -> Dict[str, Any]:
@@ -450,6 +452,7 @@ class Engine:
             position = self.get_db_position(balance_id=strat_balance_id)
             self.portfolios[gateway_name].position = Position() if position is None else position
 
+    @latency.timed("send_order")
     def send_order(self,
                    security: Stock,
                    price: float,
@@ -474,7 +477,10 @@ class Engine:
             create_time=create_time,
             remark=remark
         )
-        orderid = self.gateways[gateway_name].place_order(order)
+        tracer.start_order(order, gateway_name)
+        # 网关下单的往返时间（实盘为券商接口的请求时间）
+        with latency.span("gateway_place_order"):
+            orderid = self.gateways[gateway_name].place_order(order)
         return orderid
 
     def cancel_order(self, orderid: str, gateway_name: str):
@@ -699,205 +705,3 @@ def convert_trade_market_db2qt(trade_market: str) -> TradeMarket:
         return TradeMarket.FUTURES
     else:
         raise ValueError(f"TradeMarket {trade_market} in database is invalid!")
-
-
-def persist_data(engine, time_interval=PERSIST_TIME_INTERVAL):
-    """定期更新数据库里的数据"""
-    # 将主线程的数据库连接暂时保存起来
-    db_main = engine.db
-    # 在新线程里重新建立数据库连接
-    DB = getattr(engine.plugins["mariadb"], "DB")
-    setattr(engine, "db", DB())
-    # 定期进行数据入库
-    while engine.persist_active:
-        persist_account_balance(engine)
-        # logger.info("[Account balance] is persisted")
-        persist_position(engine)
-        # logger.info("[Position] is persisted")
-        persist_order(engine)
-        # logger.info("[Order] is persisted")
-        persist_deal(engine)
-        # logger.info("[Deal] is persisted")
-        sleep(time_interval)
-    engine.db.close()
-    # 还原主线程的数据库连接
-    setattr(engine, "db", db_main)
-    logger.info("Gracefully stop persisting data.")
-
-
-def persist_account_balance(engine):
-    """账户有任何更新，就写入数据库"""
-    # 逐个gateway进行持久化
-    for gateway_name in engine.gateways_persist:
-        db_balance = engine.get_db_balance(strategy_account=engine.strategy_account,
-                                           strategy_version=engine.strategy_version,
-                                           gateway_name=gateway_name,
-                                           )
-        if db_balance is None:
-            logger.info(
-                "[persist_account_balance] Account Balance is not available in the DB yet, need to sync balance first."
-            )
-            return
-        updates = dict()
-        for field in ("cash", "power", "max_power_short", "net_cash_power"):
-            if getattr(engine.portfolios[gateway_name].account_balance, field) != getattr(db_balance, field):
-                updates[field] = getattr(engine.portfolios[gateway_name].account_balance, field)
-        if updates:
-            engine.db.update_records(
-                table_name="balance",
-                columns=updates,
-                strategy_account=engine.strategy_account,
-                strategy_version=engine.strategy_version,
-            )
-
-
-def persist_position(engine):
-    """头寸有任何更新，就写入数据库"""
-    # 逐个gateway进行持久化
-    for gateway_name in engine.gateways_persist:
-        engine_position = engine.portfolios[gateway_name].position
-        engine_positions = engine_position.get_all_positions()
-        balance_id = engine.get_balance_id(gateway_name=gateway_name)
-        db_position = engine.get_db_position(balance_id=balance_id)
-        if db_position is None:
-            for position_data in engine_positions:
-                engine.db.insert_records(
-                    table_name="position",
-                    balance_id=balance_id,
-                    security_name=position_data.security.security_name,
-                    security_code=position_data.security.code,
-                    direction=position_data.direction.name,
-                    holding_price=position_data.holding_price,
-                    quantity=position_data.quantity,
-                    update_time=position_data.update_time
-                )
-        else:
-            # 将存在与db，但在内存记录里找不到的position删除，因为该头寸已经平掉
-            for db_position_data in db_position.get_all_positions():
-                engine_position_data = engine.portfolios[gateway_name].position.get_position(
-                    security=db_position_data.security,
-                    direction=db_position_data.direction,
-                )
-                if engine_position_data is None:
-                    engine.db.delete_records(
-                        table_name="position",
-                        balance_id=balance_id,
-                        security_name=db_position_data.security.security_name,
-                        security_code=db_position_data.security.code,
-                        direction=db_position_data.direction.name,
-                    )
-            # 现在数据库的记录是内存记录的子集了。根据内存记录里的position数据，更新数据库的记录
-            for position_data in engine_positions:
-                db_position_data = db_position.get_position(
-                    security=position_data.security,
-                    direction=position_data.direction
-                )
-                if db_position_data is None:
-                    engine.db.insert_records(
-                        table_name="position",
-                        balance_id=balance_id,
-                        security_name=position_data.security.security_name,
-                        security_code=position_data.security.code,
-                        direction=position_data.direction.name,
-                        holding_price=position_data.holding_price,
-                        quantity=position_data.quantity,
-                        update_time=position_data.update_time
-                    )
-                elif position_data.quantity != db_position_data.quantity:
-                    engine.db.update_records(
-                        table_name="position",
-                        columns=dict(
-                            holding_price=position_data.holding_price,
-                            quantity=position_data.quantity,
-                            update_time=position_data.update_time
-                        ),
-                        balance_id=balance_id,
-                        security_name=position_data.security.security_name,
-                        security_code=position_data.security.code,
-                        direction=position_data.direction.name,
-                    )
-
-
-def persist_order(engine):
-    """订单有任何更新，就写入数据库"""
-    # 逐个gateway进行持久化
-    for gateway_name in engine.gateways_persist:
-        balance_id = engine.get_balance_id(gateway_name=gateway_name)
-        orders = engine.get_all_orders(gateway_name=gateway_name)
-        if orders:
-            logger.info(orders)
-        for order in orders:
-            db_order = engine.get_db_order(balance_id=balance_id, broker_order_id=order.orderid)
-            if db_order is None:
-                engine.db.insert_records(
-                    table_name="trading_order",
-                    broker_order_id=order.orderid,
-                    balance_id=balance_id,
-                    security_name=order.security.security_name,
-                    security_code=order.security.code,
-                    price=order.price,
-                    quantity=order.quantity,
-                    direction=order.direction.name,
-                    offset=order.offset.name,
-                    order_type=order.order_type.name,
-                    create_time=order.create_time,
-                    update_time=order.updated_time,
-                    filled_avg_price=order.filled_avg_price,
-                    filled_quantity=order.filled_quantity,
-                    status=order.status.name,
-                    remark="",
-                )
-            elif order.status != db_order.status:
-                engine.db.update_records(
-                    table_name="trading_order",
-                    columns=dict(
-                        update_time=order.updated_time,
-                        filled_avg_price=order.filled_avg_price,
-                        filled_quantity=order.filled_quantity,
-                        status=order.status.name,
-                    ),
-                    balance_id=balance_id,
-                    broker_order_id=order.orderid
-                )
-
-
-def persist_deal(engine):
-    """成交有任何更新，就写入数据库"""
-    # 逐个gateway进行持久化
-    for gateway_name in engine.gateways_persist:
-        balance_id = engine.get_balance_id(gateway_name=gateway_name)
-        deals = engine.get_all_deals(gateway_name=gateway_name)
-        if deals:
-            logger.info(deals)
-        for deal in deals:
-            db_deal = engine.get_db_deal(balance_id=balance_id, broker_deal_id=deal.dealid)
-            if db_deal is None:
-                # 同步order在同步deal之前，所以这里应该是一定找得到
-                order_df = engine.db.select_records(
-                    table_name="trading_order",
-                    balance_id=balance_id,
-                    broker_order_id=deal.orderid,
-                )
-                assert not order_df.empty, (
-                    f"Records not found in order table. Check balance_id={balance_id}, broker_order_id={deal.orderid}"
-                )
-                assert order_df.shape[0] == 1, (
-                    f"More than 1 records were found in order table. Check balance_id={balance_id}, broker_order_id={deal.orderid}"
-                )
-                order_id = order_df["id"].values[0]
-                engine.db.insert_records(
-                    table_name="trading_deal",
-                    broker_deal_id=deal.dealid,
-                    broker_order_id=deal.orderid,
-                    order_id=order_id,
-                    balance_id=balance_id,
-                    security_name=deal.security.security_name,
-                    security_code=deal.security.code,
-                    direction=deal.direction.name,
-                    offset=deal.offset.name,
-                    order_type=deal.order_type.name,
-                    update_time=deal.updated_time,
-                    filled_avg_price=deal.filled_avg_price,
-                    filled_quantity=deal.filled_quantity,
-                    remark="",
-                )
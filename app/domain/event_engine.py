@@ -1,101 +1,27 @@
 # -*- coding: utf-8 -*-
-import json
-import os
+import asyncio
 from typing import Dict, List
 from datetime import datetime, timedelta
 import pandas as pd
 
 import redis
-import aioredis
 
 from app.domain.data import Bar
 from app.constants import TradeMode
 from app.domain.engine import Engine
+from app.domain.recorder import BarEventEngineRecorder
 from app.strategies.base_strategy import BaseStrategy
+from app.gateways.backtest.backtest_feeds import BarFeed, BarFeedSlice
+from app.markets.quote_bus import QuoteBus, QuoteBatch
 from app.utils.utility import timeit
 from app.utils import logger
+from app.utils.latency import latency
+from app.utils.tracing import tracer
 from app.utils.tasks import SingleTask, LoopRunTask
 from trader_config import TIME_STEP
 from app.config.configure import config
 
 
-class BarEventEngineRecorder:
-    """记录bar事件过程的变量"""
-
-    def __init__(self, **kwargs):
-        self.recorded_methods = {"datetime": "append", "portfolio_value": "append",
-                                 "strategy_portfolio_value": "append"}
-        self.recorder_name = None
-        self.datetime = []
-        self.portfolio_value = []
-        self.strategy_portfolio_value = []
-        for k, v in kwargs.items():
-            if v is None:
-                self.recorded_methods[str(k)] = "override"
-            elif isinstance(v, list) and len(v) == 0:
-                self.recorded_methods[str(k)] = "append"
-            else:
-                raise ValueError(f"BarEventEngineRecorder 的输入参数{k}的类型为{type(v)}, 只有[]或None是合法的输入")
-            setattr(self, k, v)
-
-    def get_recorded_fields(self):
-        return list(self.recorded_methods.keys())
-
-    def write_record(self, field, value):
-        record = getattr(self, field, None)
-        if self.recorded_methods[field] == "append":
-            record.append(value)
-        elif self.recorded_methods[field] == "override":
-            setattr(self, field, value)
-
-    def set_recorder_name(self, name: str):
-        self.recorder_name = name
-
-    def save_csv(self, path=None):
-        """保存所有记录变量至csv"""
-        vars = [attr for attr in dir(self) if not callable(getattr(self, attr)) and not attr.startswith("__")]
-        assert "datetime" in vars, "`datetime` is not in the recorder!"
-        assert "portfolio_value" in vars, "`portfolio_value` is not in the recorder!"
-        assert "strategy_portfolio_value" in vars, "`strategy_portfolio_value` is not in the recorder!"
-        save_dir = config.recorder.get('path')
-        if path is None:
-            path = save_dir + "/results"
-        if not os.path.exists(path):
-            os.mkdir(path)
-        now = datetime.now()
-        now = now.strftime('%Y-%m-%d %H-%M-%S.%f')
-        os.mkdir(f"{path}/{now}")
-
-        dt = getattr(self, "datetime")
-        pv = getattr(self, "portfolio_value")
-        df = pd.DataFrame([dt, pv], index=["datetime", "portfolio_value"]).T
-        for var in vars:
-            if var in ("datetime", "portfolio_value", "recorded_methods", "recorder_name"):
-                continue
-            v = getattr(self, var)
-            if self.recorded_methods[var] == "append":
-                df[var] = v
-            elif self.recorded_methods[var] == "override":
-                df[var] = None
-
-                if isinstance(v, list) and len(v) > 0 and isinstance(v[0][0], datetime) and isinstance(v[0][1], str):
-                    for i in range(len(v)):
-                        date_time = v[i][0]
-                        idx = df[df["datetime"] == date_time].index[0]
-                        if df.loc[idx, var] is None:
-                            df.loc[idx, var] = v[i][1]
-                        elif isinstance(df.loc[idx, var], str):
-                            df.loc[idx, var] = df.loc[idx, var] + "; " + v[i][1]
-                else:
-                    df.iloc[len(dt) - 1, df.columns.get_loc(var)] = str(v)
-        save_name = "result"
-        if self.recorder_name is not None and self.recorder_name != "":
-            save_name += "_" + self.recorder_name
-        result_path = f"{path}/{now}/{save_name}.csv"
-        df.to_csv(result_path, index=False)
-        return result_path
-
-
 class BarEventEngine:
     """
     Bar事件框架
@@ -107,10 +33,16 @@ class BarEventEngine:
                  start: datetime = None,
                  end: datetime = None,
                  engine: Engine = None,
+                 backtest_data: pd.DataFrame = None,
+                 quote_bus: QuoteBus = None,
                  ):
+        """backtest_data: k线数据（time_key, code, open, high, low, close, volume），
+        不指定时回测数据从 SecurityMarketStorer 加载
+        quote_bus: 实盘行情订阅，不指定时使用 Redis"""
 
         self.rClient = None
         self._load_redis()
+        self.quote_bus = quote_bus
 
         self.strategies = strategies
         self.recorders = recorders
@@ -136,7 +68,12 @@ class BarEventEngine:
         self.end = max(ends) if end is None else end
 
         self._backtest_all_data = pd.DataFrame()
-        self._load_backtest_securities_data()
+        self._backtest_feed = BarFeed(self._backtest_all_data)
+        if backtest_data is not None:
+            self._backtest_all_data = backtest_data
+            self._backtest_feed = BarFeed(backtest_data)
+        else:
+            self._load_backtest_securities_data()
 
     def _load_redis(self):
         host = config.redis.get("host", "localhost")
@@ -163,6 +100,8 @@ class BarEventEngine:
             for secList in strategy.securities.values():
                 securities.extend(secList)
         self._backtest_all_data = storer.get_kline_data(securities, start=self.start, end=self.end)
+        # 按时间和代码预先建立索引，回测时每个时间步只取对应的切片
+        self._backtest_feed = BarFeed(self._backtest_all_data)
 
     @timeit
     def run(self):
@@ -183,6 +122,26 @@ class BarEventEngine:
                 SingleTask.run(self.strategy_real_callback, strategy_name=strategy_name, recorder=recorder,
                                gateway=gateway)
 
+    def run_backtest(self):
+        """Run the backtest of all strategies to the end (blocking, without an
+        outer event loop, e.g. in a worker process)"""
+        engine = self.engine
+        engine.start()
+        loop = asyncio.get_event_loop()
+        tasks = []
+        for strategy_name in self.strategies.keys():
+            recorder = self.recorders[strategy_name]
+            recorder.set_recorder_name(strategy_name)
+            for gateway in self.engine.gateways.values():
+                assert gateway.trade_mode == TradeMode.BACKTEST, (
+                    f"run_backtest only supports backtest gateways, got {gateway.gateway_name}")
+                tasks.append(self.strategy_backtest_callback(
+                    strategy_name=strategy_name, recorder=recorder, gateway=gateway))
+        try:
+            loop.run_until_complete(asyncio.gather(*tasks))
+        finally:
+            engine.stop()
+
     def stop(self):
         self.engine.stop()
         logger.info("到达预期结束时间，策略停止（其他工作任务线程将会在1分钟内停止）")
@@ -194,36 +153,33 @@ class BarEventEngine:
             cur_datetime += timedelta(milliseconds=TIME_STEP)
             cur_datetime = datetime.combine(cur_datetime.date(), datetime.min.time())
 
-            df = self._backtest_all_data.loc[
-                self._backtest_all_data['time_key'] == cur_datetime.strftime('%Y-%m-%d %H:%M:%S')]
-            df = df.rename(columns={'time_key': 'datetime'})
             gateway.market_datetime = cur_datetime
-            kwargs['data'] = df
+            kwargs['data'] = self._backtest_feed.get_slice(cur_datetime)
             await self.on_strategy_callback(*args, **kwargs)
 
     async def strategy_real_callback(self, *args, **kwargs):
-        host = config.redis.get("host", "localhost")
-        port = config.redis.get("port", "6379")
-        password = config.redis.get("password", "")
-        db = config.redis.get("db", 1)
-        client = await aioredis.create_redis(f"redis://{host}:{port}", password=password, db=int(db))
-        channels = await client.subscribe('quant_trader_quotes_channel')  # 订阅频道
-        assert isinstance(channels[0], aioredis.Channel)
-
-        channel = channels[0]
-        while await channel.wait_message():
-            message = await channel.get_json()
-            message = json.dumps(message)
-            df = pd.read_json(message)
-            kwargs['data'] = df
-            await self.on_strategy_callback(*args, **kwargs)
+        strategy_name = kwargs.get("strategy_name")
+        strategy = self.strategies[strategy_name]
+        gateway = kwargs.get("gateway")
+        if self.quote_bus is None:
+            self.quote_bus = QuoteBus()
+        # 订阅策略频道：每轮行情是一条消息，策略每轮只回调一次（按代码的频道一轮会分成多条消息）
+        securities = {security.code: security for sec_list in strategy.securities.values() for security in sec_list}
+        self.quote_bus.register_strategy(strategy_name, securities.values())
+        subscription = await self.quote_bus.subscribe(strategies=[strategy_name])
+        try:
+            async for quotes in subscription:
+                kwargs['data'] = quotes
+                await self.on_strategy_callback(*args, **kwargs)
+        finally:
+            await subscription.close()
 
     async def on_strategy_callback(self, *args, **kwargs):
         strategy_name = kwargs.get("strategy_name")
         recorder: BarEventEngineRecorder = kwargs.get("recorder")
         gateway = kwargs.get("gateway")
         gateway_name = gateway.gateway_name
-        df: pd.DataFrame = kwargs.get("data")
+        data = kwargs.get("data")
 
         # engine = self.engine
         # gateways = engine.gateways
@@ -236,43 +192,38 @@ class BarEventEngine:
         cur_data = {}
         cur_gateway_data = {}
         for security in securities[gateway_name]:
-            data = df.loc[df['code'] == security.code].squeeze()
-            if data.empty:
-                continue
-            # bar_time = datetime.strptime(
-            #     data["datetime"], "%Y-%m-%d %H:%M:%S")
-            bar = Bar(
-                datetime=data["datetime"],
-                security=security,
-                open=data["open"],
-                high=data["high"],
-                low=data["low"],
-                close=data["close"],
-                volume=data["volume"])
+            if isinstance(data, (BarFeedSlice, QuoteBatch)):
+                bar = data.get_bar(security)
+            else:
+                bar = _get_frame_bar(data, security)
 
             if bar is None:
                 continue
 
+            if trade_mode == TradeMode.BACKTEST:
+                # 先撮合之前挂的限价单，策略再处理这根 bar
+                gateway.match_orders(security, bar)
             cur_gateway_data[security] = bar
-            strategy.update_bar(gateway_name, security, bar)
+            with latency.span("update_bar"):
+                strategy.update_bar(gateway_name, security, bar)
+            gateway.last_prices.update(security, bar.close, bar.datetime)
 
         cur_data[gateway_name] = cur_gateway_data
-        # 运行策略
+        # 运行策略（策略发出的订单带上行情的到达时间）
+        trace_token = tracer.begin(strategy_name, gateway_name, getattr(data, "ingest_ns", None))
         try:
-            await strategy.on_bar(cur_data)
+            with latency.span("on_bar"):
+                await strategy.on_bar(cur_data)
         except:
             logger.exception("strategy.on_bar fail.", cur_data=cur_data, caller=self)
+        finally:
+            tracer.end(trace_token)
 
-        gw_value = {field: [] for field in recorder.get_recorded_fields()}
-
-        for field in recorder.get_recorded_fields():
-            value = getattr(strategy, f"get_{field}")(gateway_name)
-            if isinstance(value, datetime):
-                value = value.strftime('%Y-%m-%d %H:%M:%S')
-            gw_value[field].append(value)
-
-        for field in recorder.get_recorded_fields():
-            recorder.write_record(field, gw_value[field])
+        # 每个字段记录各 gateway 的值（datetime 按时间类型记录）
+        with latency.span("recorder_write"):
+            for field in recorder.get_recorded_fields():
+                value = getattr(strategy, f"get_{field}")(gateway_name)
+                recorder.write_record(field, [value])
 
         # 重置操作
         strategy.reset_action(gateway_name)
@@ -290,3 +241,18 @@ class BarEventEngine:
             return
         elif trade_mode in (TradeMode.LIVETRADE, TradeMode.SIMULATE):
             return
+
+
+def _get_frame_bar(df: pd.DataFrame, security) -> Bar:
+    """从行情DataFrame中取出指定证券的bar（实盘行情推送使用）"""
+    data = df.loc[df['code'] == security.code].squeeze()
+    if data.empty:
+        return None
+    return Bar(
+        datetime=data["datetime"],
+        security=security,
+        open=data["open"],
+        high=data["high"],
+        low=data["low"],
+        close=data["close"],
+        volume=data["volume"])
@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime
 from dataclasses import dataclass
 
@@ -5,7 +6,7 @@ from app.domain.security import Stock
 from app.constants import Exchange, OrderType, OrderTimeInForce, OrderStatus, Direction, Offset
 
 
-@dataclass
+@dataclass(slots=True)
 class OrderBook:
     """Orderbook"""
     security: Stock
@@ -97,16 +98,32 @@ class Order:
     status: OrderStatus = OrderStatus.UNKNOWN
     orderid: str = ""
     remark: str = ""
+    trace_id: str = ""  # 下单链路追踪的关联id
+    ingest_ns: int = None  # 触发下单的行情到达时间（time.time_ns()）
 
 
 class OrderService:
+    # engine没有数据库连接池时（例如回测），所有OrderService共用一个
+    _db = None
+    _db_lock = threading.Lock()
+
     def __init__(self, engine=None):
         self.engine = engine
 
+    def get_db(self):
+        """Pooled db of the engine (connections are taken per statement)"""
+        if self.engine.has_db():
+            return self.engine.db
+        if OrderService._db is None:
+            with OrderService._db_lock:
+                # 加锁后再检查一次，并发的调用只创建一个连接
+                if OrderService._db is None:
+                    DB = getattr(self.engine.get_plugins()["mariadb"], "DB")
+                    OrderService._db = DB()
+        return OrderService._db
+
     def create_order(self, order: Order = None, account_id=0, strategy_name=""):
-        plugins = self.engine.get_plugins()
-        DB = getattr(plugins["mariadb"], "DB")
-        db = DB()
+        db = self.get_db()
 
         updated_time = order.updated_time
         if updated_time is None:
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from time import sleep
+from typing import Dict, Set, Tuple
+
+from app.constants import Direction
+from app.domain.deal import Deal
+from app.domain.order import Order
+from app.domain.portfolio import Portfolio
+from app.utils import logger
+
+PERSIST_BATCH_DELAY = 0.2  # 秒，收到变更后稍等片刻，合并同一批的连续变更
+PERSIST_RETRY_INTERVAL = 5  # 秒，写入失败后的重试间隔
+PERSIST_DEAL_MAX_RETRIES = 20  # 订单一直没有入库的成交最多重试的次数，之后丢弃
+
+ORDER_INSERT_COLUMNS = [
+    "broker_order_id", "balance_id", "security_name", "security_code", "price", "quantity", "direction",
+    "offset", "order_type", "create_time", "update_time", "filled_avg_price", "filled_quantity", "status",
+    "remark"
+]
+ORDER_UPDATE_COLUMNS = ["update_time", "filled_avg_price", "filled_quantity", "status"]
+DEAL_INSERT_COLUMNS = [
+    "broker_deal_id", "broker_order_id", "order_id", "balance_id", "security_name", "security_code",
+    "direction", "offset", "order_type", "update_time", "filled_avg_price", "filled_quantity", "remark"
+]
+POSITION_KEYS = ["balance_id", "security_code", "direction"]
+POSITION_INSERT_COLUMNS = ["security_name", "holding_price", "quantity", "update_time"] + POSITION_KEYS
+POSITION_UPDATE_COLUMNS = ["holding_price", "quantity", "update_time"]
+BALANCE_UPDATE_COLUMNS = ["cash", "power", "max_power_short", "net_cash_power"]
+
+PositionKey = Tuple[str, str]  # (security_code, direction name)
+
+
+class PersistQueue:
+    """Write-behind persistence of orders, deals, positions and balances
+
+    Gateways (orders/deals) and portfolios (balance/positions) notify the queue
+    of every change; the records are marked dirty (the latest state wins) and a
+    writer thread flushes them in one transaction per gateway, with bulk
+    inserts/updates. The keys already in the database are loaded once, so the
+    cost of a flush only depends on the number of changes, not on the history.
+    """
+
+    def __init__(self, engine, batch_delay: float = PERSIST_BATCH_DELAY):
+        self.engine = engine
+        self.batch_delay = batch_delay
+        self.db = None
+        self._active = False
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="persist_thread")
+        # 待入库的记录 (gateway_name -> ...)
+        self._orders: Dict[str, Dict[str, Order]] = {}
+        self._deals: Dict[str, Dict[str, Deal]] = {}
+        self._balances: Set[str] = set()
+        self._positions: Dict[str, Set[PositionKey]] = {}
+        self._deal_retries: Dict[str, Dict[str, int]] = {}  # 等待订单入库的成交的重试次数
+        # 已入库的记录 (gateway_name -> ...)
+        self._balance_ids: Dict[str, int] = {}
+        self._order_ids: Dict[str, Dict[str, int]] = {}  # broker_order_id -> id
+        self._deal_ids: Dict[str, Set[str]] = {}
+        self._position_keys: Dict[str, Set[PositionKey]] = {}
+
+    def start(self):
+        """Mark the current state dirty (reconciled by the first flush) and start the writer"""
+        for gateway_name in self.engine.gateways_persist:
+            gateway = self.engine.gateways[gateway_name]
+            for orderid, order in gateway.orders.items():
+                self.mark_order(gateway_name, orderid, order)
+            for dealid, deal in gateway.deals.items():
+                self.mark_deal(gateway_name, dealid, deal)
+            self.mark_balance(gateway_name)
+            for position_data in self.engine.portfolios[gateway_name].position.get_all_positions():
+                self.mark_position(gateway_name, position_data.security.code, position_data.direction)
+        self._active = True
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Flush the pending changes and stop the writer"""
+        with self._cv:
+            self._active = False
+            self._cv.notify()
+        self._thread.join(timeout)
+
+    def mark_order(self, gateway_name: str, orderid: str, order: Order):
+        with self._cv:
+            self._orders.setdefault(gateway_name, {})[orderid] = order
+            self._cv.notify()
+
+    def mark_deal(self, gateway_name: str, dealid: str, deal: Deal):
+        with self._cv:
+            self._deals.setdefault(gateway_name, {})[dealid] = deal
+            self._cv.notify()
+
+    def mark_balance(self, gateway_name: str):
+        with self._cv:
+            self._balances.add(gateway_name)
+            self._cv.notify()
+
+    def mark_position(self, gateway_name: str, security_code: str, direction: Direction):
+        with self._cv:
+            self._positions.setdefault(gateway_name, set()).add((security_code, direction.name))
+            self._cv.notify()
+
+    def on_portfolio_update(self, gateway_name: str, portfolio: Portfolio, deal: Deal):
+        """Portfolio listener: a deal changes the balance and the positions of the security"""
+        with self._cv:
+            self._balances.add(gateway_name)
+            positions = self._positions.setdefault(gateway_name, set())
+            # 平仓时更新的是反方向的头寸
+            positions.add((deal.security.code, Direction.LONG.name))
+            positions.add((deal.security.code, Direction.SHORT.name))
+            self._cv.notify()
+
+    def _has_dirty(self) -> bool:
+        return bool(self._orders or self._deals or self._balances or self._positions)
+
+    def _run(self):
+        # 每次写入（事务）从连接池取连接，写完即归还
+        self.db = self.engine.db
+        while True:
+            with self._cv:
+                while self._active and not self._has_dirty():
+                    self._cv.wait()
+                active = self._active
+            if active and self.batch_delay > 0:
+                sleep(self.batch_delay)
+            done = self.flush()
+            if not done and active:
+                with self._cv:
+                    self._cv.wait_for(lambda: not self._active, PERSIST_RETRY_INTERVAL)
+                continue
+            if not active:
+                # flush期间产生的变更（例如首次加载时待核对的头寸）也要写入；
+                # 只重试一次，避免数据库异常时无法退出
+                if self._has_dirty():
+                    self.flush()
+                break
+        logger.info("Gracefully stop persisting data.")
+
+    def flush(self) -> bool:
+        """Write all dirty records; failed gateways are put back to the queue.
+        Return False if anything was put back."""
+        done = True
+        with self._cv:
+            orders, self._orders = self._orders, {}
+            deals, self._deals = self._deals, {}
+            balances, self._balances = self._balances, set()
+            positions, self._positions = self._positions, {}
+        for gateway_name in set(orders) | set(deals) | balances | set(positions):
+            batch = (
+                orders.get(gateway_name, {}),
+                deals.get(gateway_name, {}),
+                gateway_name in balances,
+                positions.get(gateway_name, set()),
+            )
+            try:
+                balance_id = self._get_balance_id(gateway_name)
+                if balance_id is None:
+                    logger.info(
+                        f"[persist] Balance id of {gateway_name} is not available in the DB yet, need to sync "
+                        "balance first.")
+                    self._requeue(gateway_name, *batch)
+                    done = False
+                    continue
+                with self.db.transaction():
+                    committed = self._write(gateway_name, balance_id, *batch)
+            except Exception as e:
+                logger.error(f"[persist] Failed to persist {gateway_name}: {e}")
+                self._requeue(gateway_name, *batch)
+                done = False
+                continue
+            # 事务提交后才更新已入库记录
+            *keys, pending_deals = committed
+            self._commit_keys(gateway_name, *keys)
+            pending_deals = self._retry_deals(gateway_name, keys[1], pending_deals)
+            if pending_deals:
+                self._requeue(gateway_name, {}, pending_deals, False, set())
+                done = False
+        return done
+
+    def _retry_deals(
+            self,
+            gateway_name: str,
+            new_deal_ids: Set[str],
+            pending_deals: Dict[str, Deal]
+    ) -> Dict[str, Deal]:
+        """Deals to put back (their orders are not persisted yet); give up after PERSIST_DEAL_MAX_RETRIES"""
+        retries = self._deal_retries.setdefault(gateway_name, {})
+        for dealid in new_deal_ids:
+            retries.pop(dealid, None)
+        requeue = {}
+        for dealid, deal in pending_deals.items():
+            retries[dealid] = retries.get(dealid, 0) + 1
+            if retries[dealid] <= PERSIST_DEAL_MAX_RETRIES:
+                requeue[dealid] = deal
+                continue
+            retries.pop(dealid)
+            logger.error(
+                f"[persist] Order {deal.orderid} of deal {dealid} is still not persisted after "
+                f"{PERSIST_DEAL_MAX_RETRIES} retries, the deal is dropped.")
+        return requeue
+
+    def _write(
+            self,
+            gateway_name: str,
+            balance_id: int,
+            orders: Dict[str, Order],
+            deals: Dict[str, Deal],
+            balance: bool,
+            positions: Set[PositionKey],
+    ):
+        db = self.db
+        order_ids = self._order_ids[gateway_name]
+        deal_ids = self._deal_ids[gateway_name]
+        position_keys = self._position_keys[gateway_name]
+
+        # orders
+        insert_rows, update_rows = [], []
+        for orderid, order in orders.items():
+            if orderid in order_ids:
+                update_rows.append([
+                    order.updated_time, order.filled_avg_price, order.filled_quantity, order.status.name,
+                    order_ids[orderid]])
+            else:
+                insert_rows.append([
+                    orderid, balance_id, order.security.security_name, order.security.code, order.price,
+                    order.quantity, order.direction.name, order.offset.name, order.order_type.name,
+                    order.create_time, order.updated_time, order.filled_avg_price, order.filled_quantity,
+                    order.status.name, ""])
+        db.insert_many("trading_order", ORDER_INSERT_COLUMNS, insert_rows)
+        db.update_many("trading_order", ORDER_UPDATE_COLUMNS, ["id"], update_rows)
+        new_order_ids = {}
+        if insert_rows:
+            order_ids_new = [row[0] for row in insert_rows]
+            order_columns = db.query_columns(
+                "SELECT id, broker_order_id FROM trading_order WHERE balance_id=? "
+                f"AND broker_order_id IN ({','.join('?' * len(order_ids_new))})",
+                [balance_id, *order_ids_new])
+            new_order_ids = dict(zip(order_columns["broker_order_id"], order_columns["id"]))
+
+        # deals (成交记录不会变化，只需插入新记录)
+        insert_rows, new_deal_ids, pending_deals = [], set(), {}
+        for dealid, deal in deals.items():
+            if dealid in deal_ids:
+                continue
+            order_id = order_ids.get(deal.orderid, new_order_ids.get(deal.orderid))
+            if order_id is None:
+                # 对应的订单还没有入库，留到下一批
+                pending_deals[dealid] = deal
+                continue
+            insert_rows.append([
+                dealid, deal.orderid, order_id, balance_id, deal.security.security_name, deal.security.code,
+                deal.direction.name, deal.offset.name, deal.order_type.name, deal.updated_time,
+                deal.filled_avg_price, deal.filled_quantity, ""])
+            new_deal_ids.add(dealid)
+        db.insert_many("trading_deal", DEAL_INSERT_COLUMNS, insert_rows)
+        if pending_deals:
+            logger.warn(f"[persist] Orders of deals {list(pending_deals)} are not persisted yet.")
+
+        # positions
+        insert_rows, update_rows, delete_rows = [], [], []
+        new_position_keys, removed_position_keys = set(), set()
+        if positions:
+            engine_positions = {
+                (p.security.code, p.direction.name): p
+                for p in self.engine.portfolios[gateway_name].position.get_all_positions()
+            }
+            for key in positions:
+                position_data = engine_positions.get(key)
+                if position_data is None:
+                    # 头寸已经平掉
+                    if key in position_keys:
+                        delete_rows.append([balance_id, *key])
+                        removed_position_keys.add(key)
+                elif key in position_keys:
+                    update_rows.append([
+                        position_data.holding_price, position_data.quantity, position_data.update_time,
+                        balance_id, *key])
+                else:
+                    insert_rows.append([
+                        position_data.security.security_name, position_data.holding_price,
+                        position_data.quantity, position_data.update_time, balance_id, *key])
+                    new_position_keys.add(key)
+        db.delete_many("position", POSITION_KEYS, delete_rows)
+        db.update_many("position", POSITION_UPDATE_COLUMNS, POSITION_KEYS, update_rows)
+        db.insert_many("position", POSITION_INSERT_COLUMNS, insert_rows)
+
+        # balance
+        if balance:
+            account_balance = self.engine.portfolios[gateway_name].account_balance
+            db.update_many(
+                "balance", BALANCE_UPDATE_COLUMNS, ["id"],
+                [[getattr(account_balance, c) for c in BALANCE_UPDATE_COLUMNS] + [balance_id]])
+        return new_order_ids, new_deal_ids, new_position_keys, removed_position_keys, pending_deals
+
+    def _commit_keys(
+            self,
+            gateway_name: str,
+            new_order_ids: Dict[str, int],
+            new_deal_ids: Set[str],
+            new_position_keys: Set[PositionKey],
+            removed_position_keys: Set[PositionKey]
+    ):
+        self._order_ids[gateway_name].update(new_order_ids)
+        self._deal_ids[gateway_name].update(new_deal_ids)
+        position_keys = self._position_keys[gateway_name]
+        position_keys.update(new_position_keys)
+        position_keys.difference_update(removed_position_keys)
+
+    def _requeue(
+            self,
+            gateway_name: str,
+            orders: Dict[str, Order],
+            deals: Dict[str, Deal],
+            balance: bool,
+            positions: Set[PositionKey]
+    ):
+        """Put back records that failed to persist (newer changes win)"""
+        with self._cv:
+            gateway_orders = self._orders.setdefault(gateway_name, {})
+            for orderid, order in orders.items():
+                gateway_orders.setdefault(orderid, order)
+            gateway_deals = self._deals.setdefault(gateway_name, {})
+            for dealid, deal in deals.items():
+                gateway_deals.setdefault(dealid, deal)
+            if balance:
+                self._balances.add(gateway_name)
+            if positions:
+                self._positions.setdefault(gateway_name, set()).update(positions)
+            # 清理空记录，避免空转
+            if not gateway_orders:
+                self._orders.pop(gateway_name)
+            if not gateway_deals:
+                self._deals.pop(gateway_name)
+
+    def _get_balance_id(self, gateway_name: str) -> int:
+        """Balance id of the gateway (the persisted keys are loaded with it)"""
+        if gateway_name in self._balance_ids:
+            return self._balance_ids[gateway_name]
+        engine = self.engine
+        gateway = engine.gateways[gateway_name]
+        balance_df = self.db.select_records(
+            table_name="balance",
+            columns=["id"],
+            broker_name=gateway.broker_name,
+            broker_environment=gateway.trade_mode.name,
+            broker_account=gateway.broker_account,
+            strategy_account=engine.strategy_account,
+            strategy_version=engine.strategy_version,
+        )
+        if balance_df.empty:
+            return None
+        assert balance_df.shape[0] == 1, f"There are more than 1 records found in Balance. Check\n{balance_df}"
+        balance_id = int(balance_df["id"].values[0])
+
+        order_df = self.db.select_records(
+            table_name="trading_order", columns=["id", "broker_order_id"], balance_id=balance_id)
+        deal_df = self.db.select_records(
+            table_name="trading_deal", columns=["broker_deal_id"], balance_id=balance_id)
+        position_df = self.db.select_records(
+            table_name="position", columns=["security_code", "direction"], balance_id=balance_id)
+        self._order_ids[gateway_name] = dict(zip(order_df["broker_order_id"], order_df["id"]))
+        self._deal_ids[gateway_name] = set(deal_df["broker_deal_id"])
+        self._position_keys[gateway_name] = set(zip(position_df["security_code"], position_df["direction"]))
+        # 数据库里有、内存里没有的头寸，在第一次写入时核对（删除已平掉的头寸）
+        with self._cv:
+            self._positions.setdefault(gateway_name, set()).update(self._position_keys[gateway_name])
+        self._balance_ids[gateway_name] = balance_id
+        return balance_id
+
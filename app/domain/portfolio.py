@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from typing import Callable, Dict, List, Set
+
 from app.domain.balance import AccountBalance
 from app.domain.deal import Deal
 from app.constants import Direction, Offset
 from app.domain.position import Position, PositionData
+from app.domain.security import Security
 from app.gateways import BaseGateway
 
 
@@ -20,8 +23,117 @@ class Portfolio:
             position: Position,
             market: BaseGateway):
         self.account_balance = account_balance
-        self.position = position
+        self.listeners: List[Callable[["Portfolio", Deal], None]] = []
+        # 持仓市值增量维护：成交/持仓变化时重算该证券，价格变化时按净持仓调整
+        self._exposure: Dict[Security, float] = {}  # 净持仓（多 - 空）* lot_size
+        self._prices: Dict[Security, float] = {}  # 计算持仓市值所用的价格
+        self._unpriced: Set[Security] = set()  # 持仓中没有 bar 价格的证券，估值时向 gateway 查询
+        self._polled: Set[Security] = set()  # 价格表中的价格是查询得到的（不是 bar 推送的）
+        self._holdings_value = 0.0
+        self._polling = False
+        self._market = None
+        self._position = None
         self.market = market  # gateway
+        self.position = position
+
+    @property
+    def market(self) -> BaseGateway:
+        return self._market
+
+    @market.setter
+    def market(self, market: BaseGateway):
+        if self._market is not None:
+            self._market.last_prices.remove_listener(self._on_price)
+        self._market = market
+        self._polled.clear()
+        market.last_prices.add_listener(self._on_price)
+        if self._position is not None:
+            self.revalue()
+
+    @property
+    def position(self) -> Position:
+        return self._position
+
+    @position.setter
+    def position(self, position: Position):
+        if self._position is not None and self._on_position in self._position.listeners:
+            self._position.listeners.remove(self._on_position)
+        self._position = position
+        position.add_listener(self._on_position)
+        self.revalue()
+
+    def revalue(self):
+        """Recompute the holdings value from scratch"""
+        self._exposure.clear()
+        self._prices.clear()
+        self._unpriced.clear()
+        self._holdings_value = 0.0
+        for security in list(self.position.holdings):
+            self._on_position(security)
+
+    def _on_position(self, security: Security):
+        """The holdings of the security changed"""
+        old = self._exposure.pop(security, 0.0) * self._prices.pop(security, 0.0)
+        self._unpriced.discard(security)
+        holdings = self.position.holdings.get(security)
+        exposure = 0.0
+        for direction, position_data in (holdings or {}).items():
+            if direction == Direction.LONG:
+                exposure += position_data.quantity * security.lot_size
+            elif direction == Direction.SHORT:
+                exposure -= position_data.quantity * security.lot_size
+        new = 0.0
+        if holdings:
+            self._exposure[security] = exposure
+            price = self.market.last_prices.get(security)
+            if price is None or security in self._polled:
+                self._unpriced.add(security)
+            if price is None:
+                price = self._estimate_price(security)
+            self._prices[security] = price
+            new = exposure * price
+        self._holdings_value += new - old
+
+    def _on_price(self, security: Security, old_price: float, price: float):
+        if not self._polling:
+            self._polled.discard(security)
+            self._unpriced.discard(security)
+        exposure = self._exposure.get(security)
+        if exposure is None:
+            return
+        self._holdings_value += exposure * (price - self._prices[security])
+        self._prices[security] = price
+
+    def _estimate_price(self, security: Security) -> float:
+        # 2022.02.23 (Joseph): If bar data is not available, we will not
+        # be able to get the updated portfolio value; We circumvent this
+        # by using the holding prices of the securities (Be alerted that
+        # this is an estimation of the portfolio value, it is NOT
+        # accurate).
+        holdings = self.position.holdings[security]
+        return sum(pos.holding_price for pos in holdings.values()) / len(holdings)
+
+    def _price_unpriced(self):
+        """Ask the gateway for the securities without bars in the price table
+        (they are asked again on every valuation until a bar arrives)"""
+        self._polling = True
+        try:
+            for security in list(self._unpriced):
+                recent_data = self.market.get_recent_data(
+                    security=security,
+                    cur_datetime=self.market.market_datetime,
+                    dfield="kline"
+                )
+                if recent_data is not None:
+                    # 价格表的监听会更新持仓市值
+                    self._polled.add(security)
+                    self.market.last_prices.update(security, recent_data.close, recent_data.datetime)
+        finally:
+            self._polling = False
+
+    def add_listener(self, listener: Callable[["Portfolio", Deal], None]):
+        """listener(portfolio, deal) is called after the portfolio is updated by a deal"""
+        self.listeners.append(listener)
 
     def update(self, deal: Deal):
         security = deal.security
@@ -59,34 +171,13 @@ class Portfolio:
             position_data=position_data,
             offset=offset
         )
+        for listener in self.listeners:
+            listener(self, deal)
 
     @property
     def value(self):
-        v = self.account_balance.cash
-        for security in self.position.holdings:
-            recent_data = self.market.get_recent_data(
-                security=security,
-                cur_datetime=self.market.market_datetime,
-                dfield="kline"
-            )
-            if recent_data is not None:
-                cur_price = recent_data.close
-            else:
-                # 2022.02.23 (Joseph): If bar data is not available, we will not
-                # be able to get the updated portfolio value; We circumvent this
-                # by using the holding prices of the securities (Be alerted that
-                # this is an estimation of the portfolio value, it is NOT
-                # accurate).
-                cur_price = 0
-                n = 0
-                for i, pos in enumerate(self.position.holdings[security]):
-                    n += 1
-                    cur_price += self.position.holdings[security][pos].holding_price
-                cur_price /= (i + 1)
-            for direction in self.position.holdings[security]:
-                position_data = self.position.holdings[security][direction]
-                if direction == Direction.LONG:
-                    v += cur_price * position_data.quantity * security.lot_size
-                elif direction == Direction.SHORT:
-                    v -= cur_price * position_data.quantity * security.lot_size
-        return v
+        """Cash plus the value of the holdings at the last prices (O(1) once
+        every held security has a price in the gateway's price table)"""
+        if self._unpriced:
+            self._price_unpriced()
+        return self.account_balance.cash + self._holdings_value
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from app.constants import Direction, Offset
 from app.domain.security import Stock
@@ -24,6 +24,11 @@ class Position:
         if holdings is None:
             holdings = dict()
         self.holdings = holdings  # 包含每个证券做空和做多信息
+        self.listeners: List[Callable[[Stock], None]] = []
+
+    def add_listener(self, listener: Callable[[Stock], None]):
+        """listener(security) is called after the holdings of the security are updated"""
+        self.listeners.append(listener)
 
     def update(self, position_data: PositionData, offset: Offset):
         security = position_data.security
@@ -77,6 +82,8 @@ class Position:
                 self.holdings[security].pop(offset_direction, None)
         if len(self.holdings[security]) == 0:
             self.holdings.pop(security, None)
+        for listener in self.listeners:
+            listener(security)
 
     def get_position(
             self,
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+import numbers
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from app.config.configure import config
+
+RECORD_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 每个 row group 的记录数：缓存的 Python 对象约 1 MiB（每条记录 10 个字段左右）
+RECORD_CHUNK_SIZE = 1000
+
+
+def _infer_type(value) -> pa.DataType:
+    """Arrow type of a recorded value; None for a value without type information (None, [])"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, numbers.Real):
+        return pa.float64()
+    if isinstance(value, datetime):
+        return pa.timestamp("us")
+    if isinstance(value, str):
+        return pa.string()
+    if isinstance(value, (list, tuple)):
+        item_type = _merge_types(_infer_type(v) for v in value)
+        return pa.list_(pa.null() if item_type is None else item_type)
+    # 其他对象（如 AccountBalance, Position）记录为字符串
+    return pa.string()
+
+
+def _merge_types(types) -> pa.DataType:
+    merged = None
+    for t in types:
+        if t is None:
+            continue
+        merged = t if merged is None else _merge_type(merged, t)
+    return merged
+
+
+def _merge_type(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_floating(a) and pa.types.is_integer(b) or pa.types.is_integer(a) and pa.types.is_floating(b):
+        return pa.float64()
+    if pa.types.is_list(a) and pa.types.is_list(b):
+        return pa.list_(_merge_type(a.value_type, b.value_type))
+    # 类型不一致，按字符串记录
+    return pa.string()
+
+
+def _has_null(t: pa.DataType) -> bool:
+    """Whether the type has no element type yet (None, [])"""
+    if pa.types.is_null(t):
+        return True
+    if pa.types.is_list(t):
+        return _has_null(t.value_type)
+    return False
+
+
+def _to_storable(value, t: pa.DataType):
+    """Convert objects recorded as strings"""
+    if value is None:
+        return None
+    if pa.types.is_list(t):
+        return [_to_storable(v, t.value_type) for v in value]
+    if pa.types.is_string(t) and not isinstance(value, str):
+        return repr(value)
+    return value
+
+
+def _is_object(value) -> bool:
+    if isinstance(value, (list, tuple)):
+        return any(_is_object(v) for v in value)
+    return _infer_type(value) == pa.string() and not isinstance(value, str)
+
+
+class _Repr(str):
+    """A recorded object (stored as its repr) that formats as the object did"""
+
+    def __repr__(self):
+        return str(self)
+
+
+def _to_text(column: pa.Array) -> pa.Array:
+    """Timestamps (also in lists) as strings, as the engine recorded them before"""
+    t = column.type
+    if pa.types.is_list(t):
+        offsets = pc.subtract(column.offsets, column.offsets[0])
+        return pa.ListArray.from_arrays(offsets, _to_text(column.flatten()), mask=column.is_null())
+    if pa.types.is_timestamp(t):
+        return pc.strftime(pc.cast(column, pa.timestamp("s", tz=t.tz), safe=False), format=RECORD_TIME_FORMAT)
+    return column
+
+
+def _has_timestamp(t: pa.DataType) -> bool:
+    while pa.types.is_list(t):
+        t = t.value_type
+    return pa.types.is_timestamp(t)
+
+
+def _as_objects(value):
+    if isinstance(value, list):
+        return [_as_objects(v) for v in value]
+    return _Repr(value) if isinstance(value, str) else value
+
+
+def _is_annotation(value) -> bool:
+    return isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], datetime) \
+        and isinstance(value[1], str)
+
+
+class BarEventEngineRecorder:
+    """记录bar事件过程的变量
+
+    "append" 字段（参数为 []）按列类型缓存，每 `chunk_size` 行作为一个 row group
+    写入 Parquet 文件（`result_<name>.parquet`），内存占用与回测长度无关。
+    "override" 字段（参数为 None）只保留最新值；其中 (datetime, str) 形式的标注
+    （或标注列表）写入单独的标注表（`result_<name>_annotations.parquet`，按时间排序）。
+    `save_csv` 导出与之前相同格式的 csv。
+    """
+
+    def __init__(self, path: str = None, chunk_size: int = RECORD_CHUNK_SIZE, **kwargs):
+        self.recorded_methods = {"datetime": "append", "portfolio_value": "append",
+                                 "strategy_portfolio_value": "append"}
+        self.recorder_name = None
+        for k, v in kwargs.items():
+            if v is None:
+                self.recorded_methods[str(k)] = "override"
+            elif isinstance(v, list) and len(v) == 0:
+                self.recorded_methods[str(k)] = "append"
+            else:
+                raise ValueError(f"BarEventEngineRecorder 的输入参数{k}的类型为{type(v)}, 只有[]或None是合法的输入")
+        assert chunk_size > 0, f"chunk_size should be positive, got {chunk_size}"
+        self.path = path
+        self.chunk_size = chunk_size
+        self.num_records = 0
+        self._append_fields = [f for f, m in self.recorded_methods.items() if m == "append"]
+        self._buffers: Dict[str, List[Any]] = {f: [] for f in self._append_fields}
+        self._overrides: Dict[str, Any] = {}
+        self._annotations: Dict[Tuple[datetime, str, str], None] = {}  # 有序去重
+        self._run_dir: str = None
+        self._parts: List[str] = []  # 列类型变化时开始新的文件
+        self._writer: pq.ParquetWriter = None
+        self._schema: pa.Schema = None
+        self._object_fields = set()  # 记录对象 repr 的字段
+
+    def get_recorded_fields(self):
+        return list(self.recorded_methods.keys())
+
+    def set_recorder_name(self, name: str):
+        self.recorder_name = name
+
+    def write_record(self, field, value):
+        buffer = self._buffers.get(field)
+        if buffer is not None:
+            buffer.append(value)
+            if len(buffer) >= self.chunk_size and all(len(b) >= self.chunk_size for b in self._buffers.values()):
+                self.flush()
+        elif self.recorded_methods[field] == "override":
+            self._overrides[field] = value
+            self._add_annotations(field, value)
+
+    def annotate(self, date_time: datetime, field: str, text: str):
+        """Annotate the record of `date_time` (e.g. the reason of an action)"""
+        self._annotations[(date_time, field, text)] = None
+
+    def _add_annotations(self, field, value):
+        # 每个 gateway 一个值：标注或标注列表
+        for item in value if isinstance(value, list) else [value]:
+            if _is_annotation(item):
+                self.annotate(item[0], field, item[1])
+            elif isinstance(item, list):
+                for annotation in item:
+                    if _is_annotation(annotation):
+                        self.annotate(annotation[0], field, annotation[1])
+
+    @property
+    def run_dir(self) -> str:
+        """Directory of the result files of this run"""
+        if self._run_dir is None:
+            path = self.path if self.path is not None else config.recorder.get('path') + "/results"
+            now = datetime.now().strftime('%Y-%m-%d %H-%M-%S.%f')
+            self._run_dir = f"{path}/{now}"
+            os.makedirs(self._run_dir, exist_ok=True)
+        return self._run_dir
+
+    def _file_name(self, suffix: str = "") -> str:
+        save_name = "result"
+        if self.recorder_name is not None and self.recorder_name != "":
+            save_name += "_" + self.recorder_name
+        return f"{save_name}{suffix}"
+
+    def flush(self):
+        """Write the buffered records as a row group"""
+        num = min(len(b) for b in self._buffers.values())
+        if num == 0:
+            return
+        columns = {}
+        for field in self._append_fields:
+            columns[field] = self._buffers[field][:num]
+            del self._buffers[field][:num]
+        arrays = [self._to_array(field, columns[field]) for field in self._append_fields]
+        schema = pa.schema([pa.field(field, a.type) for field, a in zip(self._append_fields, arrays)])
+        if self._writer is not None and not schema.equals(self._schema):
+            self._close_writer()
+        if self._writer is None:
+            part = f"{self.run_dir}/{self._file_name()}"
+            part += ".parquet" if not self._parts else f".{len(self._parts)}.parquet"
+            self._parts.append(part)
+            self._writer = pq.ParquetWriter(part, schema)
+            self._schema = schema
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        self.num_records += num
+
+    def _to_array(self, field: str, values: list) -> pa.Array:
+        prev = self._schema.field(field).type if self._schema is not None else None
+        try:
+            # 沿用已有类型（前面的 chunk 可能只有空列表，没有元素类型）
+            array = pa.array(values, type=None if prev is None or _has_null(prev) else prev)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            # 类型不一致或记录的是对象，逐个推断
+            t = _merge_types([prev] + [_infer_type(v) for v in values])
+            if field not in self._object_fields and any(_is_object(v) for v in values):
+                self._object_fields.add(field)
+            return pa.array([_to_storable(v, t) for v in values], type=t)
+        if prev is not None and array.type != prev:
+            t = _merge_type(prev, array.type)
+            if t != array.type:
+                array = pa.array([_to_storable(v, t) for v in array.to_pylist()], type=t)
+        return array
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        """Write all buffered records and the annotations; later records go to a new file"""
+        self.flush()
+        self._close_writer()
+        annotations = list(self._annotations)
+        # override 的最新值（非标注）记录在最后一条记录的时间
+        last_time = self._last_time()
+        for field, value in self._overrides.items():
+            if not self._is_annotations(value):
+                annotations.append((last_time, field, str(value)))
+        table = pa.table({
+            "datetime": pa.array([a[0] for a in annotations], type=pa.timestamp("us")),
+            "field": pa.array([a[1] for a in annotations], type=pa.string()),
+            "text": pa.array([a[2] for a in annotations], type=pa.string()),
+        })
+        table = table.sort_by([("datetime", "ascending"), ("field", "ascending")])
+        pq.write_table(table, f"{self.run_dir}/{self._file_name('_annotations')}.parquet")
+
+    @staticmethod
+    def _is_annotations(value) -> bool:
+        items = value if isinstance(value, list) else [value]
+        return len(items) > 0 and all(_is_annotation(i) or (isinstance(i, list) and all(
+            _is_annotation(a) for a in i)) for i in items)
+
+    def _last_time(self) -> datetime:
+        if not self._parts:
+            return None
+        t = pq.read_table(self._parts[-1], columns=["datetime"])["datetime"]
+        if len(t) == 0:
+            return None
+        last = t[len(t) - 1].as_py()
+        while isinstance(last, list):
+            last = last[0] if last else None
+        if isinstance(last, str):
+            last = pd.Timestamp(last).to_pydatetime()
+        return last
+
+    def _batches(self, fields: List[str] = None):
+        """The records of all files, `chunk_size` records at a time"""
+        if self._writer is not None or any(len(b) > 0 for b in self._buffers.values()):
+            self.flush()
+            self._close_writer()
+        for part in self._parts:
+            yield from pq.ParquetFile(part).iter_batches(batch_size=self.chunk_size, columns=fields)
+
+    def read(self, fields: List[str] = None) -> pd.DataFrame:
+        """The recorded (append) fields as a DataFrame"""
+        frames = [batch.to_pandas() for batch in self._batches(fields)]
+        if not frames:
+            return pd.DataFrame(columns=fields or self._append_fields)
+        return pd.concat(frames, ignore_index=True)
+
+    def column(self, field: str, index: int = None) -> pd.Series:
+        """A recorded field; with `index`, the `index`-th value of every record (e.g. the first gateway)"""
+        chunks = []
+        for batch in self._batches([field]):
+            col = batch.column(field)
+            if index is not None:
+                col = pc.list_element(col, index)
+            chunks.append(col.to_pandas())
+        if not chunks:
+            return pd.Series([], dtype=float, name=field)
+        return pd.concat(chunks, ignore_index=True).rename(field)
+
+    def annotations(self, field: str = None, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """Annotations (datetime, field, text) sorted by datetime"""
+        path = f"{self.run_dir}/{self._file_name('_annotations')}.parquet"
+        if not os.path.exists(path):
+            self.close()
+        filters = []
+        if field is not None:
+            filters.append(("field", "=", field))
+        if start is not None:
+            filters.append(("datetime", ">=", pd.Timestamp(start)))
+        if end is not None:
+            filters.append(("datetime", "<=", pd.Timestamp(end)))
+        return pq.read_table(path, filters=filters or None).to_pandas()
+
+    def _values(self, field: str, column: pa.Array) -> list:
+        """Values of a column as recorded (timestamps as strings, objects as their repr)"""
+        values = (_to_text(column) if _has_timestamp(column.type) else column).to_pylist()
+        if field in self._object_fields:
+            values = [_as_objects(v) for v in values]
+        return values
+
+    def save_csv(self, path=None):
+        """保存所有记录变量至csv（逐个 row group 导出，内存占用有界）"""
+        self.close()
+        save_dir = self.run_dir
+        if path is not None and os.path.abspath(path) != os.path.abspath(os.path.dirname(save_dir)):
+            save_dir = f"{path}/{os.path.basename(save_dir)}"
+            os.makedirs(save_dir, exist_ok=True)
+        result_path = f"{save_dir}/{self._file_name()}.csv"
+
+        # 与之前一致：datetime, portfolio_value 在前，其他字段按名称排序
+        fields = ["datetime", "portfolio_value"] + sorted(
+            f for f in self.recorded_methods if f not in ("datetime", "portfolio_value"))
+        overrides = [f for f in fields if self.recorded_methods[f] == "override"]
+        notes = {}
+        for date_time, field, text in self._annotations:
+            key = (date_time.strftime(RECORD_TIME_FORMAT), field)
+            notes[key] = text if key not in notes else notes[key] + "; " + text
+        last_values = {f: str(v) for f, v in self._overrides.items() if not self._is_annotations(v)}
+
+        header = True
+        written = 0
+        for batch in self._batches(self._append_fields):
+            df = pd.DataFrame({field: self._values(field, batch.column(field)) for field in self._append_fields})
+            written += len(df)
+            if overrides:
+                times = [_first_time(v) for v in df["datetime"]] if notes else None
+                for field in overrides:
+                    df[field] = [notes.get((t, field)) for t in times] if notes else None
+                    if written == self.num_records and field in last_values and len(df) > 0:
+                        df.iloc[len(df) - 1, df.columns.get_loc(field)] = last_values[field]
+            df[fields].to_csv(result_path, index=False, mode="w" if header else "a", header=header)
+            header = False
+        if header:
+            pd.DataFrame(columns=fields).to_csv(result_path, index=False)
+        return result_path
+
+
+def _first_time(value) -> str:
+    while isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, datetime):
+        return value.strftime(RECORD_TIME_FORMAT)
+    return value
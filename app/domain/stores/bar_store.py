@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime
+from typing import List
+
+import pandas as pd
+
+
+class ParquetBarStore:
+    """Columnar bar store: one parquet file per security and interval.
+
+    The file sits next to the legacy one-csv-per-day directory, e.g.
+    `{DATA_PATH["kline"]}/K_1D/US.AAPL.parquet` for `K_1D/US.AAPL/*.csv`.
+    Rows are sorted by the time column and written in row groups, so reading a
+    time range only decodes the row groups that overlap it (predicate pushdown
+    on the row group statistics).
+    """
+
+    SUFFIX = ".parquet"
+    ROW_GROUP_SIZE = 50000
+    ENGINE = "pyarrow"
+
+    def __init__(self, row_group_size: int = ROW_GROUP_SIZE):
+        self.row_group_size = row_group_size
+
+    @classmethod
+    def get_file(cls, data_path: str) -> str:
+        """Parquet file of the given data path (`.../K_1D/US.AAPL`)"""
+        return data_path.rstrip("/") + cls.SUFFIX
+
+    def exists(self, data_path: str) -> bool:
+        return os.path.isfile(self.get_file(data_path))
+
+    def get_columns(self, data_path: str) -> List[str]:
+        """Column names stored in the file (without reading any data)"""
+        import pyarrow.parquet as pq
+        return pq.read_schema(self.get_file(data_path)).names
+
+    def read(
+            self,
+            data_path: str,
+            start: datetime = None,
+            end: datetime = None,
+            columns: List[str] = None,
+            time_col: str = "time_key"
+    ) -> pd.DataFrame:
+        """Read data within [start, end] (both inclusive)"""
+        filters = []
+        if start is not None:
+            filters.append((time_col, ">=", pd.Timestamp(start)))
+        if end is not None:
+            filters.append((time_col, "<=", pd.Timestamp(end)))
+        data = pd.read_parquet(
+            self.get_file(data_path),
+            engine=self.ENGINE,
+            columns=columns,
+            filters=filters or None)
+        return data.reset_index(drop=True)
+
+    def write(
+            self,
+            data_path: str,
+            data: pd.DataFrame,
+            time_col: str = "time_key",
+            mode: str = "merge"
+    ) -> str:
+        """Write data to the store.
+
+        mode:
+            'merge': (default) merge with the stored rows; rows of `data`
+                     override the stored rows of the same timestamp.
+            'overwrite': replace the stored file.
+        """
+        if mode not in ("merge", "overwrite"):
+            raise ValueError(
+                f"mode {mode} is invalid; only 'merge' or 'overwrite' are "
+                "allowed.")
+        data = data.copy()
+        data[time_col] = pd.to_datetime(data[time_col])
+        if mode == "merge" and self.exists(data_path):
+            stored = self.read(data_path, time_col=time_col)
+            data = pd.concat([stored, data], ignore_index=True)
+        data = (data.drop_duplicates(subset=[time_col], keep="last")
+                .sort_values(by=[time_col])
+                .reset_index(drop=True))
+
+        file = self.get_file(data_path)
+        os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+        # Write to a temporary file first, so that readers never see a
+        # partially written file
+        tmp_file = file + ".tmp"
+        data.to_parquet(
+            tmp_file,
+            engine=self.ENGINE,
+            index=False,
+            row_group_size=self.row_group_size)
+        os.replace(tmp_file, file)
+        return file
+
+    def migrate_csv_dir(
+            self,
+            data_path: str,
+            time_col: str = "time_key",
+            remove_csv: bool = False
+    ) -> str:
+        """Migrate a legacy csv directory (one csv per day) to the store"""
+        csv_files = sorted(f for f in os.listdir(data_path) if ".csv" in f)
+        if not csv_files:
+            return None
+        frames = [pd.read_csv(f"{data_path}/{f}") for f in csv_files]
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return None
+        file = self.write(
+            data_path, pd.concat(frames, ignore_index=True), time_col=time_col,
+            mode="overwrite")
+        if remove_csv:
+            for f in csv_files:
+                os.remove(f"{data_path}/{f}")
+            if not os.listdir(data_path):
+                os.rmdir(data_path)
+        return file
+
+
+bar_store = ParquetBarStore()
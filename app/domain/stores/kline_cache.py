@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.domain.stores.bar_store import ParquetBarStore, bar_store
+from app.utils import logger
+from trader_config import KLINE_CACHE_PATH
+
+DateRange = Tuple[date, date]
+
+# 补齐缺失区间时，向前多取几天与已缓存的数据重叠，用来发现复权因子的变化
+ADJUST_CHECK_DAYS = 7
+ADJUST_CHECK_RTOL = 1e-6
+# 只缓存日线及以上的k线（分钟线只能取到最近几天）
+CACHEABLE_FREQS = {"d": "d", "101": "d", "w": "w", "102": "w", "m": "m", "103": "m"}
+
+
+class KlineCache:
+    """Read-through cache of `facade.get_data`, keyed by (code, freq, fqt)
+
+    The bars of every key are kept in a parquet file, together with the date
+    ranges already fetched (a range without bars, e.g. before the listing,
+    is still known to be empty). A request only fetches the date ranges that
+    are missing and merges them into the stored series, so repeated or
+    overlapping backtests don't touch the network. Today is never marked as
+    fetched, since its bar may still change.
+
+    Each fetch overlaps the stored bars by a few days; if the overlapping
+    closes differ, the adjustment factors have changed (fqt != 0) and the key
+    is invalidated and fetched again. `invalidate` does the same explicitly.
+    """
+
+    def __init__(
+            self,
+            root: str = KLINE_CACHE_PATH,
+            store: ParquetBarStore = bar_store,
+            fetch: Callable[..., pd.DataFrame] = None
+    ):
+        self.root = root
+        self.store = store
+        self._fetch = fetch
+        self._lock = threading.RLock()
+        self._frames: Dict[Tuple[str, str, int], pd.DataFrame] = {}
+        self._ranges: Dict[Tuple[str, str, int], List[DateRange]] = {}
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetched_rows = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def is_cacheable(freq) -> bool:
+        return str(freq).lower() in CACHEABLE_FREQS
+
+    def stats(self) -> Dict[str, int]:
+        """hits/partial_hits/misses are counted per code and request"""
+        return dict(hits=self.hits, partial_hits=self.partial_hits, misses=self.misses, fetches=self.fetches,
+                    fetched_rows=self.fetched_rows, invalidations=self.invalidations)
+
+    def get_data(self, code_list, start: str, end: str = None, freq='d', fqt=1) -> pd.DataFrame:
+        """Same as `facade.get_data` (bars of all codes, indexed by date)"""
+        if isinstance(code_list, str):
+            code_list = [code_list]
+        freq = CACHEABLE_FREQS[str(freq).lower()]
+        fqt = int(fqt)
+        start_date = _to_date(start)
+        end_date = date.today() if end in (None, "") else _to_date(end)
+        # 今天的k线还可能变化，不记为已缓存
+        fetched_end = min(end_date, date.today() - timedelta(days=1))
+
+        with self._lock:
+            # 缺失区间相同的代码一起请求
+            groups: Dict[Tuple[DateRange, ...], List[str]] = {}
+            for code in code_list:
+                key = (code, freq, fqt)
+                missing = _subtract((start_date, end_date), self._get_ranges(key))
+                if not missing:
+                    self.hits += 1
+                    continue
+                if missing == [(start_date, end_date)]:
+                    self.misses += 1
+                else:
+                    self.partial_hits += 1
+                groups.setdefault(tuple(missing), []).append(code)
+
+            for missing, codes in groups.items():
+                for seg_start, seg_end in missing:
+                    self._fill(codes, seg_start, seg_end, fetched_end, freq, fqt)
+
+            frames = []
+            for code in code_list:
+                data = self._get_frame((code, freq, fqt))
+                if data.empty:
+                    continue
+                dates = data.index
+                frames.append(data[(dates >= pd.Timestamp(start_date))
+                                   & (dates < pd.Timestamp(end_date + timedelta(days=1)))])
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=0)
+
+    def invalidate(self, code: str = None, freq=None, fqt: int = None):
+        """Drop the cached bars (of a code and/or freq/fqt; everything by default)"""
+        freq = None if freq is None else CACHEABLE_FREQS[str(freq).lower()]
+        with self._lock:
+            for dir_freq, dir_fqt in self._cached_dirs():
+                if (freq is not None and dir_freq != freq) or (fqt is not None and dir_fqt != int(fqt)):
+                    continue
+                path = self._dir(dir_freq, dir_fqt)
+                if code is None:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    for file in (self.store.get_file(f"{path}/{code}"), f"{path}/{code}.json"):
+                        if os.path.exists(file):
+                            os.remove(file)
+            for key in list(self._frames) + list(self._ranges):
+                if ((code is None or key[0] == code) and (freq is None or key[1] == freq)
+                        and (fqt is None or key[2] == int(fqt))):
+                    self._frames.pop(key, None)
+                    self._ranges.pop(key, None)
+            self.invalidations += 1
+
+    def _fill(self, codes: List[str], seg_start: date, seg_end: date, fetched_end: date, freq: str, fqt: int):
+        """Fetch [seg_start, seg_end] of the codes and merge it into the cache"""
+        fetch_start = seg_start
+        if any(self._is_covered((code, freq, fqt), seg_start - timedelta(days=1)) for code in codes):
+            fetch_start = seg_start - timedelta(days=ADJUST_CHECK_DAYS)
+        fetched = self._download(codes, fetch_start, seg_end, freq, fqt)
+        for code in codes:
+            key = (code, freq, fqt)
+            data = fetched[fetched["code"] == code] if not fetched.empty else fetched
+            fetched_range = (fetch_start, min(seg_end, fetched_end))
+            if not self._same_adjustment(key, data):
+                logger.info(f"[kline_cache] adjustment of {code} changed, fetch it again")
+                ranges = self._get_ranges(key)
+                self.invalidate(code, freq, fqt)
+                full_start = min([fetch_start] + [r[0] for r in ranges])
+                full_end = max([seg_end] + [r[1] for r in ranges])
+                data = self._download([code], full_start, full_end, freq, fqt)
+                fetched_range = (full_start, min(full_end, fetched_end))
+            self._merge(key, data, fetched_range)
+
+    def _download(self, codes: List[str], start: date, end: date, freq: str, fqt: int) -> pd.DataFrame:
+        fetch = self._fetch
+        if fetch is None:
+            import app.facade as facade
+            fetch = facade.get_data
+        data = fetch(codes, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), freq, fqt)
+        self.fetches += 1
+        if data is None or data.empty:
+            return pd.DataFrame()
+        # 没有数据的代码返回的是带 date 列的空表，拼接后只剩一列 NaN
+        data = data.drop(columns=["date"], errors="ignore")
+        data.index = pd.DatetimeIndex(pd.to_datetime(data.index), name="date")
+        self.fetched_rows += len(data)
+        return data
+
+    def _same_adjustment(self, key, data: pd.DataFrame) -> bool:
+        """Whether the fetched closes match the cached ones on the same dates"""
+        if data.empty or key[2] == 0:
+            return True
+        cached = self._get_frame(key)
+        if cached.empty:
+            return True
+        common = cached.index.intersection(data.index)
+        if common.empty:
+            return True
+        old = cached.loc[common, "close"].to_numpy(dtype=float)
+        new = data.loc[~data.index.duplicated(keep="last")].loc[common, "close"].to_numpy(dtype=float)
+        return bool(np.allclose(old, new, rtol=ADJUST_CHECK_RTOL, equal_nan=True))
+
+    def _merge(self, key, data: pd.DataFrame, fetched: DateRange):
+        path = self._path(key)
+        if not data.empty:
+            self.store.write(path, data.reset_index(), time_col="date")
+            self._frames.pop(key, None)
+        if fetched[0] <= fetched[1]:
+            ranges = _merge_ranges(self._get_ranges(key) + [fetched])
+            self._ranges[key] = ranges
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.json", "w", encoding="utf-8") as f:
+                json.dump({"ranges": [[s.isoformat(), e.isoformat()] for s, e in ranges]}, f)
+
+    def _get_frame(self, key) -> pd.DataFrame:
+        data = self._frames.get(key)
+        if data is None:
+            path = self._path(key)
+            if self.store.exists(path):
+                data = self.store.read(path, time_col="date").set_index("date")
+            else:
+                data = pd.DataFrame()
+            self._frames[key] = data
+        return data
+
+    def _get_ranges(self, key) -> List[DateRange]:
+        ranges = self._ranges.get(key)
+        if ranges is None:
+            ranges = []
+            file = f"{self._path(key)}.json"
+            if os.path.exists(file):
+                with open(file, encoding="utf-8") as f:
+                    ranges = [(_to_date(s), _to_date(e)) for s, e in json.load(f)["ranges"]]
+            self._ranges[key] = ranges
+        return ranges
+
+    def _is_covered(self, key, day: date) -> bool:
+        return any(s <= day <= e for s, e in self._get_ranges(key))
+
+    def _dir(self, freq: str, fqt: int) -> str:
+        return f"{self.root}/{freq}_fqt{fqt}"
+
+    def _path(self, key) -> str:
+        code, freq, fqt = key
+        return f"{self._dir(freq, fqt)}/{code}"
+
+    def _cached_dirs(self) -> List[Tuple[str, int]]:
+        if not os.path.isdir(self.root):
+            return []
+        dirs = []
+        for name in os.listdir(self.root):
+            freq, _, fqt = name.partition("_fqt")
+            if fqt.isdigit():
+                dirs.append((freq, int(fqt)))
+        return dirs
+
+
+def _to_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).replace("-", "")
+    return datetime.strptime(value[:8], "%Y%m%d").date()
+
+
+def _merge_ranges(ranges: List[DateRange]) -> List[DateRange]:
+    """Sort and merge overlapping or adjacent date ranges"""
+    merged: List[DateRange] = []
+    for s, e in sorted(ranges):
+        if merged and s <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def _subtract(target: DateRange, ranges: List[DateRange]) -> List[DateRange]:
+    """Parts of `target` not covered by `ranges` (sorted and merged)"""
+    start, end = target
+    missing = []
+    for s, e in ranges:
+        if e < start:
+            continue
+        if s > end:
+            break
+        if s > start:
+            missing.append((start, s - timedelta(days=1)))
+        start = max(start, e + timedelta(days=1))
+        if start > end:
+            return missing
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+kline_cache = KlineCache()
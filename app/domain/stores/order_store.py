@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Set
+
+from app.constants import OrderStatus
+from app.domain.deal import Deal
+from app.domain.order import Order
+from app.utils.utility import BlockingDict
+
+# 终态订单不会再变化
+TERMINAL_ORDER_STATUSES = (OrderStatus.FILLED, OrderStatus.CANCELLED, OrderStatus.FAILED)
+
+
+class OrderStore(BlockingDict):
+    """Orders of a gateway (orderid -> Order), indexed by status
+
+    The status index is maintained on `put`, so an order that is modified in
+    place has to be put again (as the gateways do) to be re-indexed.
+
+    max_terminal_orders: if set, only the latest N terminal (filled/cancelled/
+        failed) orders are kept in memory; older ones are evicted and passed to
+        the archive listeners. `get` of an evicted order returns the default
+        item immediately instead of blocking.
+    """
+
+    def __init__(self, max_terminal_orders: int = None):
+        super().__init__()
+        assert max_terminal_orders is None or max_terminal_orders > 0, (
+            f"max_terminal_orders should be positive, got {max_terminal_orders}")
+        self.max_terminal_orders = max_terminal_orders
+        self.archive_listeners: List[Callable[[str, Order], None]] = []
+        # status -> orderids (insertion ordered)
+        self._status_index: Dict[OrderStatus, Dict[str, None]] = {status: OrderedDict() for status in OrderStatus}
+        self._status: Dict[str, OrderStatus] = {}
+        self._terminal: Dict[str, None] = OrderedDict()  # in the order orders became terminal
+        self._evicted: Set[str] = set()
+
+    def add_archive_listener(self, listener: Callable[[str, Order], None]):
+        """listener(orderid, order) is called when a terminal order is evicted"""
+        self.archive_listeners.append(listener)
+
+    def _on_put(self, orderid: str, order: Order):
+        status = order.status
+        old_status = self._status.get(orderid)
+        if old_status is not status:
+            if old_status is not None:
+                self._status_index[old_status].pop(orderid, None)
+            self._status_index[status][orderid] = None
+            self._status[orderid] = status
+            if status in TERMINAL_ORDER_STATUSES:
+                self._terminal[orderid] = None
+            else:
+                self._terminal.pop(orderid, None)
+        self._evicted.discard(orderid)
+
+    def _on_remove(self, orderid: str, order: Order):
+        status = self._status.pop(orderid, None)
+        if status is not None:
+            self._status_index[status].pop(orderid, None)
+        self._terminal.pop(orderid, None)
+
+    def put(self, orderid: str, order: Order):
+        super().put(orderid, order)
+        if self.max_terminal_orders is not None and len(self._terminal) > self.max_terminal_orders:
+            self._evict()
+
+    def _evict(self):
+        evicted = []
+        with self.cv:
+            while len(self._terminal) > self.max_terminal_orders:
+                # 淘汰最早进入终态的订单
+                orderid = next(iter(self._terminal))
+                order = self.queue.pop(orderid)
+                self._on_remove(orderid, order)
+                self._evicted.add(orderid)
+                evicted.append((orderid, order))
+        for orderid, order in evicted:
+            for listener in self.archive_listeners:
+                listener(orderid, order)
+
+    def get(self, orderid: str, timeout: float = None, default_item: Any = None) -> Order:
+        with self.cv:
+            if orderid in self._evicted:
+                return default_item
+        return super().get(orderid, timeout=timeout, default_item=default_item)
+
+    def get_orders_by_status(self, *statuses: OrderStatus) -> List[Order]:
+        """Orders of the given statuses, in the order they entered the status"""
+        with self.cv:
+            return [self.queue[orderid] for status in statuses for orderid in self._status_index[status]]
+
+    def get_open_orders(self) -> List[Order]:
+        """Orders that are not in a terminal status"""
+        return self.get_orders_by_status(*[s for s in OrderStatus if s not in TERMINAL_ORDER_STATUSES])
+
+    def count_by_status(self, status: OrderStatus) -> int:
+        return len(self._status_index[status])
+
+
+class DealStore(BlockingDict):
+    """Deals of a gateway (dealid -> Deal), indexed by orderid
+
+    max_deals: if set, only the latest N deals are kept in memory; older ones
+        are evicted and passed to the archive listeners.
+    """
+
+    def __init__(self, max_deals: int = None):
+        super().__init__()
+        assert max_deals is None or max_deals > 0, f"max_deals should be positive, got {max_deals}"
+        self.max_deals = max_deals
+        self.archive_listeners: List[Callable[[str, Deal], None]] = []
+        self._order_index: Dict[str, Dict[str, None]] = {}  # orderid -> dealids (insertion ordered)
+
+    def add_archive_listener(self, listener: Callable[[str, Deal], None]):
+        """listener(dealid, deal) is called when a deal is evicted"""
+        self.archive_listeners.append(listener)
+
+    def _on_put(self, dealid: str, deal: Deal):
+        self._order_index.setdefault(deal.orderid, {})[dealid] = None
+
+    def _on_remove(self, dealid: str, deal: Deal):
+        dealids = self._order_index.get(deal.orderid)
+        if dealids is not None:
+            dealids.pop(dealid, None)
+            if not dealids:
+                del self._order_index[deal.orderid]
+
+    def put(self, dealid: str, deal: Deal):
+        with self.cv:
+            old = self.queue.get(dealid)
+            if old is not None and old.orderid != deal.orderid:
+                self._on_remove(dealid, old)
+        super().put(dealid, deal)
+        if self.max_deals is not None and len(self.queue) > self.max_deals:
+            self._evict()
+
+    def _evict(self):
+        evicted = []
+        with self.cv:
+            while len(self.queue) > self.max_deals:
+                dealid = next(iter(self.queue))
+                deal = self.queue.pop(dealid)
+                self._on_remove(dealid, deal)
+                evicted.append((dealid, deal))
+        for dealid, deal in evicted:
+            for listener in self.archive_listeners:
+                listener(dealid, deal)
+
+    def find_by_orderid(self, orderid: str) -> List[Deal]:
+        """Deals of the order, O(number of its deals)"""
+        with self.cv:
+            return [self.queue[dealid] for dealid in self._order_index.get(orderid, ())]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.domain.security import Security
+
+PriceListener = Callable[[Security, Optional[float], float], None]
+
+
+class LastPriceTable:
+    """Last traded price of every security of a gateway
+
+    Updated once per incoming bar; listeners(security, old_price, new_price)
+    are called when a price changes (e.g. to revalue portfolios).
+    """
+
+    def __init__(self):
+        self._prices: Dict[Security, float] = {}
+        self._times: Dict[Security, datetime] = {}
+        self.listeners: List[PriceListener] = []
+
+    def add_listener(self, listener: PriceListener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: PriceListener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def update(self, security: Security, price: float, time: datetime = None):
+        if price is None or price != price:  # None or NaN
+            return
+        old = self._prices.get(security)
+        self._prices[security] = price
+        if time is not None:
+            self._times[security] = time
+        if old != price:
+            for listener in self.listeners:
+                listener(security, old, price)
+
+    def get(self, security: Security) -> Optional[float]:
+        return self._prices.get(security)
+
+    def get_time(self, security: Security) -> Optional[datetime]:
+        return self._times.get(security)
+
+    def __contains__(self, security: Security) -> bool:
+        return security in self._prices
+
+    def __len__(self) -> int:
+        return len(self._prices)
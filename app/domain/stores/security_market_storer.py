@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
 from enum import Enum
 from datetime import datetime
 
 import pandas as pd
 
 import app.facade as facade
-import app.constants.stock as stock_const
 import app.constants.common as com_const
 from app.domain.data import _get_data
 from app.domain.security import Stock, Security
+from app.domain.stores.kline_cache import KlineCache, kline_cache
+from app.domain.stores.security_universe import security_universe
 from trader_config import DATA_PATH, DATA_MODEL, TIME_STEP, DATA_FFILL
 
 assert set(DATA_PATH.keys()) == set(DATA_MODEL.keys()), (
@@ -21,24 +21,14 @@ assert set(DATA_PATH.keys()) == set(DATA_MODEL.keys()), (
 
 
 class SecurityMarketStorer:
-    def __init__(self, local: bool = False):
+    def __init__(self, local: bool = False, cache: KlineCache = kline_cache):
         self._local = local
+        # 日线及以上的k线先查本地缓存，只下载缺失的日期区间；cache=None 时直接请求数据源
+        self._cache = cache
 
     # 股票代码
     def get_codelist(self, market: Enum = com_const.MarketEnum.A):
-        if market == com_const.MarketEnum.HK:
-            stock_json = stock_const.HK_SHARE_STOCKS_JSON
-        elif market == com_const.MarketEnum.US:
-            stock_json = stock_const.US_SHARE_STOCKS_JSON
-        else:
-            stock_json = stock_const.A_SHARE_STOCKS_JSON
-
-        json_str = json.dumps(stock_json)
-        df = pd.DataFrame(json.loads(json_str))
-        # filter data
-        if market == com_const.MarketEnum.A:
-            df = df.drop(df[df['name'].str.contains('B') | df['name'].str.contains('ST')].index)
-        return tuple(df['symbol'].sort_values())
+        return security_universe.get_codelist(market)
 
     def get_kline_data(self, securities: [Stock], start: datetime, end: datetime = None, freq='d',
                        fqt=1) -> pd.DataFrame:
@@ -63,7 +53,12 @@ class SecurityMarketStorer:
             return result
 
         code_list = [security.code.split(".")[1] for security in securities]
-        data = facade.get_data(code_list, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), freq, fqt)
+        if self._cache is not None and self._cache.is_cacheable(freq):
+            data = self._cache.get_data(code_list, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), freq, fqt)
+        else:
+            data = facade.get_data(code_list, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), freq, fqt)
+        if data.empty:
+            return pd.DataFrame(columns=fields)
         data.reset_index(inplace=True)
         data['time_key'] = data['date']
         data.drop(columns=['date'], inplace=True)
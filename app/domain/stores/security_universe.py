@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import pandas as pd
+
+import app.constants as constants
+from app.constants import Exchange
+from app.constants.common import MarketEnum
+
+# A股、港股、美股的股票列表：market,symbol,name,exchange,industry,listed_date,area（缺失为空字符串）
+UNIVERSE_FILE = os.path.join(os.path.dirname(constants.__file__), "securities.csv.gz")
+
+
+class SecurityUniverse:
+    """Indexed registry of the A/HK/US stocks in `UNIVERSE_FILE`
+
+    The file is loaded on first use. Lookups by symbol are dict lookups; the
+    per market/exchange views and code lists are built once and cached.
+    """
+
+    def __init__(self, path: str = UNIVERSE_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._data: Optional[pd.DataFrame] = None
+        self._records: Dict[str, Dict[str, dict]] = {}
+        self._views: Dict[Tuple[str, Optional[str]], pd.DataFrame] = {}
+        self._codelists: Dict[Tuple[str, Optional[str]], Tuple[str, ...]] = {}
+
+    @property
+    def data(self) -> pd.DataFrame:
+        return self._load()
+
+    def _load(self) -> pd.DataFrame:
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    data = pd.read_csv(self._path, dtype=str, keep_default_na=False)
+                    records = {}
+                    for record in data.to_dict("records"):
+                        records.setdefault(record["market"], {})[record["symbol"]] = record
+                    self._records = records
+                    self._data = data
+        return self._data
+
+    def get(self, symbol: str, market: Union[MarketEnum, str] = None) -> Optional[dict]:
+        """Metadata of a symbol (searched in all markets if `market` is None)"""
+        self._load()
+        if market is not None:
+            return self._records.get(_market(market), {}).get(symbol)
+        for records in self._records.values():
+            if symbol in records:
+                return records[symbol]
+        return None
+
+    def __contains__(self, symbol: str) -> bool:
+        return self.get(symbol) is not None
+
+    def view(self, market: Union[MarketEnum, str], exchange: Exchange = None) -> pd.DataFrame:
+        """Stocks of a market (and exchange), indexed by symbol"""
+        key = (_market(market), None if exchange is None else exchange.value)
+        view = self._views.get(key)
+        if view is None:
+            data = self.data
+            mask = data["market"] == key[0]
+            if key[1] is not None:
+                mask &= data["exchange"] == key[1]
+            view = data[mask].set_index("symbol", drop=False)
+            self._views[key] = view
+        return view
+
+    def get_codelist(self, market: Union[MarketEnum, str] = MarketEnum.A, exchange: Exchange = None
+                     ) -> Tuple[str, ...]:
+        """Sorted symbols of a market (A股剔除 B股 和 ST)"""
+        key = (_market(market), None if exchange is None else exchange.value)
+        codes = self._codelists.get(key)
+        if codes is None:
+            df = self.view(market, exchange)
+            if key[0] == MarketEnum.A.value:
+                df = df[~(df["name"].str.contains("B") | df["name"].str.contains("ST"))]
+            codes = tuple(df["symbol"].sort_values())
+            self._codelists[key] = codes
+        return codes
+
+
+def _market(market: Union[MarketEnum, str]) -> str:
+    return market.value if isinstance(market, MarketEnum) else market
+
+
+security_universe = SecurityUniverse()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+批量下载：并发数有上限、按域名限速、失败重试，结果按输入顺序返回
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` requests per second, bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        assert rate > 0, f"rate should be > 0, got {rate}"
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Downloader:
+    """Bounded concurrency fetch engine
+
+    max_workers: number of concurrent requests (threads).
+    rate: requests per second per host (None for no limit), burst: bucket size.
+    retries/backoff: failed requests (connection errors, timeouts, 429/5xx and
+        invalid json) are retried up to `retries` times, sleeping
+        backoff * 2^attempt (with jitter, capped by max_backoff) in between.
+
+    `fetch`/`imap` run a task per item in a thread pool; the tasks do their
+    requests with `get`/`get_json` (e.g. `web_data`).
+    """
+
+    def __init__(
+            self,
+            max_workers: int = 8,
+            rate: float = None,
+            burst: int = 1,
+            retries: int = 3,
+            backoff: float = 0.5,
+            max_backoff: float = 8.0,
+            timeout: float = 10.0,
+    ):
+        assert max_workers >= 1, f"max_workers should be >= 1, got {max_workers}"
+        self.max_workers = max_workers
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.last_errors: List[Tuple[Any, Exception]] = []
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, **kwargs):
+        """Change the settings, e.g. `downloader.configure(max_workers=4, rate=10)`"""
+        for name, value in kwargs.items():
+            assert hasattr(self, name) and not name.startswith("_"), f"unknown setting {name}"
+            setattr(self, name, value)
+        with self._lock:
+            self._limiters.clear()
+
+    @property
+    def session(self) -> requests.Session:
+        # requests.Session 不保证线程安全，每个线程一个
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def _limiter(self, url: str):
+        if self.rate is None:
+            return None
+        host = urlsplit(url).netloc
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = RateLimiter(self.rate, self.burst)
+        return limiter
+
+    def _sleep(self, attempt: int):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        time.sleep(delay * (0.5 + random.random() / 2))
+
+    def get(self, url: str, params=None, headers=None, as_json: bool = False):
+        """GET with the host rate limit and retries, return the response (or its json)"""
+        limiter = self._limiter(url)
+        for attempt in range(self.retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json() if as_json else response
+                error = requests.HTTPError(f"{response.status_code} for {response.url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.JSONDecodeError as e:
+                # 被限流时可能返回不完整的内容
+                error = e
+            if attempt == self.retries:
+                raise error
+            self._sleep(attempt)
+
+    def get_json(self, url: str, params=None, headers=None):
+        return self.get(url, params=params, headers=headers, as_json=True)
+
+    @staticmethod
+    def _call(func: Callable, item) -> Tuple[Any, Exception]:
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    def imap(self, func: Callable, items: Iterable) -> Iterator[Tuple[Any, Any, Exception]]:
+        """Run func(item) for all items, yield (item, result, error) in the order of the items
+
+        Results are yielded as soon as they and all the previous ones are done,
+        at most 2 * `max_workers` tasks are submitted ahead of the consumer.
+        """
+        items = iter(items)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="downloader") as executor:
+            for item in items:
+                pending.append((item, executor.submit(self._call, func, item)))
+                if len(pending) >= self.max_workers * 2:
+                    item, future = pending.popleft()
+                    yield (item, *future.result())
+            while pending:
+                item, future = pending.popleft()
+                yield (item, *future.result())
+
+    def fetch(self, func: Callable, items: Iterable, on_result: Callable[[Any, Any], None] = None,
+              progress: bool = False) -> List[Tuple[Any, Any]]:
+        """Run func(item) for all items and return [(item, result)] in the order of the items
+
+        on_result(item, result) is called for each result as soon as it (and
+        the previous ones) is done, e.g. to write it to disk; pass it to avoid
+        keeping all the results in memory, the returned list is empty then.
+        Failed items are reported and skipped, see `self.last_errors`.
+        """
+        items = list(items)
+        pbar = None
+        if progress:
+            from tqdm import tqdm
+            pbar = tqdm(total=len(items))
+        results = []
+        errors = []
+        for item, result, error in self.imap(func, items):
+            if pbar is not None:
+                pbar.update()
+            if error is not None:
+                errors.append((item, error))
+                continue
+            if on_result is not None:
+                on_result(item, result)
+            else:
+                results.append((item, result))
+        if pbar is not None:
+            pbar.close()
+        self.last_errors = errors
+        if errors:
+            print(f"{len(errors)}/{len(items)} 下载失败: " + ", ".join(f"{item}({e})" for item, e in errors[:10]))
+        return results
+
+
+downloader = Downloader()
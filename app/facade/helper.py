@@ -7,6 +7,8 @@ from retry.api import retry
 from pathlib import Path
 from py_mini_racer import py_mini_racer
 
+from app.facade.downloader import downloader
+
 # 东方财富网网页请求头
 request_header = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; Touch; rv:11.0) like Gecko',
@@ -504,6 +506,11 @@ ths_code_name = {
 }
 
 
+SEARCH_URL = 'https://searchapi.eastmoney.com/api/suggest/get'
+# 已查询过的行情ID，批量下载时不再重复查询
+_code_id_cache = {}
+
+
 def get_code_id(code):
     """
     生成东方财富股票专用的行情ID
@@ -511,16 +518,18 @@ def get_code_id(code):
     """
     if code in code_id_dict.keys():
         return code_id_dict[code]
-    url = 'https://searchapi.eastmoney.com/api/suggest/get'
+    if code in _code_id_cache:
+        return _code_id_cache[code]
     params = (
         ('input', f'{code}'),
         ('type', '14'),
         ('token', 'D43BF722C8E33BDC906FB84D85E326E8'),
     )
-    response = session.get(url, params=params).json()
+    response = downloader.get_json(SEARCH_URL, params=params)
     code_dict = response['QuotationCodeTable']['Data']
     if code_dict:
-        return code_dict[0]['QuoteID']
+        _code_id_cache[code] = code_dict[0]['QuoteID']
+        return _code_id_cache[code]
     else:
         print('输入代码有误')
 
@@ -4,6 +4,7 @@
 交易行情数据
 """
 
+import io
 import json
 import re
 import signal
@@ -16,9 +17,14 @@ from func_timeout import func_set_timeout
 from jsonpath import jsonpath
 from datetime import datetime, timedelta
 
+from app.facade.downloader import downloader
 from app.facade.helper import (request_header, session, market_num_dict,
                                get_code_id, trans_num, trade_detail_dict, trade_detail_dict_v2)
 
+KLINE_URL = 'https://push2his.eastmoney.com/api/qt/stock/kline/get'
+# web_data 返回的列（索引为 date）
+KLINE_COLUMNS = ['name', 'code', 'open', 'high', 'low', 'close', 'volume', 'turnover', 'turnover_rate']
+
 signal.signal(signal.SIGINT, multitasking.killall)
 
 
@@ -543,39 +549,52 @@ def web_data(code, start='19000101', end=None, freq='d', fqt=1):
         ('fqt', f'{fqt}'),
     )
 
-    url = 'https://push2his.eastmoney.com/api/qt/stock/kline/get'
-    # 多线程装饰器
-
-    json_response = session.get(
-        url, headers=request_header, params=params).json()
+    json_response = downloader.get_json(KLINE_URL, headers=request_header, params=params)
     klines = jsonpath(json_response, '$..klines[:]')
     if not klines:
         columns.insert(0, '代码')
         columns.insert(0, '名称')
         return pd.DataFrame(columns=cols2)
 
-    rows = [k.split(',') for k in klines]
     name = json_response['data']['name']
     code = code_id.split('.')[-1]
-    df = pd.DataFrame(rows, columns=columns)
+    df = parse_klines(klines, columns, usecols=[c for c in cols1 if c in columns])
 
     df.insert(0, '代码', code)
     df.insert(0, '名称', name)
 
     df = df.rename(columns=dict(zip(cols1, cols2)))
-    df.index = pd.to_datetime(df['date'])
-    df = df[cols2[1:]]
-    # 将object类型转为数值型
-    ignore_cols = ['name', 'code']
-    df = trans_num(df, ignore_cols)
+    df.index.name = 'date'
     return df
 
 
+def parse_klines(klines, columns, usecols=None) -> pd.DataFrame:
+    """
+    把东方财富 'date,open,close,...' 格式的k线字符串解析为DataFrame
+    一次性交给 C 解析器按列转换为数值（'-' 或空值为 NaN），第一列日期作为索引
+    """
+    usecols = columns if usecols is None else usecols
+    df = pd.read_csv(io.StringIO('\n'.join(klines)), header=None, names=columns, usecols=usecols,
+                     dtype={columns[0]: str}, na_values=['-'], engine='c')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop(columns[0]), format='ISO8601'))
+    return df[[c for c in usecols if c != columns[0]]]
+
+
 def latest_trade_date():
     date = stock_realtime('上证指数')['datetime'].values[0][:10]
     return date
 
 
+def _concat_downloads(data_list, axis, columns=()):
+    '''合并下载结果；全部下载失败时报错（包含失败原因），没有证券时返回空表'''
+    if data_list:
+        return pd.concat(data_list, axis=axis)
+    if downloader.last_errors:
+        errors = ", ".join(f"{item}({e!r})" for item, e in downloader.last_errors[:10])
+        raise ValueError(f"{len(downloader.last_errors)} 个证券全部下载失败: {errors}")
+    return pd.DataFrame(columns=list(columns), index=pd.Index([], name='date'))
+
+
 # 获取单只或多只证券（股票、基金、债券、期货)的收盘价格dataframe
 def get_price(code_list, start='19000101', end=None, freq='d', fqt=1):
     '''code_list输入股票list列表
@@ -587,56 +606,36 @@ def get_price(code_list, start='19000101', end=None, freq='d', fqt=1):
     if end is None:
         end = latest_trade_date()
 
-    @multitasking.task
-    @func_set_timeout(5)
     def run(code):
-        try:
-            temp = web_data(code, start, end, freq, fqt)
-            temp[temp.name[0]] = temp.close
-            data_list.append(temp[temp.name[0]])
-            pbar.update()
-        except:
-            pass
+        temp = web_data(code, start, end, freq, fqt)
+        return temp.close.rename(temp.name.iloc[0])
 
-    pbar = tqdm(total=len(code_list))
-    data_list = []
-    for code in code_list:
-        try:
-            run(code)
-        except:
-            continue
-    multitasking.wait_for_tasks()
+    data_list = [data for _, data in downloader.fetch(run, code_list, progress=True)]
     # 转换为dataframe
-    df = pd.concat(data_list, axis=1)
+    df = _concat_downloads(data_list, axis=1)
     return df
 
 
 # 获取单只或多只证券（股票、基金、债券、期货(国内))的历史K线数据
-def get_data(code_list, start='19000101', end=None, freq='d', fqt=1):
+def get_data(code_list, start='19000101', end=None, freq='d', fqt=1, on_data=None):
     '''code_list输入股票list列表
     如code_list=['中国平安','贵州茅台','工业富联']
-    返回多只股票多期时间的面板数据
+    返回多只股票多期时间的面板数据（按code_list的顺序）
+    on_data(code, df):每只证券下载完成后回调（如直接写入磁盘），此时不再返回数据
     '''
     if isinstance(code_list, str):
         code_list = [code_list]
     if end is None:
         end = latest_trade_date()
 
-    data_list = []
-    pbar = tqdm(total=len(code_list))
-
-    @multitasking.task
-    @func_set_timeout(10)
     def run(code):
-        data = web_data(code, start, end, freq, fqt)
-        data_list.append(data)
-        pbar.update()
+        return web_data(code, start, end, freq, fqt)
 
-    for code in code_list:
-        run(code)
-    multitasking.wait_for_tasks()
+    data_list = [data for _, data in downloader.fetch(run, code_list, on_result=on_data, progress=True)]
+    if on_data is not None:
+        return None
     # 转换为dataframe
-    df = pd.concat(data_list, axis=0)
+    df = _concat_downloads(data_list, axis=0, columns=KLINE_COLUMNS)
     return df
 
 
@@ -647,31 +646,35 @@ def index_code_name():
     return code_name_dict
 
 
+def _index_names(code_list):
+    # 数字代码转换为指数名称（指数列表只请求一次）
+    code_name_dict = None
+    names = []
+    for code in code_list:
+        if code.isdigit():
+            if code_name_dict is None:
+                code_name_dict = index_code_name()
+            code = code_name_dict[code]
+        names.append(code)
+    return names
+
+
 # 获取指数历史交易数据
-def get_index_data(code_list, start='19000101', end=None, freq='d'):
+def get_index_data(code_list, start='19000101', end=None, freq='d', on_data=None):
     if isinstance(code_list, str):
         code_list = [code_list]
     if end is None:
         end = latest_trade_date()
 
-    data_list = []
-    pbar = tqdm(total=len(code_list))
-
-    @multitasking.task
-    @func_set_timeout(5)
     def run(code):
-        data = web_data(code, start=start, end=end, freq=freq)
-        data_list.append(data)
-        pbar.update()
+        return web_data(code, start=start, end=end, freq=freq)
 
-    for code in code_list:
-        if code.isdigit():
-            code_name_dict = index_code_name()
-            code = code_name_dict[code]
-        run(code)
-    multitasking.wait_for_tasks()
+    data_list = [data for _, data in downloader.fetch(run, _index_names(code_list), on_result=on_data,
+                                                      progress=True)]
+    if on_data is not None:
+        return None
     # 转换为dataframe
-    df = pd.concat(data_list, axis=0)
+    df = _concat_downloads(data_list, axis=0, columns=KLINE_COLUMNS)
     return df
 
 
@@ -687,30 +690,13 @@ def get_index_price(code_list, start='19000101', end=None, freq='d'):
     if end is None:
         end = latest_trade_date()
 
-    @multitasking.task
-    @func_set_timeout(5)
     def run(code):
-        try:
-            temp = web_data(code, start, end, freq)
-            temp[temp.name[0]] = temp.close
-            data_list.append(temp[temp.name[0]])
-            pbar.update()
-        except:
-            pass
+        temp = web_data(code, start, end, freq)
+        return temp.close.rename(temp.name.iloc[0])
 
-    pbar = tqdm(total=len(code_list))
-    data_list = []
-    for code in tqdm(code_list):
-        if code.isdigit():
-            code_name_dict = index_code_name()
-            code = code_name_dict[code]
-        try:
-            run(code)
-        except:
-            continue
-    multitasking.wait_for_tasks()
+    data_list = [data for _, data in downloader.fetch(run, _index_names(code_list), progress=True)]
     # 转换为dataframe
-    df = pd.concat(data_list, axis=1)
+    df = _concat_downloads(data_list, axis=1)
     return df
 
 
@@ -0,0 +1,4 @@
+from app.factors.indicators import (
+    Indicator, SMA, EMA, RMA, MACD, KDJ, ATR, RSI, Donchian, RollingMax, RollingMin
+)
+from app.factors.engine import IndicatorEngine, DailyBarCursor
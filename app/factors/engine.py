@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+from collections import deque
+from datetime import date
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+from app.domain.data import Bar
+from app.domain.security import Security
+from app.factors.indicators import Indicator, NAN
+
+
+class IndicatorEngine:
+    """Per-security incremental indicators
+
+    Strategies subscribe the indicators they need for every security once (in
+    `init_strategy`), then feed each new bar with `update_bar` and read the
+    latest values; no bar window is kept and nothing is recomputed.
+
+    Example:
+        engine = IndicatorEngine()
+        engine.subscribe(security, "EMA_20", EMA(20), history=3)
+        engine.subscribe(security, "MACD", MACD(12, 26, 9))
+        ...
+        engine.update_bar(bar)
+        ema_20 = engine.value(security, "EMA_20")
+        ema_20_prev = engine.history(security, "EMA_20")[-2]
+    """
+
+    def __init__(self):
+        self._indicators: Dict[Security, Dict[str, Indicator]] = {}
+        self._histories: Dict[Security, Dict[str, Deque[Any]]] = {}
+
+    def subscribe(
+            self,
+            security: Security,
+            name: str,
+            indicator: Indicator,
+            history: int = 1
+    ) -> Indicator:
+        """Subscribe an indicator (a fresh instance per security)
+
+        history: number of latest values kept for `history`, e.g. 2 to compare
+                 the current value with the previous one.
+        """
+        assert history > 0, f"history should be positive, got {history}"
+        self._indicators.setdefault(security, {})[name] = indicator
+        self._histories.setdefault(security, {})[name] = deque(maxlen=history)
+        return indicator
+
+    def subscribe_all(
+            self,
+            securities: Iterable[Security],
+            name: str,
+            factory: Callable[[], Indicator],
+            history: int = 1
+    ):
+        """Subscribe `factory()` for every security"""
+        for security in securities:
+            self.subscribe(security, name, factory(), history=history)
+
+    def unsubscribe(self, security: Security, name: str = None):
+        """Remove one indicator of the security, or all of them if name is None"""
+        if name is None:
+            self._indicators.pop(security, None)
+            self._histories.pop(security, None)
+            return
+        self._indicators.get(security, {}).pop(name, None)
+        self._histories.get(security, {}).pop(name, None)
+
+    def update_bar(self, bar: Bar) -> Dict[str, Any]:
+        """Feed a new bar to the indicators of `bar.security`; return the latest values"""
+        indicators = self._indicators.get(bar.security)
+        if not indicators:
+            return {}
+        histories = self._histories[bar.security]
+        values = {}
+        for name, indicator in indicators.items():
+            value = indicator.update_bar(bar)
+            histories[name].append(value)
+            values[name] = value
+        return values
+
+    def peek_bar(self, bar: Bar, names: Iterable[str]) -> Dict[str, Any]:
+        """Values of the named indicators of `bar.security` with the bar
+        appended, without feeding it (e.g. the running daily bar of live
+        quotes); only SMA, RMA and ATR support it"""
+        indicators = self._indicators.get(bar.security, {})
+        return {name: indicators[name].peek_bar(bar) for name in names}
+
+    def warm_up(self, bars: Iterable[Bar]):
+        """Feed historical bars (in chronological order)"""
+        for bar in bars:
+            self.update_bar(bar)
+
+    def get(self, security: Security, name: str) -> Indicator:
+        return self._indicators[security][name]
+
+    def value(self, security: Security, name: str) -> Any:
+        return self._indicators[security][name].value
+
+    def values(self, security: Security) -> Dict[str, Any]:
+        return {
+            name: indicator.value
+            for name, indicator in self._indicators.get(security, {}).items()
+        }
+
+    def history(self, security: Security, name: str) -> List[Any]:
+        """Latest values (oldest first), padded with NaN before warm up"""
+        values = self._histories[security][name]
+        return [NAN] * (values.maxlen - len(values)) + list(values)
+
+    def ready(self, security: Security, names: Iterable[str] = None) -> bool:
+        """Whether the indicators (all by default) of the security are warmed up"""
+        indicators = self._indicators.get(security, {})
+        if names is None:
+            names = indicators.keys()
+        return all(indicators[name].ready for name in names)
+
+
+class DailyBarCursor:
+    """Daily bars of every security, fed to an `IndicatorEngine` day by day
+
+    `load` replaces the daily bars of a security and subscribes its
+    indicators afresh; `advance` feeds the bars before a day that were not
+    fed yet, so the engine holds the indicators up to the previous session
+    and the bar of the day is added with `IndicatorEngine.peek_bar`.
+
+    Example:
+        cursor = DailyBarCursor(engine)
+        cursor.load(security, daily_bars, {"ATR": lambda: ATR(20, mamode="sma")})
+        ...
+        cursor.advance(security, bar.datetime.date())
+        atr = engine.peek_bar(bar, ["ATR"])["ATR"]
+    """
+
+    def __init__(self, engine: IndicatorEngine):
+        self.engine = engine
+        self._days: Dict[Security, List[int]] = {}  # date ordinals
+        self._bars: Dict[Security, List[Bar]] = {}
+        self._fed: Dict[Security, int] = {}
+
+    def load(
+            self,
+            security: Security,
+            bars: List[Bar],
+            indicators: Dict[str, Callable[[], Indicator]]
+    ):
+        """Daily bars (in chronological order) and the indicator factories"""
+        self.engine.unsubscribe(security)
+        for name, factory in indicators.items():
+            self.engine.subscribe(security, name, factory())
+        self._days[security] = [bar.datetime.toordinal() for bar in bars]
+        self._bars[security] = bars
+        self._fed[security] = 0
+
+    def __contains__(self, security: Security) -> bool:
+        return security in self._bars
+
+    def advance(self, security: Security, day: date):
+        """Feed the daily bars before `day`"""
+        end = bisect_left(self._days[security], day.toordinal())
+        fed = self._fed[security]
+        assert end >= fed, f"{security.code}: {day} is before the daily bars already fed"
+        if end > fed:
+            self.engine.warm_up(self._bars[security][fed:end])
+            self._fed[security] = end
+
+    def bar_of(self, security: Security, day: date) -> Optional[Bar]:
+        """The daily bar of `day`, None if it was not loaded"""
+        days = self._days.get(security, [])
+        i = bisect_left(days, day.toordinal())
+        if i < len(days) and days[i] == day.toordinal():
+            return self._bars[security][i]
+        return None
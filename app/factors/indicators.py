@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental (streaming) technical indicators.
+
+Every indicator keeps its own running state and costs O(1) (amortized for the
+rolling max/min) per new value, so an `on_bar` strategy doesn't need to rebuild
+a DataFrame of the recent bars and recompute the whole window on every bar.
+
+The definitions follow pandas_ta, so a value produced here equals the last row
+of the pandas_ta column computed on the full series fed so far:
+    EMA:      SMA of the first `length` values as seed, then alpha = 2 / (length + 1)
+    RMA:      Wilder's moving average, ewm(alpha=1 / length, min_periods=length)
+    MACD:     ema(fast) - ema(slow), signal = ema(macd, signal), hist = macd - signal
+    KDJ:      k = rma(fastk, signal), d = rma(k, signal), j = 3k - 2d
+    ATR:      ma(true range, length), mamode 'rma' (default) or 'sma'
+    RSI:      rma of gains and losses
+    Donchian: rolling min(low) / max(high)
+Values are NaN until the indicator is warmed up, as in pandas_ta.
+"""
+
+import math
+import sys
+from collections import deque
+from typing import Any, Deque, Tuple
+
+from app.domain.data import Bar
+
+NAN = float("nan")
+
+
+class Indicator:
+    """Base class of the incremental indicators"""
+
+    # Bar field fed to `update` by `update_bar`
+    source: str = "close"
+
+    value: Any = NAN
+
+    def update(self, value: float) -> Any:
+        raise NotImplementedError
+
+    def update_bar(self, bar: Bar) -> Any:
+        return self.update(getattr(bar, self.source))
+
+    def peek_bar(self, bar: Bar) -> Any:
+        """The value `update_bar(bar)` would return, without changing the state
+        (only the indicators that implement `peek(value)`: SMA, RMA; ATR
+        overrides `peek_bar`)"""
+        return self.peek(getattr(bar, self.source))
+
+    @property
+    def ready(self) -> bool:
+        value = self.value
+        if isinstance(value, tuple):
+            value = value[-1]
+        return not math.isnan(value)
+
+
+class SMA(Indicator):
+    """Simple moving average, rolling(length).mean(); NaN values are skipped"""
+
+    def __init__(self, length: int = 10, source: str = "close"):
+        assert length > 0, f"length should be positive, got {length}"
+        self.length = length
+        self.source = source
+        self._window: Deque[float] = deque(maxlen=length)
+        self._sum = 0.0
+        self.value = NAN
+
+    def update(self, value: float) -> float:
+        if math.isnan(value):
+            return self.value
+        window = self._window
+        if len(window) == self.length:
+            self._sum -= window[0]
+        window.append(value)
+        self._sum += value
+        if len(window) == self.length:
+            self.value = self._sum / self.length
+        return self.value
+
+    def peek(self, value: float) -> float:
+        window = self._window
+        if math.isnan(value) or len(window) < self.length - 1:
+            return self.value
+        total = self._sum + value
+        if len(window) == self.length:
+            total -= window[0]
+        return total / self.length
+
+
+class EMA(Indicator):
+    """Exponential moving average seeded with the SMA of the first `length` values"""
+
+    def __init__(self, length: int = 10, source: str = "close"):
+        assert length > 0, f"length should be positive, got {length}"
+        self.length = length
+        self.source = source
+        self.alpha = 2.0 / (length + 1)
+        self._count = 0
+        self._sum = 0.0
+        self.value = NAN
+
+    def update(self, value: float) -> float:
+        if math.isnan(value):
+            return self.value
+        self._count += 1
+        if self._count < self.length:
+            self._sum += value
+        elif self._count == self.length:
+            self.value = (self._sum + value) / self.length
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class RMA(Indicator):
+    """Wilder's moving average, i.e. ewm(alpha=1/length, min_periods=length).mean()
+
+    pandas' ewm uses `adjust=True` here, which is kept as a weighted sum and a
+    weight total (both decayed on every value, NaN only decays them).
+    """
+
+    def __init__(self, length: int = 10, source: str = "close"):
+        assert length > 0, f"length should be positive, got {length}"
+        self.length = length
+        self.source = source
+        self._decay = 1.0 - 1.0 / length
+        self._num = 0.0
+        self._den = 0.0
+        self._count = 0
+        self.value = NAN
+
+    def update(self, value: float) -> float:
+        self._num *= self._decay
+        self._den *= self._decay
+        if not math.isnan(value):
+            self._num += value
+            self._den += 1.0
+            self._count += 1
+        if self._count >= self.length:
+            self.value = self._num / self._den
+        return self.value
+
+    def peek(self, value: float) -> float:
+        # NaN only decays the sum and the weights (the ratio stays)
+        if math.isnan(value) or self._count + 1 < self.length:
+            return self.value
+        return (self._num * self._decay + value) / (self._den * self._decay + 1.0)
+
+
+class RollingMax:
+    """Rolling maximum over the latest `length` values (monotonic deque)"""
+
+    def __init__(self, length: int):
+        self.length = length
+        self._count = 0
+        self._queue: Deque[Tuple[int, float]] = deque()
+
+    def update(self, value: float) -> float:
+        queue = self._queue
+        while queue and queue[-1][1] <= value:
+            queue.pop()
+        queue.append((self._count, value))
+        if queue[0][0] <= self._count - self.length:
+            queue.popleft()
+        self._count += 1
+        return queue[0][1] if self._count >= self.length else NAN
+
+
+class RollingMin(RollingMax):
+    """Rolling minimum over the latest `length` values"""
+
+    def update(self, value: float) -> float:
+        return -super().update(-value)
+
+
+class MACD(Indicator):
+    """MACD, value = (macd, hist, signal)
+
+    Same order as the pandas_ta columns, i.e. ("MACD_DIF", "MACD", "MACD_DEA")
+    with the col_names used by the strategies.
+    """
+
+    def __init__(
+            self,
+            fast: int = 12,
+            slow: int = 26,
+            signal: int = 9,
+            source: str = "close"
+    ):
+        if slow < fast:
+            fast, slow = slow, fast
+        self.source = source
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+        self.macd = NAN
+        self.signal = NAN
+        self.hist = NAN
+
+    @property
+    def value(self) -> Tuple[float, float, float]:
+        return self.macd, self.hist, self.signal
+
+    def update(self, value: float) -> Tuple[float, float, float]:
+        fast = self._fast.update(value)
+        slow = self._slow.update(value)
+        if math.isnan(slow):
+            return self.value
+        self.macd = fast - slow
+        # signal line starts at the first valid macd value
+        self.signal = self._signal.update(self.macd)
+        self.hist = self.macd - self.signal
+        return self.value
+
+
+class KDJ(Indicator):
+    """KDJ, value = (k, d, j)"""
+
+    def __init__(self, length: int = 9, signal: int = 3):
+        self.length = length
+        self._highest = RollingMax(length)
+        self._lowest = RollingMin(length)
+        self._k = RMA(signal)
+        self._d = RMA(signal)
+        self.k = NAN
+        self.d = NAN
+        self.j = NAN
+
+    @property
+    def value(self) -> Tuple[float, float, float]:
+        return self.k, self.d, self.j
+
+    def update(self, value: float):
+        raise TypeError("KDJ is calculated from bars, use update_bar instead.")
+
+    def update_bar(self, bar: Bar) -> Tuple[float, float, float]:
+        highest = self._highest.update(bar.high)
+        lowest = self._lowest.update(bar.low)
+        fastk = NAN
+        if not math.isnan(highest):
+            fastk = 100 * (bar.close - lowest) / _non_zero_range(highest, lowest)
+        self.k = self._k.update(fastk)
+        self.d = self._d.update(self.k)
+        self.j = 3 * self.k - 2 * self.d
+        return self.value
+
+
+class ATR(Indicator):
+    """Average true range"""
+
+    def __init__(self, length: int = 14, mamode: str = "rma"):
+        mamode = mamode.lower()
+        if mamode not in ("rma", "sma"):
+            raise ValueError(
+                f"mamode {mamode} is invalid; only 'rma' or 'sma' are allowed.")
+        self.length = length
+        self.mamode = mamode
+        self._ma = RMA(length) if mamode == "rma" else SMA(length)
+        self._prev_close = NAN
+        self.value = NAN
+
+    def update(self, value: float):
+        raise TypeError("ATR is calculated from bars, use update_bar instead.")
+
+    def _true_range(self, bar: Bar) -> float:
+        prev_close = self._prev_close
+        if math.isnan(prev_close):
+            # the first true range is NaN (drift=1)
+            return NAN
+        return max(
+            abs(_non_zero_range(bar.high, bar.low)),
+            abs(bar.high - prev_close),
+            abs(prev_close - bar.low))
+
+    def update_bar(self, bar: Bar) -> float:
+        true_range = self._true_range(bar)
+        self._prev_close = bar.close
+        self.value = self._ma.update(true_range)
+        return self.value
+
+    def peek_bar(self, bar: Bar) -> float:
+        """ATR with the (running) bar appended, e.g. today's bar on live quotes"""
+        return self._ma.peek(self._true_range(bar))
+
+
+class RSI(Indicator):
+    """Relative strength index"""
+
+    def __init__(self, length: int = 14, source: str = "close"):
+        self.length = length
+        self.source = source
+        self._gain = RMA(length)
+        self._loss = RMA(length)
+        self._prev = NAN
+        self.value = NAN
+
+    def update(self, value: float) -> float:
+        change = value - self._prev
+        self._prev = value
+        gain = self._gain.update(max(change, 0.0) if not math.isnan(change) else NAN)
+        loss = self._loss.update(min(change, 0.0) if not math.isnan(change) else NAN)
+        total = gain + abs(loss)
+        self.value = 100 * gain / total if total != 0 else NAN
+        return self.value
+
+
+class Donchian(Indicator):
+    """Donchian channel, value = (lower, mid, upper)"""
+
+    def __init__(self, lower_length: int = 20, upper_length: int = 20):
+        self._lowest = RollingMin(lower_length)
+        self._highest = RollingMax(upper_length)
+        self.lower = NAN
+        self.mid = NAN
+        self.upper = NAN
+
+    @property
+    def value(self) -> Tuple[float, float, float]:
+        return self.lower, self.mid, self.upper
+
+    def update(self, value: float):
+        raise TypeError("Donchian is calculated from bars, use update_bar instead.")
+
+    def update_bar(self, bar: Bar) -> Tuple[float, float, float]:
+        self.lower = self._lowest.update(bar.low)
+        self.upper = self._highest.update(bar.high)
+        self.mid = 0.5 * (self.lower + self.upper)
+        return self.value
+
+
+def _non_zero_range(high: float, low: float) -> float:
+    """high - low; never zero (same as pandas_ta.utils.non_zero_range)"""
+    diff = high - low
+    if diff == 0:
+        diff += sys.float_info.epsilon
+    return diff
@@ -24,6 +24,8 @@ class AppFramework:
         self._load_settings(config_file)
         # self._init_executor()
         self._init_logger()
+        self._init_latency()
+        self._init_tracing()
         self._do_heartbeat()
         return self
 
@@ -69,6 +71,16 @@ class AppFramework:
         """Initialize logger."""
         logger.initLogger(**config.log)
 
+    def _init_latency(self) -> None:
+        """Initialize stage latency profiling (disabled unless configured)."""
+        from app.utils.latency import latency
+        latency.configure(**config.latency)
+
+    def _init_tracing(self) -> None:
+        """Initialize order tick-to-trade tracing (disabled unless configured)."""
+        from app.utils.tracing import tracer
+        tracer.configure(**config.trace)
+
     def _init_executor(self):
         cpu_n = 5
         executor_pool = ThreadPoolExecutor(max_workers=cpu_n)
@@ -1,2 +1,5 @@
 from .backtest_gateway import BacktestGateway
-from .backtest_gateway import BacktestFees
\ No newline at end of file
+from .backtest_gateway import BacktestFees
+from .backtest_feeds import BarFeed, BarFeedSlice
+from .backtest_history import BarHistory, HistoricalBarIndex
+from .backtest_matching import OrderMatcher, PendingOrderBook
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.domain.data import Bar
+from app.domain.security import Security
+
+
+class BarFeedSlice:
+    """Bars of all securities at one time step of a `BarFeed`"""
+
+    __slots__ = ("datetime", "_feed", "_index")
+
+    def __init__(self, feed: "BarFeed", datetime: datetime, index: Dict[str, int]):
+        self.datetime = datetime
+        self._feed = feed
+        self._index = index  # code -> row position in the feed arrays
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._index
+
+    @property
+    def empty(self) -> bool:
+        return len(self._index) == 0
+
+    def codes(self) -> List[str]:
+        return list(self._index.keys())
+
+    def get_bar(self, security: Security) -> Bar:
+        """Bar of the security at this time step; None if not available"""
+        i = self._index.get(security.code)
+        if i is None:
+            return None
+        feed = self._feed
+        return Bar(
+            datetime=self.datetime,
+            security=security,
+            open=feed.open[i],
+            high=feed.high[i],
+            low=feed.low[i],
+            close=feed.close[i],
+            volume=feed.volume[i])
+
+
+class BarFeed:
+    """Time-sliced bar feed for backtest
+
+    The data is sorted by (time, code) once at load time and the boundaries of
+    every time step are indexed, so fetching the bars of one step costs
+    O(securities in that step) instead of scanning the whole data frame.
+    """
+
+    FIELDS = ("open", "high", "low", "close", "volume")
+
+    def __init__(
+            self,
+            data: pd.DataFrame,
+            time_col: str = "time_key",
+            code_col: str = "code"
+    ):
+        self._steps: Dict[int, Tuple[int, int]] = {}
+        self._times: np.ndarray = np.array([], dtype="datetime64[ns]")
+        self.codes: np.ndarray = np.array([], dtype=object)
+        for field in self.FIELDS:
+            setattr(self, field, np.array([], dtype=np.float64))
+        if data is None or data.empty:
+            return
+
+        missing = {time_col, code_col, *self.FIELDS} - set(data.columns)
+        assert not missing, (
+            f"Columns {missing} are required to build the bar feed, but only "
+            f"{list(data.columns)} were given.")
+
+        times = pd.to_datetime(data[time_col]).values.astype("datetime64[ns]")
+        codes = data[code_col].values
+        # Stable sort by time then code; duplicated (time, code) rows keep the
+        # last one, which is what a dict lookup would return
+        order = np.lexsort((codes, times))
+        times = times[order]
+        self.codes = codes[order]
+        for field in self.FIELDS:
+            setattr(self, field, data[field].values[order])
+
+        ticks = times.view(np.int64)
+        bounds = np.flatnonzero(np.diff(ticks)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(ticks)]))
+        self._times = times[starts]
+        self._steps = {
+            int(t): (int(s), int(e))
+            for t, s, e in zip(ticks[starts], starts, ends)
+        }
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    def __iter__(self) -> Iterator[BarFeedSlice]:
+        for t in self._times:
+            yield self.get_slice(pd.Timestamp(t))
+
+    @property
+    def datetimes(self) -> List[datetime]:
+        """All time steps available in the feed (sorted)"""
+        return [pd.Timestamp(t) for t in self._times]
+
+    def get_slice(self, cur_datetime: datetime) -> BarFeedSlice:
+        """Bars at `cur_datetime`; an empty slice if there is no data"""
+        ts = pd.Timestamp(cur_datetime)
+        step = self._steps.get(ts.value)
+        if step is None:
+            return BarFeedSlice(self, ts, {})
+        start, end = step
+        index = {self.codes[i]: i for i in range(start, end)}
+        return BarFeedSlice(self, ts, index)
@@ -2,34 +2,35 @@
 
 import uuid
 from datetime import datetime
-from datetime import timedelta
 from datetime import time as Time
+from datetime import timedelta
 from typing import List, Dict, Union
 from dateutil.relativedelta import relativedelta
 
 import pandas as pd
 
-from trader_config import DATA_PATH, DATA_MODEL, TIME_STEP, DATA_FFILL
+from trader_config import DATA_PATH, DATA_MODEL, TIME_STEP
 from app.domain.balance import AccountBalance
 from app.constants import TradeMode, OrderStatus, Direction, OrderType
+from app.domain.bar_aggregation import daily_open_close
 from app.domain.data import Quote
 from app.domain.data import Bar
 from app.domain.data import CapitalDistribution
 from app.domain.data import get_trading_day
-from app.domain.data import _load_historical_bars_in_reverse
 from app.domain.data import _get_data
-from app.domain.data import _get_data_path
 from app.domain.data import _get_data_iterator
 from app.domain.deal import Deal
 from app.domain.order import Order, OrderBook
 from app.domain.position import PositionData
 from app.domain.security import Stock, Security
-from app.utils.utility import is_trading_time
 from app.gateways import BaseGateway
 from app.gateways.base_gateway import BaseFees
+from app.gateways.backtest.backtest_history import BarHistory, HistoricalBarIndex, bar_history
+from app.gateways.backtest.backtest_matching import OrderMatcher
+from app.domain.calendar_service import SessionTimeline, calendar_service
 from app.domain.stores.security_market_storer import SecurityMarketStorer
+from app.utils.tracing import tracer, EVENT_DEAL
 
-import app.utils as utils
 
 assert set(DATA_PATH.keys()) == set(DATA_MODEL.keys()), (
     "`DATA_PATH` and `DATA_MODEL` keys are not aligned! Please check "
@@ -161,11 +162,17 @@ class BacktestGateway(BaseGateway):
         next_cache = dict()
         trading_days = dict()
 
-        data_list = pd.DataFrame()
-        if not local:
+        data_list = kwargs.get("data")
+        if data_list is not None:
+            # 外部已加载好的k线数据（例如参数扫描时多个回测共用一份数据）
+            local = False
+        elif not local:
             storer = SecurityMarketStorer(local=False)
             data_list = storer.get_kline_data(securities, start=start, end=end)
+        else:
+            data_list = pd.DataFrame()
         self.all_data: pd.DataFrame = data_list
+        self.securities = securities
         for security in securities:
             data_iterators[security] = dict()
             prev_cache[security] = dict()
@@ -192,7 +199,7 @@ class BacktestGateway(BaseGateway):
                     #     data = ffill_data
                 else:
                     data = data_list.loc[data_list['code'] == security.code].sort_values('time_key', ascending=True)
-                    data.drop(columns='code', axis=1, inplace=True)
+                    data = data.drop(columns='code')
                 data_it = _get_data_iterator(
                     security=security,
                     full_data=data,
@@ -204,8 +211,8 @@ class BacktestGateway(BaseGateway):
                 # Sort the available dates in history
                 if dfield == "kline":
                     trading_days[security] = sorted(
-                        set(pd.to_datetime(t).strftime("%Y-%m-%d")
-                            for t in data["time_key"].values))
+                        pd.to_datetime(data["time_key"]).dt.strftime(
+                            "%Y-%m-%d").unique())
         self.data_iterators = data_iterators
         self.prev_cache = prev_cache
         self.next_cache = next_cache
@@ -215,10 +222,19 @@ class BacktestGateway(BaseGateway):
             trading_days_list.update(v)
         self.trading_days_list = [datetime.strptime(
             d, "%Y-%m-%d").date() for d in sorted(trading_days_list)]
+        self._trading_days = set(self.trading_days_list)
 
         self.start = start
         self.end = end
         self.market_datetime = start
+        # 历史 bar 按证券和周期只加载一次
+        self.history = HistoricalBarIndex()
+        # 每只证券在回测区间内的交易时段（开收盘时间数组）
+        self.session_timelines: Dict[str, SessionTimeline] = {}
+        # 限价单挂在模拟的订单簿里，每根新 bar 按最高/最低价撮合
+        self.matcher = OrderMatcher(volume_limit=kwargs.get("volume_limit"))
+        self._bar_times: Dict[Security, datetime] = {}
+        self._minute_histories: Dict[Security, BarHistory] = {}
 
     def close(self):
         """In backtest, no need to do anything"""
@@ -233,66 +249,44 @@ class BacktestGateway(BaseGateway):
                 "is invalid.")
         self.trade_mode = trade_mode
 
+    def get_session_timeline(
+            self,
+            security: Security,
+            cur_datetime: datetime = None) -> SessionTimeline:
+        """Sessions of the security over the backtest period (built once)"""
+        timeline = self.session_timelines.get(security.code)
+        if timeline is None:
+            timeline = calendar_service.session_timeline(
+                self.trading_sessions[security.code],
+                self.start.date() - timedelta(days=1),
+                self.end.date() + timedelta(days=2))
+            self.session_timelines[security.code] = timeline
+        if cur_datetime is not None and not timeline.covers(cur_datetime):
+            # 回测区间之外，临时建当天前后的时段
+            timeline = calendar_service.session_timeline(
+                self.trading_sessions[security.code],
+                cur_datetime.date() - timedelta(days=1),
+                cur_datetime.date() + timedelta(days=2))
+        return timeline
+
     def get_next_session_datetime(
             self,
             security: Security,
-            cur_datetime: datetime) -> int:
+            cur_datetime: datetime) -> datetime:
         """return start datetime of next session
         """
-        trading_sessions = self.trading_sessions[security.code]
-
-        trading_day = cur_datetime.date()
-        trading_day_sessions = []
-        # normal trading day session within a calendar day
-        if trading_sessions[-1][1] > trading_sessions[0][0]:
-            for start, end in trading_sessions:
-                session_start = datetime.combine(trading_day, start.time())
-                session_end = datetime.combine(trading_day, end.time())
-                trading_day_sessions.append([session_start, session_end])
-        # trading day session crosses two calendar days
-        else:
-            next_trading_day = trading_day + timedelta(days=1)
-            is_next_day = False
-            for idx, (start, end) in enumerate(trading_sessions):
-                if is_next_day:
-                    session_start = datetime.combine(
-                        next_trading_day, start.time())
-                    session_end = datetime.combine(
-                        next_trading_day, end.time())
-                    trading_day_sessions.append([session_start, session_end])
-                elif end.time() < start.time():
-                    session_start = datetime.combine(trading_day, start.time())
-                    session_end = datetime.combine(
-                        next_trading_day, end.time())
-                    trading_day_sessions.append([session_start, session_end])
-                    is_next_day = True
-                elif end.time() >= start.time():
-                    session_start = datetime.combine(trading_day, start.time())
-                    session_end = datetime.combine(trading_day, end.time())
-                    trading_day_sessions.append([session_start, session_end])
-                    if idx < len(trading_sessions) - 1:
-                        next_start, next_end = trading_sessions[idx + 1]
-                        if next_start.time() < end.time():
-                            is_next_day = True
-
-        for session in trading_day_sessions:
-            if cur_datetime < session[0]:
-                return session[0]
-        return trading_day_sessions[0][0] + timedelta(days=1)
+        return self.get_session_timeline(
+            security, cur_datetime).next_open(cur_datetime)
 
     def is_trading_time(self, cur_datetime: datetime) -> bool:
         """For given datetime, check whether it is in trading hours"""
-        is_trading_day = cur_datetime.date() in self.trading_days_list
+        is_trading_day = cur_datetime.date() in self._trading_days
         if not is_trading_day:
             return False
         # If any security is found in trading session, we return True
-        _is_trading_time = False
-        for security in self.securities:
-            _is_trading_time = self.is_security_trading_time(
-                security, cur_datetime.time())
-            if _is_trading_time:
-                break
-        return _is_trading_time
+        return any(
+            self.get_session_timeline(security, cur_datetime).is_open(cur_datetime)
+            for security in self.securities)
 
     def next_trading_datetime(
             self,
@@ -301,8 +295,8 @@ class BacktestGateway(BaseGateway):
     ) -> datetime:
         """Find next trading datetime; return None if not found"""
         # check whether cur_datetime is within the trading session
-        _cur_is_trading_time = self.is_security_trading_time(
-            security, cur_datetime.time())
+        _cur_is_trading_time = self.get_session_timeline(
+            security, cur_datetime).is_open(cur_datetime)
         if _cur_is_trading_time:
             # Move one time step
             next_datetime = (
@@ -396,42 +390,108 @@ class BacktestGateway(BaseGateway):
         return self.prev_cache[security]
 
     def place_order(self, order: Order) -> str:
-        """In backtest, simply assume all orders are completely filled."""
-        order.filled_time = self.market_datetime
-        order.filled_quantity = order.quantity
-        if order.order_type == OrderType.LIMIT:
-            order.filled_avg_price = order.price
-        elif order.order_type == OrderType.MARKET:
-            bar = self.get_recent_data(order.security, order.create_time)
-            if bar is not None:
-                order.filled_avg_price = bar.close
-            elif self.prev_cache[order.security]['kline'] is not None:
-                order.filled_avg_price = self.prev_cache[order.security][
-                    'kline'].close
-            elif self.next_cache[order.security]['kline'] is not None:
-                order.filled_avg_price = self.next_cache[order.security][
-                    'kline'].close
-            if order.filled_avg_price is None or order.filled_avg_price == 0:
-                raise ValueError("filled_avg_price is NOT available!")
-        order.status = OrderStatus.FILLED
+        """Market orders are filled at the latest close; limit orders are
+        filled right away if the latest close reaches them, otherwise they
+        rest in the simulated order book until a bar reaches them (see
+        `match_orders`)."""
         orderid = "bt-order-" + str(uuid.uuid4())
         order.orderid = orderid
-        dealid = "bt-deal-" + str(uuid.uuid4())
-        self.orders.put(orderid, order)
+        order.updated_time = self.market_datetime
+        if order.order_type == OrderType.LIMIT:
+            order.status = OrderStatus.SUBMITTED
+            self.orders.put(orderid, order)
+            last_price = self.last_prices.get(order.security)
+            if last_price is not None and (
+                    order.price >= last_price if order.direction == Direction.LONG
+                    else order.price <= last_price):
+                self._fill_order(order, last_price, order.quantity, self.market_datetime)
+            else:
+                self.matcher.add(order, self._get_trading_day(order.security, self.market_datetime))
+            return orderid
+
+        price = None
+        bar = self.get_recent_data(order.security, order.create_time)
+        if bar is not None:
+            price = bar.close
+        elif self.prev_cache[order.security]['kline'] is not None:
+            price = self.prev_cache[order.security]['kline'].close
+        elif self.next_cache[order.security]['kline'] is not None:
+            price = self.next_cache[order.security]['kline'].close
+        if price is None or price == 0:
+            raise ValueError("filled_avg_price is NOT available!")
+        self._fill_order(order, price, order.quantity, self.market_datetime)
+        return orderid
 
+    def _fill_order(self, order: Order, price: float, quantity: float, filled_time: datetime):
+        """Fill (part of) the order and record the deal"""
+        filled_quantity = order.filled_quantity + quantity
+        if filled_quantity > 0:
+            order.filled_avg_price = (
+                order.filled_avg_price * order.filled_quantity + price * quantity) / filled_quantity
+        else:
+            order.filled_avg_price = price
+        order.filled_quantity = filled_quantity
+        order.filled_time = filled_time
+        order.updated_time = filled_time
+        order.status = OrderStatus.FILLED if filled_quantity >= order.quantity else OrderStatus.PART_FILLED
+        self.orders.put(order.orderid, order)
+
+        dealid = "bt-deal-" + str(uuid.uuid4())
         deal = Deal(
             security=order.security,
             direction=order.direction,
             offset=order.offset,
             order_type=order.order_type,
-            updated_time=self.market_datetime,
-            filled_avg_price=order.filled_avg_price,
-            filled_quantity=order.filled_quantity,
+            updated_time=filled_time,
+            filled_avg_price=price,
+            filled_quantity=quantity,
             dealid=dealid,
-            orderid=orderid
+            orderid=order.orderid
         )
         self.deals.put(dealid, deal)
-        return orderid
+        tracer.event(order, EVENT_DEAL, gateway=self.gateway_name, orderid=order.orderid, dealid=dealid,
+                     price=price, quantity=quantity)
+
+    def _get_trading_day(self, security: Security, cur_datetime: datetime):
+        daily_open_time, daily_close_time = daily_open_close(
+            self.trading_sessions.get(security.code))
+        if daily_open_time is None:
+            return cur_datetime.date()
+        return get_trading_day(cur_datetime, daily_open_time, daily_close_time)
+
+    def _get_minute_bars(self, security: Security, bar: Bar):
+        """1min bars within the period of the bar (None if not available)"""
+        if security not in self._minute_histories:
+            try:
+                self._minute_histories[security] = self.history.get(security, "1min")
+            except FileNotFoundError:
+                self._minute_histories[security] = None
+        history = self._minute_histories[security]
+        if history is None or len(history) == 0:
+            return None
+        if bar.datetime.time() == Time(0, 0, 0):
+            # 日线以当天零点为时间，包含当天的分钟线
+            start = bar.datetime - timedelta(microseconds=1)
+            end = bar.datetime + timedelta(days=1) - timedelta(microseconds=1)
+        else:
+            start = self._bar_times.get(security)
+            if start is None:
+                return None
+            end = bar.datetime
+        return history.between(start, end)
+
+    def match_orders(self, security: Security, bar: Bar):
+        """Match the resting limit orders of the security against a new bar:
+        expire the DAY orders of previous trading days, then fill the orders
+        the bar reaches."""
+        if self.matcher.has_orders(security):
+            for order in self.matcher.expire(security, self._get_trading_day(security, bar.datetime)):
+                order.status = OrderStatus.CANCELLED
+                order.updated_time = bar.datetime
+                self.orders.put(order.orderid, order)
+            for fill in self.matcher.match(security, bar, self._get_minute_bars(security, bar)):
+                self._fill_order(fill.order, fill.price, fill.quantity, fill.time)
+        self._bar_times[security] = bar.datetime
 
     def cancel_order(self, orderid):
         """Cancel order"""
@@ -447,7 +507,9 @@ class BacktestGateway(BaseGateway):
                 f"its status is: {order.status}."
             )
             return
+        self.matcher.cancel(order)
         order.status = OrderStatus.CANCELLED
+        order.updated_time = self.market_datetime
         self.orders.put(orderid, order)
 
     def get_broker_balance(self) -> AccountBalance:
@@ -486,8 +548,9 @@ class BacktestGateway(BaseGateway):
 
         mode:
             'aggregate': use 1 min bar data to aggregate the different
-                         granularity of bars. If in this mode, 'daily_open_time'
-                         and 'daily_close_time' must also be provided.
+                         granularity of bars (e.g. 5Min/15Min/60Min/1Day).
+                         If freq is 1Day, 'trading_sessions' must also be
+                         provided.
             'direct': (default) directly load the corresponding granularity of
                       bars from CSV.
         """
@@ -513,7 +576,8 @@ class BacktestGateway(BaseGateway):
                 cur_datetime=cur_datetime,
                 trading_sessions=trading_sessions,
                 mode=mode,
-                interval=freq.lower()
+                interval=freq.lower(),
+                history=self.history
             )
         elif freq == "1Day":
             return _req_historical_day_bars(
@@ -522,11 +586,12 @@ class BacktestGateway(BaseGateway):
                 cur_datetime=cur_datetime,
                 trading_sessions=trading_sessions,
                 mode=mode,
-                interval=freq.lower()
+                interval=freq.lower(),
+                history=self.history
             )
 
         # freq is not valid
-        FREQ_ALLOWED = ("1Day", "1Min", "10Min")
+        FREQ_ALLOWED = ("1Day", "{n}Min")
         raise ValueError(
             f"Parameter freq={freq} is Not supported. Only {FREQ_ALLOWED} are "
             "allowed.")
@@ -538,123 +603,34 @@ def _req_historical_min_bars(
         cur_datetime: datetime = None,
         trading_sessions: List[datetime] = None,
         mode: str = "direct",
-        interval: str = "1min"
+        interval: str = "1min",
+        history: HistoricalBarIndex = None
 ) -> List[Bar]:
-    """Request historical 1min/10min bars."""
-    # TODO: aggregate mode has not been finished.
-    if mode not in ("direct",):
-        raise ValueError(f"mode {mode} is invalid; only 'direct' is allowed.")
-    if mode == "aggregate":
-        data_path = _get_data_path(security, "kline", interval="1min")
-    elif mode == "direct":
-        data_path = _get_data_path(security, "kline", interval=interval)
-
-    # Use trading sessions to determine daily open & close time
-    daily_open_time = None
-    daily_close_time = None
-    if (
-            (trading_sessions is not None)
-            and (len(trading_sessions) > 0)
-    ):
-        daily_open_time = trading_sessions[0][0].time()
-        daily_close_time = trading_sessions[-1][1].time()
-
-    interval_value = int(interval.replace("min", ""))
-    hist_csv_files = _load_historical_bars_in_reverse(
-        security, cur_datetime, interval)
-    bars = []
-    for n, hist_csv_file in enumerate(hist_csv_files):
-        df = pd.read_csv(f"{data_path}/{hist_csv_file}")
-        df["time_key"] = pd.to_datetime(df["time_key"])
-        df = df[df.time_key <= cur_datetime]  # if n == 0 else df
-        for _, row in df.iloc[::-1].iterrows():
-            bar_datetime = row.time_key.to_pydatetime()
-            if (
-                    (daily_open_time is not None)
-                    and (daily_close_time is not None)
-                    and (daily_open_time < daily_close_time)
-                    and (bar_datetime.time() < daily_open_time
-                         or bar_datetime.time() > daily_close_time)
-            ):
-                continue
-            elif (
-                    (daily_open_time is not None)
-                    and (daily_close_time is not None)
-                    and (daily_open_time > daily_close_time)
-                    and (daily_close_time < bar_datetime.time() < daily_open_time)
-            ):
-                continue
-
-            bar = Bar(
-                security=security,
-                datetime=bar_datetime,
-                open=row.open,
-                high=row.high,
-                low=row.low,
-                close=row.close,
-                volume=row.volume
-            )
+    """Request historical minute bars.
 
-            # fill with previous bar if current bar is not available
-            if len(bars) == 0:
-                cur_dt = datetime(
-                    year=cur_datetime.year,
-                    month=cur_datetime.month,
-                    day=cur_datetime.day,
-                    hour=cur_datetime.hour,
-                    minute=cur_datetime.minute,
-                    second=cur_datetime.second
-                )
-                while cur_dt > bar_datetime:
-                    ffill_bar_datetime = cur_dt
-                    _is_trading_time = is_trading_time(
-                        cur_time=ffill_bar_datetime.time(),
-                        trading_sessions=trading_sessions
-                    )
-                    if _is_trading_time and DATA_FFILL:
-                        ffill_bar = Bar(
-                            security=security,
-                            datetime=ffill_bar_datetime,
-                            open=row.open,
-                            high=row.high,
-                            low=row.low,
-                            close=row.close,
-                            volume=row.volume
-                        )
-                        bars.append(ffill_bar)
-                    cur_dt -= timedelta(minutes=interval_value)
-            else:
-                time_delta = int(
-                    (bars[-1].datetime - bar_datetime).total_seconds() / 60)
-                while time_delta > interval_value:
-                    ffill_bar_datetime = cur_dt
-                    ffill_bar_datetime = (
-                            bars[-1].datetime
-                            - timedelta(minutes=interval_value)
-                    )
-                    _is_trading_time = utils.is_trading_time(
-                        cur_time=ffill_bar_datetime.time(),
-                        trading_sessions=trading_sessions
-                    )
-                    if _is_trading_time and DATA_FFILL:
-                        ffill_bar = Bar(
-                            security=security,
-                            datetime=ffill_bar_datetime,
-                            open=row.open,
-                            high=row.high,
-                            low=row.low,
-                            close=row.close,
-                            volume=row.volume
-                        )
-                        bars.append(ffill_bar)
-                    time_delta -= interval_value
-
-            bars.append(bar)
-            if len(bars) >= periods:
-                return bars[:periods][::-1]
-    raise ValueError(
-        f"There is not sufficient historical 1min data for {security.code}. "
-        f"We want {periods} data points, but only got {len(bars)}.")
+    mode:
+        'aggregate': resample the 1min bars to `interval` (only the bars
+                     ended by cur_datetime are returned).
+        'direct': load the bars of `interval`, forward-filled within the
+                  trading sessions.
+    """
+    if mode not in ("aggregate", "direct"):
+        raise ValueError(
+            f"mode {mode} is invalid; only 'aggregate' or 'direct' are allowed.")
+    history = history or bar_history
+    if mode == "aggregate":
+        return history.aggregate_bars(
+            security=security,
+            periods=periods,
+            cur_datetime=cur_datetime,
+            trading_sessions=trading_sessions,
+            interval=interval)
+    return history.min_bars(
+        security=security,
+        periods=periods,
+        cur_datetime=cur_datetime,
+        trading_sessions=trading_sessions,
+        interval=interval)
 
 
 def _req_historical_day_bars(
@@ -663,129 +639,23 @@ def _req_historical_day_bars(
         cur_datetime: datetime = None,
         trading_sessions: List[datetime] = None,
         mode: str = "direct",
-        interval: str = "1day"
+        interval: str = "1day",
+        history: HistoricalBarIndex = None
 ) -> List[Bar]:
     """Request historical daily bars."""
     if mode not in ("aggregate", "direct"):
         raise ValueError(
             f"mode {mode} is invalid; only 'aggregate' or 'direct' are allowed.")
-    if mode == "aggregate":
-        data_path = _get_data_path(security, "kline", interval="1min")
-    elif mode == "direct":
-        data_path = _get_data_path(security, "kline", interval=interval)
-
-    # Use trading sessions to determine daily open & close time
-    daily_open_time = None
-    daily_close_time = None
-    if (
-            (trading_sessions is not None)
-            and (len(trading_sessions) > 0)
-    ):
-        daily_open_time = trading_sessions[0][0].time()
-        daily_close_time = trading_sessions[-1][1].time()
-
+    history = history or bar_history
     if mode == "direct":
-        hist_csv_files = _load_historical_bars_in_reverse(
-            security,
-            cur_datetime,
+        return history.day_bars(
+            security=security,
+            periods=periods,
+            cur_datetime=cur_datetime,
             interval=interval)
-        hist_csv_files = sorted(hist_csv_files, reverse=False)
-        hist_data = pd.DataFrame()
-        for n, hist_csv_file in enumerate(hist_csv_files):
-            df = pd.read_csv(f"{data_path}/{hist_csv_file}")
-            df["time_key"] = pd.to_datetime(df["time_key"])
-            hist_data = pd.concat([hist_data, df])
-        hist_data = hist_data[hist_data.time_key < datetime.combine(
-            cur_datetime.date(), Time(0, 0, 0))]
-        assert hist_data.shape[0] >= periods, (
-            f"There is not sufficient historical 1day data for {security.code}."
-            f" We want {periods} data points, but only got "
-            f"{hist_data.shape[0]}.")
-        bars = []
-        for _, row in hist_data.iloc[-periods:].iterrows():
-            bar = Bar(
-                security=security,
-                datetime=row.time_key.to_pydatetime(),
-                open=row.open,
-                high=row.high,
-                low=row.low,
-                close=row.close,
-                volume=row.volume
-            )
-            bars.append(bar)
-        return bars
-
-    elif mode == "aggregate":
-        assert daily_open_time != daily_close_time, (
-            "open and close time could not be the same!")
-        hist_csv_files = _load_historical_bars_in_reverse(
-            security, cur_datetime)
-        bars = []
-        bar_in_progress = False
-        trading_day = None
-        count = 0
-        for n, hist_csv_file in enumerate(hist_csv_files):
-            df = pd.read_csv(
-                f"{data_path}/{hist_csv_file}")
-            df["time_key"] = pd.to_datetime(df["time_key"])
-            df = df[df.time_key < cur_datetime] if n == 0 else df
-            for _, row in df.iloc[::-1].iterrows():
-                bar_datetime = row.time_key.to_pydatetime()
-                count += 1
-                if count > 60 * 24 * 3:
-                    raise TimeoutError(
-                        "It takes too long to retrieve data, "
-                        f"please check daily_open_time: {daily_open_time}, "
-                        f"and daily_close_time: {daily_close_time}.\n"
-                        "The data fed in should cross these two timestamps.")
-                if not bar_in_progress:
-                    # trading sessions is within the same calendar day
-                    is_bar_end_1 = (
-                            daily_open_time < bar_datetime.time() <= daily_close_time)
-                    # trading sessions cross two calendar days
-                    is_bar_end_2 = (
-                            bar_datetime.time() <= daily_close_time < daily_open_time)
-                    if is_bar_end_1 or is_bar_end_2:
-                        daily_bar_datetime = bar_datetime
-                        daily_close = row.close
-                        daily_high = -float('inf')
-                        daily_low = float('inf')
-                        daily_volume = 0
-                        bar_in_progress = True
-                        trading_day = utils.get_trading_day(
-                            bar_datetime, daily_open_time, daily_close_time)
-                        count = 0
-                elif bar_in_progress:
-                    # trading sessions is within the same calendar day
-                    is_bar_begin_1 = (
-                            bar_datetime.time() <= daily_open_time < daily_close_time
-                            and bar_datetime.date() == trading_day
-                    )
-                    # trading sessions cross two calendar days
-                    is_bar_begin_2 = (daily_close_time < bar_datetime.time(
-                    ) <= daily_open_time and bar_datetime.date() < trading_day)
-                    if is_bar_begin_1 or is_bar_begin_2:
-                        daily_open = row.open
-                        daily_high = max(daily_high, row.high)
-                        daily_low = min(daily_low, row.low)
-                        daily_volume += row.volume
-                        bar_in_progress = False
-                        bar = Bar(
-                            security=security,
-                            datetime=daily_bar_datetime,
-                            open=daily_open,
-                            high=daily_high,
-                            low=daily_low,
-                            close=daily_close,
-                            volume=daily_volume
-                        )
-                        bars.append(bar)
-                        if len(bars) == periods:
-                            return bars[::-1]
-                    else:
-                        daily_high = max(daily_high, row.high)
-                        daily_low = min(daily_low, row.low)
-                        daily_volume += row.volume
-        raise ValueError(
-            f"There is not sufficient historical 1day data for {security.code}."
-            f" We want {periods} data points, but only got {len(bars)}.")
+    return history.aggregate_bars(
+        security=security,
+        periods=periods,
+        cur_datetime=cur_datetime,
+        trading_sessions=trading_sessions,
+        interval=interval)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime
+from datetime import time as Time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from trader_config import DATA_FFILL
+from app.domain.bar_aggregation import NS_PER_SECOND, NS_PER_MINUTE, NS_PER_DAY
+from app.domain.bar_aggregation import BAR_FIELDS, ResampledBars
+from app.domain.bar_aggregation import daily_open_close, in_daily_range, in_trading_sessions, session_key
+from app.domain.data import Bar
+from app.domain.data import _get_data_path
+from app.domain.security import Security
+from app.domain.stores.bar_store import bar_store
+
+# 逐段检查补齐的时间是否在交易时段内（大多数缺口第一段就能确定）
+FFILL_CHUNK = 16
+
+
+def _num_trading_steps(
+        latest: int,
+        step: int,
+        count: int,
+        trading_sessions: List[datetime]
+) -> int:
+    """Number of consecutive trading times in `latest - step`, `latest - 2 * step`,
+    ... (at most `count` of them)"""
+    done = 0
+    while done < count:
+        n = min(count - done, FFILL_CHUNK << (done // FFILL_CHUNK).bit_length())
+        candidates = latest - np.arange(done + 1, done + n + 1, dtype=np.int64) * step
+        mask = in_trading_sessions(candidates % NS_PER_DAY, trading_sessions)
+        if not mask.all():
+            return done + int(np.argmin(mask))
+        done += n
+    return count
+
+
+class BarHistory:
+    """Bars of one security and interval, sorted by time and loaded once
+
+    `values` holds open/high/low/close/volume in columns. For every
+    combination of trading sessions and interval, the bars within the daily
+    open and close, and how many forward-filled bars follow each of them, are
+    indexed once; a lookback window is then a binary search plus a slice.
+    Longer intervals are resampled from these bars once per trading sessions
+    (`resampled`).
+    """
+
+    FIELDS = BAR_FIELDS
+
+    def __init__(self, data: pd.DataFrame, time_col: str = "time_key"):
+        if data is None or data.empty:
+            self.times = np.array([], dtype=np.int64)
+            self.values = np.empty((0, len(self.FIELDS)), dtype=np.float64)
+        else:
+            times = pd.to_datetime(data[time_col]).values.astype("datetime64[ns]").view(np.int64)
+            order = np.argsort(times, kind="stable")
+            self.times = times[order]
+            self.values = np.column_stack(
+                [data[field].to_numpy(dtype=np.float64)[order] for field in self.FIELDS])
+        self.tod = self.times % NS_PER_DAY
+        self._ffill_index: Dict[tuple, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._resampled: Dict[tuple, ResampledBars] = {}
+
+    @classmethod
+    def load(cls, data_path: str) -> "BarHistory":
+        """Read all bars of the data path (columnar store, or the csv files)"""
+        columns = ["time_key", *cls.FIELDS]
+        if bar_store.exists(data_path):
+            return cls(bar_store.read(data_path, columns=columns))
+        if not os.path.exists(data_path):
+            raise FileNotFoundError(f"Data was NOT found in {data_path}!")
+        csv_files = sorted(f for f in os.listdir(data_path) if ".csv" in f)
+        frames = [pd.read_csv(f"{data_path}/{f}", usecols=columns) for f in csv_files]
+        frames = [df for df in frames if not df.empty]
+        return cls(pd.concat(frames, ignore_index=True) if frames else None)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def _get_ffill_index(
+            self,
+            trading_sessions: List[datetime],
+            interval: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(rows within the daily open and close, number of bars forward-filled
+        after each of them, cumulative number of bars up to each of them)"""
+        key = (session_key(trading_sessions), interval, DATA_FFILL)
+        index = self._ffill_index.get(key)
+        if index is not None:
+            return index
+
+        daily_open_time, daily_close_time = daily_open_close(trading_sessions)
+        rows = np.flatnonzero(in_daily_range(self.tod, daily_open_time, daily_close_time))
+        fills = np.zeros(len(rows), dtype=np.int64)
+        if DATA_FFILL and len(rows) > 1:
+            step = interval * NS_PER_MINUTE
+            # 与之前逐行补齐一致：间隔按整分钟计，从后一根 bar 往前每隔 interval 补一根，
+            # 遇到非交易时间就停止
+            gap = np.diff(self.times[rows]) // NS_PER_MINUTE
+            counts = -(-gap // interval) - 1
+            for i in np.flatnonzero(counts > 0):
+                fills[i] = _num_trading_steps(
+                    int(self.times[rows[i + 1]]), step, int(counts[i]), trading_sessions)
+        index = (rows, fills, np.cumsum(fills + 1))
+        self._ffill_index[key] = index
+        return index
+
+    def window(
+            self,
+            periods: int,
+            cur_datetime: datetime,
+            trading_sessions: List[datetime] = None,
+            interval: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The last `periods` bars up to `cur_datetime` (inclusive), forward-filled
+        within the trading sessions.
+
+        Returns (times in datetime64[ns], values of shape (periods, 5)) in
+        ascending order; raises ValueError if there are not enough bars.
+        """
+        rows, fills, ends = self._get_ffill_index(trading_sessions, interval)
+        step = interval * NS_PER_MINUTE
+        cur_ns = pd.Timestamp(cur_datetime).value
+        n = int(np.searchsorted(rows, np.searchsorted(self.times, cur_ns, side="right")))
+        if n == 0:
+            raise ValueError(f"We want {periods} data points, but only got 0.")
+        last = n - 1
+        last_time = int(self.times[rows[last]])
+
+        # 最近一根 bar 到 cur_datetime（精确到秒）之间的交易时间用它补齐
+        head = np.array([], dtype=np.int64)
+        if DATA_FFILL:
+            cur_ns -= cur_ns % NS_PER_SECOND
+            total = -(-(cur_ns - last_time) // step) if cur_ns > last_time else 0
+            collected = []
+            done = 0
+            while done < total and sum(len(c) for c in collected) < periods:
+                k = min(total - done, max(periods, FFILL_CHUNK))
+                candidates = cur_ns - np.arange(done, done + k, dtype=np.int64) * step
+                collected.append(candidates[in_trading_sessions(candidates % NS_PER_DAY, trading_sessions)])
+                done += k
+            if collected:
+                head = np.concatenate(collected)[::-1]
+
+        remaining = periods - len(head) - 1
+        first = last
+        if remaining > 0:
+            available = int(ends[last - 1]) if last > 0 else 0
+            if available < remaining:
+                raise ValueError(
+                    f"We want {periods} data points, but only got {available + len(head) + 1}.")
+            starts = np.concatenate(([0], ends[:last]))
+            first = int(np.searchsorted(starts, available - remaining, side="right")) - 1
+
+        # 每根 bar 及其之后补齐的 bar 组成一段：[bar, 下一根 bar - m * step, ..., 下一根 bar - step]
+        sizes = fills[first:last] + 1
+        src = np.repeat(rows[first:last], sizes)
+        offset = np.arange(len(src)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        next_times = np.repeat(self.times[rows[first + 1:last + 1]], sizes)
+        times = np.where(offset == 0, self.times[src], next_times - (np.repeat(sizes, sizes) - offset) * step)
+
+        times = np.concatenate((times, [last_time], head))[-periods:]
+        src = np.concatenate((src, np.full(len(head) + 1, rows[last])))[-periods:]
+        return times.view("datetime64[ns]"), self.values[src]
+
+    def before(self, periods: int, cur_datetime: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """The last `periods` bars strictly before `cur_datetime`"""
+        end = int(np.searchsorted(self.times, pd.Timestamp(cur_datetime).value, side="left"))
+        assert end >= periods, f"We want {periods} data points, but only got {end}."
+        return self.times[end - periods:end].view("datetime64[ns]"), self.values[end - periods:end]
+
+    def between(self, start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """The bars after `start` up to `end` (inclusive), times in ns"""
+        lo = int(np.searchsorted(self.times, pd.Timestamp(start).value, side="right"))
+        hi = int(np.searchsorted(self.times, pd.Timestamp(end).value, side="right"))
+        return self.times[lo:hi], self.values[lo:hi]
+
+    def resampled(self, interval: str, trading_sessions: List[datetime] = None) -> ResampledBars:
+        """Bars of `interval` built from these bars (cached per trading sessions)"""
+        key = (interval.lower(), session_key(trading_sessions))
+        resampled = self._resampled.get(key)
+        if resampled is None:
+            resampled = ResampledBars(self.times, self.values, interval, trading_sessions)
+            self._resampled[key] = resampled
+        return resampled
+
+    def resampled_window(
+            self,
+            periods: int,
+            cur_datetime: datetime,
+            interval: str,
+            trading_sessions: List[datetime] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The last `periods` bars of `interval` up to `cur_datetime`
+
+        Minute bars only include the bars ended by `cur_datetime`; the daily
+        bar of the current trading day is built from the bars before
+        `cur_datetime`.
+        """
+        resampled = self.resampled(interval, trading_sessions)
+        cur_ns = pd.Timestamp(cur_datetime).value
+        if resampled.label_last:
+            end = int(np.searchsorted(self.times, cur_ns, side="left"))
+            return resampled.window(periods, end, include_partial=True)
+        end = int(np.searchsorted(self.times, cur_ns, side="right"))
+        return resampled.window(periods, end, cur_datetime)
+
+
+class HistoricalBarIndex:
+    """Historical bars for `req_historical_bars` in backtest
+
+    The bars of each security and interval are read once into a `BarHistory`,
+    instead of listing and parsing the csv files on every request.
+    """
+
+    def __init__(self):
+        self._histories: Dict[str, BarHistory] = {}
+
+    def get(self, security: Security, interval: str) -> BarHistory:
+        data_path = _get_data_path(security, "kline", interval=interval)
+        history = self._histories.get(data_path)
+        if history is None:
+            history = BarHistory.load(data_path)
+            self._histories[data_path] = history
+        return history
+
+    def clear(self):
+        self._histories.clear()
+
+    @staticmethod
+    def to_bars(security: Security, times: np.ndarray, values: np.ndarray) -> List[Bar]:
+        return [
+            Bar(security=security, datetime=dt, open=o, high=h, low=l, close=c, volume=v)
+            for dt, (o, h, l, c, v) in zip(pd.DatetimeIndex(times).to_pydatetime(), values.tolist())
+        ]
+
+    def min_bars(
+            self,
+            security: Security,
+            periods: int,
+            cur_datetime: datetime,
+            trading_sessions: List[datetime] = None,
+            interval: str = "1min"
+    ) -> List[Bar]:
+        """The last `periods` minute bars up to `cur_datetime`, forward-filled
+        within the trading sessions."""
+        history = self.get(security, interval)
+        try:
+            times, values = history.window(
+                periods, cur_datetime, trading_sessions, int(interval.replace("min", "")))
+        except ValueError as e:
+            raise ValueError(
+                f"There is not sufficient historical 1min data for {security.code}. {e}")
+        return self.to_bars(security, times, values)
+
+    def day_bars(
+            self,
+            security: Security,
+            periods: int,
+            cur_datetime: datetime,
+            interval: str = "1day"
+    ) -> List[Bar]:
+        """The last `periods` daily bars before the day of `cur_datetime`"""
+        history = self.get(security, interval)
+        try:
+            times, values = history.before(periods, datetime.combine(cur_datetime.date(), Time(0, 0, 0)))
+        except AssertionError as e:
+            raise AssertionError(
+                f"There is not sufficient historical 1day data for {security.code}. {e}")
+        return self.to_bars(security, times, values)
+
+    def aggregate_bars(
+            self,
+            security: Security,
+            periods: int,
+            cur_datetime: datetime,
+            trading_sessions: List[datetime] = None,
+            interval: str = "1day"
+    ) -> List[Bar]:
+        """Bars of `interval` aggregated from the 1min bars"""
+        try:
+            times, values = self.get(security, "1min").resampled_window(
+                periods, cur_datetime, interval, trading_sessions)
+        except ValueError as e:
+            raise ValueError(
+                f"There is not sufficient historical {interval} data for {security.code}. {e}")
+        return self.to_bars(security, times, values)
+
+
+bar_history = HistoricalBarIndex()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import math
+from heapq import heapify, heappop, heappush, merge
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Direction, OrderTimeInForce
+from app.domain.data import Bar
+from app.domain.order import Order
+from app.domain.security import Security
+
+# 堆里的过期条目少于这个数时不重建
+STALE_COMPACT_MIN = 64
+
+
+@dataclass
+class Fill:
+    """A (partial) fill of a resting order"""
+    order: Order
+    price: float
+    quantity: float
+    time: datetime
+
+
+class PendingOrderBook:
+    """Resting limit orders of one security, in price-time priority
+
+    Each side is a heap of (sort price, seq, orderid): buy orders by
+    descending price, sell orders by ascending price. The orders a bar
+    reaches are at the top of each side; `reached` pops them lazily in
+    priority order, O(log n) each, so matching only touches the orders it
+    fills (plus one), and `restore` pushes back the ones still resting.
+    Adding an order is a heap push. Removing an order only forgets it (lazy
+    deletion): its heap entry is dropped when it reaches the top, and the
+    heaps are rebuilt once stale entries outnumber the resting orders.
+    """
+
+    def __init__(self):
+        self.buys: List[tuple] = []
+        self.sells: List[tuple] = []
+        self.orders: Dict[str, Order] = {}
+        # DAY 订单按下单的交易日分组，进入下一个交易日时过期
+        self.day_orders: Dict[date, List[str]] = {}
+        self._seq = 0
+        self._stale = 0  # 已撤销/成交但仍在堆里的条目数
+        self._popped: List[Tuple[bool, tuple]] = []  # reached 弹出、等待 restore 的 (买/卖, 条目)
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def add(self, order: Order, trading_day: date = None):
+        self._seq += 1
+        if order.direction == Direction.LONG:
+            heappush(self.buys, (-order.price, self._seq, order.orderid))
+        else:
+            heappush(self.sells, (order.price, self._seq, order.orderid))
+        self.orders[order.orderid] = order
+        if order.time_in_force == OrderTimeInForce.DAY:
+            self.day_orders.setdefault(trading_day, []).append(order.orderid)
+
+    def remove(self, orderid: str) -> Order:
+        """Remove the order from the book (None if it is not resting)"""
+        order = self.orders.pop(orderid, None)
+        if order is None:
+            return None
+        self._stale += 1
+        if not self._popped and self._stale > max(len(self.orders), STALE_COMPACT_MIN):
+            self._compact()
+        return order
+
+    def _compact(self):
+        self.buys = [key for key in self.buys if key[2] in self.orders]
+        self.sells = [key for key in self.sells if key[2] in self.orders]
+        heapify(self.buys)
+        heapify(self.sells)
+        self._stale = 0
+
+    def reached(self, is_buy: bool, limit: float) -> Iterator[Order]:
+        """Resting orders of one side with sort price <= `limit` (buy: -low,
+        sell: high), in priority order; call `restore` when done"""
+        while True:
+            side = self.buys if is_buy else self.sells
+            if not side or side[0][0] > limit:
+                return
+            key = heappop(side)
+            order = self.orders.get(key[2])
+            if order is None:
+                self._stale -= 1
+                continue
+            self._popped.append((is_buy, key))
+            yield order
+
+    def restore(self):
+        """Push back the orders popped by `reached` that are still resting"""
+        for is_buy, key in self._popped:
+            if key[2] in self.orders:
+                heappush(self.buys if is_buy else self.sells, key)
+            else:
+                # 弹出后才移除的订单已不在堆里
+                self._stale -= 1
+        self._popped = []
+
+    def expire(self, trading_day: date) -> List[Order]:
+        """Remove the DAY orders placed before `trading_day`"""
+        expired = []
+        for day in [d for d in self.day_orders if d < trading_day]:
+            for orderid in self.day_orders.pop(day):
+                order = self.remove(orderid)
+                if order is not None:
+                    expired.append(order)
+        return expired
+
+
+class OrderMatcher:
+    """Simulated matching of resting limit orders against bars (backtest)
+
+    An order is reached when the bar trades at its price (buy: low <= price,
+    sell: high >= price) and fills at its price, or at the open if the bar
+    opens through it. With the minute bars of the period, an order fills at
+    the first minute that reaches it. Orders without time in force are good
+    till cancelled.
+
+    volume_limit: if set, the orders filled on a bar take at most this
+        fraction of its volume, in price-time priority; the rest stays in the
+        book (partial fills). Order quantities are in lots and the bar volume
+        in shares, so partial fills are whole lots.
+    """
+
+    def __init__(self, volume_limit: float = None):
+        assert volume_limit is None or volume_limit > 0, (
+            f"volume_limit should be positive, got {volume_limit}")
+        self.volume_limit = volume_limit
+        self.books: Dict[Security, PendingOrderBook] = {}
+
+    def has_orders(self, security: Security) -> bool:
+        book = self.books.get(security)
+        return book is not None and len(book) > 0
+
+    def add(self, order: Order, trading_day: date = None):
+        book = self.books.get(order.security)
+        if book is None:
+            book = self.books[order.security] = PendingOrderBook()
+        book.add(order, trading_day)
+
+    def cancel(self, order: Order) -> bool:
+        """Take the order out of its book; False if it is not resting"""
+        book = self.books.get(order.security)
+        return book is not None and book.remove(order.orderid) is not None
+
+    def expire(self, security: Security, trading_day: date) -> List[Order]:
+        book = self.books.get(security)
+        if book is None or not book.day_orders:
+            return []
+        return book.expire(trading_day)
+
+    def match(
+            self,
+            security: Security,
+            bar: Bar,
+            minutes: Tuple[np.ndarray, np.ndarray] = None
+    ) -> List[Fill]:
+        """Fills of the resting orders on a new bar, in the order they happen
+
+        minutes: (times in ns, values of open/high/low/close/volume) of the
+            minute bars within the bar, if available.
+        """
+        book = self.books.get(security)
+        if book is None or len(book) == 0:
+            return []
+        use_minutes = minutes is not None and len(minutes[0]) > 0
+        if use_minutes:
+            m_times, m_values = minutes
+            low, high = m_values[:, 2].min(), m_values[:, 1].max()
+            volume = m_values[:, 4].sum()
+            # 第一根到达委托价的分钟：累计最低价（最高价）单调，二分查找
+            reach = (-np.minimum.accumulate(m_values[:, 2]), np.maximum.accumulate(m_values[:, 1]))
+        else:
+            low, high, volume = bar.low, bar.high, bar.volume
+            reach = None
+
+        def candidates(is_buy: bool):
+            """(成交的分钟, 买/卖, 价格优先级, 订单, 成交价)，按成交顺序"""
+            limit = -low if is_buy else high
+            for rank, order in enumerate(book.reached(is_buy, limit)):
+                if reach is None:
+                    i, open_ = 0, bar.open
+                elif is_buy:
+                    i = int(np.searchsorted(reach[0], -order.price, side="left"))
+                    open_ = float(m_values[i, 0])
+                else:
+                    i = int(np.searchsorted(reach[1], order.price, side="left"))
+                    open_ = float(m_values[i, 0])
+                price = min(order.price, open_) if is_buy else max(order.price, open_)
+                yield i, not is_buy, rank, order, price
+
+        # 可成交的量（股数）；订单数量以手为单位，部分成交取整手
+        capacity = math.inf if self.volume_limit is None else volume * self.volume_limit
+        lot_size = security.lot_size or 1
+        fills = []
+        try:
+            # 买卖两边各自按成交顺序，合并后依次成交，可成交量用完即停止
+            for i, _, _, order, price in merge(candidates(True), candidates(False)):
+                remaining = order.quantity - order.filled_quantity
+                quantity = remaining if capacity >= remaining * lot_size else math.floor(capacity / lot_size)
+                if quantity <= 0:
+                    break
+                capacity -= quantity * lot_size
+                if quantity == remaining:
+                    book.remove(order.orderid)
+                time = pd.Timestamp(int(m_times[i])).to_pydatetime() if use_minutes else bar.datetime
+                fills.append(Fill(order=order, price=price, quantity=quantity, time=time))
+        finally:
+            book.restore()
+        return fills
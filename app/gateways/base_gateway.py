@@ -17,6 +17,8 @@ from app.domain.security import Security
 from app.domain.balance import AccountBalance
 from app.domain.order import OrderBook, Order
 from app.domain.position import PositionData
+from app.domain.stores.order_store import OrderStore, DealStore
+from app.domain.stores.price_table import LastPriceTable
 from app.utils import BlockingDict
 from trader_config import GATEWAYS
 
@@ -68,9 +70,12 @@ class BaseGateway(ABC):
         self.trade_market = trade_market
         self.broker_name = GATEWAYS[gateway_name]["broker_name"]
         self.broker_account = GATEWAYS[gateway_name]["broker_account"]
-        self.orders = BlockingDict()
-        self.deals = BlockingDict()
+        # 订单按状态、成交按订单号建立索引，查询不需要遍历
+        self.orders = OrderStore(max_terminal_orders=kwargs.get("max_terminal_orders"))
+        self.deals = DealStore(max_deals=kwargs.get("max_deals"))
         self.quote = BlockingDict()
+        # 每只证券的最新价格（每根 bar 更新一次），组合按它计算持仓市值
+        self.last_prices = LastPriceTable()
         self.orderbook = BlockingDict()
 
         self.custom_quote_funcs: QuoteHookFuncs = QuoteHookFuncs()
@@ -162,12 +167,11 @@ class BaseGateway(ABC):
 
     def find_deals_with_orderid(self, orderid: str) -> List[Deal]:
         """Find deals based on orderid"""
-        found_deals = []
-        for dealid in self.deals:
-            deal = self.deals.get(dealid)
-            if deal.orderid == orderid:
-                found_deals.append(deal)
-        return found_deals
+        return self.deals.find_by_orderid(orderid)
+
+    def get_open_orders(self) -> List[Order]:
+        """Get orders that are not filled/cancelled/failed yet"""
+        return self.orders.get_open_orders()
 
     def place_order(self, order: Order):
         """Place order"""
@@ -199,7 +203,7 @@ class BaseGateway(ABC):
     def get_all_orders(self) -> List[Order]:
         """Get all orders (sent by current algo)"""
         all_orders = []
-        for orderid, order in self.orders.queue.items():
+        for orderid, order in self.orders.items():
             order.orderid = orderid
             all_orders.append(order)
         return all_orders
@@ -207,7 +211,7 @@ class BaseGateway(ABC):
     def get_all_deals(self) -> List[Deal]:
         """Get all deals (sent by current algo and got executed)"""
         all_deals = []
-        for dealid, deal in self.deals.queue.items():
+        for dealid, deal in self.deals.items():
             deal.dealid = dealid
             all_deals.append(deal)
         return all_deals
@@ -34,8 +34,11 @@ from app.domain.order import Order, OrderBook
 from app.domain.position import PositionData
 from app.domain.security import Stock, Security, Futures
 from app.domain.data import Bar, Quote, CapitalDistribution
+from app.domain.bar_aggregation import interval_minutes, resample_bar_df
 from app.utils.utility import try_parsing_datetime
 from app.utils.utility import get_kline_dfield_from_seconds
+from app.utils.tracing import tracer
+from app.utils.tracing import EVENT_BROKER_SUBMIT, EVENT_BROKER_ACK, EVENT_ORDER_UPDATE, EVENT_DEAL
 from .utility import (
     convert_trade_market_qt2futu,
     convert_direction_qt2futu,
@@ -267,7 +270,11 @@ class FutuGateway(BaseGateway):
                 dealid=dealid,
                 orderid=orderid)
             self.deals.put(dealid, deal)
+            tracer.event(order, EVENT_DEAL, gateway=self.gateway_name, orderid=orderid, dealid=dealid,
+                         price=deal.filled_avg_price, quantity=deal.filled_quantity)
         self.orders.put(orderid, order)
+        tracer.event(order, EVENT_ORDER_UPDATE, gateway=self.gateway_name, orderid=orderid,
+                     status=order.status.value, filled_quantity=order.filled_quantity)
 
     def process_deal(self, content: pd.DataFrame):
         """Callback of Deal"""
@@ -296,6 +303,8 @@ class FutuGateway(BaseGateway):
             dealid=dealid,
             orderid=orderid)
         self.deals.put(dealid, deal)
+        tracer.event(order, EVENT_DEAL, gateway=self.gateway_name, orderid=orderid, dealid=dealid,
+                     price=deal.filled_avg_price, quantity=deal.filled_quantity)
 
     @property
     def market_datetime(self):
@@ -405,6 +414,7 @@ class FutuGateway(BaseGateway):
         ):
             code = get_hk_futures_code(security=order.security)
 
+        tracer.event(order, EVENT_BROKER_SUBMIT, gateway=self.gateway_name)
         ret_code, data = self.trd_ctx.place_order(
             price=price,
             qty=qty,
@@ -417,9 +427,11 @@ class FutuGateway(BaseGateway):
         )
         if ret_code:
             print(f"[place_order]({order}) failed: {data}")
+            tracer.event(order, EVENT_BROKER_ACK, gateway=self.gateway_name, error=str(data))
             return ""
         # valid orderid must be returned by server
         orderid = data["order_id"].values[0]
+        tracer.event(order, EVENT_BROKER_ACK, gateway=self.gateway_name, orderid=orderid)
         # change order status
         order.status = QTOrderStatus.SUBMITTED
         # order will be updated later by process_order method
@@ -526,17 +538,31 @@ class FutuGateway(BaseGateway):
             trading_sessions: List[List[datetime]] = None,
             mode: str = "direct"
     ) -> List[Bar]:
-        """request historical bar data."""
+        """request historical bar data.
+
+        mode:
+            'aggregate': aggregate the 1min bars to freq (e.g. 5Min/15Min/
+                         60Min/1Day) within the trading sessions.
+            'direct': (default) request the bars of freq from FUTU.
+        """
+        if freq == "1Day" and trading_sessions is None:
+            raise ValueError(
+                f"Parameters trading_sessions is mandatory if freq={freq}.")
+
+        if mode == "aggregate" and freq != "1Min":
+            return self._req_aggregated_bars(
+                security=security,
+                periods=periods,
+                freq=freq,
+                cur_datetime=cur_datetime,
+                trading_sessions=trading_sessions)
+
         # Check whether freq is valid
         assert freq in self.KL_ALLOWED, (
             f"Parameter freq={freq} is Not supported. "
             f"Only {self.KL_ALLOWED} are allowed."
         )
 
-        if freq == "1Day" and trading_sessions is None:
-            raise ValueError(
-                f"Parameters trading_sessions is mandatory if freq={freq}.")
-
         # return historical bar data
         data_df = self._api_get_historical_bar(
             instrument=security.code,
@@ -558,6 +584,48 @@ class FutuGateway(BaseGateway):
             hist_bars.append(bar)
         return hist_bars
 
+    def _req_aggregated_bars(
+            self,
+            security: Security,
+            periods: int,
+            freq: str,
+            cur_datetime: datetime = None,
+            trading_sessions: List[List[datetime]] = None
+    ) -> List[Bar]:
+        """Aggregate the 1min bars to freq"""
+        minutes = interval_minutes(freq)
+        bar_minutes = minutes
+        if bar_minutes is None:
+            # 每个交易日的分钟数
+            bar_minutes = sum(
+                int((s[1] - s[0]).total_seconds() // 60) % (24 * 60)
+                for s in trading_sessions) or 24 * 60
+        data_df = self._api_get_historical_bar(
+            instrument=security.code,
+            asset_type=f"{security.__class__.__name__}_{security.exchange.value}",
+            periods=(periods + 1) * bar_minutes,
+            freq="1Min")
+        bars_df = resample_bar_df(data_df, freq, trading_sessions)
+        if minutes is not None:
+            # 只取已经结束的 bar
+            bars_df = bars_df[bars_df["time_key"] <= (cur_datetime or datetime.now())]
+        assert bars_df.shape[0] >= periods, (
+            f"Data received is not sufficient to requested ({bars_df.shape[0]} < {periods}).")
+
+        hist_bars = []
+        for row in bars_df.tail(periods).itertuples():
+            bar = Bar(
+                datetime=row.time_key.to_pydatetime(),
+                security=security,
+                open=row.open,
+                high=row.high,
+                low=row.low,
+                close=row.close,
+                volume=row.volume
+            )
+            hist_bars.append(bar)
+        return hist_bars
+
     def get_historical_kline_df(
             self,
             security: Security,
@@ -0,0 +1,277 @@
+import asyncio
+import threading
+from time import time_ns
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.domain.data import Bar
+from app.domain.security import Security
+from app.markets.data import SubscribeQuote
+from app.markets.subscription_registry import register_quote_config
+from app.config.configure import config
+from app.utils import logger
+from app.utils.latency import latency
+
+QUOTE_CHANNEL_PREFIX = 'quant_trader_quotes'
+QUOTE_FIELDS = ("open", "high", "low", "close", "volume")
+QUOTE_SCHEMA = pa.schema(
+    [("code", pa.string()), ("datetime", pa.timestamp("ns"))] + [(field, pa.float64()) for field in QUOTE_FIELDS])
+
+
+def quotes_to_batch(df: pd.DataFrame) -> pa.RecordBatch:
+    """Quote frame (code, datetime, open, high, low, close, volume) -> Arrow record batch"""
+    arrays = [
+        pa.array(df["code"].astype(str).to_numpy(), type=pa.string()),
+        pa.array(pd.to_datetime(df["datetime"]).to_numpy(dtype="datetime64[ns]"), type=pa.timestamp("ns")),
+    ]
+    arrays += [pa.array(df[field].to_numpy(dtype=np.float64), type=pa.float64()) for field in QUOTE_FIELDS]
+    return pa.RecordBatch.from_arrays(arrays, schema=QUOTE_SCHEMA)
+
+
+def serialize_quotes(batch: pa.RecordBatch) -> bytes:
+    """Quote record batch -> Arrow IPC stream"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, QUOTE_SCHEMA) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_quotes(df: pd.DataFrame) -> bytes:
+    """Quote frame (code, datetime, open, high, low, close, volume) -> Arrow IPC stream"""
+    return serialize_quotes(quotes_to_batch(df))
+
+
+class QuoteBatch:
+    """Decoded quotes, the latest bar of every code
+
+    The numeric columns are numpy views of the Arrow buffers (no copy);
+    `get_bar` builds the Bar of a security like `BarFeedSlice.get_bar`.
+    `ingest_ns` is when the (earliest) message of the quotes arrived.
+    """
+
+    __slots__ = ("_rows", "ingest_ns")
+
+    def __init__(self, ingest_ns: int = None):
+        self._rows: Dict[str, Tuple[List[np.ndarray], int]] = {}  # code -> (columns, row)
+        self.ingest_ns = ingest_ns
+
+    @classmethod
+    def decode(cls, payload: bytes, ingest_ns: int = None) -> "QuoteBatch":
+        quotes = cls(ingest_ns)
+        reader = pa.ipc.open_stream(pa.py_buffer(payload))
+        for batch in reader:
+            columns = [batch.column(1).to_numpy(zero_copy_only=True)]
+            columns += [batch.column(i).to_numpy(zero_copy_only=True) for i in range(2, 2 + len(QUOTE_FIELDS))]
+            for row, code in enumerate(batch.column(0).to_pylist()):
+                quotes._rows[code] = (columns, row)
+        return quotes
+
+    def update(self, other: "QuoteBatch"):
+        self._rows.update(other._rows)
+        if self.ingest_ns is None or (other.ingest_ns is not None and other.ingest_ns < self.ingest_ns):
+            self.ingest_ns = other.ingest_ns
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._rows
+
+    @property
+    def empty(self) -> bool:
+        return len(self._rows) == 0
+
+    def codes(self) -> List[str]:
+        return list(self._rows.keys())
+
+    def get_bar(self, security: Security) -> Bar:
+        item = self._rows.get(security.code)
+        if item is None:
+            return None
+        columns, i = item
+        return Bar(
+            datetime=pd.Timestamp(columns[0][i]).to_pydatetime(),
+            security=security,
+            open=float(columns[1][i]),
+            high=float(columns[2][i]),
+            low=float(columns[3][i]),
+            close=float(columns[4][i]),
+            volume=float(columns[5][i]))
+
+
+class InProcessTransport:
+    """Pub/sub inside one process (tests, or publisher and strategies in the same process)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def publish(self, channel: str, payload: bytes) -> int:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            # 发布者可以在其他线程；消息带上到达时间
+            loop.call_soon_threadsafe(queue.put_nowait, (channel, payload, time_ns()))
+        return len(subscribers)
+
+    def publish_many(self, messages: List[Tuple[str, bytes]]) -> int:
+        for channel, payload in messages:
+            self.publish(channel, payload)
+        return len(messages)
+
+    async def subscribe(self, channels: Iterable[str], queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, []).append((loop, queue))
+
+    async def unsubscribe(self, channels: Iterable[str], queue: asyncio.Queue):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel] = [s for s in self._subscribers.get(channel, []) if s[1] is not queue]
+
+
+class RedisTransport:
+    """Redis pub/sub (publish with redis, subscribe with aioredis)"""
+
+    def __init__(self, client=None):
+        self.host = config.redis.get("host", "localhost")
+        self.port = config.redis.get("port", "6379")
+        self.password = config.redis.get("password", "")
+        self.db = config.redis.get("db", 1)
+        if client is None:
+            import redis
+            pool = redis.ConnectionPool(host=self.host, port=self.port, password=self.password, db=self.db)
+            client = redis.Redis(connection_pool=pool)
+        self.rClient = client
+        self._readers = {}
+
+    def publish(self, channel: str, payload: bytes) -> int:
+        return self.rClient.publish(channel, payload)
+
+    def publish_many(self, messages: List[Tuple[str, bytes]]) -> int:
+        """Publish the messages in one round trip"""
+        pipe = self.rClient.pipeline(transaction=False)
+        for channel, payload in messages:
+            pipe.publish(channel, payload)
+        pipe.execute()
+        return len(messages)
+
+    def register(self, strategy_name: str, quote_config: str):
+        register_quote_config(self.rClient, quote_config, strategy_name)
+
+    async def subscribe(self, channels: Iterable[str], queue: asyncio.Queue):
+        # 只有实盘订阅行情时才需要 aioredis
+        import aioredis
+        from aioredis.pubsub import Receiver
+        client = await aioredis.create_redis(f"redis://{self.host}:{self.port}", password=self.password,
+                                             db=int(self.db))
+        receiver = Receiver()
+        await client.subscribe(*[receiver.channel(channel) for channel in channels])
+
+        async def read():
+            async for channel, payload in receiver.iter():
+                queue.put_nowait((channel.name.decode(), payload, time_ns()))
+
+        self._readers[id(queue)] = (client, asyncio.ensure_future(read()))
+
+    async def unsubscribe(self, channels: Iterable[str], queue: asyncio.Queue):
+        client, reader = self._readers.pop(id(queue), (None, None))
+        if client is None:
+            return
+        reader.cancel()
+        await client.unsubscribe(*channels)
+        client.close()
+
+
+class QuoteSubscription:
+    """Quotes of the subscribed channels; `get` waits for the next update
+
+    The queue holds (channel, payload, ingest time in `time.time_ns()`).
+    """
+
+    def __init__(self, bus: "QuoteBus", channels: List[str]):
+        self.bus = bus
+        self.channels = channels
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def get(self) -> QuoteBatch:
+        """The next quotes; messages already waiting are merged (latest bar per code)"""
+        _, payload, ingest_ns = await self.queue.get()
+        with latency.span("quote_decode"):
+            quotes = QuoteBatch.decode(payload, ingest_ns)
+            while not self.queue.empty():
+                _, payload, ingest_ns = self.queue.get_nowait()
+                quotes.update(QuoteBatch.decode(payload, ingest_ns))
+        return quotes
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> QuoteBatch:
+        return await self.get()
+
+    async def close(self):
+        await self.bus.transport.unsubscribe(self.channels, self.queue)
+
+
+class QuoteBus:
+    """Binary quote pub/sub with a channel per symbol (and per strategy)
+
+    Publishers send the quote frame with `publish`: every code goes to its own
+    channel, and the codes of each strategy in `strategies` are also sent as
+    one message to the strategy channel. The frame is converted to Arrow
+    once and all messages of a round are sent with one `publish_many`. Subscribers only receive the codes
+    they subscribe to. A polling round of a strategy is one message on its
+    strategy channel (per-symbol messages of a round may arrive apart), so
+    strategies subscribe to their strategy channel after `register_strategy`.
+    """
+
+    def __init__(self, transport=None, prefix: str = QUOTE_CHANNEL_PREFIX):
+        self.transport = RedisTransport() if transport is None else transport
+        self.prefix = prefix
+
+    def symbol_channel(self, code: str) -> str:
+        return f"{self.prefix}:symbol:{code}"
+
+    def strategy_channel(self, strategy_name: str) -> str:
+        return f"{self.prefix}:strategy:{strategy_name}"
+
+    def publish(self, df: pd.DataFrame, strategies: Dict[str, Iterable[str]] = None) -> int:
+        """Publish the quotes (one row per code); return the number of messages"""
+        if df.empty:
+            return 0
+        batch = quotes_to_batch(df)
+        codes = batch.column(0)
+        messages = []
+        for strategy_name, strategy_codes in (strategies or {}).items():
+            rows = batch.filter(pc.is_in(codes, value_set=pa.array(list(strategy_codes), type=pa.string())))
+            if rows.num_rows == 0:
+                continue
+            messages.append((self.strategy_channel(strategy_name), serialize_quotes(rows)))
+        # 按代码的频道：每个代码一行（切片不复制数据）
+        messages += [(self.symbol_channel(code), serialize_quotes(batch.slice(i, 1)))
+                     for i, code in enumerate(codes.to_pylist())]
+        return self.transport.publish_many(messages)
+
+    def register_strategy(self, strategy_name: str, securities: Iterable[Security]) -> bool:
+        """Ask the quotes service to publish the strategy channel of the
+        securities; False if the transport has no subscription registry"""
+        register = getattr(self.transport, "register", None)
+        if register is None:
+            return False
+        register(strategy_name, SubscribeQuote(strategy_name=strategy_name, securities=list(securities)).to_json())
+        return True
+
+    async def subscribe(self, codes: Iterable[str] = (), strategies: Iterable[str] = ()) -> QuoteSubscription:
+        channels = [self.symbol_channel(code) for code in codes]
+        channels += [self.strategy_channel(name) for name in strategies]
+        assert channels, "no codes or strategies to subscribe"
+        subscription = QuoteSubscription(self, channels)
+        await self.transport.subscribe(channels, subscription.queue)
+        logger.info(f"[quote_bus] subscribed {len(channels)} channels")
+        return subscription
@@ -1,89 +1,137 @@
-import json
 import time
-from datetime import datetime,timedelta,timezone
-
-
-from app.markets.data import SubscribeQuote
-from typing import List, Any
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
 
+import pandas as pd
 import redis
-import exchange_calendars as xcals
 
+from app.domain.calendar_service import calendar_service
+from app.markets.data import SubscribeQuote
+from app.markets.quote_bus import QuoteBus, RedisTransport
+from app.markets.subscription_registry import QuoteSubscriptionRegistry
 from app.facade.trade import realtime_data
 from app.config.configure import config
 from app.utils import logger
 
-quote_publish_channel = 'quant_trader_quotes_channel'
+# 代码前缀 -> 交易日历
+MARKET_CALENDARS = {
+    "US": "XNYS",
+    "HK": "XHKG",
+    "SH": "XSHG",
+    "SZ": "XSHG",
+}
 
 
-class QuotesService:
-    def __init__(self):
-        self.quotes: List[SubscribeQuote] = []
+@dataclass
+class QuoteCycleStats:
+    """Latency of one polling cycle"""
+    started: datetime
+    markets: List[str] = field(default_factory=list)  # 开市的市场
+    codes: int = 0
+    messages: int = 0
+    fetch_ms: Dict[str, float] = field(default_factory=dict)  # 每个市场的行情请求耗时
+    publish_ms: float = 0
+    total_ms: float = 0
+
 
+class QuotesService:
+    """Poll the realtime quotes of the subscribed codes and publish them
+
+    Every `interval` seconds the subscriptions are refreshed, the codes are
+    grouped by market and only the markets in session are fetched (at most
+    `batch_size` codes per request). When no subscribed market is open the
+    service sleeps `idle_interval` seconds.
+    """
+
+    def __init__(
+            self,
+            quote_bus: QuoteBus = None,
+            registry: QuoteSubscriptionRegistry = None,
+            interval: float = 10,
+            idle_interval: float = 60,
+            batch_size: int = 100,
+            fetch: Callable[[List[str]], pd.DataFrame] = None,
+    ):
         host = config.redis.get("host", "localhost")
         port = config.redis.get("port", "6379")
         password = config.redis.get("password", "")
         db = config.redis.get("db", 1)
         pool = redis.ConnectionPool(host=host, port=port, password=password, db=db)
         self.rClient = redis.Redis(connection_pool=pool, db=db)
-
-        self.calendars = {}
-        self._init_calendar()
-
-    def _init_calendar(self):
-        self.calendars['us_calendar'] = xcals.get_calendar("XNYS")
+        # 行情按代码（和策略）分频道、以 Arrow IPC 格式发布
+        self.quote_bus = QuoteBus(RedisTransport(self.rClient)) if quote_bus is None else quote_bus
+        self.registry = QuoteSubscriptionRegistry(self.rClient) if registry is None else registry
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.batch_size = batch_size
+        self._fetch = fetch if fetch is not None else (lambda codes: realtime_data("", codes))
+        self.last_stats: QuoteCycleStats = None
+        self._running = False
 
     def subscribe(self, quote: SubscribeQuote = None):
-        self.quotes.append(quote)
+        self.registry.subscribe(quote)
 
     def start(self):
-        while True:
-            code_list = self._load_quote_codes()
-            if len(code_list) == 0:
-                continue
-
-            codes = []
-            for co in code_list:
-                if co.split(".")[0] == 'US' and self._is_now_trading_time('US') is False:
-                    continue
-                codes.append(co.split(".")[1])
-
-            if len(codes) == 0:
+        self._running = True
+        while self._running:
+            stats = self.run_cycle()
+            interval = self.interval if stats.markets else self.idle_interval
+            time.sleep(max(0.0, interval - stats.total_ms / 1000))
+
+    def stop(self):
+        self._running = False
+
+    def run_cycle(self, now: datetime = None) -> QuoteCycleStats:
+        """Fetch and publish the quotes of the markets in session once"""
+        now = datetime.now(timezone.utc) if now is None else now
+        tic = time.perf_counter()
+        stats = QuoteCycleStats(started=now)
+        try:
+            self.registry.refresh()
+        except Exception:
+            logger.exception("refresh quote subscriptions fail.", caller=self)
+
+        frames = []
+        for market, codes in self.registry.codes_by_market().items():
+            if not self._is_trading_time(market, now):
                 continue
-
-            df = realtime_data("", codes)
-            df['close'] = df['current']
-            for code in code_list:
-                df.loc[df['code'] == code.split(".")[1], 'code'] = code
-            ret = self.rClient.publish(quote_publish_channel, df.to_json())
-            logger.info("redis publish", ret)
-            time.sleep(10)
-
-    def _load_quote_codes(self) -> List:
-        """
-        从redis中加载行情配置
-        """
-        # securities = [
-        #     Stock(code="US.NVDA", lot_size=1, security_name="英伟达", exchange=Exchange.NASDAQ),
-        #     Stock(code="US.PDD", lot_size=1, security_name="拼多多", exchange=Exchange.NASDAQ),
-        #     Stock(code="US.TSLA", lot_size=1, security_name="特斯拉", exchange=Exchange.NASDAQ),
-        # ]
-
-        rest = self.rClient.hgetall('quant_trader_quotes_config')
-        for k, item in rest.items():
-            quote = SubscribeQuote.from_json(item)
-            self.quotes.append(quote)
-
-        # self.quotes.append(quote)
-        codes = []
-        for quote in self.quotes:
-            codes.extend([security.code for security in quote.securities])
-        return list(set(codes))
-
-    def _is_now_trading_time(self, type_name='US'):
-        utc_now = datetime.now(timezone.utc)
-        if type_name == 'US':
-            us_now = utc_now
-            return self.calendars['us_calendar'].is_open_on_minute(us_now.strftime("%Y-%m-%d %H:%M"))
-
-        return False
+            stats.markets.append(market)
+            fetch_tic = time.perf_counter()
+            for i in range(0, len(codes), self.batch_size):
+                batch = codes[i:i + self.batch_size]
+                try:
+                    frames.append(self._fetch_quotes(batch))
+                except Exception:
+                    logger.exception(f"fetch {market} quotes fail.", caller=self)
+            stats.fetch_ms[market] = (time.perf_counter() - fetch_tic) * 1000
+            stats.codes += len(codes)
+
+        frames = [df for df in frames if not df.empty]
+        if frames:
+            publish_tic = time.perf_counter()
+            stats.messages = self.quote_bus.publish(pd.concat(frames, ignore_index=True),
+                                                    strategies=self.registry.strategies())
+            stats.publish_ms = (time.perf_counter() - publish_tic) * 1000
+        stats.total_ms = (time.perf_counter() - tic) * 1000
+        self.last_stats = stats
+        if stats.markets:
+            fetch_ms = ", ".join(f"{m} {ms:.0f}ms" for m, ms in stats.fetch_ms.items())
+            logger.info(f"quotes cycle: {stats.codes} codes, {stats.messages} messages, fetch {fetch_ms}, "
+                        f"publish {stats.publish_ms:.0f}ms, total {stats.total_ms:.0f}ms")
+        return stats
+
+    def _fetch_quotes(self, codes: List[str]) -> pd.DataFrame:
+        """Realtime quotes of the codes of one market, with the full codes (e.g. US.AAPL)"""
+        symbols = {code.split(".")[1]: code for code in codes}
+        df = self._fetch(list(symbols))
+        df['close'] = df['current']
+        df['code'] = df['code'].map(symbols)
+        return df[df['code'].notna()]
+
+    def _is_trading_time(self, market: str, now: datetime) -> bool:
+        name = MARKET_CALENDARS.get(market)
+        if name is None:
+            return False
+        # 交易日历只加载一次，按开收盘时间数组二分查找
+        return calendar_service.is_open_on_minute(name, now)
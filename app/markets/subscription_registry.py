@@ -0,0 +1,101 @@
+import time
+from typing import Dict, List
+
+from app.markets.data import SubscribeQuote
+from app.utils import logger
+
+QUOTES_CONFIG_KEY = 'quant_trader_quotes_config'
+
+
+def version_key(key: str = QUOTES_CONFIG_KEY) -> str:
+    return f"{key}:version"
+
+
+def register_quote_config(client, quote_config: str, strategy_name: str, key: str = QUOTES_CONFIG_KEY):
+    """Write the quote config (SubscribeQuote json) of a strategy and bump the version"""
+    pipe = client.pipeline()
+    pipe.hset(key, strategy_name, quote_config)
+    pipe.incr(version_key(key))
+    pipe.execute()
+
+
+def unregister_quote_config(client, strategy_name: str, key: str = QUOTES_CONFIG_KEY):
+    pipe = client.pipeline()
+    pipe.hdel(key, strategy_name)
+    pipe.incr(version_key(key))
+    pipe.execute()
+
+
+class QuoteSubscriptionRegistry:
+    """The quotes subscribed by the strategies
+
+    Strategies register their securities in the redis hash `key` (see
+    `register_quote_config`), which bumps a version counter. `refresh` only
+    reloads the hash when the version changed, or every `reload_interval`
+    seconds for writers that don't bump it. Subscriptions added with
+    `subscribe` are local to this process.
+    """
+
+    def __init__(self, client=None, key: str = QUOTES_CONFIG_KEY, reload_interval: float = 60):
+        self.client = client
+        self.key = key
+        self.reload_interval = reload_interval
+        self._remote: Dict[str, SubscribeQuote] = {}
+        self._local: Dict[str, SubscribeQuote] = {}
+        self._version = None
+        self._loaded_at = None
+        self._codes: List[str] = None
+
+    def subscribe(self, quote: SubscribeQuote):
+        self._local[quote.strategy_name] = quote
+        self._codes = None
+
+    def unsubscribe(self, strategy_name: str):
+        self._local.pop(strategy_name, None)
+        self._codes = None
+
+    def refresh(self) -> bool:
+        """Reload the subscriptions from redis if they changed; return whether they were reloaded"""
+        if self.client is None:
+            return False
+        version = self.client.get(version_key(self.key))
+        expired = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval
+        if version == self._version and not expired:
+            return False
+        quotes = {}
+        for name, item in self.client.hgetall(self.key).items():
+            try:
+                quote = SubscribeQuote.from_json(item)
+            except Exception:
+                logger.exception(f"invalid quote config of {name}", caller=self)
+                continue
+            quotes[quote.strategy_name] = quote
+        changed = quotes != self._remote
+        self._remote = quotes
+        self._version = version
+        self._loaded_at = time.monotonic()
+        if changed:
+            self._codes = None
+            logger.info(f"quote subscriptions reloaded: {len(quotes)} strategies, version {version}")
+        return changed
+
+    @property
+    def quotes(self) -> List[SubscribeQuote]:
+        return list({**self._remote, **self._local}.values())
+
+    def strategies(self) -> Dict[str, List[str]]:
+        """Strategy name -> codes"""
+        return {quote.strategy_name: [security.code for security in quote.securities] for quote in self.quotes}
+
+    def codes(self) -> List[str]:
+        """All subscribed codes (e.g. US.AAPL), sorted"""
+        if self._codes is None:
+            self._codes = sorted({security.code for quote in self.quotes for security in quote.securities})
+        return self._codes
+
+    def codes_by_market(self) -> Dict[str, List[str]]:
+        """Market prefix of the code (US/HK/SH/SZ) -> codes"""
+        markets = {}
+        for code in self.codes():
+            markets.setdefault(code.split(".")[0], []).append(code)
+        return markets
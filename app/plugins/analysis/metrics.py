@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
+from typing import Union
 
 import numpy as np
 import pandas as pd
@@ -15,17 +15,18 @@ def convert_time(time_: str) -> str:
         return f"{hour}:30:00"
 
 
-def holding_period(time_: pd.Series) -> float:
-    """open_datetime and close_datetime are in the format of %Y-%m-%d %H:%M:%S
-    (
-        time_['close_datetime'].astype('datetime64')
-        - time_['open_datetime'].astype('datetime64')).apply(lambda x:
-        x.total_seconds() / 60.
-    )
+def holding_period(time_: Union[pd.Series, pd.DataFrame]) -> Union[float, pd.Series]:
+    """Holding period in minutes of a trade (or of every trade of a DataFrame)
+    with open_datetime and close_datetime (datetime or %Y-%m-%d %H:%M:%S)
     """
-    begin_dt = datetime.strptime(time_["open_datetime"], "%Y-%m-%d %H:%M:%S")
-    end_dt = datetime.strptime(time_["close_datetime"], "%Y-%m-%d %H:%M:%S")
-    return (end_dt - begin_dt).total_seconds() / 60.
+    begin_dt = pd.to_datetime(time_["open_datetime"], format="%Y-%m-%d %H:%M:%S")
+    end_dt = pd.to_datetime(time_["close_datetime"], format="%Y-%m-%d %H:%M:%S")
+    return (end_dt - begin_dt) / pd.Timedelta(minutes=1)
+
+
+def trading_session(time_: pd.Series) -> pd.Series:
+    """Vectorized convert_time of datetimes: the half hour session (%H:%M:%S)"""
+    return time_.dt.floor("30min").dt.strftime("%H:%M:%S")
 
 
 def percentile(n: float):
@@ -16,12 +16,13 @@ from plotly.subplots import make_subplots
 
 from app.utils.utility import try_parsing_datetime
 from app.plugins.analysis.metrics import percentile
-from app.plugins.analysis.metrics import convert_time
 from app.plugins.analysis.metrics import holding_period
+from app.plugins.analysis.metrics import trading_session
 from app.plugins.analysis.metrics import sharpe_ratio
 from app.plugins.analysis.metrics import information_ratio
 from app.plugins.analysis.metrics import modigliani_ratio
 from app.plugins.analysis.metrics import rolling_maximum_drawdown
+from app.plugins.analysis.results import load_results, match_round_trips
 
 
 class PerformanceCTA:
@@ -42,42 +43,30 @@ class PerformanceCTA:
         self.result_path = result_path
 
     def calc_statistics(self):
-        # read result csv
+        # read results (typed Parquet of the recorder, or the csv export)
         result = Path(
             os.getcwd()).parent.parent.parent.joinpath(
             self.result_path)
-        df = pd.read_csv(str(result).replace("%20", " "))
-
-        df.datetime = [try_parsing_datetime(
-            max(ast.literal_eval(dt))) for dt in df["datetime"]]
-        df.strategy_portfolio_value = [sum(ast.literal_eval(
-            spv)) for spv in df["strategy_portfolio_value"]]
+        results = load_results(str(result).replace("%20", " "), self.instruments["security"])
+        bars = results.bars
 
         # cal performance indicators on : sharpe ratio, info ratio, m2, mdd
-        df1 = df.copy()
-        agg_dict = {"strategy_portfolio_value": "last"}
-        for i, gateway_name in enumerate(self.instruments["security"]):
+        df1 = bars[["strategy_portfolio_value"]].copy()
+        lots = []
+        for gateway_name in self.instruments["security"]:
             for j, security in enumerate(
                     self.instruments["security"][gateway_name]):
-                df1[f"{gateway_name}_{security}_close"] = df1["close"].apply(
-                    lambda x: ast.literal_eval(x)[i][j])
-                agg_dict[f"{gateway_name}_{security}_close"] = "last"
+                df1[f"{gateway_name}_{security}_close"] = results.close[(gateway_name, security)].to_numpy()
+                lots.append(self.instruments["lot"][gateway_name][j])
 
-        df_d = df1.set_index('datetime').resample('D').agg(agg_dict)
+        df_d = df1.resample('D').last()
         df_d = df_d.dropna()
         # returns = df_d['strategy_portfolio_value'].pct_change()
         returns = (
             df_d['strategy_portfolio_value'].diff()
             / df_d['strategy_portfolio_value'].iloc[0]).dropna()
 
-        df_d["benchmark"] = 0
-        for i, gateway_name in enumerate(self.instruments["security"]):
-            for j, security in enumerate(
-                    self.instruments["security"][gateway_name]):
-                df_d["benchmark"] += (
-                    df_d[f"{gateway_name}_{security}_close"]
-                    *self.instruments["lot"][gateway_name][j]
-                )
+        df_d["benchmark"] = df_d.iloc[:, 1:].to_numpy() @ np.array(lots, dtype=float) if lots else 0
         # benchmark_returns = df_d["benchmark"].pct_change()
         benchmark_returns = (
             df_d["benchmark"].diff() / df_d["benchmark"].iloc[0]).dropna()
@@ -97,207 +86,76 @@ class PerformanceCTA:
             }
         ).T
 
-        # only take care of rows with actions
-        df_action = df[df["action"].apply(lambda x: x.count("|") > 0)]
-        df_action = df_action.reset_index(drop=True).copy()
-
-        # Do not count fees when considering win/loss of each trade
-        df_action.loc[:, "count_trades"] = None
-        df_action.loc[:, "pv_without_fees"] = None
-        for idx, row in df_action.iterrows():
-            action_str = row["action"]
-            num_trades = action_str.count("|")
-            df_action.loc[idx, "count_trades"] = num_trades
-            df_action.loc[idx, "pv_without_fees"] = (
-                df_action.loc[idx, "strategy_portfolio_value"]
-            )
-            if num_trades > 0:
-                gateway_action_strs = ast.literal_eval(action_str)
-                for i, gateway_action_str in enumerate(gateway_action_strs):
-                    gateway_name = list(self.instruments["security"].keys())[i]
-                    gateway_actions = [
-                        ast.literal_eval(a)
-                        for a in gateway_action_str.split("|")
-                        if "{" in a]
-                    for gateway_action in gateway_actions:
-                        sec_idx = self.instruments["security"][gateway_name].index(
-                            gateway_action['sec'])
-                        commission = self.instruments["commission"][gateway_name][sec_idx]
-                        df_action.loc[idx, "pv_without_fees"] = (
-                            df_action.loc[idx, "pv_without_fees"]
-                            + commission * gateway_action['qty']
-                        )
-
-        win_trades = []
-        loss_trades = []
-        flat_trades = []
-
-        open_trades = {gw: {sec: {} for sec in self.instruments["security"][gw]}
-                       for gw in self.instruments["security"]}
-
-        for idx, row in df_action.iterrows():
-            action_str = row["action"]
-            gateway_action_strs = ast.literal_eval(action_str)
-            for gw_idx, gateway_action_str in enumerate(gateway_action_strs):
-                gateway_name = list(
-                    self.instruments["security"].keys())[gw_idx]
-                gateway_actions = [
-                    ast.literal_eval(a)
-                    for a in gateway_action_str.split("|")
-                    if "{" in a]
-                for action in gateway_actions:
-                    security = action['sec']
-                    sec_idx = self.instruments["security"][gateway_name].index(
-                        security)
-                    lot = self.instruments["lot"][gateway_name][sec_idx]
-                    commission = self.instruments["commission"][gateway_name][sec_idx]
-                    slippage = self.instruments["slippage"][gateway_name][sec_idx]
-
-                    action["datetime"] = row["datetime"].to_pydatetime().strftime(
-                        "%Y-%m-%d %H:%M:%S")
-                    if action["offset"] == "OPEN":
-                        open_trades[gateway_name][security][action['no']] = action
-                    elif action["offset"] == "CLOSE":
-                        close_trd = action
-                        open_trd = open_trades[gateway_name][security][action['no']]
-                        assert open_trd["qty"] == close_trd["qty"], (
-                            "Qty doesn't match in open and close trade!"
-                        )
-                        qty = open_trd["qty"]
-                        close_trd_price = close_trd["close"]
-                        open_trd_price = open_trd["close"]
-                        # make a copy, instead of a reference!
-                        side = open_trd["side"] + ""
-                        if open_trd["side"] == "LONG":
-                            pnl = (
-                                (close_trd_price - open_trd_price) * qty * lot
-                                - commission * qty * 2
-                                - slippage * qty * 2
-                            )  # 2 for open&close
-                        elif open_trd["side"] == "SHORT":
-                            pnl = (
-                                (open_trd_price - close_trd_price) * qty * lot
-                                - commission * qty * 2
-                                - slippage * qty * 2
-                            )  # 2 for open&close
-                        # remove open trades in the dict
-                        del open_trades[gateway_name][security][action['no']]
-
-                        # record
-                        if pnl > 1e-8:
-                            win_trades.append([
-                                security,
-                                open_trd["datetime"],
-                                close_trd["datetime"],
-                                open_trd["datetime"].split(" ")[1],
-                                close_trd["datetime"].split(" ")[1],
-                                open_trd_price,
-                                close_trd_price,
-                                side,
-                                qty,
-                                pnl,
-                            ])
-                        elif pnl < -1e-8:
-                            loss_trades.append([
-                                security,
-                                open_trd["datetime"],
-                                close_trd["datetime"],
-                                open_trd["datetime"].split(" ")[1],
-                                close_trd["datetime"].split(" ")[1],
-                                open_trd_price,
-                                close_trd_price,
-                                side,
-                                qty,
-                                pnl,
-                            ])
-                        else:
-                            flat_trades.append([
-                                security,
-                                open_trd["datetime"],
-                                close_trd["datetime"],
-                                open_trd["datetime"].split(" ")[1],
-                                close_trd["datetime"].split(" ")[1],
-                                open_trd_price,
-                                close_trd_price,
-                                side,
-                                qty,
-                                pnl,
-                            ])
-
-        cols = [
-            "security",
-            "open_datetime",
-            "close_datetime",
-            "open_time",
-            "close_time",
-            "close_at_open",
-            "close_at_close",
-            "side",
-            "qty",
-            "pnl"]
-        if win_trades:
-            win_trades_df = pd.DataFrame(win_trades, columns=cols)
-            win_trades_df["open_session"] = win_trades_df["open_time"].apply(
-                convert_time)
-            win_trades_df["close_session"] = win_trades_df["close_time"].apply(
-                convert_time)
-            win_trades_df["holding_period"] = win_trades_df[[
-                "open_datetime", "close_datetime"]].apply(holding_period, axis=1)
-        if loss_trades:
-            loss_trades_df = pd.DataFrame(loss_trades, columns=cols)
-            loss_trades_df["open_session"] = loss_trades_df["open_time"].apply(
-                convert_time)
-            loss_trades_df["close_session"] = loss_trades_df["close_time"].apply(
-                convert_time)
-            loss_trades_df["holding_period"] = loss_trades_df[[
-                "open_datetime", "close_datetime"]].apply(holding_period, axis=1)
-        if flat_trades:
-            flat_trades_df = pd.DataFrame(flat_trades, columns=cols)
-            flat_trades_df["open_session"] = flat_trades_df["open_time"].apply(
-                convert_time)
-            flat_trades_df["close_session"] = flat_trades_df["close_time"].apply(
-                convert_time)
-            flat_trades_df["holding_period"] = flat_trades_df[[
-                "open_datetime", "close_datetime"]].apply(holding_period, axis=1)
+        # round-trip trades: opening and closing fills are paired first in, first out
+        trades = match_round_trips(results.fills)
+        costs = {}
+        for gateway_name in self.instruments["security"]:
+            for j, security in enumerate(
+                    self.instruments["security"][gateway_name]):
+                costs[(gateway_name, security)] = (
+                    self.instruments["lot"][gateway_name][j],
+                    self.instruments["commission"][gateway_name][j],
+                    self.instruments["slippage"][gateway_name][j],
+                )
+        keys = list(zip(trades["gateway"], trades["security"]))
+        lot = np.array([costs[k][0] for k in keys], dtype=float)
+        commission = np.array([costs[k][1] for k in keys], dtype=float)
+        slippage = np.array([costs[k][2] for k in keys], dtype=float)
+        qty = trades["qty"].to_numpy(dtype=float)
+        sign = np.where(trades["side"] == "LONG", 1.0, -1.0)
+        pnl = (
+            sign * (trades["close_price"].to_numpy(dtype=float) - trades["open_price"].to_numpy(dtype=float))
+            * qty * lot
+            - commission * qty * 2
+            - slippage * qty * 2
+        )  # 2 for open&close
+
+        trades_df = pd.DataFrame({
+            "security": trades["security"],
+            "open_datetime": pd.to_datetime(trades["open_datetime"]),
+            "close_datetime": pd.to_datetime(trades["close_datetime"]),
+            "close_at_open": trades["open_price"],
+            "close_at_close": trades["close_price"],
+            "side": trades["side"],
+            "qty": qty,
+            "pnl": pnl,
+        })
+        trades_df.insert(3, "open_time", trades_df["open_datetime"].dt.strftime("%H:%M:%S"))
+        trades_df.insert(4, "close_time", trades_df["close_datetime"].dt.strftime("%H:%M:%S"))
+        trades_df["open_session"] = trading_session(trades_df["open_datetime"])
+        trades_df["close_session"] = trading_session(trades_df["close_datetime"])
+        trades_df["holding_period"] = holding_period(trades_df)
+        trades_df["date"] = trades_df["close_datetime"].dt.date
 
         self.result = result
-        self.win_trades = win_trades
-        self.loss_trades = loss_trades
-        self.flat_trades = flat_trades
-        if win_trades:
-            self.win_trades_df = win_trades_df
-        if loss_trades:
-            self.loss_trades_df = loss_trades_df
-        if flat_trades:
-            self.flat_trades_df = flat_trades_df
+        self.trades_df = trades_df
+        self.win_trades_df = trades_df[trades_df["pnl"] > 1e-8].reset_index(drop=True)
+        self.loss_trades_df = trades_df[trades_df["pnl"] < -1e-8].reset_index(drop=True)
+        self.flat_trades_df = trades_df[trades_df["pnl"].abs() <= 1e-8].reset_index(drop=True)
 
         num_win_trades = self.win_trades_df.shape[0]
         num_loss_trades = self.loss_trades_df.shape[0]
         num_trades = num_win_trades + num_loss_trades
         total_pnl = self.win_trades_df["pnl"].sum(
         ) + self.loss_trades_df["pnl"].sum()
-        win_trades_ratio = num_win_trades / (num_win_trades + num_loss_trades)
+        win_trades_ratio = num_win_trades / num_trades if num_trades else np.nan
         max_trade_pnl = self.win_trades_df["pnl"].max()
         min_trade_pnl = self.loss_trades_df["pnl"].min()
-        avg_win_trade_pnl = self.win_trades_df["pnl"].sum() / num_win_trades
-        avg_loss_trade_pnl = self.loss_trades_df["pnl"].sum() / num_loss_trades
-        avg_trade_pnl = total_pnl / num_trades
-
-        self.win_trades_df["date"] = self.win_trades_df["close_datetime"].apply(
-            lambda x: datetime.strptime(x, "%Y-%m-%d %H:%M:%S").date())
-        self.loss_trades_df["date"] = self.loss_trades_df["close_datetime"].apply(
-            lambda x: datetime.strptime(x, "%Y-%m-%d %H:%M:%S").date())
+        avg_win_trade_pnl = self.win_trades_df["pnl"].mean()
+        avg_loss_trade_pnl = self.loss_trades_df["pnl"].mean()
+        avg_trade_pnl = total_pnl / num_trades if num_trades else np.nan
+
         total_trades_df = pd.concat([self.win_trades_df, self.loss_trades_df])
-        daily_pnl_df = total_trades_df.groupby("date").pnl.agg(["sum"])
-        num_days = len(df["datetime"].apply(lambda x: x.date()).unique())
-        num_active_days = daily_pnl_df.shape[0]
+        daily_pnl = total_trades_df.groupby("date").pnl.sum()
+        num_days = bars.index.normalize().nunique()
+        num_active_days = daily_pnl.shape[0]
         active_days_ratio = num_active_days / num_days
-        num_win_days = (daily_pnl_df > 0).sum().values[0]
-        num_loss_days = (daily_pnl_df < 0).sum().values[0]
-        win_days_ratio = num_win_days / num_active_days
-        max_daily_pnl = daily_pnl_df.max().values[0]
-        min_daily_pnl = daily_pnl_df.min().values[0]
-        avg_daily_pnl = total_pnl / num_active_days
+        num_win_days = int((daily_pnl > 0).sum())
+        num_loss_days = int((daily_pnl < 0).sum())
+        win_days_ratio = num_win_days / num_active_days if num_active_days else np.nan
+        max_daily_pnl = daily_pnl.max()
+        min_daily_pnl = daily_pnl.min()
+        avg_daily_pnl = total_pnl / num_active_days if num_active_days else np.nan
 
         # Add more statistics to strategy metrics
         self.strategy_metrics.loc["total_pnl"] = total_pnl
@@ -374,7 +232,7 @@ class PerformanceCTA:
             total_trades = []
             total_holding_periods = []
             total_holding_periods_index = []
-            if self.win_trades:
+            if not self.win_trades_df.empty:
                 self.win_trades_df.to_excel(
                     writer,
                     sheet_name="win_trades",
@@ -391,7 +249,7 @@ class PerformanceCTA:
                 total_holding_periods.append(win_trades_holding_period.T)
                 total_holding_periods_index.append("win_trades")
 
-            if self.loss_trades:
+            if not self.loss_trades_df.empty:
                 self.loss_trades_df.to_excel(
                     writer,
                     sheet_name="loss_trades",
@@ -408,7 +266,7 @@ class PerformanceCTA:
                 total_holding_periods.append(loss_trades_holding_period.T)
                 total_holding_periods_index.append("loss_trades")
 
-            if self.flat_trades:
+            if not self.flat_trades_df.empty:
                 self.flat_trades_df.to_excel(
                     writer,
                     sheet_name="flat_trades",
@@ -431,9 +289,7 @@ class PerformanceCTA:
             )
 
             df = pd.concat(total_trades)
-            df["date"] = df["close_datetime"].apply(
-                lambda x: datetime.strptime(
-                    x, "%Y-%m-%d %H:%M:%S").date())
+            df["date"] = df["close_datetime"].dt.date
             df = df.sort_values(by=['close_datetime'])
 
             df.to_excel(
@@ -442,13 +298,13 @@ class PerformanceCTA:
                 index=False
             )
 
-            if hasattr(self, "win_trades_df"):
+            if not self.win_trades_df.empty:
                 self.win_trades_df.pnl.agg(metrics).to_excel(
                     writer,
                     sheet_name="win_trades_summary",
                 )
 
-            if hasattr(self, "loss_trades_df"):
+            if not self.loss_trades_df.empty:
                 self.loss_trades_df.pnl.agg(metrics).to_excel(
                     writer,
                     sheet_name="loss_trades_summary",
@@ -508,28 +364,19 @@ def plot_pnl(
     Ref: Start, End and Duration of Maximum Drawdown in Python
     (https://stackoverflow.com/questions/22607324/start-end-and-duration-of-maximum-drawdown-in-python)
     """
-    df = pd.read_csv(result_path)
-    df["datetime"] = df["datetime"].apply(lambda dt: max(
-        try_parsing_datetime(x) for x in ast.literal_eval(dt)))
-    df["strategy_portfolio_value"] = df["strategy_portfolio_value"].apply(
-        lambda pv: sum(ast.literal_eval(pv)))
+    df = load_results(result_path).bars.reset_index()
 
     if start is None:
         start = df.iloc[0]["datetime"].to_pydatetime()
     if end is None:
         end = df.iloc[-1]["datetime"].to_pydatetime()
 
-    # Turn into daily pnl
-    # Ref:
-    # https://stackoverflow.com/questions/43009761/pandas-identify-last-row-by-date
+    # Turn into daily pnl (last row of each date)
     if freq == "daily":
-        df["date"] = df["datetime"].apply(lambda x: x.date())
-        last_row_index = df.groupby(df.date,
-                                    as_index=True).apply(lambda g: g.index[-1])
-        df = df.loc[last_row_index.to_list()]
+        df = df[~df["datetime"].dt.normalize().duplicated(keep="last")]
 
     df = df[(df["datetime"] >= start) & (df["datetime"] <= end)]
-    df["datetime"] = df["datetime"].apply(lambda x: str(x))
+    df["datetime"] = df["datetime"].astype(str)
 
     dt = np.array(df['datetime'])
     spv = np.array(df["strategy_portfolio_value"])
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import ast
+import glob
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+RESULT_FIELDS = ("datetime", "portfolio_value", "strategy_portfolio_value", "close", "action")
+FILL_COLUMNS = ["datetime", "gateway", "security", "offset", "side", "position_side", "qty", "price", "no", "row"]
+TRADE_COLUMNS = ["gateway", "security", "side", "open_datetime", "close_datetime", "open_price", "close_price",
+                 "qty"]
+
+
+@dataclass
+class StrategyResults:
+    """Typed results of a run
+
+    bars: index datetime (latest of the gateways), portfolio_value and
+          strategy_portfolio_value (sum of the gateways)
+    close: index datetime, one column per (gateway, security)
+    fills: the actions of the strategy, one row per action (FILL_COLUMNS)
+    """
+    bars: pd.DataFrame
+    close: pd.DataFrame
+    fills: pd.DataFrame
+
+
+def result_parts(result_path: str) -> List[str]:
+    """The Parquet files written by the recorder for the csv `result_path`"""
+    stem = os.path.splitext(result_path)[0]
+    parts = glob.glob(f"{glob.escape(stem)}.parquet") + glob.glob(f"{glob.escape(stem)}.*.parquet")
+    return sorted((p for p in parts if not p.endswith("_annotations.parquet")), key=_part_number)
+
+
+def _part_number(path: str) -> int:
+    m = re.search(r"\.(\d+)\.parquet$", path)
+    return int(m.group(1)) if m else 0
+
+
+def read_result_table(result_path: str) -> pa.Table:
+    """Recorded fields of a run as typed Arrow columns (list per gateway, nested list per security)
+
+    Reads the Parquet files of the recorder when they exist, otherwise parses
+    the csv export (each cell is the python literal of the list).
+    """
+    parts = result_parts(result_path) if result_path.endswith(".csv") else [result_path]
+    parts = [p for p in parts if os.path.exists(p) and p.endswith(".parquet")]
+    if parts:
+        tables = []
+        for part in parts:
+            names = pq.ParquetFile(part).schema_arrow.names
+            tables.append(pq.read_table(part, columns=[f for f in RESULT_FIELDS if f in names]))
+        return pa.concat_tables(tables, promote_options="permissive")
+    df = pd.read_csv(result_path, usecols=lambda c: c in RESULT_FIELDS, dtype=str, keep_default_na=False)
+    columns = {}
+    for field in df.columns:
+        values = [_parse_cell(v) for v in df[field]]
+        if field == "datetime":
+            columns[field] = _to_timestamps(pa.array(values, type=pa.list_(pa.string())))
+        elif field == "action":
+            columns[field] = pa.array(values, type=pa.list_(pa.string()))
+        else:
+            columns[field] = pa.array(values)
+    return pa.table(columns)
+
+
+def _parse_cell(text: str):
+    if text == "":
+        return None
+    try:
+        # 数值/日期列表用 json 解析（比 literal_eval 快很多）
+        return json.loads(text.replace("'", '"'))
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def _to_timestamps(array: pa.ListArray) -> pa.ListArray:
+    values = pc.cast(pc.strptime(array.values, format="%Y-%m-%d %H:%M:%S", unit="us", error_is_null=True),
+                     pa.timestamp("us"))
+    return pa.ListArray.from_arrays(array.offsets, values)
+
+
+def list_element(array, index: int) -> pa.Array:
+    """The `index`-th value of every list (null when the list is shorter)"""
+    array = array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+    if pa.types.is_null(array.type):
+        return array
+    offsets = array.offsets.to_numpy()
+    positions = offsets[:-1] + index
+    valid = (offsets[1:] - offsets[:-1]) > index
+    if array.null_count:
+        valid &= array.is_valid().to_numpy(zero_copy_only=False)
+    values = array.values.take(pa.array(np.where(valid, positions, 0))) if len(array.values) else \
+        pa.nulls(len(array), array.type.value_type)
+    return pc.if_else(pa.array(valid), values, pa.scalar(None, values.type))
+
+
+def _gateway_names(num: int, securities: Dict[str, List[str]] = None) -> List[str]:
+    names = list(securities) if securities else []
+    return names[:num] + [f"gw{i}" for i in range(len(names), num)]
+
+
+def _num_lists(array) -> int:
+    if len(array) == 0 or pa.types.is_null(array.type):
+        return 0
+    return int(pc.max(pc.list_value_length(array)).as_py() or 0)
+
+
+def load_results(result_path: str, securities: Dict[str, List[str]] = None) -> StrategyResults:
+    """Load the results of a run; securities: gateway name -> security codes (in the recorded order)"""
+    table = read_result_table(result_path)
+    dt_col = table["datetime"].combine_chunks()
+    num_gateways = _num_lists(dt_col)
+    gateways = _gateway_names(num_gateways, securities)
+
+    # 各 gateway 的最新时间
+    dt = None
+    for i in range(num_gateways):
+        element = list_element(dt_col, i)
+        dt = element if dt is None else pc.max_element_wise(dt, element)
+    index = pd.DatetimeIndex(dt.to_numpy(zero_copy_only=False) if dt is not None else [], name="datetime")
+
+    bars = pd.DataFrame(index=index)
+    for field in ("portfolio_value", "strategy_portfolio_value"):
+        if field not in table.column_names:
+            continue
+        col = table[field].combine_chunks()
+        total = np.zeros(len(index))
+        for i in range(_num_lists(col)):
+            total += np.nan_to_num(list_element(col, i).to_numpy(zero_copy_only=False).astype(float))
+        bars[field] = total
+
+    close = pd.DataFrame(index=index)
+    if "close" in table.column_names:
+        col = table["close"].combine_chunks()
+        for i, gateway in enumerate(gateways[:_num_lists(col)]):
+            gw_col = list_element(col, i)
+            names = (securities or {}).get(gateway) or []
+            for j in range(_num_lists(gw_col)):
+                security = names[j] if j < len(names) else j
+                close[(gateway, security)] = list_element(gw_col, j).to_numpy(zero_copy_only=False).astype(float)
+        close.columns = pd.MultiIndex.from_tuples(close.columns, names=["gateway", "security"]) \
+            if len(close.columns) else close.columns
+
+    fills = parse_fills(table["action"].combine_chunks(), index, gateways) if "action" in table.column_names \
+        else pd.DataFrame(columns=FILL_COLUMNS)
+    missing = fills["price"].isna().to_numpy()
+    if missing.any() and len(close.columns):
+        # 操作没有记录价格时，用该记录的收盘价
+        columns = pd.Index(close.columns)
+        col_idx = columns.get_indexer(list(zip(fills["gateway"][missing], fills["security"][missing])))
+        row_idx = fills["row"].to_numpy()[missing]
+        found = col_idx >= 0
+        prices = fills["price"].to_numpy().copy()
+        prices[np.flatnonzero(missing)[found]] = close.to_numpy()[row_idx[found], col_idx[found]]
+        fills["price"] = prices
+    return StrategyResults(bars=bars, close=close, fills=fills)
+
+
+def parse_fills(actions: pa.ListArray, index: pd.DatetimeIndex, gateways: List[str]) -> pd.DataFrame:
+    """Actions ("{...}|{...}|" per gateway) -> one row per action (`row` is the position of the record)"""
+    flat = actions.values
+    if len(flat) == 0:
+        return pd.DataFrame(columns=FILL_COLUMNS)
+    # 只解析有操作的记录
+    has_action = pc.fill_null(pc.match_substring(flat, "{"), False).to_numpy(zero_copy_only=False)
+    rows = pc.list_parent_indices(actions).to_numpy()
+    starts = actions.offsets.to_numpy()[:-1]
+    records = []
+    for k in np.flatnonzero(has_action):
+        row = rows[k]
+        gw_idx = k - starts[row]
+        for item in flat[k].as_py().split("|"):
+            if "{" not in item:
+                continue
+            action = ast.literal_eval(item)
+            side = action.get("side")
+            offset = action.get("offset")
+            records.append((
+                index[row],
+                gateways[gw_idx] if gw_idx < len(gateways) else f"gw{gw_idx}",
+                action.get("sec"),
+                offset,
+                side,
+                # 平仓操作的方向与持仓方向相反
+                side if offset != "CLOSE" else ("LONG" if side == "SHORT" else "SHORT"),
+                action.get("qty", 1),
+                action.get("close", action.get("price")),
+                action.get("no"),
+                row,
+            ))
+    fills = pd.DataFrame.from_records(records, columns=FILL_COLUMNS)
+    fills["qty"] = fills["qty"].astype(float)
+    fills["price"] = fills["price"].astype(float)
+    return fills
+
+
+def match_round_trips(fills: pd.DataFrame) -> pd.DataFrame:
+    """Pair the opening and closing fills of each (gateway, security, side) first in, first out
+
+    A closing fill larger than the oldest open fill closes it and continues
+    with the next one, so one fill can be part of several round trips;
+    closing quantities without an open position are ignored.
+    Returns one row per round trip (TRADE_COLUMNS), in the order of the
+    closing fills.
+    """
+    if fills.empty:
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+    keys = fills["gateway"].astype(str) + "\x00" + fills["security"].astype(str) + "\x00" + fills["position_side"]
+    group, _ = pd.factorize(keys)
+    is_open = (fills["offset"] == "OPEN").to_numpy()
+    is_close = (fills["offset"] == "CLOSE").to_numpy()
+    qty = fills["qty"].to_numpy(dtype=float).copy()
+
+    # 没有持仓可平的平仓数量不参与配对：实际平仓的累计数量 = 累计平仓 - 历史最大的超额平仓
+    by_group = pd.Series(group)
+    cum_open = pd.Series(np.where(is_open, qty, 0.0)).groupby(by_group).cumsum()
+    cum_close = pd.Series(np.where(is_close, qty, 0.0)).groupby(by_group).cumsum()
+    excess = (cum_close - cum_open).clip(lower=0).groupby(by_group).cummax()
+    closed = (cum_close - excess).groupby(by_group).diff().fillna(cum_close - excess).to_numpy()
+    qty[is_close] = closed[is_close]
+
+    order = np.arange(len(fills))
+    opens = order[is_open][np.argsort(group[is_open], kind="stable")]
+    closes = order[is_close][np.argsort(group[is_close], kind="stable")]
+
+    num_groups = group.max() + 1
+    open_total = np.bincount(group[opens], weights=qty[opens], minlength=num_groups)
+    close_total = np.bincount(group[closes], weights=qty[closes], minlength=num_groups)
+    matched = np.minimum(open_total, close_total)
+    base = np.concatenate([[0.0], np.cumsum(matched)[:-1]])
+
+    def cumulative_end(idx):
+        # 组内累计数量，截断到可配对的数量，再加上组的起点，得到全局单调的区间终点
+        g = group[idx]
+        cum = np.cumsum(qty[idx])
+        cum -= np.concatenate([[0.0], np.cumsum(np.bincount(g, weights=qty[idx], minlength=num_groups))])[g]
+        return base[g] + np.minimum(cum, matched[g])
+
+    open_end = cumulative_end(opens)
+    close_end = cumulative_end(closes)
+    bounds = np.unique(np.concatenate([[0.0], base, base + matched, open_end, close_end]))
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    keep = (lengths > 1e-9) & (starts < matched.sum() - 1e-9)
+    starts, lengths = starts[keep], lengths[keep]
+    o = opens[np.searchsorted(open_end, starts, side="right")]
+    c = closes[np.searchsorted(close_end, starts, side="right")]
+
+    trades = pd.DataFrame({
+        "gateway": fills["gateway"].to_numpy()[c],
+        "security": fills["security"].to_numpy()[c],
+        "side": fills["position_side"].to_numpy()[c],
+        "open_datetime": fills["datetime"].to_numpy()[o],
+        "close_datetime": fills["datetime"].to_numpy()[c],
+        "open_price": fills["price"].to_numpy()[o],
+        "close_price": fills["price"].to_numpy()[c],
+        "qty": lengths,
+        "_close": c,
+        "_open": o,
+    })
+    trades = trades.sort_values(["_close", "_open"], kind="stable").drop(columns=["_close", "_open"])
+    return trades.reset_index(drop=True)
@@ -1,133 +1,29 @@
 # -*- coding: utf-8 -*-
 
-import threading
 import mariadb
 from datetime import datetime
-from typing import Iterable, List, Dict, Union, Any
-
-import pandas as pd
-import numpy as np
 
 from app.config.configure import config
+from app.plugins.sql_db import SqlDB, DB_POOL_SIZE
 
-lock = threading.Lock()
 
-class DB:
+class DB(SqlDB):
 
-    def __init__(self):
-        self.conn = mariadb.connect(
-                user=config.db.get('user'),
-                password=config.db.get('password'),
-                host=config.db.get('host'),
-                port=config.db.get('port'),
-                database=config.db.get('database')
-            )
-        self.cursor = self.conn.cursor()
+    def __init__(self, pool_size: int = DB_POOL_SIZE):
+        super().__init__(pool_size=pool_size)
         # self.create_balance_table()
         # self.create_position_table()
         # self.create_order_table()
         # self.create_deal_table()
 
-    def close(self):
-        with lock:
-            self.cursor.close()
-            self.conn.close()
-
-    def commit(self):
-        self.conn.commit()
-
-    def execute(self, sql: str, parameters: Iterable = None):
-        with lock:
-            if parameters is None:
-                self.cursor.execute(sql)
-                self.commit()
-                return
-            self.cursor.execute(sql, parameters)
-            self.commit()
-
-    def _parse_sql_value(self, value: Union[str, float, int, datetime]):
-        if isinstance(value, str):
-            return f"\"{value}\""
-        elif (
-            isinstance(value, float)
-            or isinstance(value, int)
-            or isinstance(value, np.int64)
-        ):
-            return f"{value}"
-        elif isinstance(value, datetime):
-            return f"\"{value.strftime('%Y-%m-%d %H:%M:%S')}\""
-        else:
-            raise ValueError(
-                f"Data format is not support! type({value})={type(value)}")
-
-    def _parse_sql_where_condition(self, **kwargs):
-        sql = ""
-        if len(kwargs) > 0:
-            sql += "WHERE "
-        for idx, (k, v) in enumerate(kwargs.items()):
-            if idx != 0:
-                sql += "AND "
-            if k == "condition_str":  # all non "=" conditions
-                sql += f"{v} "
-            else:
-                sql += f"{k}={self._parse_sql_value(v)} "
-        return sql
-
-    def delete_table(self, table_name: str):
-        sql = f"DROP TABLE {table_name}"
-        self.execute(sql)
-
-    def select_records(
-            self,
-            table_name: str,
-            columns: List[str] = None,
-            **kwargs
-    ):
-        if columns is None:
-            columns = "*"
-        else:
-            columns = ",".join(columns)
-        sql = f"SELECT {columns} FROM {table_name} "
-        sql += self._parse_sql_where_condition(**kwargs)
-        self.execute(sql)
-        with lock:
-            data = self.cursor.fetchall()
-            return pd.DataFrame(
-                data,
-                columns=[d[0] for d in self.cursor.description])
-
-    def update_records(
-            self,
-            table_name: str,
-            columns: Dict[str, Any],
-            **kwargs
-    ):
-        assert len(columns) > 0, "At least one column needs to be updated!"
-        sql = f"UPDATE {table_name} "
-        for idx, (k, v) in enumerate(columns.items()):
-            if idx == 0:
-                sql += "SET "
-            sql += f"{k}={self._parse_sql_value(v)} "
-            if idx != len(columns) - 1:
-                sql += ","
-        sql += self._parse_sql_where_condition(**kwargs)
-        self.execute(sql)
-
-    def insert_records(self, table_name: str, **kwargs):
-        assert len(kwargs) > 0, (
-            "Must provide columns and values when inserting!"
+    def _connect(self):
+        return mariadb.connect(
+            user=config.db.get('user'),
+            password=config.db.get('password'),
+            host=config.db.get('host'),
+            port=config.db.get('port'),
+            database=config.db.get('database')
         )
-        sql = f"INSERT INTO {table_name} ("
-        sql += ",".join(kwargs.keys())
-        sql += ") VALUES ("
-        sql += ",".join([self._parse_sql_value(v) for v in kwargs.values()])
-        sql += ")"
-        self.execute(sql)
-
-    def delete_records(self, table_name: str, **kwargs):
-        sql = (f"DELETE FROM {table_name} "
-               f"{self._parse_sql_where_condition(**kwargs)}")
-        self.execute(sql)
 
     def create_balance_table(self):
         sql = (
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DB_POOL_SIZE = 8
+# 等待空闲连接的最长时间（秒），以及期间检查已结束线程连接的间隔
+DB_ACQUIRE_TIMEOUT = 30
+DB_RECLAIM_INTERVAL = 1
+
+
+class SqlDB:
+    """Base class of the sql plugins (mariadb/sqlite3)
+
+    Connections are taken from a pool of at most `pool_size` connections for
+    one statement, or for a whole `transaction`, and given back right after,
+    so threads never share a cursor, there is no process-wide lock and the
+    number of threads is not bounded by the pool. A thread waits at most
+    `acquire_timeout` seconds for a connection (TimeoutError); connections
+    of threads that died in a transaction are reclaimed while waiting.
+
+    All values are sent as statement parameters (no string interpolation);
+    `condition_str` is the only raw sql fragment, for non "=" conditions.
+    """
+
+    placeholder = "?"
+
+    def __init__(self, pool_size: int = DB_POOL_SIZE, acquire_timeout: float = DB_ACQUIRE_TIMEOUT):
+        assert pool_size > 0, f"pool_size should be positive, got {pool_size}"
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self._local = threading.local()
+        self._pool_cv = threading.Condition()
+        self._idle: List[Any] = []
+        self._owners: Dict[int, Tuple[Any, threading.Thread]] = {}  # id(conn) -> (conn, thread)
+        self._connecting = 0  # connections being created (outside the lock)
+
+    def _connect(self):
+        """Create a new DB-API connection"""
+        raise NotImplementedError("[_connect] has not been implemented")
+
+    def _acquire(self):
+        deadline = monotonic() + self.acquire_timeout
+        with self._pool_cv:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._owners[id(conn)] = (conn, threading.current_thread())
+                    return conn
+                if len(self._owners) + self._connecting < self.pool_size:
+                    self._connecting += 1
+                    break
+                if self._reclaim():
+                    continue
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No DB connection available within {self.acquire_timeout}s "
+                        f"(pool_size={self.pool_size})")
+                self._pool_cv.wait(min(remaining, DB_RECLAIM_INTERVAL))
+        # 建立连接可能较慢，不占用锁
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._pool_cv:
+                self._connecting -= 1
+                self._pool_cv.notify()
+            raise
+        with self._pool_cv:
+            self._connecting -= 1
+            self._owners[id(conn)] = (conn, threading.current_thread())
+        return conn
+
+    def _reclaim(self) -> bool:
+        """Put back the connections of finished threads (with _pool_cv held)"""
+        dead = [key for key, (_, thread) in self._owners.items() if not thread.is_alive()]
+        for key in dead:
+            conn, _ = self._owners.pop(key)
+            try:
+                conn.rollback()
+                self._idle.append(conn)
+            except Exception:
+                # the connection is broken, a new one will be created
+                pass
+        return len(dead) > 0
+
+    def _release(self, conn):
+        with self._pool_cv:
+            if self._owners.pop(id(conn), None) is not None:
+                self._idle.append(conn)
+                self._pool_cv.notify()
+
+    @contextmanager
+    def _connection(self):
+        """Connection of the current transaction, or one from the pool for
+        the duration of the block"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Close all connections of the pool"""
+        with self._pool_cv:
+            conns = self._idle + [conn for conn, _ in self._owners.values()]
+            self._idle, self._owners = [], {}
+            self._pool_cv.notify_all()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run(self, sql: str, parameters: Sequence = None, fetch: bool = False):
+        """Execute one statement; return (columns, rows) if `fetch`"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if parameters is None:
+                    cursor.execute(sql)
+                else:
+                    cursor.execute(sql, tuple(_adapt(v) for v in parameters))
+                result = None
+                if fetch:
+                    rows = cursor.fetchall()
+                    columns = [d[0] for d in cursor.description] if cursor.description else []
+                    result = (columns, rows)
+            finally:
+                cursor.close()
+            if getattr(self._local, "conn", None) is None:
+                conn.commit()
+        return result
+
+    def execute(self, sql: str, parameters: Sequence = None):
+        """Execute one statement (committed at once outside a transaction)"""
+        self._run(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Sequence]):
+        """Execute one statement for many rows (sent as one bulk request)"""
+        rows = [tuple(_adapt(v) for v in row) for row in seq_of_parameters]
+        if not rows:
+            return
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(sql, rows)
+            finally:
+                cursor.close()
+            if getattr(self._local, "conn", None) is None:
+                conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        """Statements executed in the block (by this thread) use one
+        connection and are committed together, or rolled back if any of
+        them fails"""
+        if getattr(self._local, "conn", None) is not None:
+            # nested: joins the outer transaction
+            yield self
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield self
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def query(self, sql: str, parameters: Sequence = None) -> pd.DataFrame:
+        """Run a select statement and return the rows as a DataFrame"""
+        columns, data = self._fetch(sql, parameters)
+        return pd.DataFrame.from_dict(
+            {c: values for c, values in zip(columns, data)}) if columns else pd.DataFrame()
+
+    def query_columns(self, sql: str, parameters: Sequence = None) -> Dict[str, np.ndarray]:
+        """Run a select statement and return one numpy array per column"""
+        columns, data = self._fetch(sql, parameters)
+        return {c: np.asarray(values) for c, values in zip(columns, data)}
+
+    def _fetch(self, sql: str, parameters: Sequence = None) -> Tuple[List[str], List[list]]:
+        columns, rows = self._run(sql, parameters, fetch=True)
+        data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        return columns, data
+
+    def _parse_sql_where_condition(self, **kwargs) -> Tuple[str, list]:
+        conditions, parameters = [], []
+        for k, v in kwargs.items():
+            if k == "condition_str":  # all non "=" conditions
+                conditions.append(v)
+            else:
+                conditions.append(f"{k}={self.placeholder}")
+                parameters.append(v)
+        if not conditions:
+            return "", parameters
+        return "WHERE " + " AND ".join(conditions), parameters
+
+    def delete_table(self, table_name: str):
+        sql = f"DROP TABLE {table_name}"
+        self.execute(sql)
+
+    def select_records(
+            self,
+            table_name: str,
+            columns: List[str] = None,
+            **kwargs
+    ) -> pd.DataFrame:
+        columns = "*" if columns is None else ",".join(columns)
+        where, parameters = self._parse_sql_where_condition(**kwargs)
+        return self.query(f"SELECT {columns} FROM {table_name} {where}", parameters)
+
+    def update_records(
+            self,
+            table_name: str,
+            columns: Dict[str, Any],
+            **kwargs
+    ):
+        assert len(columns) > 0, "At least one column needs to be updated!"
+        where, parameters = self._parse_sql_where_condition(**kwargs)
+        sql = (f"UPDATE {table_name} "
+               f"SET {','.join(f'{k}={self.placeholder}' for k in columns)} {where}")
+        self.execute(sql, list(columns.values()) + parameters)
+
+    def insert_records(self, table_name: str, **kwargs):
+        assert len(kwargs) > 0, (
+            "Must provide columns and values when inserting!"
+        )
+        self.insert_many(table_name, list(kwargs.keys()), [list(kwargs.values())])
+
+    def delete_records(self, table_name: str, **kwargs):
+        where, parameters = self._parse_sql_where_condition(**kwargs)
+        self.execute(f"DELETE FROM {table_name} {where}", parameters)
+
+    def insert_many(self, table_name: str, columns: List[str], rows: Iterable[Sequence]):
+        """Insert rows (values in the order of `columns`)"""
+        sql = (f"INSERT INTO {table_name} ({','.join(columns)}) "
+               f"VALUES ({','.join([self.placeholder] * len(columns))})")
+        self.executemany(sql, rows)
+
+    def update_many(
+            self,
+            table_name: str,
+            columns: List[str],
+            keys: List[str],
+            rows: Iterable[Sequence]
+    ):
+        """Update rows; each row holds the values of `columns` followed by the
+        values of `keys` (the where condition)"""
+        assert len(columns) > 0, "At least one column needs to be updated!"
+        sql = (f"UPDATE {table_name} SET {','.join(f'{c}={self.placeholder}' for c in columns)} "
+               f"WHERE {' AND '.join(f'{k}={self.placeholder}' for k in keys)}")
+        self.executemany(sql, rows)
+
+    def delete_many(self, table_name: str, keys: List[str], rows: Iterable[Sequence]):
+        """Delete rows; each row holds the values of `keys`"""
+        sql = (f"DELETE FROM {table_name} "
+               f"WHERE {' AND '.join(f'{k}={self.placeholder}' for k in keys)}")
+        self.executemany(sql, rows)
+
+
+def _adapt(value: Any) -> Any:
+    """Python value accepted by the db drivers"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError(
+        f"Data format is not support! type({value})={type(value)}")
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, Sequence, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from app.constants import TradeMarket, TradeMode
+from app.domain.balance import AccountBalance
+from app.domain.engine import Engine
+from app.domain.event_engine import BarEventEngineRecorder, BarEventEngine
+from app.domain.position import Position
+from app.domain.security import Security
+from app.gateways import BacktestGateway, BacktestFees
+from app.plugins.analysis.metrics import sharpe_ratio
+from app.strategies.base_strategy import BaseStrategy
+from app.utils import logger
+
+SWEEP_RESULT_FILE = "sweep.jsonl"  # 每完成一组参数追加一行，用于断点续跑
+SWEEP_TABLE_FILE = "sweep.csv"
+
+
+class SharedFrame:
+    """Columns of a DataFrame in shared memory
+
+    The market data is loaded once by the parent process; worker processes
+    attach to the blocks instead of loading (or unpickling) their own copy.
+    Non numeric columns (e.g. code) are stored as integer codes.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self.spec: List[Tuple[str, str, str, int, list]] = []
+        try:
+            for col in data.columns:
+                values = data[col].to_numpy()
+                categories = None
+                if values.dtype.kind == "M":
+                    values = values.astype("datetime64[ns]")
+                elif values.dtype.kind not in "biuf":
+                    values, categories = pd.factorize(values)
+                    categories = list(categories)
+                shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                self._blocks.append(shm)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+                self.spec.append((col, shm.name, values.dtype.str, len(values), categories))
+        except BaseException:
+            self.unlink()
+            raise
+
+    @staticmethod
+    def attach(spec: List[Tuple[str, str, str, int, list]]) -> Tuple[pd.DataFrame, List[shared_memory.SharedMemory]]:
+        """DataFrame backed by the shared blocks; the blocks must be kept
+        alive (returned) as long as the DataFrame is used"""
+        blocks, columns = [], {}
+        for col, name, dtype, n, categories in spec:
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            values = np.ndarray((n,), dtype=np.dtype(dtype), buffer=shm.buf)
+            values.flags.writeable = False
+            if categories is not None:
+                values = np.asarray(categories, dtype=object)[values]
+            columns[col] = values
+        return pd.DataFrame(columns, copy=False), blocks
+
+    def unlink(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+
+def make_run_id(params: Dict[str, Any]) -> str:
+    """Stable id of a parameter combination"""
+    key = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def expand_grid(param_grid: Dict[str, Sequence]) -> List[Dict[str, Any]]:
+    """All combinations of the parameter grid"""
+    names = list(param_grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[param_grid[n] for n in names])]
+
+
+class ParameterSweep:
+    """Run one event-driven backtest per parameter combination in a process pool
+
+    Every run builds its own BacktestGateway/Engine/strategy/BarEventEngine,
+    applies the parameters with `strategy.set_parameters` and records the
+    results; the market data is loaded once and shared by all workers.
+    Finished runs are appended to `<result_path>/sweep.jsonl`, so an
+    interrupted sweep resumes with the remaining combinations.
+    """
+
+    def __init__(
+            self,
+            strategy_cls: Type[BaseStrategy],
+            param_grid: Dict[str, Sequence],
+            securities: List[Security],
+            start: datetime,
+            end: datetime,
+            result_path: str,
+            gateway_name: str = "Backtest",
+            trade_market: TradeMarket = TradeMarket.US,
+            init_capital: float = 10000,
+            trading_sessions: Dict[str, List] = None,
+            processes: int = None,
+    ):
+        assert len(param_grid) > 0, "param_grid should not be empty"
+        self.strategy_cls = strategy_cls
+        self.param_grid = param_grid
+        self.securities = securities
+        self.start = start
+        self.end = end
+        self.result_path = result_path
+        self.gateway_name = gateway_name
+        self.trade_market = trade_market
+        self.init_capital = init_capital
+        self.trading_sessions = trading_sessions
+        self.processes = processes or os.cpu_count()
+
+    def load_data(self) -> pd.DataFrame:
+        from app.domain.stores.security_market_storer import SecurityMarketStorer
+        storer = SecurityMarketStorer(local=False)
+        return storer.get_kline_data(self.securities, start=self.start, end=self.end)
+
+    def finished_runs(self) -> Dict[str, dict]:
+        """Results of the runs already done (from a previous, maybe interrupted, sweep)"""
+        done = {}
+        path = os.path.join(self.result_path, SWEEP_RESULT_FILE)
+        if not os.path.exists(path):
+            return done
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时写了一半的行
+                    continue
+                if row.get("error") is None:
+                    done[row["run_id"]] = row
+        return done
+
+    def run(self, data: pd.DataFrame = None) -> pd.DataFrame:
+        """Run the sweep and return the comparison table (one row per run)"""
+        os.makedirs(self.result_path, exist_ok=True)
+        done = self.finished_runs()
+        tasks = []
+        for params in expand_grid(self.param_grid):
+            run_id = make_run_id(params)
+            if run_id not in done:
+                tasks.append((run_id, params))
+        logger.info(f"[sweep] {len(done)} runs done, {len(tasks)} to run with {self.processes} processes")
+
+        if tasks:
+            if data is None:
+                data = self.load_data()
+            shared = SharedFrame(data)
+            try:
+                self._run_tasks(tasks, shared.spec, done)
+            finally:
+                shared.unlink()
+
+        table = pd.DataFrame(list(done.values()))
+        if not table.empty:
+            table = table.drop(columns=["params", "error"])
+            table = table.sort_values("sharpe_ratio", ascending=False, na_position="last", ignore_index=True)
+        table.to_csv(os.path.join(self.result_path, SWEEP_TABLE_FILE), index=False)
+        return table
+
+    def _run_tasks(self, tasks: List[Tuple[str, dict]], spec: list, done: Dict[str, dict]):
+        settings = dict(
+            strategy_cls=self.strategy_cls,
+            securities=self.securities,
+            start=self.start,
+            end=self.end,
+            result_path=self.result_path,
+            gateway_name=self.gateway_name,
+            trade_market=self.trade_market,
+            init_capital=self.init_capital,
+            trading_sessions=self.trading_sessions,
+        )
+        processes = min(self.processes, len(tasks))
+        with open(os.path.join(self.result_path, SWEEP_RESULT_FILE), "a", encoding="utf-8") as f, \
+                get_context().Pool(processes, initializer=_init_worker, initargs=(spec, settings)) as pool:
+            # 每个任务是一次完整回测，chunksize=1 让空闲进程立刻取下一个任务
+            for row in pool.imap_unordered(_run_backtest, tasks, chunksize=1):
+                f.write(json.dumps(row, default=str) + "\n")
+                f.flush()
+                if row.get("error") is None:
+                    done[row["run_id"]] = row
+                    logger.info(f"[sweep] {row['run_id']} {row['params']} "
+                                f"return={row['total_return']:.4f} sharpe={row['sharpe_ratio']:.4f}")
+                else:
+                    logger.error(f"[sweep] {row['run_id']} {row['params']} failed: {row['error']}")
+
+
+# 工作进程的状态（每个进程初始化一次）
+_worker = {}
+
+
+def _init_worker(spec: list, settings: dict):
+    data, blocks = SharedFrame.attach(spec)
+    _worker.update(data=data, blocks=blocks, settings=settings)
+
+
+def _run_backtest(task: Tuple[str, dict]) -> dict:
+    run_id, params = task
+    row = {"run_id": run_id, "params": params, "error": None}
+    start_time = time.perf_counter()
+    try:
+        row.update(_backtest(run_id, params, **_worker["settings"]))
+    except Exception as e:
+        logger.exception(f"[sweep] run {run_id} failed")
+        row["error"] = repr(e)
+    row["elapsed"] = time.perf_counter() - start_time
+    row.update({f"param_{k}": v for k, v in params.items()})
+    return row
+
+
+def _backtest(
+        run_id: str,
+        params: dict,
+        strategy_cls: Type[BaseStrategy],
+        securities: List[Security],
+        start: datetime,
+        end: datetime,
+        result_path: str,
+        gateway_name: str,
+        trade_market: TradeMarket,
+        init_capital: float,
+        trading_sessions: Dict[str, List],
+) -> dict:
+    # 每次回测使用新的事件循环，避免上一次回测遗留的任务
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        data = _worker["data"]
+        gateway_kwargs = {} if trading_sessions is None else {"trading_sessions": trading_sessions}
+        gateway = BacktestGateway(
+            securities=securities,
+            trade_market=trade_market,
+            gateway_name=gateway_name,
+            fees=BacktestFees,
+            start=start,
+            end=end,
+            data=data,
+            **gateway_kwargs
+        )
+        gateway.SHORT_INTEREST_RATE = 0.0
+        gateway.trade_mode = TradeMode.BACKTEST
+        engine = Engine(gateways={gateway_name: gateway})
+
+        strategy_account = strategy_cls.__name__
+        strategy = strategy_cls(
+            securities={gateway_name: securities},
+            strategy_account=strategy_account,
+            strategy_version=run_id,
+            init_strategy_account_balance={gateway_name: AccountBalance(cash=init_capital)},
+            init_strategy_position={gateway_name: Position()},
+            engine=engine,
+        )
+        strategy.set_parameters(**params)
+        init_params = inspect.signature(strategy.init_strategy).parameters
+        if "start" in init_params and "end" in init_params:
+            strategy.init_strategy(start=start, end=end)
+        else:
+            strategy.init_strategy()
+        engine.update_strategy(strategy.strategy_account, strategy.strategy_version)
+
+        run_path = os.path.join(result_path, "runs", run_id)
+        recorder = BarEventEngineRecorder(path=run_path, datetime=[], action=[], open=[], high=[], low=[], close=[],
+                                          volume=[])
+        event_engine = BarEventEngine(
+            strategies={strategy_account: strategy},
+            recorders={strategy_account: recorder},
+            engine=engine,
+            backtest_data=data,
+        )
+        event_engine.run_backtest()
+
+        result = _summarize(recorder)
+        result["num_deals"] = len(gateway.deals)
+        result["result_file"] = recorder.save_csv()
+        return result
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def _summarize(recorder: BarEventEngineRecorder) -> dict:
+    """Performance metrics of a recorded run"""
+    # recorder 的每条记录是各 gateway 的值列表
+    pv = recorder.column("strategy_portfolio_value", 0).to_numpy(dtype=float)
+    actions = recorder.column("action", 0).tolist()
+    if len(pv) == 0 or pv[0] == 0:
+        return dict(final_value=np.nan, total_return=np.nan, sharpe_ratio=np.nan, max_drawdown=np.nan,
+                    num_bars=len(pv), num_actions=0)
+    returns = pv[1:] / pv[:-1] - 1
+    drawdown = pv / np.maximum.accumulate(pv) - 1
+    return dict(
+        final_value=float(pv[-1]),
+        total_return=float(pv[-1] / pv[0] - 1),
+        sharpe_ratio=float(sharpe_ratio(returns)) if len(returns) > 1 else np.nan,
+        max_drawdown=float(drawdown.min()),
+        num_bars=len(pv),
+        num_actions=sum(1 for a in actions if a),
+    )
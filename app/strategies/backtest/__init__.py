@@ -1,5 +1,7 @@
 from .vec_backtest import (data_feed,trade_indicators,trade_performance,
                            start_backtest,MR_Strategy,North_Strategy,
-                           TT_strategy)
+                           TT_strategy,performance_table,successive_counts)
+from .panel_backtest import (PanelBacktestResult,panel_backtest,panel_performance,
+                             panel_trades,panel_trade_stats,target_weights)
 
-from .turtle import *
\ No newline at end of file
+from .turtle import *
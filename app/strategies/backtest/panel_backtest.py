@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""多标的向量化回测
+
+价格和信号都是 (日期 × 标的) 的二维数组，所有标的同时计算，没有逐行/逐标的的 Python 循环。
+信号的含义与 vec_backtest 中的单标的策略一致：1 持有，0 空仓，NaN 保持前一个信号；
+当天的信号在下一根 bar 执行（position = signal.shift(1)）。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from app.strategies.backtest.vec_backtest import performance_table, successive_counts
+
+
+@dataclass
+class PanelBacktestResult:
+    weights: pd.DataFrame  # 每个标的的持仓权重
+    asset_returns: pd.DataFrame  # 每个标的对组合收益的贡献（已扣除交易成本）
+    returns: pd.Series  # 组合每日收益率
+    turnover: pd.Series  # 每日换手（权重变化绝对值之和）
+    close: pd.DataFrame
+    open: pd.DataFrame = None
+
+    @property
+    def capital_line(self) -> pd.Series:
+        return (self.returns + 1.0).cumprod()
+
+
+def _as_array(values, index=None, columns=None) -> np.ndarray:
+    if isinstance(values, pd.DataFrame):
+        if index is not None:
+            values = values.reindex(index=index, columns=columns)
+        return values.to_numpy(dtype=float)
+    return np.asarray(values, dtype=float)
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Forward fill NaN along the rows (dates)"""
+    n = values.shape[0]
+    idx = np.where(np.isnan(values), 0, np.arange(n)[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = values[idx, np.arange(values.shape[1])]
+    return filled
+
+
+def target_weights(
+        signal: np.ndarray,
+        tradable: np.ndarray,
+        max_weight: float = 1.0,
+        max_positions: int = None
+) -> np.ndarray:
+    """Target weights from the (forward filled) signals
+
+    Positive signals are the raw weights; they are normalized to sum to 1 per
+    date, each weight is capped by `max_weight` (the rest stays in cash), and
+    only the `max_positions` largest signals are kept.
+    """
+    raw = np.where(tradable, np.nan_to_num(np.clip(signal, 0, None)), 0.0)
+    if max_positions is not None and max_positions < raw.shape[1]:
+        # 每个日期只保留信号最强的 max_positions 个标的（相同信号按列顺序）
+        order = np.argsort(-raw, axis=1, kind="stable")
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(raw.shape[1])[None, :].repeat(raw.shape[0], axis=0), axis=1)
+        raw = np.where(rank < max_positions, raw, 0.0)
+    total = raw.sum(axis=1, keepdims=True)
+    weights = np.divide(raw, total, out=np.zeros_like(raw), where=total > 0)
+    return np.minimum(weights, max_weight)
+
+
+def panel_backtest(
+        close,
+        signal,
+        open=None,
+        cost: float = 0.0,
+        max_weight: float = 1.0,
+        max_positions: int = None,
+        rebalance: int = 1,
+) -> PanelBacktestResult:
+    """Vectorized backtest of a (date × security) panel
+
+    close/open/signal: DataFrames (index=dates, columns=codes) or 2-D arrays
+        of the same shape; NaN prices mean the security is not tradable.
+    open: if given, orders are filled at the next open (like MR_Strategy),
+        otherwise at the close when the signal is generated (like TT_strategy).
+    cost: cost per unit of turnover (weight bought or sold).
+    max_weight/max_positions: position limits, see `target_weights`.
+    rebalance: weights are only changed every `rebalance` bars.
+
+    With one security, 0/1 signals and cost=0, the returns are the same as
+    `capital_ret` of the single security strategies in vec_backtest.
+    """
+    assert rebalance >= 1, f"rebalance should be >= 1, got {rebalance}"
+    index = columns = None
+    if isinstance(close, pd.DataFrame):
+        index, columns = close.index, close.columns
+    else:
+        close = np.asarray(close, dtype=float)
+        index, columns = pd.RangeIndex(close.shape[0]), pd.RangeIndex(close.shape[1])
+    c = _as_array(close)
+    s = _as_array(signal, index, columns) if isinstance(signal, pd.DataFrame) else _as_array(signal)
+    o = None
+    if open is not None:
+        o = _as_array(open, index, columns) if isinstance(open, pd.DataFrame) else _as_array(open)
+    assert s.shape == c.shape and (o is None or o.shape == c.shape), (
+        f"close{c.shape}, signal{s.shape} and open{None if o is None else o.shape} should have the same shape")
+
+    tradable = ~np.isnan(c)
+    target = target_weights(_ffill(s), tradable, max_weight=max_weight, max_positions=max_positions)
+    if rebalance > 1:
+        # 非调仓日沿用上一个调仓日的权重
+        held = np.full_like(target, np.nan)
+        held[::rebalance] = target[::rebalance]
+        target = np.nan_to_num(_ffill(held))
+    # 当天的信号在下一根 bar 执行
+    weights = np.zeros_like(target)
+    weights[1:] = target[:-1]
+    weights = np.where(tradable, weights, 0.0)
+    prev = np.zeros_like(weights)
+    prev[1:] = weights[:-1]
+
+    prev_close = np.full_like(c, np.nan)
+    prev_close[1:] = c[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rets = np.nan_to_num(c / prev_close - 1)
+        if o is None:
+            asset = weights * rets
+        else:
+            # 继续持有的部分按收盘价计算收益，新买入的部分从开盘价开始，卖出的部分在开盘价卖出
+            intraday = np.nan_to_num(c / o - 1)
+            overnight = np.nan_to_num(o / prev_close - 1)
+            asset = (np.minimum(prev, weights) * rets
+                     + np.clip(weights - prev, 0, None) * intraday
+                     + np.clip(prev - weights, 0, None) * overnight)
+    trades = np.abs(weights - prev)
+    asset -= cost * trades
+
+    return PanelBacktestResult(
+        weights=pd.DataFrame(weights, index=index, columns=columns),
+        asset_returns=pd.DataFrame(asset, index=index, columns=columns),
+        returns=pd.Series(asset.sum(axis=1), index=index, name="capital_ret"),
+        turnover=pd.Series(trades.sum(axis=1), index=index, name="turnover"),
+        close=pd.DataFrame(c, index=index, columns=columns),
+        open=None if o is None else pd.DataFrame(o, index=index, columns=columns),
+    )
+
+
+def panel_performance(result: PanelBacktestResult, index_rets: pd.Series) -> pd.DataFrame:
+    """The metrics of `trade_performance` for the benchmark, the equally
+    weighted buy & hold of all securities and the strategy"""
+    close = result.close
+    buy_hold = (close / close.shift(1) - 1).mean(axis=1).fillna(0)
+    rets = pd.DataFrame({
+        "index": index_rets.reindex(result.returns.index).fillna(0),
+        "rets": buy_hold,
+        "capital_ret": result.returns,
+    })
+    table = performance_table(rets, "index")
+    return table.T.rename(columns={"index": "基准指数", "rets": "买入持有", "capital_ret": "交易策略"})
+
+
+def panel_trades(result: PanelBacktestResult, cost: float = 0.0) -> pd.DataFrame:
+    """Round trips of every security (from buying to selling all of it)
+
+    trade_return is the price return between the fills minus the round trip
+    cost, stock_return the close to close return over the same period.
+    """
+    w = result.weights.to_numpy()
+    c = result.close.to_numpy()
+    o = None if result.open is None else result.open.to_numpy()
+    holding = w > 0
+    prev = np.zeros_like(holding)
+    prev[1:] = holding[:-1]
+    # 按 (标的, 日期) 排序，同一标的的买入/卖出交替出现
+    entry_col, entry_row = np.nonzero((holding & ~prev).T)
+    exit_col, exit_row = np.nonzero((~holding & prev).T)
+    # 回测结束时仍持有的不算完整交易
+    still_open = holding[-1]
+    last_entry = np.r_[entry_col[1:] != entry_col[:-1], True]
+    keep = ~(still_open[entry_col] & last_entry)
+    entry_col, entry_row = entry_col[keep], entry_row[keep]
+    assert len(entry_col) == len(exit_col), "entries and exits are not paired"
+
+    prev_close = np.full_like(c, np.nan)
+    prev_close[1:] = c[:-1]
+    if o is None:
+        entry_px, exit_px = prev_close[entry_row, entry_col], prev_close[exit_row, exit_col]
+    else:
+        entry_px, exit_px = o[entry_row, entry_col], o[exit_row, exit_col]
+    dates = result.weights.index
+    trades = pd.DataFrame({
+        "code": result.weights.columns[entry_col],
+        "start_date": dates[entry_row],
+        "end_date": dates[exit_row],
+        "trade_return": exit_px / entry_px - 1 - 2 * cost,
+        "stock_return": c[exit_row, exit_col] / prev_close[entry_row, entry_col] - 1,
+    })
+    if isinstance(dates, pd.DatetimeIndex):
+        trades["hold_time"] = (trades["end_date"] - trades["start_date"]).dt.days
+    else:
+        trades["hold_time"] = exit_row - entry_row
+    return trades
+
+
+def panel_trade_stats(trades: pd.DataFrame) -> pd.DataFrame:
+    """The trade metrics of `trade_indicators`, per security"""
+    if trades.empty:
+        return pd.DataFrame()
+    trades = trades.sort_values(["code", "start_date"], kind="stable", ignore_index=True)
+    gain = np.where(trades["trade_return"] > 0, 1.0, np.where(trades["trade_return"] < 0, 0.0, np.nan))
+    gain = pd.Series(gain).groupby(trades["code"]).ffill().to_numpy()
+    successive = successive_counts(gain, groups=trades["code"].to_numpy())
+    trades = trades.assign(gain=gain, successive_gain=successive)
+
+    grouped = trades.groupby("code", sort=False)
+    stats = pd.DataFrame({
+        "trade_num": grouped.size(),
+        "max_holdtime": grouped["hold_time"].max(),
+        "average_change": grouped["trade_return"].mean(),
+        "max_gain": grouped["trade_return"].max(),
+        "max_loss": grouped["trade_return"].min(),
+    })
+    years = (grouped["end_date"].max() - grouped["start_date"].min())
+    if pd.api.types.is_timedelta64_dtype(years):
+        years = years.dt.days / 365
+    stats["trade_per_year"] = stats["trade_num"] / years.replace(0, np.nan)
+    stats["max_successive_gain"] = trades[trades["gain"] == 1].groupby("code")["successive_gain"].max()
+    stats["max_successive_loss"] = trades[trades["gain"] == 0].groupby("code")["successive_gain"].max()
+    return stats
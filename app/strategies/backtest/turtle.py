@@ -3,7 +3,7 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from copy import deepcopy, copy
+from copy import copy
 from app.facade.trade import get_data
 
 
@@ -152,8 +152,9 @@ class TurtleSystem:
     def _calc_N(self):
         # Calculates N for all codes
         for t in self.codes:
-            tr = self.data[t].apply(
-                lambda x: calcTR(x['high'], x['low'], x['close']), axis=1)
+            # 与 calcTR 相同（逐行计算），按列向量化
+            high, low, close = self.data[t]['high'], self.data[t]['low'], self.data[t]['close']
+            tr = np.maximum(np.abs(high - low), np.abs(close - low))
             self.data[t, 'N'] = tr.rolling(self.atr_periods).mean()
 
     def _check_cash_balance(self, shares, price):
@@ -295,11 +296,17 @@ class TurtleSystem:
                         {t: None for t in self.codes}
                     for s in self.sys_list}
 
-        for i, (ts, row) in enumerate(self.data.iterrows()):
+        # 每个标的的列预先转成 numpy 数组按行号取值，避免 iterrows 为每一行构造 Series
+        columns = {t: {col: self.data[t][col].to_numpy() for col in self.data[t].columns}
+                   for t in self.codes}
+        for i, ts in enumerate(self.data.index):
             for t in self.codes:
+                row = {col: values[i] for col, values in columns[t].items()}
                 for s, system in enumerate(self.sys_list):
-                    position[system][t] = self._run_system(t, row[t], position[system][t])
-            self.portfolio[i] = deepcopy(position)
+                    position[system][t] = self._run_system(t, row, position[system][t])
+            # 头寸只包含标量，浅拷贝每个头寸即可（等同于 deepcopy）
+            self.portfolio[i] = {system: {t: None if p is None else dict(p) for t, p in v.items()}
+                                 for system, v in position.items()}
             self.portfolio[i]['date'] = ts
             self.portfolio[i]['cash'] = copy(self.cash)
             self.portfolio_value = self._calc_portfolio_value(self.portfolio[i])
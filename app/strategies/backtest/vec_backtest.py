@@ -16,7 +16,7 @@ from app.facade.trade import get_data
 # 获取数据
 def data_feed(code, index='hs300', start='20000101', end='', fqt=2):
     # 获取个股数据
-    df = get_data(code, start=start, end=end, fqt=fqt).fillna(method='ffill')
+    df = get_data(code, start=start, end=end, fqt=fqt).ffill()
     # 指数数据,作为参照指标
     df['index'] = get_data(index, start, end).close.pct_change().fillna(0)
     # 计算收益率
@@ -68,22 +68,9 @@ def trade_indicators(df):
     # 计算连续盈利亏损的次数
     trade.loc[trade['trade_return'] > 0, 'gain'] = 1
     trade.loc[trade['trade_return'] < 0, 'gain'] = 0
-    trade['gain'].fillna(method='ffill', inplace=True)
-    # 根据gain这一列计算连续盈利亏损的次数
-    rtn_list = list(trade['gain'])
-    successive_gain_list = []
-    num = 1
-    for i in range(len(rtn_list)):
-        if i == 0:
-            successive_gain_list.append(num)
-        else:
-            if (rtn_list[i] == rtn_list[i - 1] == 1) or (rtn_list[i] == rtn_list[i - 1] == 0):
-                num += 1
-            else:
-                num = 1
-            successive_gain_list.append(num)
-    # 将计算结果赋给新的一列'successive_gain'
-    trade['successive_gain'] = successive_gain_list
+    trade['gain'] = trade['gain'].ffill()
+    # 根据gain这一列计算连续盈利亏损的次数，并赋给新的一列'successive_gain'
+    trade['successive_gain'] = successive_counts(trade['gain'].to_numpy())
     # 分别在盈利和亏损的两个dataframe里按照'successive_gain'的值排序并取最大值
     max_successive_gain = trade[trade['gain'] == 1].sort_values(by='successive_gain', \
                                                                 ascending=False)['successive_gain'].iloc[0]
@@ -102,50 +89,59 @@ def trade_indicators(df):
     return trade
 
 
-def trade_performance(df, plot=True):
-    if 'capital_ret' in df.columns:
-        df1 = df.loc[:, ['index', 'rets', 'capital_ret']]
-        name_dict = {'index': '基准指数', 'rets': '买入持有', 'capital_ret': '交易策略'}
-    else:
-        df1 = df.loc[:, ['index', 'rets']]
-        name_dict = {'index': '基准指数', 'rets': '买入持有'}
-    # df1.loc[df.index[0], ['index','rets']] = 0
+def successive_counts(values: np.ndarray, groups: np.ndarray = None) -> np.ndarray:
+    """连续相同值的计数（1, 2, 3, ...），值变化或者分组变化时重新计数；NaN 不与任何值相同"""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return np.array([], dtype=int)
+    new_run = np.ones(n, dtype=bool)
+    new_run[1:] = values[1:] != values[:-1]
+    if groups is not None:
+        groups = np.asarray(groups)
+        new_run[1:] |= groups[1:] != groups[:-1]
+    pos = np.arange(n)
+    run_start = np.maximum.accumulate(np.where(new_run, pos, 0))
+    return pos - run_start + 1
 
-    # 计算收益率
+
+def _period_returns(rets: pd.DataFrame, keys) -> pd.DataFrame:
+    """各周期的复合收益率"""
+    return np.expm1(np.log1p(rets).groupby(keys).sum())
+
+
+def _win_rate(period_rets: pd.DataFrame) -> pd.Series:
+    return (period_rets > 0).sum() / (period_rets != 0).sum()
+
+
+def performance_table(rets: pd.DataFrame, index_col: str = 'index') -> pd.DataFrame:
+    """每一列日收益率的绩效指标（列与列之间同时计算）
+
+    rets: 以日期为索引的日收益率，index_col 为基准指数的收益率
+    """
     # 累计收益率
-    acc_ret = (df1 + 1).cumprod()
+    acc_ret = (rets + 1).cumprod()
     # 计算总收益率
     total_ret = acc_ret.iloc[-1] - 1
     # 年化收益率，假设一年250个交易日
-    annual_ret = pow(1 + total_ret, 250 / len(df1)) - 1
+    annual_ret = pow(1 + total_ret, 250 / len(rets)) - 1
     # 最大回撤
     md = ((acc_ret.cummax() - acc_ret) / acc_ret.cummax()).max()
-    exReturn = df1 - 0.03 / 250
+    exReturn = rets - 0.03 / 250
     # 计算夏普比率
-    sharper_atio = np.sqrt(len(exReturn)) * exReturn.mean() / df1.std()
+    sharper_atio = np.sqrt(len(exReturn)) * exReturn.mean() / rets.std()
     # 计算CAPM里的alpha和beta系数
-    beta0 = df1[['rets', 'index']].cov().iat[0, 1] / df['index'].var()
-    alpha0 = (annual_ret['rets'] - annual_ret['index'] * beta0)
-    if 'capital_ret' in df1.columns:
-        beta1 = df1[['capital_ret', 'index']].cov().iat[0, 1] / df['index'].var()
-        alpha1 = (annual_ret['capital_ret'] - annual_ret['index'] * beta1)
-        alpha = [np.nan, alpha0, alpha1, ]
-        beta = [np.nan, beta0, beta1, ]
-    else:
-        alpha = [np.nan, alpha0]
-        beta = [np.nan, beta0]
-    # 计算每一年(月,周)股票,资金曲线的收益
-    year_ret = df1.resample('A').apply(lambda x: (x + 1.0).prod() - 1.0)
-    month_ret = df1.resample('M').apply(lambda x: (x + 1.0).prod() - 1.0)
-    week_ret = df1.resample('W').apply(lambda x: (x + 1.0).prod() - 1.0)
-    # 去掉缺失值
-    year_ret.fillna(0, inplace=True)
-    month_ret.fillna(0, inplace=True)
-    week_ret.fillna(0, inplace=True)
-    # 计算胜率
-    year_win_rate = year_ret.apply(lambda s: len(s[s > 0]) / len(s[s != 0]))
-    month_win_rate = month_ret.apply(lambda s: len(s[s > 0]) / len(s[s != 0]))
-    week_win_rate = week_ret.apply(lambda s: len(s[s > 0]) / len(s[s != 0]))
+    index = rets[index_col]
+    cov = (rets - rets.mean()).mul(index - index.mean(), axis=0).sum() / (len(rets) - 1)
+    beta = cov / index.var()
+    alpha = annual_ret - annual_ret[index_col] * beta
+    alpha[index_col] = np.nan
+    beta[index_col] = np.nan
+    # 计算每一年(月,周)的收益及胜率
+    dates = pd.DatetimeIndex(rets.index)
+    year_ret = _period_returns(rets, dates.year)
+    month_ret = _period_returns(rets, [dates.year, dates.month])
+    week_ret = _period_returns(rets, dates.to_period('W'))
     result = pd.DataFrame()
     result['总收益率'] = total_ret
     result['年化收益率'] = annual_ret
@@ -153,12 +149,25 @@ def trade_performance(df, plot=True):
     result['夏普比率'] = sharper_atio
     result['Alpha'] = alpha
     result['Beta'] = beta
-    result['年胜率'] = year_win_rate
-    result['月胜率'] = month_win_rate
-    result['周胜率'] = week_win_rate
+    result['年胜率'] = _win_rate(year_ret)
+    result['月胜率'] = _win_rate(month_ret)
+    result['周胜率'] = _win_rate(week_ret)
+    return result
+
+
+def trade_performance(df, plot=True):
+    if 'capital_ret' in df.columns:
+        df1 = df.loc[:, ['index', 'rets', 'capital_ret']]
+        name_dict = {'index': '基准指数', 'rets': '买入持有', 'capital_ret': '交易策略'}
+    else:
+        df1 = df.loc[:, ['index', 'rets']]
+        name_dict = {'index': '基准指数', 'rets': '买入持有'}
+    # df1.loc[df.index[0], ['index','rets']] = 0
+
+    result = performance_table(df1, 'index')
     result = result.T.rename(columns=name_dict)
     if plot:
-        acc_ret = acc_ret.rename(columns=name_dict)
+        acc_ret = (df1 + 1).cumprod().rename(columns=name_dict)
         acc_ret.plot(figsize=(15, 7))
         plt.title('策略累计净值', size=15)
         plt.xlabel('')
@@ -205,8 +214,8 @@ def MR_Strategy(df, lookback=20, buy_threshold=-1.5, sell_threshold=1.5, cost=0.
     # 当score值大于1.5且第二天开盘没有跌停发出卖入信号设置为0
     df.loc[(df.score > sell_threshold) & (df['open'] > df['close'].shift(1) * 0.903), 'signal'] = 0
     df['position'] = df['signal'].shift(1)
-    df['position'].fillna(method='ffill', inplace=True)  # 用前面的值来填充
-    df['position'].fillna(0, inplace=True)
+    df['position'] = df['position'].ffill()  # 用前面的值来填充
+    df['position'] = df['position'].fillna(0)
     # 根据交易信号和仓位计算策略的每日收益率
     df.loc[df.index[0], 'capital_ret'] = 0
     # 今天开盘新买入的position在今天的涨幅(扣除手续费)
@@ -246,8 +255,8 @@ def North_Strategy(data, window=252, stdev_n=1.5, cost=0.00):
     # 当日北向资金跌破下轨线发出卖出信号设置为0
     df.loc[df['北向资金'] < df.lower, 'signal'] = 0
     df['position'] = df['signal'].shift(1)
-    df['position'].fillna(method='ffill', inplace=True)
-    df['position'].fillna(0, inplace=True)
+    df['position'] = df['position'].ffill()
+    df['position'] = df['position'].fillna(0)
     # 根据交易信号和仓位计算策略的每日收益率
     df.loc[df.index[0], 'capital_ret'] = 0
     # 今天开盘新买入的position在今天的涨幅(扣除手续费)
@@ -278,7 +287,7 @@ def TT_strategy(data, n1=20, n2=10):
     sell_index = df[df.close < df['L_N2'].shift(1)].index
     df.loc[sell_index, 'signal'] = 0
     df['position'] = df['signal'].shift(1)
-    df['position'].fillna(method='ffill', inplace=True)
+    df['position'] = df['position'].ffill()
     d = df[df['position'] == 1].index[0] - timedelta(days=1)
     df1 = df.loc[d:].copy()
     df1['position'][0] = 0
@@ -66,6 +66,14 @@ class BaseStrategy:
             )
             self.portfolios[gateway_name] = portfolio
 
+    def set_parameters(self, **params):
+        """Override strategy parameters (e.g. in a parameter sweep), called
+        before init_strategy"""
+        for name, value in params.items():
+            assert hasattr(self, name), (
+                f"{self.__class__.__name__} has no parameter `{name}`")
+            setattr(self, name, value)
+
     def init_strategy(self, *args, **kwargs):
         raise NotImplementedError(
             "init_strategy has not been implemented yet.")
@@ -1,4 +1,5 @@
 from abc import ABC
+from functools import partial
 from time import sleep
 from datetime import datetime, timedelta
 from typing import Dict, List
@@ -9,17 +10,19 @@ import pandas_ta as ta
 
 from multiprocessing import Process, freeze_support
 
-import exchange_calendars as xcals
-
 from app.domain.balance import AccountBalance
+from app.domain.calendar_service import calendar_service
 from app.domain.position import Position, PositionData
 from app.constants import Direction, Offset, OrderSide, OrderType, TradeMode, OrderStatus
-from app.domain.data import Bar
+from app.domain.data import Bar, BarSeries
 from app.domain.engine import Engine
 from app.domain.security import Stock, Security
 from app.utils import logger
+from app.utils.latency import latency
 from app.strategies.base_strategy import BaseStrategy
 from app.utils.tasks import SingleTask, LoopRunTask
+from app.factors import IndicatorEngine, DailyBarCursor, ATR
+from app.strategies.helpers import kline_bars
 
 
 @dataclass
@@ -70,6 +73,9 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
             **kwargs
         )
         self._dKline_df = pd.DataFrame()  # pd.DataFrame
+        # 日线 ATR 逐日增量计算，当日的 bar 用 peek_bar 叠加
+        self.indicators = IndicatorEngine()
+        self.daily_bars = DailyBarCursor(self.indicators)
         # security list
         self.securities = securities
         # execution engine
@@ -86,13 +92,13 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
             self.sleep_time = 5
         else:
             self.is_backtest = True
-        self.ohlcv: Dict[Security, List] = {}
+        self.ohlcv: Dict[Security, BarSeries] = {}
         # 海龟参数
         self.turtle_ctxs: Dict[str, TurtleContext] = {}
 
     def init_strategy(self):
         for security in self.engine.gateways[self.gateway_name].securities:
-            self.ohlcv[security] = []
+            self.ohlcv[security] = BarSeries(security, maxlen=120)
             # 海龟上下文
             self.turtle_ctxs[security.code]: TurtleContext = TurtleContext()
 
@@ -119,6 +125,8 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
         for security in self.securities[gateway_name]:
             df = data.loc[data['code'] == security.code].sort_values('time_key')
             self.dispatch_kline_indicator(security, df)
+            self.daily_bars.load(security, kline_bars(security, df),
+                                 {"ATR": partial(ATR, self.turtle_ctxs[security.code].atr_period, mamode="sma")})
             self._dKline_df = pd.concat([self._dKline_df, df], ignore_index=True)
 
         # 重建索引
@@ -169,42 +177,27 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
         # 平均波动性
         # ATR(df, 21)
 
+    @latency.timed("indicator")
     def calculate_session_indicator(self, bar: Bar = None) -> pd.Series:
+        """ATR of the daily bars up to the session of the bar
+
+        The daily bars before the session are fed to the indicators once; the
+        bar of the session (the daily bar in backtest, the running bar of the
+        live quotes) is added with peek_bar.
+        """
         data = pd.Series(dtype='float64')
         security = bar.security
         # Collect bar data (only keep latest 120 records)
         self.ohlcv[security].append(bar)
-        if len(self.ohlcv[security]) > 120:
-            self.ohlcv[security].pop(0)
-
-        code = security.code
-        df = self._dKline_df.loc[code]
 
-        if self.is_backtest is False:
-            bar_ohlc = pd.DataFrame({
-                "time_key": [bar.datetime.strftime("%Y-%m-%d 00:00:00")],
-                "code": [code],
-                "open": [bar.open],
-                "high": [bar.high],
-                "low": [bar.low],
-                "close": [bar.close],
-            })
-            df.reset_index(inplace=True)
-            df['code'] = code
-            df = pd.concat([df, bar_ohlc], ignore_index=True)
-            df = df.tail(60)
-            df.set_index(['code', 'time_key'], inplace=True)
-        else:
-            idx = pd.IndexSlice
-            df = df.loc[idx[:bar.datetime.strftime("%Y-%m-%d 00:00:00")]]
-
-        atr_period = self.turtle_ctxs[security.code].atr_period
-        if len(df) <= atr_period:
+        if security not in self.daily_bars:
             return data
-
-        df.ta.atr(length=atr_period, mamode='sma', col_names="ATR", append=True)
-        data = df.loc[bar.datetime.strftime("%Y-%m-%d 00:00:00")]
-        return data
+        day = bar.datetime.date()
+        self.daily_bars.advance(security, day)
+        session_bar = self.daily_bars.bar_of(security, day) if self.is_backtest else bar
+        if session_bar is None:
+            return data
+        return pd.Series({"ATR": self.indicators.peek_bar(session_bar, ["ATR"])["ATR"]})
 
     async def on_bar(self, cur_data: Dict[str, Dict[Security, Bar]]):
         logger.info("-" * 30 + "Enter on_bar" + "-" * 30)
@@ -236,8 +229,7 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
 
             bar = cur_data[gateway_name][security]
             # todo: 获取股票交易日历，并判断是否在交易日内
-            calendar = xcals.get_calendar("XNYS")
-            if calendar.is_session(bar.datetime.strftime("%Y-%m-%d")) is False:
+            if calendar_service.is_session("XNYS", bar.datetime) is False:
                 continue
 
             # 处理实时指标
@@ -246,7 +238,7 @@ class FutureTurtleStrategy(BaseStrategy, ABC):
                 continue
 
             code = security.code
-            pre_date = calendar.previous_session(bar.datetime.strftime("%Y-%m-%d"), True)
+            pre_date = calendar_service.previous_session("XNYS", bar.datetime)
             pre_session_data = self._dKline_df.loc[
                 (code, pre_date.strftime("%Y-%m-%d 00:00:00"))].squeeze()
 
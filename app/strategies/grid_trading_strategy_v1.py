@@ -10,17 +10,18 @@ from enum import Enum
 
 import pandas as pd
 import pandas_ta as ta
-import exchange_calendars as xcals
 
 from functools import reduce
 from app.domain.balance import AccountBalance
+from app.domain.calendar_service import calendar_service
 from app.domain.position import Position, PositionData
 from app.constants import Direction, Offset, OrderTimeInForce, OrderType, TradeMode, OrderStatus
-from app.domain.data import Bar
+from app.domain.data import Bar, BarSeries
 from app.domain.order import Order
 from app.domain.engine import Engine
 from app.domain.security import Stock, Security
 from app.utils import logger
+from app.utils.latency import latency
 from app.strategies.base_strategy import BaseStrategy
 from app.utils.tasks import SingleTask, LoopRunTask
 
@@ -52,6 +53,7 @@ PARAMS = {
 
 GRID_SIDE_BUY: str = "BUY"
 GRID_SIDE_SELL: str = "SELL"
+GRID_SIDE_RESET: str = "RESET"
 
 
 class Interval_mode(Enum):
@@ -125,8 +127,9 @@ class GridTradingStrategy(BaseStrategy, ABC):
 
     流程：
     1.初始化时根据现在的价格生成网格交易单（2单），提交限价单直到触发。（注：配合技术指标确认什么时候开始首次初始化网格单）
-    2.有bar事件时校验上一次网格交易订单状态：如果其中一个交易单成交，撤销另一个交易单，并生成下一个网格交易单（update_order）
-    3.回测模式下（不支持限价单）：
+    2.有bar事件时校验上一次网格交易订单状态：如果其中一个交易单成交，撤销另一个交易单，并生成下一个网格交易单（update_order）；
+      部分成交的交易单先把成交计入持仓，剩余部分继续挂单，完全成交后再更新网格；两个交易单同时成交时记一次配对（update_both_orders）
+    3.回测模式下：限价单挂在回测网关的模拟订单簿里，bar的最高/最低价到达委托价时成交
     """
     quantity_precision = 0  # 数量精度（ETF数量精度2，最小数量0.01）
     price_precision = 2  # 价格精度
@@ -163,6 +166,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
         self.sleep_time = 0
         self.gateway_name = None
         self.pre_pair_orders = {}  # 前配对新鲜
+        self.applied_deals = set()  # 已计入策略持仓的成交（部分成交的订单会多次检查）
         for gateway_name in self.securities.keys():
             self.gateway_name = gateway_name
             self.pre_pair_orders[gateway_name] = {}
@@ -172,7 +176,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
         else:
             self.is_backtest = True
 
-        self.ohlcv: Dict[Security, List] = {}
+        self.ohlcv: Dict[Security, BarSeries] = {}
 
         self.money = 100000
         self.id_prefix = "grid_trading_strategy_"
@@ -191,7 +195,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
                       ):
         self.ohlcv = {}
         for security in self.securities[self.gateway_name]:
-            self.ohlcv[security] = []
+            self.ohlcv[security] = BarSeries(security, maxlen=120)
             self.pre_pair_orders[self.gateway_name][security.code] = {}
 
         # 静态缓存
@@ -215,6 +219,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
             "pending_prders": [],  # 当前挂单列表
             "up_price": 0.0,  # 上一格价格
             "down_price": 0.0,  # 下一格价格
+            "odd_quantity": 0,  # 撤销的网格单已成交的数量（买为正，卖为负），破网清仓时一并平仓
         }
 
     def stop(self):
@@ -247,7 +252,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
                 gateway_name=self.gateway_name,
                 new_client_order_id=self.id_prefix + GRID_SIDE_SELL
             )
-            self._submit_order(params)
+            self._submit_order(params, GRID_SIDE_SELL)
         elif self.account_dict["positions_grids"] < 0:
             quantity = self.grid_dict["one_grid_quantity"] * abs(self.account_dict["positions_grids"])
             # BUY
@@ -261,7 +266,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
                 gateway_name=self.gateway_name,
                 new_client_order_id=self.id_prefix + GRID_SIDE_BUY
             )
-            self._submit_order(params)
+            self._submit_order(params, GRID_SIDE_BUY)
 
     def get_down_price(self, price: float) -> float:
         '''计算下一格价格'''
@@ -380,11 +385,18 @@ class GridTradingStrategy(BaseStrategy, ABC):
 
     def reset_grid(self, security: Security = None, new_price: float = 0):
         '''破网处理'''
+        # 撤销还在挂着的网格单
+        for pre_orderid in self.pre_pair_orders[self.gateway_name][security.code].values():
+            self._cancel_pair_order(pre_orderid)
+        self.pre_pair_orders[self.gateway_name][security.code] = {}
         # 清仓
         params: TradingOrderParam = None
-        # 清仓数量
-        quantity = self.grid_dict["one_grid_quantity"] * abs(self.account_dict["positions_grids"])
-        if self.account_dict["positions_grids"] > 0:  # 如果是多头持仓
+        # 清仓数量（网格持仓加上撤销的网格单已成交的数量）
+        net_quantity = self.grid_dict["one_grid_quantity"] * self.account_dict["positions_grids"] + \
+                       self.account_dict["odd_quantity"]
+        self.account_dict["odd_quantity"] = 0
+        quantity = abs(net_quantity)
+        if net_quantity > 0:  # 如果是多头持仓
             side = "SELL"  # 清仓方向
             params = TradingOrderParam(
                 security=security,
@@ -397,7 +409,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
                 new_client_order_id=self.id_prefix + "reset_grid",
                 gateway_name=self.gateway_name,
             )
-        elif self.account_dict["positions_grids"] < 0:
+        elif net_quantity < 0:
             side = "BUY"
             params = TradingOrderParam(
                 security=security,
@@ -412,9 +424,10 @@ class GridTradingStrategy(BaseStrategy, ABC):
             )
 
         if params:
-            order_id = self._submit_order(params)
+            order_id = self._submit_order(params, GRID_SIDE_RESET)
             if not order_id:
                 logger.error(f"reset_grid fail. deal_order. params= {params}")
+            self._listen_order_deals_for_portfolios(order_id, self.gateway_name)
 
         # 计算清仓盈亏
         if new_price <= 0:
@@ -465,7 +478,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
             gateway_name=self.gateway_name,
             new_client_order_id=self.id_prefix + GRID_SIDE_BUY,
         )
-        down_orderid = self._submit_order(down_params)
+        down_orderid = self._submit_order(down_params, GRID_SIDE_BUY)
 
         # 初始化网格，没有卖单
         # up_params = TradingOrderParam(
@@ -484,13 +497,12 @@ class GridTradingStrategy(BaseStrategy, ABC):
         if down_orderid != "":
             self.account_dict["pending_prders"] = ["buy"]
 
+    @latency.timed("indicator")
     def calculate_session_indicator(self, bar: Bar = None) -> pd.Series:
         data = pd.Series(dtype='float64')
         security = bar.security
         # Collect bar data (only keep latest 120 records)
         self.ohlcv[security].append(bar)
-        if len(self.ohlcv[security]) > 120:
-            self.ohlcv[security].pop(0)
 
         return data
 
@@ -522,9 +534,8 @@ class GridTradingStrategy(BaseStrategy, ABC):
                 continue
 
             bar = quote_data[gateway_name][security]
-            calendar = xcals.get_calendar("XNYS")
-            if self.is_backtest is False and calendar.is_open_on_minute(
-                    (bar.datetime + timedelta(hours=-8)).strftime("%Y-%m-%d %H:%M")) is False:
+            if self.is_backtest is False and calendar_service.is_open_on_minute(
+                    "XNYS", bar.datetime + timedelta(hours=-8)) is False:
                 continue
 
             cur_price = bar.close
@@ -540,48 +551,43 @@ class GridTradingStrategy(BaseStrategy, ABC):
             else:
                 '''
                 1.检测上一次网格的订单状态：如果上一次网格其中一个订单成交，则更新下一次网格
-                2.回测模式下：先校验价格，再检测订单状态
+                2.回测模式下：订单由回测网关按bar价格撮合，同样检测订单状态
+                3.部分成交的订单先把成交计入持仓，剩余部分继续挂单，等完全成交再更新网格
                 '''
-                side = ""
-                price = 0.0
-                order: Order = None
-
                 if cur_price >= self.grid_dict["max_price"] or cur_price <= self.grid_dict["min_price"]:
                     # 破网
                     self.reset_grid(security, cur_price)
-                    logger.warn("reset_grid bar info", security=security, price=price,
+                    logger.warn("reset_grid bar info", security=security, price=cur_price,
                                 max_price=self.grid_dict["max_price"],
                                 min_price=self.grid_dict["min_price"], caller=self)
 
+                filled_orders: Dict[str, Order] = {}
                 for k, pre_orderid in self.pre_pair_orders[self.gateway_name][security.code].items():
-                    is_check_order = True
-                    order = self.engine.get_order(orderid=pre_orderid, gateway_name=gateway_name)
-                    if self.is_backtest:
-                        if (k == GRID_SIDE_BUY and cur_price > order.price) or (
-                                k == GRID_SIDE_SELL and cur_price < order.price):
-                            is_check_order = False
-
-                    if is_check_order:
-                        order = self._listen_order_deals_for_portfolios(pre_orderid, gateway_name)
-                        if order.status == OrderStatus.FILLED or OrderStatus.PART_FILLED:
-                            side = k
-                            price = order.filled_avg_price
-                            break
-
-                if not side:
+                    # 未成交的订单返回None
+                    order = self._listen_order_deals_for_portfolios(pre_orderid, gateway_name)
+                    if order is not None and order.status == OrderStatus.FILLED:
+                        filled_orders[k] = order
+
+                if not filled_orders:
                     return
 
-                self._update_order(security, side, price)
-                # 记录操作
-                order_instruct = TradingOrderParam(
-                    security=order.security,
-                    price=order.filled_avg_price,
-                    quantity=order.quantity,
-                    direction=order.direction,
-                    offset=order.offset,
-                    gateway_name=self.gateway_name,
-                )
-                self.on_action(gateway_name, order_instruct)
+                if len(filled_orders) == 2:
+                    # 同一根bar上下两个网格单都成交
+                    self._update_both_orders(security, filled_orders[GRID_SIDE_BUY], filled_orders[GRID_SIDE_SELL])
+                else:
+                    side, order = next(iter(filled_orders.items()))
+                    self._update_order(security, side, order.filled_avg_price)
+                for order in filled_orders.values():
+                    # 记录操作
+                    order_instruct = TradingOrderParam(
+                        security=order.security,
+                        price=order.filled_avg_price,
+                        quantity=order.quantity,
+                        direction=order.direction,
+                        offset=order.offset,
+                        gateway_name=self.gateway_name,
+                    )
+                    self.on_action(gateway_name, order_instruct)
 
     def _real_price(self, cur_price: float = None, gateway_price: float = None) -> float:
         if gateway_price is None:
@@ -617,13 +623,10 @@ class GridTradingStrategy(BaseStrategy, ABC):
 
         if cancel_orderid:
             # 网格配对，将另外一个订单撤销撤销订单
-            err = self.engine.cancel_order(orderid=cancel_orderid, gateway_name=self.gateway_name)
-            if err:
-                logger.error(f"Can't cancel order ({cancel_orderid}). Error: {err}")
+            if not self._cancel_pair_order(cancel_orderid):
                 return
             # 将挂单列表设置为空
             self.account_dict["pending_prders"] = []
-            logger.info(f"Successfully cancel order ({cancel_orderid}).")
 
         # 更新account_dict
         self.account_dict["positions_cost"] = self.get_positions_cost()
@@ -635,6 +638,27 @@ class GridTradingStrategy(BaseStrategy, ABC):
             self.account_dict["pairing_count"] += 1
             self.account_dict["pair_profit"] += self.get_pair_profit(price, side)
 
+        self._place_grid_orders(security, price)
+
+    def _update_both_orders(self, security: Security = None, buy_order: Order = None, sell_order: Order = None):
+        """
+        上下两个网格单在同一根bar都成交：持仓格数不变，记一次配对，按后成交的价格挂下一次网格单
+        """
+        self.pre_pair_orders[self.gateway_name][security.code] = {}
+        if buy_order.filled_time is not None and sell_order.filled_time is not None and \
+                buy_order.filled_time > sell_order.filled_time:
+            price = buy_order.filled_avg_price
+        else:
+            price = sell_order.filled_avg_price
+
+        self.account_dict["pairing_count"] += 1
+        self.account_dict["pair_profit"] += (sell_order.filled_avg_price - buy_order.filled_avg_price) * \
+                                            self.grid_dict["one_grid_quantity"]
+        self.account_dict["positions_profit"] = self.get_positions_profit(price)
+        self._place_grid_orders(security, price)
+
+    def _place_grid_orders(self, security: Security = None, price: float = 0.0):
+        """以成交价格为中枢挂下一次网格单（超出网格则破网）"""
         # 新建委托
         if price >= self.grid_dict["max_price"] or price <= self.grid_dict["min_price"]:
             # 破网
@@ -656,7 +680,7 @@ class GridTradingStrategy(BaseStrategy, ABC):
                 gateway_name=self.gateway_name,
                 new_client_order_id=self.id_prefix + GRID_SIDE_BUY
             )
-            down_orderid = self._submit_order(down_params)
+            down_orderid = self._submit_order(down_params, GRID_SIDE_BUY)
 
             if self.account_dict["positions_grids"] > 0:
                 up_params = TradingOrderParam(
@@ -670,13 +694,33 @@ class GridTradingStrategy(BaseStrategy, ABC):
                     gateway_name=self.gateway_name,
                     new_client_order_id=self.id_prefix + GRID_SIDE_SELL
                 )
-                up_orderid = self._submit_order(up_params)
+                up_orderid = self._submit_order(up_params, GRID_SIDE_SELL)
                 if not down_orderid or not up_orderid:
                     logger.error("update_order down or up fail.")
 
             self.account_dict["pending_prders"] = ["buy", "sell"]
 
-    def _submit_order(self, param: TradingOrderParam = None) -> str:
+    def _cancel_pair_order(self, orderid: str) -> bool:
+        """
+        撤销网格单未成交的部分；撤单前已成交的数量不计入网格，记入odd_quantity，破网清仓时一并平仓
+        """
+        # 先把撤单前的成交计入持仓
+        self._listen_order_deals_for_portfolios(orderid, self.gateway_name)
+        order = self.engine.get_order(orderid=orderid, gateway_name=self.gateway_name)
+        if order is None:
+            return True
+        if order.status in (OrderStatus.SUBMITTED, OrderStatus.PART_FILLED):
+            err = self.engine.cancel_order(orderid=orderid, gateway_name=self.gateway_name)
+            if err:
+                logger.error(f"Can't cancel order ({orderid}). Error: {err}")
+                return False
+            logger.info(f"Successfully cancel order ({orderid}).")
+        if order.filled_quantity > 0:
+            sign = 1 if order.direction == Direction.LONG else -1
+            self.account_dict["odd_quantity"] += sign * order.filled_quantity
+        return True
+
+    def _submit_order(self, param: TradingOrderParam = None, side: str = "") -> str:
         # 处理订单
         order_id = self.engine.send_order(param.security,
                                           param.price,
@@ -691,9 +735,9 @@ class GridTradingStrategy(BaseStrategy, ABC):
             logger.error("Fail to submit order")
             return ""
         # 缓存网格配对的orderid
-        if param.direction == Direction.LONG:
+        if side == GRID_SIDE_BUY:
             self.pre_pair_orders[param.gateway_name][param.security.code][GRID_SIDE_BUY] = order_id
-        elif param.direction == Direction.SHORT:
+        elif side == GRID_SIDE_SELL:
             self.pre_pair_orders[param.gateway_name][param.security.code][GRID_SIDE_SELL] = order_id
 
         return order_id
@@ -721,12 +765,13 @@ class GridTradingStrategy(BaseStrategy, ABC):
         if order.status != OrderStatus.FILLED and order.status != OrderStatus.PART_FILLED:
             return
 
-        # 处理交易
+        # 处理交易（部分成交的订单会多次检查，只计入新的成交）
         deals = self.engine.find_deals_with_orderid(
             orderid, gateway_name=gateway_name)
         for deal in deals:
-            if not deal:
+            if not deal or deal.dealid in self.applied_deals:
                 continue
+            self.applied_deals.add(deal.dealid)
             # 更新持仓
             try:
                 self.portfolios[gateway_name].update(deal)
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
+from typing import List
+
 import numpy as np
 import pandas as pd
 
+from app.domain.data import Bar
+from app.domain.security import Security
+
 
 def append_kdj(df):
     '''calculate kdj'''
@@ -87,3 +92,14 @@ def ATR(df: pd.DataFrame = None, period: int = 21):
     df['ATR'] = df['TR'].rolling(period).mean()
     # 无数据的先删掉
     df.drop(['H-L', 'H-PC', 'L-PC', 'TR'], axis=1, inplace=True)
+
+
+def kline_bars(security: Security, df: pd.DataFrame) -> List[Bar]:
+    """Bars of a kline frame (time_key, open, high, low, close, volume), in time order"""
+    df = df.sort_values('time_key')
+    times = pd.to_datetime(df['time_key']).dt.to_pydatetime()
+    values = df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype=np.float64).tolist()
+    return [
+        Bar(datetime=dt, security=security, open=o, high=h, low=l, close=c, volume=v)
+        for dt, (o, h, l, c, v) in zip(times, values)
+    ]
@@ -8,7 +8,7 @@ from finta import TA
 from app.domain.balance import AccountBalance
 from app.domain.position import Position
 from app.constants import Direction, Offset, OrderType, TradeMode, OrderStatus
-from app.domain.data import Bar
+from app.domain.data import Bar, BarSeries
 from app.domain.engine import Engine
 from app.domain.security import Stock, Security
 from app.strategies.base_strategy import BaseStrategy
@@ -51,7 +51,7 @@ class StockHKStrategy(BaseStrategy, ABC):
         for gateway_name in self.engine.gateways:
             self.ohlcv[gateway_name] = {}
             for security in self.engine.gateways[gateway_name].securities:
-                self.ohlcv[gateway_name][security] = []
+                self.ohlcv[gateway_name][security] = BarSeries(security, maxlen=50)
 
     def on_bar(self, cur_data: Dict[str, Dict[Security, Bar]]):
 
@@ -88,17 +88,11 @@ class StockHKStrategy(BaseStrategy, ABC):
 
                 # Collect bar data (only keep latest 20 records)
                 self.ohlcv[gateway_name][security].append(bar)
-                if len(self.ohlcv[gateway_name][security]) > 50:
-                    self.ohlcv[gateway_name][security].pop(0)
 
-                open_ts = [b.open for b in
-                           self.ohlcv[gateway_name][security]]
-                high_ts = [b.high for b in
-                           self.ohlcv[gateway_name][security]]
-                low_ts = [b.low for b in
-                          self.ohlcv[gateway_name][security]]
-                close_ts = [b.close for b in
-                            self.ohlcv[gateway_name][security]]
+                open_ts = self.ohlcv[gateway_name][security].open
+                high_ts = self.ohlcv[gateway_name][security].high
+                low_ts = self.ohlcv[gateway_name][security].low
+                close_ts = self.ohlcv[gateway_name][security].close
 
                 ohlc = pd.DataFrame({
                     "open": open_ts,
@@ -4,19 +4,22 @@ from datetime import datetime, timedelta
 from typing import Dict, List
 import math
 from dataclasses import dataclass
+from functools import partial
 
 import pandas as pd
 import pandas_ta as ta
-import exchange_calendars as xcals
 
 from app.domain.balance import AccountBalance
+from app.domain.calendar_service import calendar_service
 from app.domain.position import Position, PositionData
 from app.constants import Direction, Offset, OrderSide, OrderType, TradeMode, OrderStatus
 from app.domain.data import Bar
 from app.domain.engine import Engine
 from app.domain.security import Stock, Security
 from app.utils import logger
+from app.utils.latency import latency
 from app.strategies.base_strategy import BaseStrategy
+from app.factors import IndicatorEngine, EMA, KDJ, MACD
 from app.utils.tasks import SingleTask, LoopRunTask
 
 from app.domain.stores.security_market_storer import SecurityMarketStorer
@@ -102,15 +105,20 @@ class StockUSHighFrequencyStrategy(BaseStrategy, ABC):
             else:
                 self.is_backtest = True
 
-        self.ohlcv = {}
+        # 分钟线指标（增量计算）
+        self.indicators = IndicatorEngine()
         # 止损位
         self.cut_lost_position = {}
 
     def init_strategy(self):
         for gateway_name in self.engine.gateways:
-            self.ohlcv[gateway_name] = {}
             for security in self.engine.gateways[gateway_name].securities:
-                self.ohlcv[gateway_name][security] = []
+                self.indicators.subscribe(security, "EMA_10", EMA(10), history=2)
+                self.indicators.subscribe(security, "EMA_20", EMA(20), history=3)
+                self.indicators.subscribe(security, "EMA_60", EMA(60), history=4)
+                self.indicators.subscribe(security, "KDJ", KDJ(9, 3))
+                self.indicators.subscribe(security, "KD_MACD", KDJ(9, 6), history=2)
+                self.indicators.subscribe(security, "MACD", MACD(12, 26, 9), history=2)
                 # 初始化止损位
                 self.cut_lost_position[security.code]: CutLostPosition = CutLostPosition()
 
@@ -200,83 +208,72 @@ class StockUSHighFrequencyStrategy(BaseStrategy, ABC):
         df.loc[(df['EMA_60'] < df['EMA_60'].shift(1)) & (df['EMA_60'] < df['EMA_60'].shift(2)) & (
                 df['EMA_60'] < df['EMA_60'].shift(3)), 'ema60_up'] = 0
 
-    def calculate_session_indicator(self, gateway_name, bar: Bar = None) -> pd.DataFrame:
+    @latency.timed("indicator")
+    def calculate_session_indicator(self, gateway_name, bar: Bar = None) -> pd.Series:
+        """分钟线指标，增量计算；未满60根bar时返回空Series"""
         security = bar.security
-        # Collect bar data (only keep latest 120 records)
-        self.ohlcv[gateway_name][security].append(bar)
-        if len(self.ohlcv[gateway_name][security]) > 120:
-            self.ohlcv[gateway_name][security].pop(0)
-
-        open_ts = [b.open for b in
-                   self.ohlcv[gateway_name][security]]
-        high_ts = [b.high for b in
-                   self.ohlcv[gateway_name][security]]
-        low_ts = [b.low for b in
-                  self.ohlcv[gateway_name][security]]
-        close_ts = [b.close for b in
-                    self.ohlcv[gateway_name][security]]
-
-        df = pd.DataFrame({
-            "open": open_ts,
-            "high": high_ts,
-            "low": low_ts,
-            "close": close_ts
-        })
-        if len(df) < 60:
-            return df
-
-        tech_strategy = ta.Strategy(
-            name="Momo and Volatility",
-            description="SMA 50,200, BBANDS, RSI, MACD and Volume SMA 20",
-            ta=[
-                {"kind": "ema", "length": 10},
-                {"kind": "ema", "length": 20},
-                {"kind": "ema", "length": 60},
-                # {"kind": "rsi"},
-                {"kind": "kdj", "col_names": ("KDJ_K", "KDJ_D", "KDJ_J")},
-                {"kind": "kdj", "signal": 6, "col_names": ("KD_MACD_K", "KD_MACD_D", "KD_MACD_J")},
-                {"kind": "macd", "asmode": False, "col_names": ("MACD_DIF", "MACD", "MACD_DEA")},
-                # {"kind": "sma", "close": "volume", "length": 20, "prefix": "VOLUME"},
-            ]
-        )
-        freeze_support()
-        df.ta.strategy(tech_strategy)
-        df['MACD'] *= 2  # MACD需要乘以2
+        values = self.indicators.update_bar(bar)
+        if not self.indicators.ready(security, ["EMA_60"]):
+            return pd.Series(dtype=float)
+
+        history = partial(self.indicators.history, security)
+        kdj_k, kdj_d, kdj_j = values["KDJ"]
+        kd_macd_k, kd_macd_d, kd_macd_j = values["KD_MACD"]
+        macd_dif, macd, macd_dea = values["MACD"]
+        macd *= 2  # MACD需要乘以2
+        prev_macd = history("MACD")[-2][1] * 2
+        prev_kd_macd_k = history("KD_MACD")[-2][0]
+        ema_10_1, ema_10 = history("EMA_10")
+        ema_20_2, ema_20_1, ema_20 = history("EMA_20")
+        ema_60_3, ema_60_2, ema_60_1, ema_60 = history("EMA_60")
+
+        indicator = {
+            "open": bar.open,
+            "high": bar.high,
+            "low": bar.low,
+            "close": bar.close,
+            "EMA_10": ema_10,
+            "EMA_20": ema_20,
+            "EMA_60": ema_60,
+            "KDJ_K": kdj_k,
+            "KDJ_D": kdj_d,
+            "KDJ_J": kdj_j,
+            "KD_MACD_K": kd_macd_k,
+            "KD_MACD_D": kd_macd_d,
+            "KD_MACD_J": kd_macd_j,
+            "MACD_DIF": macd_dif,
+            "MACD": macd,
+            "MACD_DEA": macd_dea,
+        }
         # 当macd DIF>DEA交叉信号
-        df.loc[(df['MACD'] > 0) & (df['MACD'].shift(1) < 0), 'macd_fork_signal'] = 1
-        df.loc[(df['MACD'] < 0) & (df['MACD'].shift(1) > 0), 'macd_fork_signal'] = 0
-
+        indicator["macd_fork_signal"] = _signal(
+            macd > 0 and prev_macd < 0,
+            macd < 0 and prev_macd > 0)
         # 当macd红柱发散信号
-        df.loc[(df['MACD'] > 0) & (df['MACD'].shift(1) < df['MACD']), 'macd_diffuse_signal'] = 1
-        df.loc[(df['MACD'] < 0) & (df['MACD'].shift(1) > df['MACD']), 'macd_diffuse_signal'] = 0
-
-        # 当macd DIF>0.2或DIF<-0.2 且发散发出买卖信号
-        df.loc[(df['MACD_DIF'] > 0.2) & (df['MACD_DIF'].shift(1) < df['MACD_DIF']) & (
-                df['MACD_DIF'].shift(-1) > df['MACD_DIF']), 'macd_dif_signal'] = 1
-        df.loc[(df['MACD_DIF'] < -0.2) & (df['MACD_DIF'].shift(1) > df['MACD_DIF']) & (
-                df['MACD_DIF'].shift(-1) < df['MACD_DIF']), 'macd_dif_signal'] = 0
-
+        indicator["macd_diffuse_signal"] = _signal(
+            macd > 0 and prev_macd < macd,
+            macd < 0 and prev_macd > macd)
+        # 当macd DIF>0.2或DIF<-0.2 且发散发出买卖信号（需要下一根bar确认，当前bar无信号）
+        indicator["macd_dif_signal"] = math.nan
         # 当kd-macd DIF>0.2或DIF<-0.2 且发散发出买卖信号
-        df.loc[(df['KD_MACD_K'] < 50) & (df['KD_MACD_K'].shift(1) < df['KD_MACD_K']), 'kdmacd_k_signal'] = 1
-        df.loc[(df['KD_MACD_K'] < -0.2) & (df['KD_MACD_K'].shift(1) > df['KD_MACD_K']), 'kdmacd_k_signal'] = 0
-
+        indicator["kdmacd_k_signal"] = _signal(
+            kd_macd_k < 50 and prev_kd_macd_k < kd_macd_k,
+            kd_macd_k < -0.2 and prev_kd_macd_k > kd_macd_k)
         # 均线交叉信号
-        df.loc[(df['EMA_10'] > df['EMA_20']) & (df['EMA_10'].shift(1) < df['EMA_20'].shift(1)), 'ema_fork_signal'] = 1
-        df.loc[(df['EMA_10'] < df['EMA_20']) & (df['EMA_10'].shift(1) > df['EMA_20'].shift(1)), 'ema_fork_signal'] = 0
+        indicator["ema_fork_signal"] = _signal(
+            ema_10 > ema_20 and ema_10_1 < ema_20_1,
+            ema_10 < ema_20 and ema_10_1 > ema_20_1)
         # 均线比较信号
-        df.loc[(df['EMA_10'] > df['EMA_20']), 'ema_signal'] = 1
-        df.loc[(df['EMA_10'] < df['EMA_20']), 'ema_signal'] = 0
-
+        indicator["ema_signal"] = _signal(ema_10 > ema_20, ema_10 < ema_20)
         # 20日趋势
-        df.loc[(df['EMA_20'] > df['EMA_20'].shift(1)) & (df['EMA_20'].shift(1) > df['EMA_20'].shift(2)), 'ema20_up'] = 1
-        df.loc[(df['EMA_20'] < df['EMA_20'].shift(1)) & (df['EMA_20'].shift(1) < df['EMA_20'].shift(2)), 'ema20_up'] = 0
-
+        indicator["ema20_up"] = _signal(
+            ema_20 > ema_20_1 > ema_20_2,
+            ema_20 < ema_20_1 < ema_20_2)
         # 60趋势
-        df.loc[(df['EMA_60'] > df['EMA_60'].shift(1)) & (df['EMA_60'] > df['EMA_60'].shift(2)) & (
-                df['EMA_60'] > df['EMA_60'].shift(3)), 'ema60_up'] = 1
-        df.loc[(df['EMA_60'] < df['EMA_60'].shift(1)) & (df['EMA_60'] < df['EMA_60'].shift(2)) & (
-                df['EMA_60'] < df['EMA_60'].shift(3)), 'ema60_up'] = 0
-        return df
+        indicator["ema60_up"] = _signal(
+            ema_60 > ema_60_1 and ema_60 > ema_60_2 and ema_60 > ema_60_3,
+            ema_60 < ema_60_1 and ema_60 < ema_60_2 and ema_60 < ema_60_3)
+        return pd.Series(indicator)
 
     # 仓位管理
     def position_manager(self):
@@ -421,17 +418,15 @@ class StockUSHighFrequencyStrategy(BaseStrategy, ABC):
 
                 bar = cur_data[gateway_name][security]
                 # todo: 获取股票交易日历，并判断是否在交易日内
-                calendar = xcals.get_calendar("XNYS")
-                if calendar.is_session(bar.datetime.strftime("%Y-%m-%d")) is False:
+                if calendar_service.is_session("XNYS", bar.datetime) is False:
                     return
                 # 处理实时指标
-                session_indicator_df = self.calculate_session_indicator(gateway_name, bar)
-                session_indicator = session_indicator_df.iloc[-1]
-                if {'MACD', 'EMA_20'}.issubset(session_indicator_df.columns) is False:
+                session_indicator = self.calculate_session_indicator(gateway_name, bar)
+                if session_indicator.empty:
                     return
 
                 code = security.code.split(".")[1]
-                pre_date = calendar.previous_session(bar.datetime.strftime("%Y-%m-%d"), True)
+                pre_date = calendar_service.previous_session("XNYS", bar.datetime)
 
                 daily_indicator = self._dKline_df.loc[
                     (pre_date.strftime("%Y-%m-%d 00:00:00"), code)].squeeze()
@@ -530,3 +525,12 @@ class StockUSHighFrequencyStrategy(BaseStrategy, ABC):
                 logger.error(f"Can't cancel order ({order_id}). Error: {err}")
                 return
             logger.info(f"Successfully cancel order ({order_id}).")
+
+
+def _signal(buy: bool, sell: bool) -> float:
+    """1: buy, 0: sell, NaN: no signal"""
+    if sell:
+        return 0
+    if buy:
+        return 1
+    return math.nan
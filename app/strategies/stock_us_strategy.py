@@ -1,4 +1,5 @@
 from abc import ABC
+from functools import partial
 from time import sleep
 from datetime import datetime, timedelta
 from typing import Dict, List
@@ -6,17 +7,20 @@ from dataclasses import dataclass
 
 import pandas as pd
 import pandas_ta as ta
-import exchange_calendars as xcals
 
 from app.domain.balance import AccountBalance
+from app.domain.calendar_service import calendar_service
 from app.domain.position import Position, PositionData
 from app.constants import Direction, Offset, OrderTimeInForce, OrderType, TradeMode, OrderStatus
-from app.domain.data import Bar
+from app.domain.data import Bar, BarSeries
 from app.domain.engine import Engine
 from app.domain.security import Stock, Security
 from app.utils import logger
+from app.utils.latency import latency
 from app.strategies.base_strategy import BaseStrategy
 from app.utils.tasks import SingleTask, LoopRunTask
+from app.factors import IndicatorEngine, DailyBarCursor, ATR
+from app.strategies.helpers import kline_bars
 
 from multiprocessing import Process, freeze_support
 
@@ -91,6 +95,9 @@ class StockUSStrategy(BaseStrategy, ABC):
             **kwargs
         )
         self._dKline_df = pd.DataFrame()  # pd.DataFrame
+        # 日线 ATR 逐日增量计算，当日的 bar 用 peek_bar 叠加
+        self.indicators = IndicatorEngine()
+        self.daily_bars = DailyBarCursor(self.indicators)
         # security list
         self.securities = securities
         # execution engine
@@ -108,7 +115,7 @@ class StockUSStrategy(BaseStrategy, ABC):
         else:
             self.is_backtest = True
 
-        self.ohlcv: Dict[Security, List] = {}
+        self.ohlcv: Dict[Security, BarSeries] = {}
         self.id_prefix = "stock_us_strategy_"
         # 海龟参数
         self.turtle_ctxs: Dict[str, TurtleContext] = {}
@@ -120,7 +127,7 @@ class StockUSStrategy(BaseStrategy, ABC):
                       ):
         self.ohlcv = {}
         for security in self.securities[self.gateway_name]:
-            self.ohlcv[security] = []
+            self.ohlcv[security] = BarSeries(security, maxlen=120)
             self.turtle_ctxs[security.code]: TurtleContext = TurtleContext()
 
         if self.is_backtest is False:
@@ -153,6 +160,8 @@ class StockUSStrategy(BaseStrategy, ABC):
         for security in securities:
             df = data.loc[data['code'] == security.code].sort_values('time_key')
             self.dispatch_kline_indicator(df)
+            self.daily_bars.load(security, kline_bars(security, df),
+                                 {"ATR": partial(ATR, self.turtle_ctxs[security.code].atr_period, mamode="sma")})
             self._dKline_df = pd.concat([self._dKline_df, df], ignore_index=True)
 
         # 重建索引
@@ -215,45 +224,26 @@ class StockUSStrategy(BaseStrategy, ABC):
         df.loc[(df['EMA_60'] < df['EMA_60'].shift(1)) & (df['EMA_60'] < df['EMA_60'].shift(2)) & (
                 df['EMA_60'] < df['EMA_60'].shift(3)), 'ema60_up'] = 0
 
+    @latency.timed("indicator")
     def calculate_session_indicator(self, bar: Bar = None) -> pd.Series:
+        """ATR of the daily bars up to the session of the bar
+
+        The daily bars before the session are fed to the indicators once; the
+        daily bar of the session is added with peek_bar.
+        """
         data = pd.Series(dtype='float64')
         security = bar.security
         # Collect bar data (only keep latest 120 records)
         self.ohlcv[security].append(bar)
-        if len(self.ohlcv[security]) > 120:
-            self.ohlcv[security].pop(0)
 
-        code = security.code
-        df = self._dKline_df.loc[code]
-
-        if self.is_backtest is False:
-            bar_ohlc = pd.DataFrame({
-                "time_key": [bar.datetime.strftime("%Y-%m-%d 00:00:00")],
-                "code": [code],
-                "open": [bar.open],
-                "high": [bar.high],
-                "low": [bar.low],
-                "close": [bar.close],
-            })
-            df.reset_index(inplace=True)
-            df['code'] = code
-            # df = pd.concat([df, bar_ohlc], ignore_index=True)
-            df = df.tail(60)
-            df.set_index(['code', 'time_key'], inplace=True)
-        else:
-            idx = pd.IndexSlice
-            df = df.loc[idx[:bar.datetime.strftime("%Y-%m-%d 00:00:00")]]
-            df['code'] = code
-            df.reset_index(inplace=True)
-            df.set_index(['code', 'time_key'], inplace=True)
-
-        atr_period = self.turtle_ctxs[security.code].atr_period
-        if len(df) <= atr_period:
+        if security not in self.daily_bars:
             return data
-
-        df.ta.atr(length=atr_period, mamode='sma', col_names="ATR", append=True)
-        data = df.loc[(code, bar.datetime.strftime("%Y-%m-%d 00:00:00"))]
-        return data
+        day = bar.datetime.date()
+        self.daily_bars.advance(security, day)
+        session_bar = self.daily_bars.bar_of(security, day)
+        if session_bar is None:
+            return data
+        return pd.Series({"ATR": self.indicators.peek_bar(session_bar, ["ATR"])["ATR"]})
 
     def _try_buy(self, ctx: TradeStrategyContext = None):
         """
@@ -439,10 +429,8 @@ class StockUSStrategy(BaseStrategy, ABC):
                 continue
 
             bar = cur_data[gateway_name][security]
-            calendar = xcals.get_calendar("XNYS")
-
-            if self.is_backtest is False and calendar.is_open_on_minute(
-                    (bar.datetime + timedelta(hours=-8)).strftime("%Y-%m-%d %H:%M")) is False:
+            if self.is_backtest is False and calendar_service.is_open_on_minute(
+                    "XNYS", bar.datetime + timedelta(hours=-8)) is False:
                 continue
 
             logger.info("is_session is True,bar = ", bar)
@@ -452,7 +440,7 @@ class StockUSStrategy(BaseStrategy, ABC):
                 continue
 
             code = security.code
-            pre_date = calendar.previous_session(bar.datetime.strftime("%Y-%m-%d"), True)
+            pre_date = calendar_service.previous_session("XNYS", bar.datetime)
 
             daily_indicator = self._dKline_df.loc[
                 (code, pre_date.strftime("%Y-%m-%d 00:00:00"))].squeeze()
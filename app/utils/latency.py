@@ -0,0 +1,261 @@
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter_ns
+from typing import Dict, List
+
+from app.utils import logger
+
+__all__ = ("latency", "LatencyHistogram", "LatencyProfiler")
+
+# 每个2的幂次区间再分16个子区间（相对误差不超过 1/16）
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+PERCENTILES = (50, 90, 99)
+
+
+def _bucket_index(ns: int) -> int:
+    if ns < SUB_BUCKETS:
+        return max(ns, 0)
+    shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (ns >> shift) - SUB_BUCKETS
+
+
+def _bucket_bounds(index: int):
+    """[lower, upper) of the bucket in ns"""
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index % SUB_BUCKETS + SUB_BUCKETS
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in ns
+
+    Recording is one bucket increment; percentiles are read from the bucket
+    counts (within 1/16 of the exact value). Counts recorded from several
+    threads at once are approximate.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (64 * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int):
+        self.counts[_bucket_index(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q: float) -> float:
+        """Duration (ns) below which q% of the records are; 0 if empty"""
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                lower, upper = _bucket_bounds(index)
+                return min((lower + upper) / 2, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """count, mean/percentiles/max in microseconds"""
+        summary = {"count": self.count, "mean_us": self.total / self.count / 1e3 if self.count else 0}
+        for q in PERCENTILES:
+            summary[f"p{q}_us"] = self.percentile(q) / 1e3
+        summary["max_us"] = self.max / 1e3
+        return summary
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(perf_counter_ns() - self.start)
+        return False
+
+
+class LatencyProfiler:
+    """Latency of named stages (quote decode, on_bar, send_order, ...)
+
+    Usage:
+        with latency.span("on_bar"):
+            ...
+
+        @latency.timed("indicator")
+        def calculate_session_indicator(...):
+            ...
+
+    Disabled by default: a span is then a shared no-op object and nothing
+    is recorded. When enabled, every stage aggregates into a
+    `LatencyHistogram`; `snapshot` summarises them, and `start_exporter`
+    writes the snapshot to a file periodically and/or serves it on a local
+    HTTP endpoint.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = None
+        self._server = None
+
+    def configure(self, enabled: bool = False, snapshot_file: str = None, interval: float = 60,
+                  port: int = None, **kwargs):
+        """Apply the `LATENCY` config, e.g.
+        {"enabled": true, "snapshot_file": "latency.json", "interval": 60, "port": 9109}"""
+        self.enabled = enabled
+        if enabled and (snapshot_file or port):
+            self.start_exporter(snapshot_file=snapshot_file, interval=interval, port=port)
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def span(self, name: str):
+        """Context manager timing the stage"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self.histogram(name))
+
+    def record(self, name: str, ns: int):
+        """Record a duration measured elsewhere (e.g. with `perf_counter_ns`)"""
+        if self.enabled:
+            self.histogram(name).record(ns)
+
+    def timed(self, name: str):
+        """Decorator timing every call of a function as the stage"""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.histogram(name).record(perf_counter_ns() - start)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Summary (count, mean/p50/p90/p99/max in us) of every stage"""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        return {name: histogram.summary() for name, histogram in histograms}
+
+    def write_snapshot(self, path: str):
+        """Write the snapshot as json (replaced atomically)"""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+    def prometheus_text(self) -> str:
+        """The snapshot in the Prometheus text format (summaries in seconds)"""
+        lines = ["# TYPE quant_trader_stage_latency_seconds summary"]
+        for name, summary in self.snapshot().items():
+            for q in PERCENTILES:
+                lines.append(f'quant_trader_stage_latency_seconds{{stage="{name}",quantile="{q / 100}"}} '
+                             f'{summary[f"p{q}_us"] / 1e6:.9f}')
+            lines.append(f'quant_trader_stage_latency_seconds_sum{{stage="{name}"}} '
+                         f'{summary["mean_us"] * summary["count"] / 1e6:.9f}')
+            lines.append(f'quant_trader_stage_latency_seconds_count{{stage="{name}"}} {summary["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def start_exporter(self, snapshot_file: str = None, interval: float = 60, port: int = None):
+        """Write the snapshot to `snapshot_file` every `interval` seconds, and/or
+        serve it on http://127.0.0.1:`port` (/metrics: Prometheus text, other
+        paths: json)"""
+        self.stop_exporter()
+        self._stop.clear()
+        if snapshot_file:
+            def write():
+                while not self._stop.wait(interval):
+                    try:
+                        self.write_snapshot(snapshot_file)
+                    except Exception:
+                        logger.exception("write latency snapshot fail.", caller=self)
+
+            self._writer = threading.Thread(target=write, name="latency-snapshot", daemon=True)
+            self._writer.start()
+        if port is not None:
+            profiler = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.startswith("/metrics"):
+                        body, content_type = profiler.prometheus_text(), "text/plain; version=0.0.4"
+                    else:
+                        body, content_type = json.dumps(profiler.snapshot()), "application/json"
+                    body = body.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name="latency-metrics", daemon=True).start()
+            logger.info(f"latency metrics on http://127.0.0.1:{self._server.server_port}/metrics", caller=self)
+
+    def stop_exporter(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+latency = LatencyProfiler()
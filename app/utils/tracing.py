@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import queue
+import threading
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import time_ns
+from typing import Optional
+
+from app.utils import logger
+
+__all__ = ("tracer", "OrderTracer", "TraceContext")
+
+# 订单时间线上的事件
+EVENT_ORDER = "order"  # 下单（包含触发下单的行情到达和策略回调的时间）
+EVENT_BROKER_SUBMIT = "broker_submit"  # 网关调用券商下单接口
+EVENT_BROKER_ACK = "broker_ack"  # 券商下单接口返回
+EVENT_ORDER_UPDATE = "order_update"  # 券商推送的订单状态
+EVENT_DEAL = "deal"  # 券商推送的成交
+
+
+@dataclass(frozen=True)
+class TraceContext:
+    """What triggered the orders sent in a strategy callback"""
+    strategy_name: str
+    gateway_name: str
+    ingest_ns: Optional[int]
+    callback_ns: int
+
+
+_context: ContextVar[Optional[TraceContext]] = ContextVar("order_trace_context", default=None)
+
+
+def _json_default(value):
+    # numpy 标量（券商推送的数量、价格等）
+    item = getattr(value, "item", None)
+    return item() if callable(item) else str(value)
+
+
+class OrderTracer:
+    """Tick-to-trade timeline of every order, written as json lines
+
+    The strategy callback opens a context (`begin`) with the ingest time of
+    the quotes; `start_order` gives each order sent in it a correlation id
+    (`Order.trace_id`) and the ingest time, and the gateways stamp the same
+    id on the broker request, ack, order updates and deals (`event`). All
+    times are `time.time_ns()`. Records are written by a background thread;
+    `cmd/tools/order_trace_report.py` summarises a trace file.
+
+    Disabled by default (every call returns at once).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = None
+
+    def configure(self, enabled: bool = False, file: str = "logs/order_trace.jsonl", **kwargs):
+        """Apply the `TRACE` config, e.g. {"enabled": true, "file": "logs/order_trace.jsonl"}"""
+        self.close()
+        self.enabled = enabled
+        if enabled:
+            self.open(file)
+
+    def open(self, path: str):
+        self.close()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.enabled = True
+        self._thread = threading.Thread(target=self._write, args=(path,), name="order_trace", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Write the pending records and stop the writer"""
+        self.enabled = False
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, path: str):
+        with open(path, "a") as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                try:
+                    f.write(json.dumps(record, default=_json_default) + "\n")
+                except (TypeError, ValueError, OSError):
+                    logger.exception("write order trace fail.", record=record, caller=self)
+                if self._queue.empty():
+                    f.flush()
+
+    def begin(self, strategy_name: str, gateway_name: str, ingest_ns: int = None):
+        """Open the context of a strategy callback; returns the token for `end`"""
+        if not self.enabled:
+            return None
+        return _context.set(TraceContext(strategy_name, gateway_name, ingest_ns, time_ns()))
+
+    def end(self, token):
+        if token is not None:
+            _context.reset(token)
+
+    def start_order(self, order, gateway_name: str):
+        """Give the order a correlation id and record what triggered it"""
+        if not self.enabled:
+            return
+        now = time_ns()
+        context = _context.get()
+        order.trace_id = uuid.uuid4().hex
+        if context is not None:
+            order.ingest_ns = context.ingest_ns
+        self._queue.put({
+            "trace_id": order.trace_id,
+            "event": EVENT_ORDER,
+            "ts_ns": now,
+            "strategy": context.strategy_name if context is not None else None,
+            "gateway": gateway_name,
+            "ingest_ns": order.ingest_ns,
+            "callback_ns": context.callback_ns if context is not None else None,
+            "code": order.security.code,
+            "direction": order.direction.value,
+            "order_type": order.order_type.value,
+            "price": order.price,
+            "quantity": order.quantity,
+        })
+
+    def event(self, order, event: str, **fields):
+        """Stamp an event of the order's timeline (orders without id are skipped)"""
+        if not self.enabled or order is None or not getattr(order, "trace_id", ""):
+            return
+        record = {"trace_id": order.trace_id, "event": event, "ts_ns": time_ns()}
+        record.update(fields)
+        self._queue.put(record)
+
+
+tracer = OrderTracer()
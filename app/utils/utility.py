@@ -7,7 +7,7 @@ from datetime import time as Time
 
 import threading
 import queue
-from typing import Any, List
+from typing import Any, Callable, List, Tuple
 
 import func_timeout
 
@@ -21,18 +21,35 @@ class BlockingDict(object):
     def __init__(self):
         self.queue = {}
         self.cv = threading.Condition()
-        self.count = 0
+        self.listeners: List[Callable[[Any, Any], None]] = []
+
+    def add_listener(self, listener: Callable[[Any, Any], None]):
+        """listener(key, value) is called after every `put`"""
+        self.listeners.append(listener)
+
+    def _on_put(self, key, value):
+        """Called with the lock held after `key` is set (for subclasses to maintain indexes)"""
+        pass
+
+    def _on_remove(self, key, value):
+        """Called with the lock held after `key` is removed"""
+        pass
 
     def put(self, key, value):
         with self.cv:
             self.queue[key] = value
+            self._on_put(key, value)
             self.cv.notify_all()
+        for listener in self.listeners:
+            listener(key, value)
 
     def pop(self) -> Any:
         with self.cv:
             while not self.queue:
                 self.cv.wait()
-            return self.queue.popitem()
+            key, value = self.queue.popitem()
+            self._on_remove(key, value)
+            return key, value
 
     def get(self, key, timeout: float = None, default_item: Any = None) -> Any:
         with self.cv:
@@ -41,16 +58,22 @@ class BlockingDict(object):
                     return default_item
             return self.queue.get(key)
 
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, key):
+        return key in self.queue
+
     def __iter__(self):
-        return self
+        # iterate over a snapshot of the keys, so that other threads can put
+        # items while iterating
+        with self.cv:
+            return iter(list(self.queue))
 
-    def __next__(self):
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Snapshot of the (key, value) pairs"""
         with self.cv:
-            if self.count == len(self.queue):
-                self.count = 0
-                raise StopIteration
-            self.count += 1
-            return list(self.queue.keys())[self.count - 1]
+            return list(self.queue.items())
 
 
 class DefaultQueue:
@@ -0,0 +1,114 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import math
+from datetime import datetime, timedelta
+from datetime import time as Time
+from timeit import default_timer as timer
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from app.domain.data import get_trading_day
+from app.gateways.backtest.backtest_history import BarHistory
+
+DAY_SESSIONS = ((Time(9, 30), Time(12, 0)), (Time(13, 0), Time(16, 0)))
+# 夜盘跨越两个自然日
+NIGHT_SESSIONS = ((Time(21, 0), Time(2, 30)), (Time(9, 0), Time(11, 30)), (Time(13, 30), Time(15, 0)))
+
+
+def trading_sessions(sessions, day: datetime) -> List[List[datetime]]:
+    return [[datetime.combine(day.date(), s), datetime.combine(day.date(), e)] for s, e in sessions]
+
+
+def make_bars(days: int, seed: int = 0) -> pd.DataFrame:
+    """1min bars around the clock, with missing minutes"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2022-01-03", periods=days * 24 * 60, freq="1min")
+    times = times[rng.random(len(times)) > 0.05]
+    close = 100 + np.cumsum(rng.normal(0, 0.1, len(times)))
+    return pd.DataFrame({
+        "time_key": times, "open": close + rng.normal(0, 0.05, len(times)), "high": close + 0.1,
+        "low": close - 0.1, "close": close, "volume": rng.integers(1, 1000, len(times)).astype(float)})
+
+
+def reference(df: pd.DataFrame, interval: str, sessions) -> List[tuple]:
+    """逐根 bar 计算所属区间（对照）"""
+    groups = {}
+    open_time, close_time = sessions[0][0], sessions[-1][1]
+    for t, o, h, l, c, v in df[["time_key", "open", "high", "low", "close", "volume"]].itertuples(index=False):
+        t = t.to_pydatetime()
+        tod = t.time()
+        for s, e in sessions:
+            if s <= e and s <= tod <= e:
+                start = datetime.combine(t.date(), s)
+            elif s > e and (tod >= s or tod <= e):
+                start = datetime.combine(t.date() - timedelta(days=int(tod < s)), s)
+            else:
+                continue
+            length = (datetime.combine(t.date(), e) - datetime.combine(t.date(), s)) % timedelta(days=1)
+            break
+        else:
+            continue
+        if interval == "1day":
+            key = get_trading_day(t, open_time, close_time)
+        else:
+            k = timedelta(minutes=int(interval[:-3]))
+            key = min(start + max(math.ceil((t - start) / k), 1) * k, start + length)
+        bar = groups.get(key)
+        if bar is None:
+            groups[key] = [t if interval == "1day" else key, o, h, l, c, v]
+        else:
+            bar[0] = t if interval == "1day" else key
+            bar[2], bar[3], bar[4], bar[5] = max(bar[2], h), min(bar[3], l), c, bar[5] + v
+    return [tuple(b) for b in groups.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized bar aggregation with a per-bar loop")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--periods", type=int, default=10)
+    args = parser.parse_args()
+
+    df = make_bars(args.days)
+    rng = np.random.default_rng(1)
+    requests = [df.time_key.iloc[0].to_pydatetime() + timedelta(
+        seconds=int(rng.integers((args.periods + 3) * 86400, args.days * 86400))) for _ in range(args.requests)]
+    ok = True
+    for name, sessions in (("day sessions", DAY_SESSIONS), ("night sessions", NIGHT_SESSIONS)):
+        for interval in ("5min", "15min", "60min", "1day"):
+            history = BarHistory(df)
+            t_new = 0
+            same = True
+            tic = timer()
+            history.resampled(interval, trading_sessions(sessions, requests[0]))
+            t_build = timer() - tic
+            for cur in requests:
+                if interval == "1day":
+                    expected = reference(df[df.time_key < cur], interval, sessions)
+                else:
+                    expected = [b for b in reference(df[df.time_key <= cur], interval, sessions) if b[0] <= cur]
+                expected = expected[-args.periods:]
+                tic = timer()
+                times, values = history.resampled_window(
+                    args.periods, cur, interval, trading_sessions(sessions, cur))
+                t_new += timer() - tic
+                got = [(t, *v) for t, v in zip(pd.DatetimeIndex(times).to_pydatetime(), values.tolist())]
+                same &= len(got) == len(expected) and all(
+                    g[0] == e[0] and np.allclose(g[1:], e[1:]) for g, e in zip(got, expected))
+            tic = timer()
+            reference(df, interval, sessions)
+            t_ref = timer() - tic
+            ok &= same
+            print(f"{name} {interval}: per-bar loop {t_ref * 1e3:.0f} ms, vectorized build {t_build * 1e3:.1f} ms, "
+                  f"window {t_new / args.requests * 1e6:.0f} us/request, same: {same}")
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from app.constants import Exchange
+from app.domain.data import Bar, BarSeries
+from app.domain.security import Stock
+
+
+@dataclass
+class DictBar:
+    """Bar 之前的实现（普通dataclass，每个实例带 __dict__），作为对照"""
+    datetime: datetime
+    security: Stock
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+
+def measure(name, build, n):
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    data = build(n)
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in end.compare_to(start, "filename"))
+    print(f"{name:<12} {size / n:8.1f} bytes/bar")
+    del data
+    return size / n
+
+
+def build_bars(cls):
+    security = Stock(code="US.AAPL", security_name="苹果", exchange=Exchange.NASDAQ)
+    t0 = datetime(2020, 1, 2, 9, 30)
+
+    def build(n):
+        return [cls(datetime=t0 + timedelta(minutes=i), security=security, open=1.0 + i, high=2.0 + i,
+                    low=0.5 + i, close=1.5 + i, volume=100.0 + i) for i in range(n)]
+    return build
+
+
+def build_series(n):
+    security = Stock(code="US.AAPL", security_name="苹果", exchange=Exchange.NASDAQ)
+    t0 = datetime(2020, 1, 2, 9, 30)
+    series = BarSeries(security, maxlen=n)
+    for i in range(n):
+        series.append(Bar(datetime=t0 + timedelta(minutes=i), security=security, open=1.0 + i, high=2.0 + i,
+                          low=0.5 + i, close=1.5 + i, volume=100.0 + i))
+    return series
+
+
+def main(n: int = 100000):
+    legacy = measure("dataclass", build_bars(DictBar), n)
+    slotted = measure("slots", build_bars(Bar), n)
+    series = measure("BarSeries", build_series, n)
+    print(f"slots: {legacy / slotted:.1f}x smaller, BarSeries: {legacy / series:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,119 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+from datetime import datetime, timedelta
+from datetime import time as Time
+from timeit import default_timer as timer
+
+import numpy as np
+
+from app.domain.calendar_service import calendar_service
+from app.utils.utility import is_trading_time
+
+DAY_SESSIONS = ((Time(9, 30), Time(12, 0)), (Time(13, 0), Time(16, 0)))
+# 夜盘跨越两个自然日
+NIGHT_SESSIONS = ((Time(21, 0), Time(2, 30)), (Time(9, 0), Time(11, 30)), (Time(13, 30), Time(15, 0)))
+
+
+def legacy_next_session(trading_sessions, cur_datetime: datetime) -> datetime:
+    """改动前 BacktestGateway.get_next_session_datetime 的实现"""
+    trading_day = cur_datetime.date()
+    trading_day_sessions = []
+    if trading_sessions[-1][1] > trading_sessions[0][0]:
+        for start, end in trading_sessions:
+            session_start = datetime.combine(trading_day, start.time())
+            session_end = datetime.combine(trading_day, end.time())
+            trading_day_sessions.append([session_start, session_end])
+    else:
+        next_trading_day = trading_day + timedelta(days=1)
+        is_next_day = False
+        for idx, (start, end) in enumerate(trading_sessions):
+            if is_next_day:
+                trading_day_sessions.append([datetime.combine(next_trading_day, start.time()),
+                                             datetime.combine(next_trading_day, end.time())])
+            elif end.time() < start.time():
+                trading_day_sessions.append([datetime.combine(trading_day, start.time()),
+                                             datetime.combine(next_trading_day, end.time())])
+                is_next_day = True
+            elif end.time() >= start.time():
+                trading_day_sessions.append([datetime.combine(trading_day, start.time()),
+                                             datetime.combine(trading_day, end.time())])
+                if idx < len(trading_sessions) - 1:
+                    next_start, next_end = trading_sessions[idx + 1]
+                    if next_start.time() < end.time():
+                        is_next_day = True
+    for session in trading_day_sessions:
+        if cur_datetime < session[0]:
+            return session[0]
+    return trading_day_sessions[0][0] + timedelta(days=1)
+
+
+def reference_next_session(trading_sessions, cur_datetime: datetime) -> datetime:
+    """最近的下一个开盘时间（逐日枚举）"""
+    starts = [datetime.combine(cur_datetime.date() + timedelta(days=d), s[0].time())
+              for d in (0, 1) for s in trading_sessions]
+    return min(s for s in starts if s > cur_datetime)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the session timeline with rebuilding the sessions")
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    start = datetime(2022, 1, 3)
+    end = start + timedelta(days=args.days)
+    rng = np.random.default_rng(0)
+    queries = [start + timedelta(seconds=int(s)) for s in rng.integers(0, args.days * 86400, args.queries)]
+    ok = True
+    for name, sessions in (("day sessions", DAY_SESSIONS), ("night sessions", NIGHT_SESSIONS)):
+        trading_sessions = [[datetime.combine(start.date(), s), datetime.combine(start.date(), e)]
+                            for s, e in sessions]
+        tic = timer()
+        timeline = calendar_service.session_timeline(
+            trading_sessions, start.date() - timedelta(days=1), end.date() + timedelta(days=2))
+        t_build = timer() - tic
+
+        tic = timer()
+        legacy = [(is_trading_time(t.time(), trading_sessions), legacy_next_session(trading_sessions, t))
+                  for t in queries]
+        t_legacy = timer() - tic
+        tic = timer()
+        got = [(timeline.is_open(t), timeline.next_open(t)) for t in queries]
+        t_new = timer() - tic
+
+        expected = [(is_open, reference_next_session(trading_sessions, t))
+                    for t, (is_open, _) in zip(queries, legacy)]
+        same = got == expected
+        same_legacy = sum(g[1] == l[1] for g, l in zip(got, legacy))
+        ok &= same
+        print(f"{name}: rebuild {t_legacy / args.queries * 1e6:.1f} us/query -> timeline "
+              f"{t_new / args.queries * 1e6:.1f} us/query (built in {t_build * 1e3:.1f} ms), "
+              f"same as reference: {same}, next open same as before: {same_legacy}/{args.queries}")
+
+    try:
+        import exchange_calendars as xcals
+    except ImportError:
+        print("exchange_calendars is not installed, skip the exchange calendars")
+    else:
+        for exchange in ("XNYS", "XHKG"):
+            calendar = xcals.get_calendar(exchange)
+            minutes = [datetime(2023, 1, 2) + timedelta(minutes=int(m)) for m in rng.integers(0, 365 * 1440, 2000)]
+            tic = timer()
+            expected = [calendar.is_open_on_minute(m.strftime("%Y-%m-%d %H:%M")) for m in minutes]
+            t_legacy = timer() - tic
+            tic = timer()
+            got = [calendar_service.is_open_on_minute(exchange, m) for m in minutes]
+            t_new = timer() - tic
+            same = got == expected
+            ok &= same
+            print(f"{exchange}: is_open_on_minute {t_legacy / len(minutes) * 1e6:.1f} us -> "
+                  f"{t_new / len(minutes) * 1e6:.1f} us, same: {same}")
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Exchange
+from app.domain.data import Bar, _get_data_iterator
+from app.domain.security import Stock
+
+
+def legacy_data_iterator(security: Stock, full_data: pd.DataFrame):
+    """_get_data_iterator 之前的实现（iterrows），作为对照"""
+    time_col = full_data.columns[0]
+    for _, row in full_data.iterrows():
+        cur_time = row[time_col]
+        if not isinstance(row[time_col], str):
+            cur_time = cur_time.to_pydatetime()
+        kwargs = {"datetime": cur_time, "security": security}
+        for col in full_data.columns:
+            if col == time_col:
+                continue
+            kwargs[col] = row[col]
+        yield Bar(**kwargs)
+
+
+def make_minute_data(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    close = 100 + rng.standard_normal(n).cumsum()
+    return pd.DataFrame({
+        "time_key": pd.date_range("2020-01-02 09:30:00", periods=n, freq="min"),
+        "open": close + rng.standard_normal(n) * 0.1,
+        "high": close + 0.5,
+        "low": close - 0.5,
+        "close": close,
+        "volume": rng.integers(100, 10000, n).astype(float),
+    })
+
+
+def bench(name, func, *args):
+    tic = timer()
+    n = sum(1 for _ in func(*args))
+    toc = timer()
+    print(f"{name:<12} {n} bars in {toc - tic:.3f}s ({(toc - tic) / n * 1e6:.2f} us/bar)")
+    return toc - tic
+
+
+def main(n: int = 200000):
+    security = Stock(code="US.AAPL", security_name="苹果", exchange=Exchange.NASDAQ)
+    data = make_minute_data(n)
+
+    # 结果一致性
+    for old, new in zip(legacy_data_iterator(security, data.head(1000)),
+                        _get_data_iterator(security, data.head(1000), "Bar")):
+        assert old == new, (old, new)
+
+    t_old = bench("iterrows", legacy_data_iterator, security, data)
+    t_new = bench("columnar", _get_data_iterator, security, data, "Bar")
+    print(f"speedup: {t_old / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
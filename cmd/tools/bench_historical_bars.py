@@ -0,0 +1,291 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from datetime import time as Time
+from timeit import default_timer as timer
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+import app.utils as utils
+from trader_config import DATA_PATH, DATA_FFILL
+from app.constants import Exchange
+from app.domain.data import Bar
+from app.domain.data import _get_data_path
+from app.domain.data import _load_historical_bars_in_reverse
+from app.domain.security import Security, Stock
+from app.gateways.backtest.backtest_history import HistoricalBarIndex
+from app.utils.utility import is_trading_time
+
+SESSIONS = ((Time(9, 30), Time(12, 0)), (Time(13, 0), Time(16, 0)))
+
+
+def legacy_min_bars(
+        security: Security,
+        periods: int,
+        cur_datetime: datetime = None,
+        trading_sessions: List[datetime] = None,
+        mode: str = "direct",
+        interval: str = "1min"
+) -> List[Bar]:
+    """改动前的实现：每次请求都列出并读取全部 csv，逐行往前遍历"""
+    if mode not in ("direct",):
+        raise ValueError(f"mode {mode} is invalid; only 'direct' is allowed.")
+    if mode == "aggregate":
+        data_path = _get_data_path(security, "kline", interval="1min")
+    elif mode == "direct":
+        data_path = _get_data_path(security, "kline", interval=interval)
+
+    # Use trading sessions to determine daily open & close time
+    daily_open_time = None
+    daily_close_time = None
+    if (
+            (trading_sessions is not None)
+            and (len(trading_sessions) > 0)
+    ):
+        daily_open_time = trading_sessions[0][0].time()
+        daily_close_time = trading_sessions[-1][1].time()
+
+    interval_value = int(interval.replace("min", ""))
+    hist_csv_files = _load_historical_bars_in_reverse(
+        security, cur_datetime, interval)
+    bars = []
+    for n, hist_csv_file in enumerate(hist_csv_files):
+        df = pd.read_csv(f"{data_path}/{hist_csv_file}")
+        df["time_key"] = pd.to_datetime(df["time_key"])
+        df = df[df.time_key <= cur_datetime]  # if n == 0 else df
+        for _, row in df.iloc[::-1].iterrows():
+            bar_datetime = row.time_key.to_pydatetime()
+            if (
+                    (daily_open_time is not None)
+                    and (daily_close_time is not None)
+                    and (daily_open_time < daily_close_time)
+                    and (bar_datetime.time() < daily_open_time
+                         or bar_datetime.time() > daily_close_time)
+            ):
+                continue
+            elif (
+                    (daily_open_time is not None)
+                    and (daily_close_time is not None)
+                    and (daily_open_time > daily_close_time)
+                    and (daily_close_time < bar_datetime.time() < daily_open_time)
+            ):
+                continue
+
+            bar = Bar(
+                security=security,
+                datetime=bar_datetime,
+                open=row.open,
+                high=row.high,
+                low=row.low,
+                close=row.close,
+                volume=row.volume
+            )
+
+            # fill with previous bar if current bar is not available
+            if len(bars) == 0:
+                cur_dt = datetime(
+                    year=cur_datetime.year,
+                    month=cur_datetime.month,
+                    day=cur_datetime.day,
+                    hour=cur_datetime.hour,
+                    minute=cur_datetime.minute,
+                    second=cur_datetime.second
+                )
+                while cur_dt > bar_datetime:
+                    ffill_bar_datetime = cur_dt
+                    _is_trading_time = is_trading_time(
+                        cur_time=ffill_bar_datetime.time(),
+                        trading_sessions=trading_sessions
+                    )
+                    if _is_trading_time and DATA_FFILL:
+                        ffill_bar = Bar(
+                            security=security,
+                            datetime=ffill_bar_datetime,
+                            open=row.open,
+                            high=row.high,
+                            low=row.low,
+                            close=row.close,
+                            volume=row.volume
+                        )
+                        bars.append(ffill_bar)
+                    cur_dt -= timedelta(minutes=interval_value)
+            else:
+                time_delta = int(
+                    (bars[-1].datetime - bar_datetime).total_seconds() / 60)
+                while time_delta > interval_value:
+                    ffill_bar_datetime = cur_dt
+                    ffill_bar_datetime = (
+                            bars[-1].datetime
+                            - timedelta(minutes=interval_value)
+                    )
+                    _is_trading_time = utils.is_trading_time(
+                        cur_time=ffill_bar_datetime.time(),
+                        trading_sessions=trading_sessions
+                    )
+                    if _is_trading_time and DATA_FFILL:
+                        ffill_bar = Bar(
+                            security=security,
+                            datetime=ffill_bar_datetime,
+                            open=row.open,
+                            high=row.high,
+                            low=row.low,
+                            close=row.close,
+                            volume=row.volume
+                        )
+                        bars.append(ffill_bar)
+                    time_delta -= interval_value
+
+            bars.append(bar)
+            if len(bars) >= periods:
+                return bars[:periods][::-1]
+    raise ValueError(
+        f"There is not sufficient historical 1min data for {security.code}. "
+        f"We want {periods} data points, but only got {len(bars)}.")
+
+
+def legacy_day_bars(
+        security: Security,
+        periods: int,
+        cur_datetime: datetime = None,
+        trading_sessions: List[datetime] = None,
+        mode: str = "direct",
+        interval: str = "1day"
+) -> List[Bar]:
+    """改动前的实现（direct 模式）：每次请求都列出并读取全部 csv"""
+    data_path = _get_data_path(security, "kline", interval=interval)
+    hist_csv_files = _load_historical_bars_in_reverse(
+        security,
+        cur_datetime,
+        interval=interval)
+    hist_csv_files = sorted(hist_csv_files, reverse=False)
+    hist_data = pd.DataFrame()
+    for n, hist_csv_file in enumerate(hist_csv_files):
+        df = pd.read_csv(f"{data_path}/{hist_csv_file}")
+        df["time_key"] = pd.to_datetime(df["time_key"])
+        hist_data = pd.concat([hist_data, df])
+    hist_data = hist_data[hist_data.time_key < datetime.combine(
+        cur_datetime.date(), Time(0, 0, 0))]
+    assert hist_data.shape[0] >= periods, (
+        f"There is not sufficient historical 1day data for {security.code}."
+        f" We want {periods} data points, but only got "
+        f"{hist_data.shape[0]}.")
+    bars = []
+    for _, row in hist_data.iloc[-periods:].iterrows():
+        bar = Bar(
+            security=security,
+            datetime=row.time_key.to_pydatetime(),
+            open=row.open,
+            high=row.high,
+            low=row.low,
+            close=row.close,
+            volume=row.volume
+        )
+        bars.append(bar)
+    return bars
+
+
+def trading_sessions(day: datetime) -> List[List[datetime]]:
+    return [[datetime.combine(day.date(), s), datetime.combine(day.date(), e)] for s, e in SESSIONS]
+
+
+def write_data(path: str, security: Security, days: List[datetime], seed: int = 0):
+    """1min bars (with missing minutes and some pre-market bars) and daily bars, one csv per day"""
+    rng = np.random.default_rng(seed)
+    min_path = f"{path}/K_1M/{security.code}"
+    day_path = f"{path}/K_1D/{security.code}"
+    os.makedirs(min_path)
+    os.makedirs(day_path)
+    price = 100.0
+    for day in days:
+        times = pd.date_range(datetime.combine(day.date(), Time(9, 0)),
+                              datetime.combine(day.date(), Time(16, 0)), freq="1min")
+        tod = times.time
+        keep = ((tod >= SESSIONS[0][0]) & (tod <= SESSIONS[0][1])) | (tod >= SESSIONS[1][0]) \
+            | (rng.random(len(times)) < 0.1)
+        keep &= rng.random(len(times)) > 0.05
+        times = times[keep]
+        close = price + np.cumsum(rng.normal(0, 0.1, len(times)))
+        price = close[-1]
+        df = pd.DataFrame({
+            "time_key": times.strftime("%Y-%m-%d %H:%M:%S"), "open": close + 0.05, "high": close + 0.1,
+            "low": close - 0.1, "close": close, "volume": rng.integers(1, 1000, len(times)).astype(float)})
+        df.to_csv(f"{min_path}/{day:%Y-%m-%d}.csv", index=False)
+        pd.DataFrame({
+            "time_key": [f"{day:%Y-%m-%d} 00:00:00"], "open": [close[0]], "high": [close.max()],
+            "low": [close.min()], "close": [close[-1]], "volume": [float(df.volume.sum())]
+        }).to_csv(f"{day_path}/{day:%Y-%m-%d}.csv", index=False)
+
+
+def as_tuples(bars):
+    return [(b.datetime, b.open, b.high, b.low, b.close, b.volume) for b in bars]
+
+
+def call(fn, **kwargs):
+    try:
+        return as_tuples(fn(**kwargs))
+    except (ValueError, AssertionError) as e:
+        return type(e).__name__
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the in-memory history index with the csv scans")
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--periods", type=int, default=300)
+    args = parser.parse_args()
+
+    security = Stock(code="HK.00700", security_name="TENCENT", lot_size=100, exchange=Exchange.SEHK)
+    days = [d.to_pydatetime() for d in pd.bdate_range("2022-01-03", periods=args.days)]
+    rng = np.random.default_rng(1)
+    requests = []
+    for _ in range(args.requests):
+        day = days[int(rng.integers(1, len(days)))]
+        cur = datetime.combine(day.date(), Time(9, 0)) + timedelta(seconds=int(rng.integers(0, 8 * 3600)))
+        requests.append((cur, int(rng.integers(1, args.periods))))
+
+    kline_path = DATA_PATH["kline"]
+    with tempfile.TemporaryDirectory() as tmp:
+        DATA_PATH["kline"] = tmp
+        try:
+            write_data(tmp, security, days)
+            history = HistoricalBarIndex()
+            cases = (
+                ("1min", legacy_min_bars, history.min_bars, dict(mode="direct", interval="1min")),
+                ("1day", legacy_day_bars, history.day_bars, dict(mode="direct", interval="1day")),
+            )
+            ok = True
+            print(f"{args.days} days, {args.requests} requests, {DATA_FFILL=}")
+            for name, legacy, index, legacy_kwargs in cases:
+                t_old = t_new = 0
+                same = True
+                for cur, periods in requests:
+                    periods = periods if "min" in name else max(1, periods // 30)
+                    kwargs = dict(security=security, periods=periods, cur_datetime=cur)
+                    tic = timer()
+                    expected = call(legacy, trading_sessions=trading_sessions(cur), **kwargs, **legacy_kwargs)
+                    t_old += timer() - tic
+                    if name == "1day":
+                        new_kwargs = kwargs
+                    else:
+                        new_kwargs = dict(kwargs, trading_sessions=trading_sessions(cur))
+                    tic = timer()
+                    got = call(index, **new_kwargs)
+                    t_new += timer() - tic
+                    same &= got == expected
+                ok &= same
+                print(f"{name}: csv scan {t_old / args.requests * 1e3:.2f} ms/request -> "
+                      f"index {t_new / args.requests * 1e3:.3f} ms/request, same: {same}")
+        finally:
+            DATA_PATH["kline"] = kline_path
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import sys as _sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Exchange
+from app.domain.data import Bar
+from app.domain.security import Stock
+from app.factors import IndicatorEngine, DailyBarCursor, EMA, SMA, MACD, KDJ, ATR, RSI, Donchian
+
+
+def non_zero_range(high, low):
+    diff = high - low
+    if diff.eq(0).any():
+        diff += _sys.float_info.epsilon
+    return diff
+
+
+def rma(close, length):
+    return close.ewm(alpha=1.0 / length, min_periods=length).mean()
+
+
+def ema(close, length):
+    close = close.copy()
+    sma_nth = close[0:length].mean()
+    close[:length - 1] = np.nan
+    close.iloc[length - 1] = sma_nth
+    return close.ewm(span=length, adjust=False).mean()
+
+
+def reference(df: pd.DataFrame) -> pd.DataFrame:
+    """pandas_ta 的计算公式（未安装 pandas_ta 时作为对照）"""
+    try:
+        import pandas_ta as ta
+    except ImportError:
+        ta = None
+    ref = pd.DataFrame(index=df.index)
+    if ta is not None:
+        ref["EMA_20"] = ta.ema(df["close"], 20)
+        ref["SMA_VOLUME_20"] = ta.sma(df["volume"], 20)
+        macd = ta.macd(df["close"], 12, 26, 9)
+        ref["MACD"], ref["MACD_H"], ref["MACD_S"] = macd.iloc[:, 0], macd.iloc[:, 1], macd.iloc[:, 2]
+        kdj = ta.kdj(df["high"], df["low"], df["close"], 9, 6)
+        ref["K"], ref["D"], ref["J"] = kdj.iloc[:, 0], kdj.iloc[:, 1], kdj.iloc[:, 2]
+        ref["ATR"] = ta.atr(df["high"], df["low"], df["close"], 14)
+        ref["ATR_SMA"] = ta.atr(df["high"], df["low"], df["close"], 20, mamode="sma")
+        ref["RSI"] = ta.rsi(df["close"], 14)
+        dc = ta.donchian(df["high"], df["low"], 20, 20)
+        ref["DCL"], ref["DCM"], ref["DCU"] = dc.iloc[:, 0], dc.iloc[:, 1], dc.iloc[:, 2]
+        return ref
+
+    close, high, low = df["close"], df["high"], df["low"]
+    ref["EMA_20"] = ema(close, 20)
+    ref["SMA_VOLUME_20"] = df["volume"].rolling(20).mean()
+    macd = ema(close, 12) - ema(close, 26)
+    signal = ema(macd.loc[macd.first_valid_index():], 9)
+    ref["MACD"], ref["MACD_H"], ref["MACD_S"] = macd, macd - signal, signal
+    fastk = 100 * (close - low.rolling(9).min()) / non_zero_range(high.rolling(9).max(), low.rolling(9).min())
+    k = rma(fastk, 6)
+    d = rma(k, 6)
+    ref["K"], ref["D"], ref["J"] = k, d, 3 * k - 2 * d
+    prev_close = close.shift(1)
+    tr = pd.concat([non_zero_range(high, low), high - prev_close, prev_close - low], axis=1).abs().max(axis=1)
+    tr.iloc[:1] = np.nan
+    ref["ATR"] = rma(tr, 14)
+    ref["ATR_SMA"] = tr.rolling(20).mean()
+    change = close.diff(1)
+    gain, loss = change.clip(lower=0), change.clip(upper=0)
+    gain_avg, loss_avg = rma(gain, 14), rma(loss, 14)
+    ref["RSI"] = 100 * gain_avg / (gain_avg + loss_avg.abs())
+    ref["DCL"], ref["DCU"] = low.rolling(20).min(), high.rolling(20).max()
+    ref["DCM"] = 0.5 * (ref["DCL"] + ref["DCU"])
+    return ref
+
+
+def make_bars(n: int):
+    security = Stock(code="US.AAPL", security_name="苹果", exchange=Exchange.NASDAQ)
+    rng = np.random.default_rng(0)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, n))
+    high = close + rng.uniform(0, 1, n)
+    low = close - rng.uniform(0, 1, n)
+    open_ = low + (high - low) * rng.uniform(0, 1, n)
+    volume = rng.integers(100, 10000, n).astype(float)
+    t0 = datetime(2020, 1, 2, 9, 30)
+    bars = [
+        Bar(datetime=t0 + timedelta(minutes=i), security=security, open=open_[i], high=high[i],
+            low=low[i], close=close[i], volume=volume[i])
+        for i in range(n)
+    ]
+    df = pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": volume})
+    return security, bars, df
+
+
+def streaming(security, bars) -> pd.DataFrame:
+    engine = IndicatorEngine()
+    engine.subscribe(security, "EMA_20", EMA(20))
+    engine.subscribe(security, "SMA_VOLUME_20", SMA(20, source="volume"))
+    engine.subscribe(security, "MACD", MACD(12, 26, 9))
+    engine.subscribe(security, "KDJ", KDJ(9, 6))
+    engine.subscribe(security, "ATR", ATR(14))
+    engine.subscribe(security, "ATR_SMA", ATR(20, mamode="sma"))
+    engine.subscribe(security, "RSI", RSI(14))
+    engine.subscribe(security, "DC", Donchian(20, 20))
+    rows = []
+    start = time.perf_counter()
+    for bar in bars:
+        rows.append(engine.update_bar(bar))
+    elapsed = time.perf_counter() - start
+    out = pd.DataFrame({
+        "EMA_20": [r["EMA_20"] for r in rows],
+        "SMA_VOLUME_20": [r["SMA_VOLUME_20"] for r in rows],
+        "MACD": [r["MACD"][0] for r in rows],
+        "MACD_H": [r["MACD"][1] for r in rows],
+        "MACD_S": [r["MACD"][2] for r in rows],
+        "K": [r["KDJ"][0] for r in rows],
+        "D": [r["KDJ"][1] for r in rows],
+        "J": [r["KDJ"][2] for r in rows],
+        "ATR": [r["ATR"] for r in rows],
+        "ATR_SMA": [r["ATR_SMA"] for r in rows],
+        "RSI": [r["RSI"] for r in rows],
+        "DCL": [r["DC"][0] for r in rows],
+        "DCM": [r["DC"][1] for r in rows],
+        "DCU": [r["DC"][2] for r in rows],
+    })
+    return out, elapsed
+
+
+def atr_sma(df: pd.DataFrame, length: int) -> pd.Series:
+    """ta.atr(mamode='sma') 的计算公式"""
+    close, high, low = df["close"], df["high"], df["low"]
+    prev_close = close.shift(1)
+    tr = pd.concat([non_zero_range(high, low), high - prev_close, prev_close - low], axis=1).abs().max(axis=1)
+    tr.iloc[:1] = np.nan
+    return tr.rolling(length).mean()
+
+
+def check_session_atr(security, bars, length: int = 20, days: int = 500) -> bool:
+    """海龟策略的当日 ATR：逐日喂入 + peek_bar，对照每根 bar 重算日线 ATR
+
+    每个交易日用一根盘中的 bar（当日日线的一部分）检查实盘的算法，用当日日线检查回测的算法。
+    """
+    daily = bars[:days]
+    df = pd.DataFrame({f: [getattr(b, f) for b in daily] for f in ("open", "high", "low", "close", "volume")})
+    days_ = [datetime(2020, 1, 1) + timedelta(days=i) for i in range(len(daily))]
+    daily = [Bar(datetime=d, security=security, open=b.open, high=b.high, low=b.low, close=b.close,
+                 volume=b.volume) for d, b in zip(days_, daily)]
+    engine = IndicatorEngine()
+    cursor = DailyBarCursor(engine)
+    # 同一证券还订阅了不支持 peek 的指标（EMA、MACD），peek_bar 只计算指定的指标
+    cursor.load(security, daily, {"ATR": lambda: ATR(length, mamode="sma"),
+                                  "ATR_RMA": lambda: ATR(14), "EMA": lambda: EMA(10), "MACD": lambda: MACD()})
+    ok = True
+    new = old = 0.0
+    for i, day_bar in enumerate(daily):
+        running = Bar(datetime=day_bar.datetime.replace(hour=10), security=security, open=day_bar.open,
+                      high=(day_bar.open + day_bar.high) / 2, low=(day_bar.open + day_bar.low) / 2,
+                      close=(day_bar.high + day_bar.low) / 2, volume=day_bar.volume / 2)
+        start = time.perf_counter()
+        cursor.advance(security, running.datetime.date())
+        backtest = engine.peek_bar(cursor.bar_of(security, running.datetime.date()), ["ATR"])
+        live = engine.peek_bar(running, ["ATR"])
+        new += time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected_backtest = atr_sma(df.iloc[:i + 1], length).iloc[-1]
+        live_df = pd.concat([df.iloc[:i], pd.DataFrame([{"open": running.open, "high": running.high,
+                                                          "low": running.low, "close": running.close}])],
+                            ignore_index=True)
+        expected_live = atr_sma(live_df, length).iloc[-1]
+        old += time.perf_counter() - start
+        ok &= bool(np.allclose([backtest["ATR"], live["ATR"]], [expected_backtest, expected_live],
+                               rtol=1e-9, atol=1e-9, equal_nan=True))
+    # peek_bar 与 update_bar 的结果一致（RMA）
+    rma_engine = IndicatorEngine()
+    rma_engine.subscribe(security, "ATR_RMA", ATR(14))
+    for day_bar in daily:
+        peeked = rma_engine.peek_bar(day_bar, ["ATR_RMA"])["ATR_RMA"]
+        ok &= bool(np.allclose(peeked, rma_engine.update_bar(day_bar)["ATR_RMA"], equal_nan=True))
+    print(f"session ATR ({len(daily)} days): match={ok}, peek {new / len(daily) * 1e6:.1f} us/bar, "
+          f"recompute {old / len(daily) * 1e6:.1f} us/bar")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check streaming indicators against pandas_ta and time them")
+    parser.add_argument("-n", type=int, default=20000, help="number of bars")
+    parser.add_argument("--window", type=int, default=120, help="window recomputed per bar by the old approach")
+    args = parser.parse_args()
+
+    security, bars, df = make_bars(args.n)
+    out, elapsed = streaming(security, bars)
+    ref = reference(df)
+    ok = True
+    for col in ref.columns:
+        a, b = out[col].to_numpy(), ref[col].to_numpy(dtype=float)
+        same_nan = np.array_equal(np.isnan(a), np.isnan(b))
+        close = np.allclose(a, b, rtol=1e-9, atol=1e-9, equal_nan=True)
+        ok &= same_nan and close
+        print(f"{col:<14} nan-aligned={same_nan} max-abs-diff={np.nanmax(np.abs(a - b)):.3e}")
+    ok &= check_session_atr(security, bars)
+    print(f"match: {ok}")
+
+    # old approach: rebuild the window and recompute on every bar
+    m = min(args.n - args.window, 2000)
+    start = time.perf_counter()
+    for i in range(args.window, args.window + m):
+        reference(df.iloc[i - args.window:i])
+    window_elapsed = (time.perf_counter() - start) / m
+    print(f"streaming:  {elapsed / args.n * 1e6:10.1f} us/bar")
+    print(f"recompute:  {window_elapsed * 1e6:10.1f} us/bar (window={args.window})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import copy
+import math
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Direction, Offset, OrderStatus, OrderTimeInForce, OrderType
+from app.domain.data import Bar
+from app.domain.order import Order
+from app.domain.security import Stock
+from app.gateways.backtest.backtest_matching import OrderMatcher
+
+SECURITY = Stock(code="HK.00700", lot_size=100, security_name="TENCENT")
+
+
+def make_bars(n: int, minutes_per_bar: int, seed: int = 0):
+    """随机游走的 bar，以及每根 bar 内的分钟线"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2022, 1, 3, 9, 30)
+    price = 100.0
+    bars = []
+    for i in range(n):
+        t0 = np.datetime64(start + timedelta(minutes=i * minutes_per_bar), "ns").astype(np.int64)
+        times = t0 + np.arange(1, minutes_per_bar + 1, dtype=np.int64) * 60 * 10 ** 9
+        close = price + np.cumsum(rng.normal(0, 0.05, minutes_per_bar))
+        opens = np.concatenate(([price], close[:-1]))
+        values = np.column_stack((
+            opens, np.maximum(opens, close) + rng.random(minutes_per_bar) * 0.03,
+            np.minimum(opens, close) - rng.random(minutes_per_bar) * 0.03, close,
+            rng.integers(1, 500, minutes_per_bar).astype(float) * SECURITY.lot_size))
+        price = close[-1]
+        bar = Bar(security=SECURITY, datetime=start + timedelta(minutes=(i + 1) * minutes_per_bar),
+                  open=values[0, 0], high=values[:, 1].max(), low=values[:, 2].min(), close=values[-1, 3],
+                  volume=values[:, 4].sum())
+        bars.append((bar, (times, values)))
+    return bars
+
+
+def reference_match(pending: dict, bar: Bar, minutes, volume_limit):
+    """逐个订单扫描（对照）"""
+    candidates = []
+    for seq, order in pending.items():
+        buy = order.direction == Direction.LONG
+        if minutes is not None:
+            times, values = minutes
+            for j in range(len(times)):
+                if (buy and values[j, 2] <= order.price) or (not buy and values[j, 1] >= order.price):
+                    break
+            else:
+                continue
+            open_, time = values[j, 0], pd.Timestamp(int(times[j])).to_pydatetime()
+        elif (buy and bar.low <= order.price) or (not buy and bar.high >= order.price):
+            j, open_, time = 0, bar.open, bar.datetime
+        else:
+            continue
+        price = min(order.price, open_) if buy else max(order.price, open_)
+        candidates.append(((j, not buy, -order.price if buy else order.price, seq), order, price, time))
+    candidates.sort(key=lambda c: c[0])
+    capacity = math.inf
+    if volume_limit is not None:
+        capacity = (minutes[1][:, 4].sum() if minutes is not None else bar.volume) * volume_limit
+    fills = []
+    for _, order, price, time in candidates:
+        # 数量以手为单位，成交量以股为单位
+        remaining = order.quantity - order.filled_quantity
+        quantity = remaining if capacity >= remaining * SECURITY.lot_size else math.floor(capacity / SECURITY.lot_size)
+        if quantity <= 0:
+            break
+        capacity -= quantity * SECURITY.lot_size
+        fills.append((order.orderid, price, quantity, time))
+    return fills
+
+
+def apply(order: Order, quantity: float):
+    order.filled_quantity += quantity
+    order.status = OrderStatus.FILLED if order.filled_quantity >= order.quantity else OrderStatus.PART_FILLED
+
+
+def run(bars, args, use_minutes: bool, volume_limit):
+    rng = np.random.default_rng(1)
+    matcher = OrderMatcher(volume_limit=volume_limit)
+    pending = {}  # seq -> order (对照)
+    by_id = {}
+    seq = 0
+    same = True
+    t_new = t_ref = 0
+    n_fills = 0
+    bars_per_day = 390 // args.minutes_per_bar
+    for i, (bar, minutes) in enumerate(bars):
+        day = i // bars_per_day
+        minutes = minutes if use_minutes else None
+        # DAY 订单在下一个交易日过期
+        tic = timer()
+        expired = matcher.expire(SECURITY, day)
+        fills = matcher.match(SECURITY, bar, minutes)
+        t_new += timer() - tic
+        got = [(f.order.orderid, f.price, f.quantity, f.time) for f in fills]
+
+        tic = timer()
+        expired_ref = [s for s, o in pending.items() if o.time_in_force == OrderTimeInForce.DAY and o.remark < day]
+        expired_ref = [pending.pop(s) for s in expired_ref]
+        expected = reference_match(pending, bar, minutes, volume_limit)
+        t_ref += timer() - tic
+        same &= sorted(o.orderid for o in expired) == sorted(o.orderid for o in expired_ref)
+        same &= len(got) == len(expected) and all(
+            g[0] == e[0] and np.isclose(g[1], e[1]) and g[2] == e[2] and g[3] == e[3]
+            for g, e in zip(got, expected))
+
+        for orderid, _, quantity, _ in got:
+            apply(by_id[orderid][0], quantity)
+        for orderid, _, quantity, _ in expected:
+            s, order = by_id[orderid][2], by_id[orderid][1]
+            apply(order, quantity)
+            if order.status == OrderStatus.FILLED:
+                pending.pop(s)
+        n_fills += len(got)
+
+        # 撤掉部分订单，再挂新的订单
+        for s in list(pending)[:: max(1, len(pending) // 3)][:args.cancels]:
+            order = pending.pop(s)
+            same &= matcher.cancel(by_id[order.orderid][0])
+        for _ in range(args.orders):
+            seq += 1
+            buy = rng.random() < 0.5
+            price = round(bar.close + (-1 if buy else 1) * rng.exponential(1.0), 2)
+            order = Order(security=SECURITY, price=price, quantity=int(rng.integers(1, 200)),
+                          direction=Direction.LONG if buy else Direction.SHORT,
+                          offset=Offset.OPEN if buy else Offset.CLOSE, order_type=OrderType.LIMIT,
+                          create_time=bar.datetime, status=OrderStatus.SUBMITTED,
+                          time_in_force=OrderTimeInForce.DAY if rng.random() < 0.2 else OrderTimeInForce.GTC,
+                          orderid=f"order-{seq}", remark=day)
+            ref_order = copy.copy(order)
+            by_id[order.orderid] = (order, ref_order, seq)
+            pending[seq] = ref_order
+            matcher.add(order, day)
+    return same, t_new, t_ref, n_fills, len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the order book matching with scanning every order")
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--minutes_per_bar", type=int, default=5)
+    parser.add_argument("--orders", type=int, default=20, help="new orders per bar")
+    parser.add_argument("--cancels", type=int, default=2, help="cancelled orders per bar")
+    args = parser.parse_args()
+
+    bars = make_bars(args.bars, args.minutes_per_bar)
+    ok = True
+    for use_minutes in (False, True):
+        for volume_limit in (None, 0.1):
+            same, t_new, t_ref, n_fills, n_pending = run(bars, args, use_minutes, volume_limit)
+            ok &= same
+            print(f"minutes={use_minutes} volume_limit={volume_limit}: scan {t_ref / args.bars * 1e6:.0f} us/bar "
+                  f"-> order book {t_new / args.bars * 1e6:.0f} us/bar, {n_fills} fills, "
+                  f"{n_pending} orders resting at the end, same: {same}")
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import time
+from copy import deepcopy, copy
+
+import numpy as np
+import pandas as pd
+
+from app.strategies.backtest import (
+    MR_Strategy, TurtleSystem, panel_backtest, panel_performance, panel_trades, panel_trade_stats,
+    performance_table, successive_counts
+)
+
+
+def make_panel(n_days: int, n_codes: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2010-01-01", periods=n_days, name="date")
+    codes = [f"C{i:05d}" for i in range(n_codes)]
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_codes)), axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.005, (n_days, n_codes)))
+    return (pd.DataFrame(close, index=dates, columns=codes),
+            pd.DataFrame(open_, index=dates, columns=codes))
+
+
+def mr_signal(close: pd.DataFrame, open_: pd.DataFrame, lookback=20, buy_threshold=-1.5, sell_threshold=1.5):
+    """MR_Strategy 的买卖信号（所有标的同时计算）"""
+    rets = close.pct_change().fillna(0)
+    score = ((rets - rets.rolling(lookback).mean()) / rets.rolling(lookback).std()).fillna(0)
+    signal = pd.DataFrame(np.nan, index=close.index, columns=close.columns)
+    signal[(score < buy_threshold) & (open_ < close.shift(1) * 1.097)] = 1
+    signal[(score > sell_threshold) & (open_ > close.shift(1) * 0.903)] = 0
+    return signal
+
+
+def legacy_successive(rtn_list):
+    successive_gain_list = []
+    num = 1
+    for i in range(len(rtn_list)):
+        if i == 0:
+            successive_gain_list.append(num)
+        else:
+            if (rtn_list[i] == rtn_list[i - 1] == 1) or (rtn_list[i] == rtn_list[i - 1] == 0):
+                num += 1
+            else:
+                num = 1
+            successive_gain_list.append(num)
+    return successive_gain_list
+
+
+class SyntheticTurtle(TurtleSystem):
+    """TurtleSystem on synthetic data (no data source needed)"""
+
+    def __init__(self, data: pd.DataFrame, **kwargs):
+        self._synthetic = data
+        super().__init__(codes=list(data.columns.get_level_values(0).unique()), **kwargs)
+
+    def _get_data(self):
+        return self._synthetic.copy()
+
+    def legacy_run(self):
+        # 改动前的实现：iterrows + deepcopy
+        self.portfolio = {}
+        position = {s: {t: None for t in self.codes} for s in self.sys_list}
+        for i, (ts, row) in enumerate(self.data.iterrows()):
+            for t in self.codes:
+                for s, system in enumerate(self.sys_list):
+                    position[system][t] = self._run_system(t, row[t], position[system][t])
+            self.portfolio[i] = deepcopy(position)
+            self.portfolio[i]['date'] = ts
+            self.portfolio[i]['cash'] = copy(self.cash)
+            self.portfolio_value = self._calc_portfolio_value(self.portfolio[i])
+
+
+def turtle_data(close: pd.DataFrame, open_: pd.DataFrame) -> pd.DataFrame:
+    high = np.maximum(close, open_) * 1.01
+    low = np.minimum(close, open_) * 0.99
+    frames = {"open": open_, "high": high, "low": low, "close": close}
+    df = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+    return df
+
+
+def check_single_security(close, open_) -> bool:
+    code = close.columns[0]
+    df = pd.DataFrame({"open": open_[code], "close": close[code]})
+    df["rets"] = df.close.pct_change().fillna(0)
+    df["index"] = df["rets"] * 0.5
+    mr = MR_Strategy(df.copy())
+    result = panel_backtest(close[[code]], mr_signal(close[[code]], open_[[code]]), open=open_[[code]])
+    diff = np.abs(mr["capital_ret"].to_numpy() - result.returns.to_numpy()).max()
+    perf_old = performance_table(mr[["index", "rets", "capital_ret"]])
+    perf_new = panel_performance(result, df["index"])
+    perf_diff = np.nanmax(np.abs(perf_old.loc["capital_ret"].to_numpy(dtype=float)
+                                 - perf_new["交易策略"].to_numpy(dtype=float)))
+    print(f"single security vs MR_Strategy: max |capital_ret diff|={diff:.3e}, max |metric diff|={perf_diff:.3e}")
+    return diff < 1e-12 and perf_diff < 1e-9
+
+
+def check_streaks() -> bool:
+    rng = np.random.default_rng(1)
+    gain = rng.choice([0.0, 1.0, np.nan], size=5000, p=[0.45, 0.45, 0.1])
+    ok = np.array_equal(successive_counts(gain), legacy_successive(list(gain)))
+    print(f"successive counts vs loop: {ok}")
+    return ok
+
+
+def check_turtle(close, open_, n_days: int) -> bool:
+    data = turtle_data(close.iloc[:n_days, :3], open_.iloc[:n_days, :3])
+    legacy = SyntheticTurtle(data)
+    start = time.perf_counter()
+    legacy.legacy_run()
+    legacy_elapsed = time.perf_counter() - start
+    new = SyntheticTurtle(data)
+    start = time.perf_counter()
+    new.run()
+    new_elapsed = time.perf_counter() - start
+    same = legacy.get_portfolio_values().equals(new.get_portfolio_values())
+    print(f"TurtleSystem.run ({n_days} days x 3 codes): same portfolio values={same}, "
+          f"iterrows {legacy_elapsed:.2f}s -> {new_elapsed:.2f}s")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the panel vectorized backtest")
+    parser.add_argument("--days", type=int, default=2500)
+    parser.add_argument("--codes", type=int, default=3000)
+    args = parser.parse_args()
+
+    close, open_ = make_panel(args.days, args.codes)
+    ok = check_single_security(close, open_)
+    ok &= check_streaks()
+    ok &= check_turtle(close, open_, min(args.days, 500))
+
+    signal = mr_signal(close, open_)
+    start = time.perf_counter()
+    result = panel_backtest(close, signal, open=open_, cost=0.001, max_weight=0.05, max_positions=50, rebalance=5)
+    perf = panel_performance(result, close.pct_change().mean(axis=1).fillna(0))
+    trades = panel_trades(result, cost=0.001)
+    stats = panel_trade_stats(trades)
+    elapsed = time.perf_counter() - start
+    print(f"panel {args.days} days x {args.codes} codes: {elapsed:.2f}s, {len(trades)} trades")
+    print(perf)
+    print(stats.describe().T[["mean", "min", "max"]])
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
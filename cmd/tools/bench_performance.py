@@ -0,0 +1,120 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import ast
+import tempfile
+from collections import deque
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from app.domain.recorder import BarEventEngineRecorder
+from app.plugins.analysis.results import load_results, match_round_trips
+
+
+def record_run(path: str, n: int, securities, seed: int = 0) -> str:
+    """Minute results of a run with random open/close actions"""
+    rng = np.random.default_rng(seed)
+    recorder = BarEventEngineRecorder(path=path, datetime=[], action=[], close=[])
+    recorder.set_recorder_name("bench")
+    closes = 100 + np.cumsum(rng.normal(0, 0.2, (n, len(securities))), axis=0)
+    positions = {security: 0 for security in securities}
+    start = datetime(2021, 1, 4, 9, 30)
+    value = 1e6
+    for i in range(n):
+        actions = ""
+        for j, security in enumerate(securities):
+            if rng.random() > 0.02:
+                continue
+            qty = int(rng.integers(1, 4))
+            if positions[security] > 0 and rng.random() < 0.5:
+                qty = min(qty, positions[security])
+                positions[security] -= qty
+                action = dict(gw="Backtest", sec=security, side="SHORT", offset="CLOSE", qty=qty)
+            else:
+                positions[security] += qty
+                action = dict(gw="Backtest", sec=security, side="LONG", offset="OPEN", qty=qty)
+            actions += str(dict(action, close=float(closes[i, j]))) + "|"
+        value += rng.normal(0, 50)
+        for field, v in (("datetime", start + timedelta(minutes=i)), ("portfolio_value", value),
+                         ("strategy_portfolio_value", value), ("action", actions),
+                         ("close", [float(c) for c in closes[i]])):
+            recorder.write_record(field, [v])
+    return recorder.save_csv()
+
+
+def legacy_parse(result_path: str) -> pd.DataFrame:
+    """之前的解析：每行 literal_eval"""
+    df = pd.read_csv(result_path)
+    df["datetime"] = [pd.Timestamp(max(ast.literal_eval(dt))) for dt in df["datetime"]]
+    df["strategy_portfolio_value"] = [sum(ast.literal_eval(v)) for v in df["strategy_portfolio_value"]]
+    df["close"] = [ast.literal_eval(v) for v in df["close"]]
+    df["action"] = [ast.literal_eval(v) for v in df["action"]]
+    return df
+
+
+def loop_fifo(fills: pd.DataFrame) -> list:
+    """逐个成交配对（对照）"""
+    queues = {}
+    trades = []
+    for fill in fills.itertuples():
+        queue = queues.setdefault((fill.gateway, fill.security, fill.position_side), deque())
+        if fill.offset == "OPEN":
+            queue.append([fill.datetime, fill.qty])
+            continue
+        remaining = fill.qty
+        while remaining > 0 and queue:
+            open_fill = queue[0]
+            qty = min(remaining, open_fill[1])
+            trades.append((fill.security, open_fill[0], fill.datetime, qty))
+            remaining -= qty
+            open_fill[1] -= qty
+            if open_fill[1] == 0:
+                queue.popleft()
+    return trades
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time loading results and pairing trades for the performance analysis")
+    parser.add_argument("--bars", type=int, default=100000)
+    parser.add_argument("--securities", type=int, default=4)
+    args = parser.parse_args()
+
+    securities = [f"HK.S{i:02d}" for i in range(args.securities)]
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = record_run(tmp, args.bars, securities)
+
+        tic = timer()
+        legacy_parse(result_path)
+        t_legacy = timer() - tic
+        tic = timer()
+        results = load_results(result_path, {"Backtest": securities})
+        t_typed = timer() - tic
+        parquet = result_path[:-len(".csv")] + ".parquet"
+        os.rename(parquet, parquet + ".bak")
+        tic = timer()
+        from_csv = load_results(result_path, {"Backtest": securities})
+        t_csv = timer() - tic
+
+        tic = timer()
+        trades = match_round_trips(results.fills)
+        t_match = timer() - tic
+        tic = timer()
+        expected = loop_fifo(results.fills)
+        t_loop = timer() - tic
+
+    got = list(zip(trades["security"], trades["open_datetime"], trades["close_datetime"], trades["qty"]))
+    ok = got == expected and from_csv.bars.equals(results.bars) and from_csv.fills.equals(results.fills)
+    print(f"{args.bars} bars x {args.securities} securities, {len(results.fills)} fills, {len(trades)} trades")
+    print(f"load: literal_eval {t_legacy:.2f}s -> parquet {t_typed:.3f}s (csv fallback {t_csv:.2f}s)")
+    print(f"pair trades: loop {t_loop * 1e3:.1f}ms -> vectorized FIFO {t_match * 1e3:.1f}ms")
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
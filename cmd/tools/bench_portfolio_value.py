@@ -0,0 +1,104 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Exchange, Direction, Offset, OrderType, TradeMode
+from app.domain.balance import AccountBalance
+from app.domain.deal import Deal
+from app.domain.portfolio import Portfolio
+from app.domain.position import Position
+from app.domain.security import Stock
+from app.gateways import BacktestGateway, BacktestFees
+
+
+def legacy_value(portfolio: Portfolio) -> float:
+    """改动前的 Portfolio.value：每次读取都向 gateway 查询每只持仓证券的最新 bar"""
+    market = portfolio.market
+    v = portfolio.account_balance.cash
+    for security, holdings in portfolio.position.holdings.items():
+        recent_data = market.get_recent_data(security=security, cur_datetime=market.market_datetime, dfield="kline")
+        if recent_data is not None:
+            cur_price = recent_data.close
+        else:
+            cur_price = sum(pos.holding_price for pos in holdings.values()) / len(holdings)
+        for direction, position_data in holdings.items():
+            if direction == Direction.LONG:
+                v += cur_price * position_data.quantity * security.lot_size
+            elif direction == Direction.SHORT:
+                v -= cur_price * position_data.quantity * security.lot_size
+    return v
+
+
+def make_data(securities, times, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frames = []
+    for security in securities:
+        close = 100 + rng.standard_normal(len(times)).cumsum()
+        frames.append(pd.DataFrame({
+            "time_key": times, "code": security.code, "open": close, "high": close + 1,
+            "low": close - 1, "close": close, "volume": 1000.0}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the incremental Portfolio.value with the legacy one")
+    parser.add_argument("--securities", type=int, default=200)
+    parser.add_argument("--bars", type=int, default=100)
+    parser.add_argument("--reads", type=int, default=2, help="value reads per bar (engine + strategy portfolio)")
+    args = parser.parse_args()
+
+    securities = [Stock(code=f"US.S{i:04d}", security_name=f"S{i:04d}", lot_size=1 + i % 3,
+                        exchange=Exchange.NASDAQ) for i in range(args.securities)]
+    times = [datetime(2020, 1, 1) + timedelta(days=i) for i in range(args.bars + 1)]
+    data = make_data(securities, times)
+    gateway = BacktestGateway(securities=securities, trade_market=None, gateway_name="Backtest",
+                              fees=BacktestFees, start=times[0], end=times[-1], data=data)
+    gateway.trade_mode = TradeMode.BACKTEST
+    portfolio = Portfolio(AccountBalance(cash=1e7), Position(), gateway)
+    # 最后一只证券不推送 bar，估值时回退到向 gateway 查询
+    pushed = securities[:-1]
+
+    rng = np.random.default_rng(1)
+    t_new = t_old = 0
+    max_err = 0.0
+    for cur_time in times[:-1]:
+        for security in securities:
+            bar = gateway.get_recent_data(security=security, cur_datetime=cur_time, dfield="kline")
+            if security in pushed:
+                gateway.last_prices.update(security, bar.close, bar.datetime)
+            if rng.random() < 0.1:
+                holdings = portfolio.position.holdings.get(security, {})
+                if Direction.LONG in holdings and rng.random() < 0.5:
+                    direction, offset, quantity = Direction.SHORT, Offset.CLOSE, holdings[Direction.LONG].quantity
+                else:
+                    direction, offset, quantity = Direction.LONG, Offset.OPEN, int(rng.integers(1, 10))
+                portfolio.update(Deal(security=security, direction=direction, offset=offset,
+                                      order_type=OrderType.MARKET, updated_time=cur_time,
+                                      filled_avg_price=bar.close, filled_quantity=quantity))
+        tic = timer()
+        for _ in range(args.reads):
+            value = portfolio.value
+        t_new += timer() - tic
+        tic = timer()
+        for _ in range(args.reads):
+            expected = legacy_value(portfolio)
+        t_old += timer() - tic
+        max_err = max(max_err, abs(value - expected))
+
+    reads = args.bars * args.reads
+    print(f"{len(portfolio.position.holdings)} holdings, {reads} reads")
+    print(f"legacy {t_old / reads * 1e6:.1f} us/read -> incremental {t_new / reads * 1e6:.2f} us/read")
+    print(f"max abs diff {max_err:.2e}")
+    print(f"match: {max_err < 1e-6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import asyncio
+import json
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from app.constants import Exchange
+from app.domain.security import Stock
+from app.markets.quote_bus import QuoteBus, InProcessTransport, QuoteBatch, encode_quotes
+
+
+def make_quotes(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.normal(0, 1, n)
+    return pd.DataFrame({
+        "code": [f"US.S{i:04d}" for i in range(n)],
+        "name": [f"S{i:04d}" for i in range(n)],
+        "datetime": "2023-05-10 10:30:00",
+        "open": close - 0.5,
+        "high": close + 1,
+        "low": close - 1,
+        "close": close,
+        "current": close,
+        "volume": rng.integers(1000, 10 ** 6, n).astype(float),
+        "turnover_rate": rng.random(n),
+    })
+
+
+def legacy_decode(message: str) -> pd.DataFrame:
+    # 改动前：get_json 解析，json.dumps 再序列化，pd.read_json 再解析
+    return pd.read_json(StringIO(json.dumps(json.loads(message))))
+
+
+class CountingTransport(InProcessTransport):
+    """Counts the publish calls (a round trip each with Redis)"""
+
+    def __init__(self):
+        super().__init__()
+        self.round_trips = 0
+
+    def publish(self, channel: str, payload: bytes) -> int:
+        self.round_trips += 1
+        return super().publish(channel, payload)
+
+    def publish_many(self, messages) -> int:
+        self.round_trips += 1
+        for channel, payload in messages:
+            super().publish(channel, payload)
+        return len(messages)
+
+
+def legacy_publish(bus: QuoteBus, df: pd.DataFrame, strategies) -> int:
+    # 改动前：每行编码一次，每条消息一次 publish
+    codes = df["code"].to_numpy()
+    for i, code in enumerate(codes):
+        bus.transport.publish(bus.symbol_channel(code), encode_quotes(df.iloc[i:i + 1]))
+    for strategy_name, strategy_codes in strategies.items():
+        bus.transport.publish(bus.strategy_channel(strategy_name), encode_quotes(df[np.isin(codes, list(strategy_codes))]))
+    return len(codes) + len(strategies)
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+async def check_bus(df: pd.DataFrame) -> bool:
+    transport = CountingTransport()
+    bus = QuoteBus(transport)
+    mine = [Stock(code=code, security_name=code, exchange=Exchange.NASDAQ) for code in df["code"][:3]]
+    subscription = await bus.subscribe(codes=[s.code for s in mine])
+    by_strategy = await bus.subscribe(strategies=["demo"])
+    messages = bus.publish(df, strategies={"demo": df["code"][-2:]})
+    await asyncio.sleep(0)
+    # 一轮行情只发布一次（Redis 上是一个 pipeline）
+    one_trip = transport.round_trips == 1 and messages == len(df) + 1
+    # 一轮行情在策略频道上是一条消息（策略只回调一次）
+    one_round = by_strategy.queue.qsize() == 1
+    quotes = await subscription.get()
+    strategy_quotes = await by_strategy.get()
+    bar = quotes.get_bar(mine[0])
+    ok = (one_round and one_trip and sorted(quotes.codes()) == sorted(s.code for s in mine)
+          and sorted(strategy_quotes.codes()) == sorted(df["code"][-2:])
+          and bar.close == df["close"].iloc[0] and bar.datetime == pd.Timestamp("2023-05-10 10:30:00"))
+    print(f"in-process bus: subscriber got {len(quotes)} of {len(df)} codes, strategy channel "
+          f"{len(strategy_quotes)} codes in one message={one_round}, {messages} messages in one publish={one_trip}, "
+          f"bar ok={ok}")
+    await subscription.close()
+    await by_strategy.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the quote bus and compare it with the JSON pub/sub")
+    parser.add_argument("--codes", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    df = make_quotes(args.codes)
+    message = df.to_json()
+    payload = encode_quotes(df)
+    securities = [Stock(code=code, security_name=code, exchange=Exchange.NASDAQ) for code in df["code"]]
+
+    legacy = timeit(lambda: legacy_decode(message), args.repeat)
+    fast = timeit(lambda: QuoteBatch.decode(payload), args.repeat)
+    quotes = QuoteBatch.decode(payload)
+    bars = timeit(lambda: [quotes.get_bar(s) for s in securities[:20]], args.repeat)
+    print(f"{args.codes} quotes: json {len(message)} bytes, arrow {len(payload)} bytes")
+    print(f"decode: json x3 {legacy * 1e3:.2f}ms -> arrow {fast * 1e3:.3f}ms; 20 bars {bars * 1e3:.3f}ms")
+    strategies = {f"strategy_{i}": df["code"][i::10] for i in range(5)}
+    legacy_bus, bus = QuoteBus(CountingTransport()), QuoteBus(CountingTransport())
+    legacy = timeit(lambda: legacy_publish(legacy_bus, df, strategies), args.repeat)
+    fast = timeit(lambda: bus.publish(df, strategies=strategies), args.repeat)
+    print(f"publish ({len(strategies)} strategies): per-row encode {legacy * 1e3:.2f}ms, "
+          f"{legacy_bus.transport.round_trips // args.repeat} publishes -> {fast * 1e3:.2f}ms, "
+          f"{bus.transport.round_trips // args.repeat} publish")
+    ok = asyncio.run(check_bus(df))
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from app.domain.recorder import BarEventEngineRecorder, RECORD_CHUNK_SIZE
+
+
+class LegacyRecorder:
+    """之前的实现：每个字段一个 list，保存时整体构建 DataFrame（只保留 append 字段的部分）"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.records = {field: [] for field in fields}
+
+    def write_record(self, field, value):
+        self.records[field].append(value)
+
+    @staticmethod
+    def records_of(records, fields):
+        legacy = LegacyRecorder(fields)
+        for record in records:
+            for field in fields:
+                value = record[field]
+                if isinstance(value, datetime):
+                    value = value.strftime('%Y-%m-%d %H:%M:%S')
+                legacy.write_record(field, [value])
+        return legacy.records
+
+    def save_csv(self, path):
+        df = pd.DataFrame(self.records)
+        df.to_csv(path, index=False)
+        return path
+
+
+def make_records(n: int, num_securities: int):
+    rng = np.random.default_rng(0)
+    start = datetime(2020, 1, 2, 9, 30)
+    for i in range(n):
+        close = [float(x) for x in 100 + rng.standard_normal(num_securities)]
+        yield {
+            "datetime": start + timedelta(minutes=i),
+            "portfolio_value": 1e6 + i,
+            "strategy_portfolio_value": 1e6 + i,
+            "action": "BUY|" if i % 100 == 0 else "",
+            "open": close,
+            "high": close,
+            "low": close,
+            "close": close,
+            "volume": close,
+        }
+
+
+def run(recorder, records, fields, path, memory: bool):
+    if memory:
+        tracemalloc.start()
+    tic = timer()
+    for record in records:
+        for field in fields:
+            value = record[field]
+            if isinstance(recorder, LegacyRecorder) and isinstance(value, datetime):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')  # 之前引擎记录的是字符串
+            recorder.write_record(field, [value])
+    record_time = timer() - tic
+    record_peak = 0
+    if memory:
+        _, record_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    tic = timer()
+    result = recorder.save_csv(path)
+    save_time = timer() - tic
+    peak = 0
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, record_time, save_time, record_peak, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the streaming recorder with the in-memory one")
+    parser.add_argument("--bars", type=int, default=100000)
+    parser.add_argument("--securities", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=RECORD_CHUNK_SIZE)
+    parser.add_argument("--memory", action="store_true", help="trace the peak memory (much slower)")
+    args = parser.parse_args()
+
+    fields = ["datetime", "portfolio_value", "strategy_portfolio_value", "action",
+              "open", "high", "low", "close", "volume"]
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyRecorder(fields)
+        old_csv, old_record, old_save, old_record_peak, old_peak = run(
+            legacy, make_records(args.bars, args.securities), fields, f"{tmp}/legacy.csv", args.memory)
+        del legacy
+
+        recorder = BarEventEngineRecorder(path=tmp, chunk_size=args.chunk_size, **{
+            f: [] for f in fields if f not in ("datetime", "portfolio_value", "strategy_portfolio_value")})
+        new_csv, new_record, new_save, new_record_peak, new_peak = run(
+            recorder, make_records(args.bars, args.securities), fields, None, args.memory)
+
+        print(f"{args.bars} bars x {args.securities} securities")
+        # 只有 --memory（tracemalloc）时才有内存数据
+        old_memory = f" ({old_record_peak / 2 ** 20:.1f} MiB)" if args.memory else ""
+        old_save_memory = f" (peak {old_peak / 2 ** 20:.1f} MiB)" if args.memory else ""
+        new_memory = f" ({new_record_peak / 2 ** 20:.1f} MiB)" if args.memory else ""
+        new_save_memory = f" (peak {new_peak / 2 ** 20:.1f} MiB)" if args.memory else ""
+        print(f"legacy:    record {old_record:.2f}s{old_memory}, save {old_save:.2f}s{old_save_memory}")
+        print(f"streaming: record {new_record:.2f}s{new_memory}, save {new_save:.2f}s{new_save_memory}, "
+              f"{recorder.num_records} records")
+        old = pd.read_csv(old_csv)
+        new = pd.read_csv(new_csv)[old.columns]
+        # 文本也与 pandas.to_csv 一致（按导出的列顺序）
+        with open(new_csv) as f:
+            text = f.read()
+        columns = pd.read_csv(new_csv, nrows=0).columns
+        legacy_text = pd.DataFrame(LegacyRecorder.records_of(make_records(args.bars, args.securities), fields))[
+            columns].to_csv(index=False)
+        same_text = text == legacy_text
+        print(f"same values: {old.equals(new)}, same text: {same_text}")
+        print(f"match: {old.equals(new) and same_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.facade.helper import trans_num
+from app.facade.trade import parse_klines
+
+COLUMNS = ['日期', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+COLS1 = ['日期', '名称', '代码', '开盘', '最高', '最低', '收盘', '成交量', '成交额', '换手率']
+COLS2 = ['date', 'name', 'code', 'open', 'high', 'low', 'close', 'volume', 'turnover', 'turnover_rate']
+
+
+def make_klines(n: int, seed: int = 0, freq: str = 'D'):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2003-01-01', periods=n, freq=freq)
+    fmt = '%Y-%m-%d' if freq == 'D' else '%Y-%m-%d %H:%M'
+    close = np.round(10 + np.cumsum(rng.normal(0, 0.1, n)), 2)
+    volume = rng.integers(1000, 10 ** 7, n)
+    klines = []
+    for i, day in enumerate(dates.strftime(fmt)):
+        rate = '-' if i % 997 == 0 else f'{rng.random():.2f}'
+        klines.append(f'{day},{close[i]:.2f},{close[i]:.2f},{close[i] + 0.1:.2f},{close[i] - 0.1:.2f},'
+                      f'{volume[i]},{volume[i] * close[i]:.1f},1.23,-0.45,-0.05,{rate}')
+    return klines
+
+
+def legacy_parse(klines, name='S', code='600000'):
+    # 改动前 web_data 的解析：逐行 split，再逐列 to_numeric
+    rows = [k.split(',') for k in klines]
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df.insert(0, '代码', code)
+    df.insert(0, '名称', name)
+    df = df.rename(columns=dict(zip(COLS1, COLS2)))
+    df.index = pd.to_datetime(df['date'])
+    df = df[COLS2[1:]]
+    return trans_num(df, ['name', 'code'])
+
+
+def fast_parse(klines, name='S', code='600000'):
+    # 与 web_data 中的新解析相同
+    df = parse_klines(klines, COLUMNS, usecols=[c for c in COLS1 if c in COLUMNS])
+    df.insert(0, '代码', code)
+    df.insert(0, '名称', name)
+    df = df.rename(columns=dict(zip(COLS1, COLS2)))
+    df.index.name = 'date'
+    return df
+
+
+def timeit(func, klines, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(klines)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the kline string parsing of web_data")
+    parser.add_argument("--rows", type=int, default=5000, help="bars per code (20 years of daily bars)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    ok = True
+    for freq in ('D', 'min'):
+        klines = make_klines(args.rows, freq=freq)
+        try:
+            pd.testing.assert_frame_equal(legacy_parse(klines), fast_parse(klines))
+            same = True
+        except AssertionError as e:
+            print(e)
+            same = False
+        ok &= same
+        legacy = timeit(legacy_parse, klines, args.repeat)
+        fast = timeit(fast_parse, klines, args.repeat)
+        print(f"{args.rows} {freq} bars: same frame={same}, "
+              f"legacy {legacy * 1e3:.2f}ms -> fast {fast * 1e3:.2f}ms ({legacy / fast:.1f}x)")
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import app.facade as facade
+import app.facade.helper as helper
+import app.facade.trade as trade
+from app.facade.downloader import downloader
+from app.domain.stores.bar_store import ParquetBarStore
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the kline and code search endpoints with latency and random 503s"""
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    requests = 0
+    failures = 0
+    fail_rate = 0.0
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.requests += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(cls.latency)
+        status, body = self._handle()
+        # 写响应之前结束计数，否则客户端的下一个请求可能先到
+        with cls.lock:
+            cls.active -= 1
+            cls.failures += status != 200
+        self._send(status, body)
+
+    def _handle(self):
+        if random.random() < self.fail_rate:
+            return 503, {}
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.endswith("/suggest/get"):
+            return 200, {"QuotationCodeTable": {"Data": [{"QuoteID": f"1.{query['input']}"}]}}
+        code = query["secid"].split(".")[-1]
+        start = date(int(query["beg"][:4]), int(query["beg"][4:6]), int(query["beg"][6:]))
+        days = (date(int(query["end"][:4]), int(query["end"][4:6]), int(query["end"][6:])) - start).days + 1
+        klines = []
+        for i in range(days):
+            day = start + timedelta(days=i)
+            price = 10 + int(code) % 97 + i * 0.01
+            klines.append(f"{day:%Y-%m-%d},{price},{price},{price},{price},1000,10000,0,0,0,0.1")
+        return 200, {"data": {"name": f"S{code}", "klines": klines}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check facade.get_data against a local stand-in server")
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=None, help="requests per second per host")
+    parser.add_argument("--fail-rate", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    StandInHandler.fail_rate = args.fail_rate
+    StandInHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    trade.KLINE_URL = f"{base}/api/qt/stock/kline/get"
+    helper.SEARCH_URL = f"{base}/api/suggest/get"
+    downloader.configure(max_workers=args.workers, rate=args.rate, burst=args.workers, backoff=0.01,
+                         retries=5)
+
+    codes = [f"{600000 + i}" for i in range(args.codes)]
+    start = time.perf_counter()
+    data = facade.get_data(codes, start="2023-01-01", end="2023-03-31")
+    elapsed = time.perf_counter() - start
+    ordered = list(dict.fromkeys(data["code"])) == codes
+    print(f"{len(codes)} codes in {elapsed:.2f}s, {StandInHandler.requests} requests "
+          f"({StandInHandler.failures} injected 503s), max concurrent requests {StandInHandler.max_active}")
+    print(f"all codes: {data['code'].nunique() == len(codes)}, ordered: {ordered}, "
+          f"errors: {len(downloader.last_errors)}")
+
+    # 直接写入磁盘，不在内存中拼接
+    store = ParquetBarStore()
+    with tempfile.TemporaryDirectory() as path:
+        written = []
+
+        def save(code, df):
+            store.write(f"{path}/{code}", df.reset_index(), time_col="date")
+            written.append(code)
+
+        facade.get_data(codes[:20], start="2023-01-01", end="2023-01-31", on_data=save)
+        print(f"streamed to disk in order: {written == codes[:20]}")
+    server.shutdown()
+    ok = ordered and StandInHandler.max_active <= args.workers and not downloader.last_errors
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import asyncio
+import importlib
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from app.constants import Direction, Exchange, OrderStatus, TradeMode
+from app.domain.balance import AccountBalance
+from app.domain.data import Bar
+from app.domain.engine import Engine
+from app.domain.position import Position
+from app.domain.security import Stock
+from app.gateways import BacktestGateway, BacktestFees
+
+SECURITY = Stock(code="US.AAPL", security_name="AAPL", lot_size=1, exchange=Exchange.NASDAQ)
+GATEWAY_NAME = "Backtest"
+
+# (最低价, 最高价, 收盘价)，网格中枢 100，间隔 2%：买单 98.04，卖单 102.0，下限 90.57
+SCENARIOS = {
+    # 成交量限制下买单分三根 bar 成交，随后卖单部分成交、价格跌破网格下限时破网清仓
+    "partial fills": (0.1, [(100, 100, 100), (97.5, 99, 98.5), (97.5, 99, 98.5), (97.5, 99, 98.5),
+                            (99, 101, 100.5), (89, 99, 89)]),
+    # 买单成交后，同一根 bar 上下两个网格单（96.12 / 100.0）都成交
+    "both legs": (None, [(100, 100, 100), (98, 99, 98.5), (96, 100.5, 99), (98.5, 99.5, 99)]),
+}
+
+
+def make_bars(prices):
+    start = datetime(2022, 1, 3)
+    return [Bar(security=SECURITY, datetime=start + timedelta(days=i), open=close, high=high, low=low,
+                close=close, volume=400) for i, (low, high, close) in enumerate(prices)]
+
+
+def net_quantity(position: Position) -> float:
+    holdings = position.holdings.get(SECURITY, {})
+    long = holdings[Direction.LONG].quantity if Direction.LONG in holdings else 0
+    short = holdings[Direction.SHORT].quantity if Direction.SHORT in holdings else 0
+    return long - short
+
+
+def run(module: str, volume_limit, bars, verbose: bool):
+    """逐根 bar 撮合并运行网格策略，检查策略持仓与网关成交是否一致"""
+    strategy_class = getattr(importlib.import_module(f"app.strategies.{module}"), "GridTradingStrategy")
+    # 多一根 bar，最后一根 bar 上的市价单（破网清仓）也能取到价格
+    rows = bars + [bars[-1]]
+    data = pd.DataFrame({"time_key": [bar.datetime for bar in bars] + [bars[-1].datetime + timedelta(days=1)],
+                         "code": SECURITY.code, "open": [bar.open for bar in rows], "high": [bar.high for bar in rows],
+                         "low": [bar.low for bar in rows], "close": [bar.close for bar in rows],
+                         "volume": [bar.volume for bar in rows]})
+    gateway = BacktestGateway(securities=[SECURITY], trade_market=None, gateway_name=GATEWAY_NAME,
+                              fees=BacktestFees, start=bars[0].datetime, end=data["time_key"].iloc[-1], data=data,
+                              volume_limit=volume_limit)
+    gateway.trade_mode = TradeMode.BACKTEST
+    engine = Engine(gateways={GATEWAY_NAME: gateway})
+    strategy = strategy_class(
+        securities={GATEWAY_NAME: [SECURITY]},
+        strategy_account="grid",
+        strategy_version="check",
+        init_strategy_account_balance={GATEWAY_NAME: AccountBalance(cash=1e6)},
+        init_strategy_position={GATEWAY_NAME: Position()},
+        engine=engine,
+    )
+    # 两个版本的默认间隔不同，统一为 2%
+    strategy.set_parameters(interval=0.02)
+    strategy.init_strategy()
+
+    same = True
+    for bar in bars:
+        gateway.market_datetime = bar.datetime
+        gateway.match_orders(SECURITY, bar)
+        gateway.last_prices.update(SECURITY, bar.close, bar.datetime)
+        asyncio.run(strategy.on_bar({GATEWAY_NAME: {SECURITY: bar}}))
+
+        deals = [deal for _, deal in gateway.deals.items()]
+        expected = sum(d.filled_quantity * (1 if d.direction == Direction.LONG else -1) for d in deals)
+        got = net_quantity(strategy.portfolios[GATEWAY_NAME].position)
+        # 网格单之外不能有未配对的挂单
+        legs = set(strategy.pre_pair_orders[GATEWAY_NAME][SECURITY.code].values())
+        stray = [o.orderid for o in gateway.get_open_orders() if o.orderid not in legs]
+        same &= got == expected and not stray
+        if verbose:
+            statuses = {side: gateway.get_order(orderid).status.value
+                        for side, orderid in strategy.pre_pair_orders[GATEWAY_NAME][SECURITY.code].items()}
+            print(f"  {bar.datetime:%Y-%m-%d} low={bar.low} high={bar.high} close={bar.close}: "
+                  f"position {got} / deals {expected}, grids {strategy.account_dict['positions_grids']}, "
+                  f"pairing {strategy.account_dict['pairing_count']}, legs {statuses}, stray {len(stray)}")
+    return same, strategy, gateway
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the grid strategies apply every deal of their (partially) filled orders")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    ok = True
+    for module in ("grid_trading_strategy", "grid_trading_strategy_v1"):
+        for name, (volume_limit, prices) in SCENARIOS.items():
+            same, strategy, gateway = run(module, volume_limit, make_bars(prices), args.verbose)
+            if name == "partial fills":
+                # 破网清仓后只剩新的网格买单
+                same &= strategy.account_dict["positions_grids"] == 0 and strategy.account_dict["odd_quantity"] == 0
+            elif name == "both legs":
+                same &= strategy.account_dict["positions_grids"] == 1 and strategy.account_dict["pairing_count"] == 1
+            filled = len(gateway.orders.get_orders_by_status(OrderStatus.FILLED))
+            print(f"{module} / {name}: {len(gateway.deals)} deals of {filled} filled orders, "
+                  f"strategy position matches deals: {same}")
+            ok &= same
+    print(f"match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ from app.constants import TradeMode, TradeMarket, Exchange
 from app.domain.data import Bar
 import app.gateways as gateways
 from app.domain.security import Stock
+from app.domain.stores.bar_store import bar_store
 
 
 def main():
@@ -76,17 +77,29 @@ def main():
             end_date=end.strftime("%Y-%m-%d")
         )
         trade_days = gateway.get_trading_days()
-        save_csv(data_df, trade_days, freq, path="/home/zhaojunfeng/workspace/python/quant-trader")
+        save_parquet(data_df, freq, path="/home/zhaojunfeng/workspace/python/quant-trader")
 
 
-def save_csv(data_df: pd.DataFrame, trade_days: List, freq: str, path=None):
+def get_kline_path(freq: str) -> str:
     k_freq_path = "K_unknown"
     if freq == "1Min":
         k_freq_path = "K_1M"
     elif freq == "1Day":
         k_freq_path = "K_1D"
+    return k_freq_path
+
+
+def save_parquet(data_df: pd.DataFrame, freq: str, path=None):
+    """保存到列式存储（每只股票每个周期一个parquet文件）"""
+    code = data_df.iloc[0].code
+    result_path = f"{path}/data/k_line/{get_kline_path(freq)}/{code}"
+    result_path_filename = bar_store.write(result_path, data_df)
+    print(result_path_filename)
+
+
+def save_csv(data_df: pd.DataFrame, trade_days: List, freq: str, path=None):
     code = data_df.iloc[0].code
-    result_path = f"{path}/data/k_line/{k_freq_path}/{code}/"
+    result_path = f"{path}/data/k_line/{get_kline_path(freq)}/{code}/"
     if not os.path.exists(result_path):
         os.makedirs(result_path)
 
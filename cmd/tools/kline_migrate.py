@@ -0,0 +1,38 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+
+from app.domain.stores.bar_store import bar_store
+from trader_config import DATA_PATH
+
+
+def migrate(data_root: str, remove_csv: bool = False):
+    """将 {data_root}/K_xx/<code>/<date>.csv 目录迁移为 {data_root}/K_xx/<code>.parquet"""
+    for kline_name in sorted(os.listdir(data_root)):
+        kline_path = f"{data_root}/{kline_name}"
+        if not os.path.isdir(kline_path):
+            continue
+        for code in sorted(os.listdir(kline_path)):
+            data_path = f"{kline_path}/{code}"
+            if not os.path.isdir(data_path):
+                continue
+            file = bar_store.migrate_csv_dir(data_path, remove_csv=remove_csv)
+            if file is None:
+                print(f"skip {data_path}: no csv data")
+                continue
+            print(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate csv kline tree to the columnar bar store")
+    parser.add_argument("--path", default=DATA_PATH["kline"], help="kline data root, default DATA_PATH['kline']")
+    parser.add_argument("--remove-csv", action="store_true", help="remove csv files after migration")
+    args = parser.parse_args()
+    migrate(args.path, remove_csv=args.remove_csv)
+
+
+if __name__ == "__main__":
+    main()
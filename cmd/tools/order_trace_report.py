@@ -0,0 +1,130 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app.utils.tracing import EVENT_ORDER, EVENT_BROKER_SUBMIT, EVENT_BROKER_ACK, EVENT_ORDER_UPDATE, EVENT_DEAL
+
+# 阶段名 -> (开始时间, 结束时间)
+STAGES = {
+    "quote_to_callback": ("ingest_ns", "callback_ns"),
+    "callback_to_order": ("callback_ns", EVENT_ORDER),
+    "order_to_submit": (EVENT_ORDER, EVENT_BROKER_SUBMIT),
+    "submit_to_ack": (EVENT_BROKER_SUBMIT, EVENT_BROKER_ACK),
+    # 券商的推送可能比下单接口返回更早，从发出请求开始计算
+    "submit_to_update": (EVENT_BROKER_SUBMIT, EVENT_ORDER_UPDATE),
+    "submit_to_deal": (EVENT_BROKER_SUBMIT, EVENT_DEAL),
+    "tick_to_trade": ("ingest_ns", EVENT_BROKER_SUBMIT),
+    "tick_to_fill": ("ingest_ns", EVENT_DEAL),
+}
+
+
+def load_timelines(path: str) -> pd.DataFrame:
+    """One row per order: strategy, gateway, code and the first time (ns) of every event"""
+    orders: Dict[str, dict] = {}
+    events: Dict[str, Dict[str, int]] = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            trace_id, event, ts = record["trace_id"], record["event"], record["ts_ns"]
+            if event == EVENT_ORDER:
+                orders[trace_id] = record
+            first = events.setdefault(trace_id, {})
+            if event not in first or ts < first[event]:
+                first[event] = ts
+    rows = []
+    for trace_id, order in orders.items():
+        row = {
+            "trace_id": trace_id,
+            "strategy": order.get("strategy") or "-",
+            "gateway": order.get("gateway") or "-",
+            "code": order.get("code"),
+            "ingest_ns": order.get("ingest_ns"),
+            "callback_ns": order.get("callback_ns"),
+        }
+        row.update(events.get(trace_id, {}))
+        rows.append(row)
+    columns = ["trace_id", "strategy", "gateway", "code", "ingest_ns", "callback_ns", EVENT_ORDER,
+               EVENT_BROKER_SUBMIT, EVENT_BROKER_ACK, EVENT_ORDER_UPDATE, EVENT_DEAL]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def stage_latencies(timelines: pd.DataFrame) -> pd.DataFrame:
+    """Latency (ms) of every stage of every order (NaN if a stage did not happen)"""
+    latencies = timelines[["trace_id", "strategy", "gateway", "code"]].copy()
+    for stage, (start, end) in STAGES.items():
+        latencies[stage] = (timelines[end].astype(float) - timelines[start].astype(float)) / 1e6
+    return latencies
+
+
+def summarise(latencies: pd.DataFrame, by: str) -> pd.DataFrame:
+    """count/p50/p90/p99/max (ms) of every stage per `by`"""
+    rows = []
+    for key, group in latencies.groupby(by, sort=True):
+        for stage in STAGES:
+            values = group[stage].dropna().to_numpy()
+            if len(values) == 0:
+                continue
+            p50, p90, p99 = np.percentile(values, (50, 90, 99))
+            rows.append({by: key, "stage": stage, "count": len(values), "p50_ms": p50, "p90_ms": p90,
+                         "p99_ms": p99, "max_ms": values.max()})
+    return pd.DataFrame(rows, columns=[by, "stage", "count", "p50_ms", "p90_ms", "p99_ms", "max_ms"])
+
+
+def print_slowest(path: str, latencies: pd.DataFrame, n: int):
+    """Full timelines of the n orders with the slowest tick to trade"""
+    slowest = latencies.dropna(subset=["tick_to_trade"]).nlargest(n, "tick_to_trade")
+    wanted = set(slowest.trace_id)
+    records: Dict[str, List[dict]] = {t: [] for t in wanted}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record["trace_id"] in wanted:
+                    records[record["trace_id"]].append(record)
+    for trace_id in slowest.trace_id:
+        timeline = sorted(records[trace_id], key=lambda r: r["ts_ns"])
+        order = next((r for r in timeline if r["event"] == EVENT_ORDER), timeline[0])
+        origin = order.get("ingest_ns") or timeline[0]["ts_ns"]
+        print(f"\n{trace_id} {order.get('strategy')} {order.get('gateway')} {order.get('code')}")
+        for record in timeline:
+            extra = {k: v for k, v in record.items() if k not in ("trace_id", "event", "ts_ns")}
+            print(f"  +{(record['ts_ns'] - origin) / 1e6:10.3f} ms  {record['event']:<14} {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the tick-to-trade latency of an order trace file")
+    parser.add_argument("trace_file", help="json lines written by the order tracer (TRACE.file)")
+    parser.add_argument("--slowest", type=int, default=0, help="print the timelines of the N slowest orders")
+    parser.add_argument("--csv", default=None, help="also write the latency of every order to this csv")
+    args = parser.parse_args()
+
+    timelines = load_timelines(args.trace_file)
+    if timelines.empty:
+        print(f"no orders in {args.trace_file}")
+        return
+    latencies = stage_latencies(timelines)
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_rows", 500)
+    print(f"{len(latencies)} orders in {args.trace_file}")
+    for by in ("strategy", "gateway"):
+        print(f"\nper {by} (ms):")
+        print(summarise(latencies, by).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    if args.slowest:
+        print_slowest(args.trace_file, latencies, args.slowest)
+    if args.csv:
+        latencies.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
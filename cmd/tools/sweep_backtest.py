@@ -0,0 +1,67 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(sys.path[0]) + "/../")
+
+import argparse
+import ast
+import importlib
+from datetime import datetime
+
+from app.constants import Exchange
+from app.domain.security import Stock
+from app.service.sweep_service import ParameterSweep
+
+
+def parse_param(text: str):
+    """name=v1,v2,... (values are python literals, otherwise strings)"""
+    name, _, values = text.partition("=")
+    assert name and values, f"Invalid parameter `{text}`, expected name=v1,v2,..."
+    parsed = []
+    for v in values.split(","):
+        try:
+            parsed.append(ast.literal_eval(v))
+        except (ValueError, SyntaxError):
+            parsed.append(v)
+    return name, parsed
+
+
+def load_class(path: str):
+    module, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a backtest for every combination of strategy parameters")
+    parser.add_argument("--strategy", required=True,
+                        help="strategy class, e.g. app.strategies.grid_trading_strategy.GridTradingStrategy")
+    parser.add_argument("--codes", required=True, help="comma separated codes, e.g. US.BILI,US.PDD")
+    parser.add_argument("--exchange", default="NASDAQ", help="exchange of the codes")
+    parser.add_argument("--param", action="append", required=True,
+                        help="name=v1,v2,... (repeat for every parameter), e.g. interval=0.01,0.02")
+    parser.add_argument("--start", default="2020-01-01")
+    parser.add_argument("--end", default=datetime.today().strftime("%Y-%m-%d"))
+    parser.add_argument("--capital", type=float, default=10000)
+    parser.add_argument("--processes", type=int, default=None, help="default: number of cpus")
+    parser.add_argument("--output", required=True,
+                        help="result directory; rerunning with the same directory resumes the sweep")
+    args = parser.parse_args()
+
+    exchange = Exchange[args.exchange]
+    securities = [Stock(code=code, security_name=code, exchange=exchange) for code in args.codes.split(",")]
+    sweep = ParameterSweep(
+        strategy_cls=load_class(args.strategy),
+        param_grid=dict(parse_param(p) for p in args.param),
+        securities=securities,
+        start=datetime.strptime(args.start, "%Y-%m-%d"),
+        end=datetime.strptime(args.end, "%Y-%m-%d"),
+        result_path=args.output,
+        init_capital=args.capital,
+        processes=args.processes,
+    )
+    table = sweep.run()
+    print(table.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ import pandas as pd
 
 from app.constants import TradeMode, TradeMarket, Exchange
 from app.domain.security import Stock
+from app.domain.stores.bar_store import bar_store
 from app.facade.trade import get_data
 
 
@@ -40,17 +41,29 @@ def main():
         data_df['time_key'] = data_df['time_key'].apply(lambda x: x.to_pydatetime().strftime("%Y-%m-%d 00:00:00"))
         trade_days = [x.to_pydatetime().strftime("%Y-%m-%d") for _, x in enumerate(data_df.index.tolist())]
         data_df = data_df[['code', 'time_key', 'open', 'high', 'low', 'close', 'volume', 'turnover', 'turnover_rate']]
-        save_csv(data_df, trade_days, freq, path="../..")
+        save_parquet(data_df, freq, path="../..")
 
 
-def save_csv(data_df: pd.DataFrame, trade_days: List, freq: str, path=None):
+def get_kline_path(freq: str) -> str:
     k_freq_path = "K_unknown"
     if freq == "1Min":
         k_freq_path = "K_1M"
     elif freq == "1Day":
         k_freq_path = "K_1D"
+    return k_freq_path
+
+
+def save_parquet(data_df: pd.DataFrame, freq: str, path=None):
+    """保存到列式存储（每只股票每个周期一个parquet文件）"""
+    code = data_df.iloc[0].code
+    result_path = f"{path}/data/k_line/{get_kline_path(freq)}/{code}"
+    result_path_filename = bar_store.write(result_path, data_df)
+    print(result_path_filename)
+
+
+def save_csv(data_df: pd.DataFrame, trade_days: List, freq: str, path=None):
     code = data_df.iloc[0].code
-    result_path = f"{path}/data/k_line/{k_freq_path}/{code}/"
+    result_path = f"{path}/data/k_line/{get_kline_path(freq)}/{code}/"
     if not os.path.exists(result_path):
         os.makedirs(result_path)
 
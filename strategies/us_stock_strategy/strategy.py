@@ -10,6 +10,7 @@ from app.domain.security import Stock, Security
 from app.strategies import BaseStrategy
 
 from app.infra.db.redis_driver import get_redis_conn
+from app.markets.subscription_registry import register_quote_config
 
 
 def register_strategy_securities(strategy_name='', trade_mode: TradeMode = TradeMode.BACKTEST):
@@ -44,7 +45,7 @@ def register_strategy_securities(strategy_name='', trade_mode: TradeMode = Trade
     strategy_securities = json.dumps(strategy_securities_dict)
 
     redis_client = get_redis_conn()
-    redis_client.hset('quant_trader_quotes_config', strategy_name, strategy_securities)
+    register_quote_config(redis_client, strategy_securities, strategy_name)
 
     rest = redis_client.hget('quant_trader_quotes_config', strategy_name)
     rest = json.loads(rest)
@@ -73,7 +74,7 @@ def register_strategy_etf_securities(strategy_name: str = "", trade_mode: TradeM
     strategy_securities = json.dumps(strategy_securities_dict)
 
     redis_client = get_redis_conn()
-    redis_client.hset('quant_trader_quotes_config', strategy_name, strategy_securities)
+    register_quote_config(redis_client, strategy_securities, strategy_name)
 
     rest = redis_client.hget('quant_trader_quotes_config', strategy_name)
     rest = json.loads(rest)
@@ -56,6 +56,9 @@ DATA_PATH = {
     "kline": "/Users/ZhaoJunfeng/workspace/python/quant-trader/data/k_line",
 }
 
+# 日线k线的本地缓存（按 code/freq/fqt 存储，只下载缺失的日期区间）
+KLINE_CACHE_PATH = "/Users/ZhaoJunfeng/workspace/python/quant-trader/data/kline_cache"
+
 DATA_MODEL = {
     "kline": "Bar",
 }